@@ -29,6 +29,10 @@
 //!
 //! Beside the headers for authentication, we also add the header `API_VERSION` that contain the [parsec_api_protocol::ApiVersion]
 //!
+//! The server may also reply with a `Consistency-Fence` header, the greatest value received
+//! must be sent back with the next requests so that their reads are consistent with the
+//! previous writes (the server may use database replicas lagging behind the primary).
+//!
 
 pub(crate) mod sse;
 
@@ -39,7 +43,15 @@ use reqwest::{
     header::{HeaderMap, HeaderValue, ACCEPT, AUTHORIZATION, CONTENT_LENGTH, CONTENT_TYPE},
     Client, RequestBuilder, Url,
 };
-use std::{fmt::Debug, marker::PhantomData, path::Path, sync::Arc};
+use std::{
+    fmt::Debug,
+    marker::PhantomData,
+    path::Path,
+    sync::{
+        atomic::{AtomicU64, Ordering},
+        Arc,
+    },
+};
 
 use libparsec_platform_http_proxy::ProxyConfig;
 use libparsec_protocol::{api_version_major_to_full, API_LATEST_MAJOR_VERSION};
@@ -50,7 +62,8 @@ use crate::testbed::{get_send_hook, SendHookConfig};
 use crate::{
     authenticated_cmds::sse::check_response,
     error::{ConnectionError, ConnectionResult},
-    SSEConnectionError, SSEStream, API_VERSION_HEADER_NAME, PARSEC_CONTENT_TYPE,
+    SSEConnectionError, SSEStream, API_VERSION_HEADER_NAME, CONSISTENCY_FENCE_HEADER_NAME,
+    PARSEC_CONTENT_TYPE,
 };
 
 use self::sse::EVENT_STREAM_CONTENT_TYPE;
@@ -66,6 +79,8 @@ pub struct AuthenticatedCmds {
     url: Url,
     device: Arc<LocalDevice>,
     author_header_value: HeaderValue,
+    /// Greatest `Consistency-Fence` received from the server, `0` if none.
+    consistency_fence: AtomicU64,
     #[cfg(feature = "test-with-testbed")]
     send_hook: SendHookConfig,
 }
@@ -99,6 +114,7 @@ impl AuthenticatedCmds {
             url,
             device,
             author_header_value,
+            consistency_fence: AtomicU64::new(0),
             #[cfg(feature = "test-with-testbed")]
             send_hook,
         }
@@ -146,12 +162,25 @@ impl AuthenticatedCmds {
             api_version_header_value,
             request_body,
         );
+        let req = match self.consistency_fence.load(Ordering::Relaxed) {
+            0 => req,
+            consistency_fence => req.header(CONSISTENCY_FENCE_HEADER_NAME, consistency_fence),
+        };
 
         #[cfg(feature = "test-with-testbed")]
         let resp = self.send_hook.low_level_send(req).await?;
         #[cfg(not(feature = "test-with-testbed"))]
         let resp = req.send().await?;
 
+        if let Some(consistency_fence) = resp
+            .headers()
+            .get(CONSISTENCY_FENCE_HEADER_NAME)
+            .and_then(|value| value.to_str().ok()?.parse::<u64>().ok())
+        {
+            self.consistency_fence
+                .fetch_max(consistency_fence, Ordering::Relaxed);
+        }
+
         match resp.status().as_u16() {
             200 => {
                 let response_body = resp.bytes().await?;
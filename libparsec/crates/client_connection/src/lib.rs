@@ -30,3 +30,4 @@ pub use libparsec_protocol as protocol;
 pub const PARSEC_CONTENT_TYPE: &str = "application/msgpack";
 
 pub const API_VERSION_HEADER_NAME: &str = "Api-Version";
+pub const CONSISTENCY_FENCE_HEADER_NAME: &str = "Consistency-Fence";
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+
+"""
+Measure the time taken by the event bus to connect then disconnect many clients
+(e.g. a mass reconnection after the PostgreSQL notification connection got lost),
+each client listening on a global event and on a keyed one.
+
+Usage: python misc/bench_event_bus.py --clients 50000 --realms 100
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "server"))
+
+from parsec.event_bus import EventBus, EventBusConnectionContext
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the event bus connections")
+    parser.add_argument("--clients", type=int, default=50_000, help="Number of clients")
+    parser.add_argument("--realms", type=int, default=100, help="Number of dispatch keys")
+    args = parser.parse_args()
+
+    event_bus = EventBus()
+    event_bus.set_dispatch_key("realm_updated", lambda event, realm: realm)
+    events_received = 0
+
+    def _listen_factory():  # type: ignore[no-untyped-def]
+        def _listen(event, **kwargs):  # type: ignore[no-untyped-def]
+            nonlocal events_received
+            events_received += 1
+
+        return _listen
+
+    start = time.perf_counter()
+    contexts: list[EventBusConnectionContext] = []
+    for i in range(args.clients):
+        # Each client has its own callback
+        _listen = _listen_factory()
+        event_bus_ctx = event_bus.connection_context()
+        event_bus_ctx.connect("pinged", _listen)
+        event_bus_ctx.connect("realm_updated", _listen, f"realm-{i % args.realms}")
+        contexts.append(event_bus_ctx)
+    connect_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    event_bus.send("realm_updated", realm="realm-0")
+    send_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    # Disconnection occurs in arbitrary order
+    for event_bus_ctx in reversed(contexts):
+        event_bus_ctx.clear()
+    disconnect_time = time.perf_counter() - start
+
+    print(
+        f"{args.clients} clients: connect {connect_time * 1e3:.0f}ms,"
+        f" keyed send to {events_received} clients {send_time * 1e3:.3f}ms,"
+        f" disconnect {disconnect_time * 1e3:.0f}ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
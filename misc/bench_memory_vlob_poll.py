@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+
+"""
+Measure the throughput of `poll_changes` + `get_stats` on a big realm with the
+memory backend, which keeps per-realm indexes instead of scanning all the vlobs
+and blocks of the server.
+
+Usage: python misc/bench_memory_vlob_poll.py --vlobs 10000 --polls 1000
+"""
+
+from __future__ import annotations
+
+import argparse
+import math
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "server"))
+
+from parsec._parsec import DateTime, DeviceID, OrganizationID, RealmRole, VlobID
+from parsec.backend.config import BackendConfig, MockedBlockStoreConfig, MockedEmailConfig
+from parsec.backend.memory import components_factory
+from parsec.backend.realm import RealmGrantedRole
+from parsec.event_bus import EventBus
+from parsec.utils import trio_run
+
+
+async def main(args: argparse.Namespace) -> None:
+    config = BackendConfig(
+        administration_token="s3cr3t",
+        db_url="MOCKED",
+        db_min_connections=1,
+        db_max_connections=1,
+        sse_keepalive=math.inf,
+        blockstore_config=MockedBlockStoreConfig(),
+        email_config=MockedEmailConfig(sender="bench@example.com", tmpdir="/tmp"),
+        forward_proto_enforce_https=None,
+        backend_addr=None,
+        debug=False,
+    )
+    organization_id = OrganizationID("BenchOrg")
+    author = DeviceID("alice@dev1")
+    realm_id = VlobID.new()
+
+    async with components_factory(config, EventBus()) as components:
+        await components["organization"].create(organization_id, bootstrap_token="")
+        await components["realm"].create(
+            organization_id,
+            RealmGrantedRole(
+                certificate=b"<dummy>",
+                realm_id=realm_id,
+                user_id=author.user_id,
+                role=RealmRole.OWNER,
+                granted_by=author,
+                granted_on=DateTime(2000, 1, 2),
+            ),
+        )
+        for _ in range(args.vlobs):
+            await components["vlob"].create(
+                organization_id=organization_id,
+                author=author,
+                realm_id=realm_id,
+                encryption_revision=1,
+                vlob_id=VlobID.new(),
+                timestamp=DateTime(2000, 1, 3),
+                blob=b"<dummy>",
+            )
+
+        start = time.perf_counter()
+        for _ in range(args.polls):
+            await components["vlob"].poll_changes(organization_id, author, realm_id, args.vlobs - 1)
+            await components["realm"].get_stats(organization_id, author, realm_id)
+        duration = time.perf_counter() - start
+
+    print(
+        f"{args.polls} poll_changes + get_stats on a {args.vlobs} vlobs realm:"
+        f" {args.polls / duration:.0f} ops/s"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the memory backend realm indexes")
+    parser.add_argument("--vlobs", type=int, default=10000, help="Number of vlobs in the realm")
+    parser.add_argument("--polls", type=int, default=1000, help="Number of polls")
+    trio_run(main, parser.parse_args())
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+
+"""
+Measure the throughput of the `realm_user_change` update done on each vlob write:
+- sub-queries: the previous version of `_q_set_last_vlob_update`, which resolves the
+  realm & user internal IDs with sub-queries each time it is executed
+- cached internal IDs: the current version, the internal IDs being resolved through
+  the per-process `InternalIdCache`
+
+The organization, the user and its realms must already exist in the database (e.g.
+created by a client connected to a server using this database). Note the benchmark
+updates the `last_vlob_update` of the user in its realms.
+
+Usage: python misc/bench_postgresql_internal_ids.py --db postgresql://localhost/parsec \
+    --organization CoolOrg --user alice
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import Awaitable, Callable
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "server"))
+
+from parsec._parsec import DateTime, OrganizationID, UserID
+from parsec.backend.postgresql.handler import PGHandler
+from parsec.backend.postgresql.utils import Q, q_realm_internal_id, q_user_internal_id
+from parsec.backend.postgresql.vlob_queries.write import _q_set_last_vlob_update
+from parsec.event_bus import EventBus
+from parsec.utils import open_service_nursery, trio_run
+
+_q_set_last_vlob_update_with_subqueries = Q(
+    f"""
+INSERT INTO realm_user_change(realm, user_, last_role_change, last_vlob_update)
+VALUES (
+    { q_realm_internal_id(organization_id="$organization_id", realm_id="$realm_id") },
+    { q_user_internal_id(organization_id="$organization_id", user_id="$user_id") },
+    NULL,
+    $timestamp
+)
+ON CONFLICT (realm, user_)
+DO UPDATE SET last_vlob_update = (
+    SELECT GREATEST($timestamp, last_vlob_update)
+    FROM realm_user_change
+    WHERE realm={ q_realm_internal_id(organization_id="$organization_id", realm_id="$realm_id") }
+    AND user_={ q_user_internal_id(organization_id="$organization_id", user_id="$user_id") }
+    LIMIT 1
+)
+"""
+)
+
+_q_get_realms = """
+SELECT realm_id
+FROM realm
+WHERE organization = (SELECT _id FROM organization WHERE organization_id = $1)
+"""
+
+
+async def bench(fn: Callable[[int], Awaitable[None]], count: int) -> float:
+    start = time.perf_counter()
+    for i in range(count):
+        await fn(i)
+    return count / (time.perf_counter() - start)
+
+
+async def main(args: argparse.Namespace) -> None:
+    organization_id = OrganizationID(args.organization)
+    user_id = UserID(args.user)
+    timestamp = DateTime.now()
+    dbh = PGHandler(args.db, 1, 1, EventBus())
+
+    async with open_service_nursery() as nursery:
+        await dbh.init(nursery, events_component=None)
+        try:
+            async with dbh.pool.acquire() as conn:
+                realms = [
+                    row["realm_id"] for row in await conn.fetch(_q_get_realms, args.organization)
+                ]
+                if not realms:
+                    raise SystemExit(f"Organization {args.organization} has no realm")
+
+                async def _with_subqueries(i: int) -> None:
+                    await conn.execute(
+                        *_q_set_last_vlob_update_with_subqueries(
+                            organization_id=organization_id.str,
+                            realm_id=realms[i % len(realms)],
+                            user_id=user_id.str,
+                            timestamp=timestamp,
+                        )
+                    )
+
+                async def _with_internal_ids(i: int) -> None:
+                    await conn.execute(
+                        *_q_set_last_vlob_update(
+                            realm_internal_id=await dbh.internal_ids.realm(
+                                conn, organization_id, realms[i % len(realms)]
+                            ),
+                            user_internal_id=await dbh.internal_ids.user(
+                                conn, organization_id, user_id
+                            ),
+                            timestamp=timestamp,
+                        )
+                    )
+
+                print(f"{args.count} executions over {len(realms)} realms:")
+                for name, fn in (
+                    ("sub-queries", _with_subqueries),
+                    ("cached internal IDs", _with_internal_ids),
+                ):
+                    print(f"{name:>20}: {await bench(fn, args.count):.0f} queries/s")
+        finally:
+            await dbh.teardown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the PostgreSQL internal IDs cache")
+    parser.add_argument("--db", required=True, help="PostgreSQL URL")
+    parser.add_argument("--organization", required=True, help="Organization ID")
+    parser.add_argument("--user", required=True, help="ID of the user doing the writes")
+    parser.add_argument("--count", type=int, default=2000, help="Number of executions")
+    trio_run(main, parser.parse_args(), use_asyncio=True)
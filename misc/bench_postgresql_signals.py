@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+
+"""
+Measure the throughput of the backend events broadcasted through PostgreSQL
+LISTEN/NOTIFY: several server processes (stood for by a `PGHandler` each) listen to
+the same database, the events are sent from the first one by batches (i.e. all the
+events of a transaction are coalesced into a single notification) and must reach
+all of them.
+
+Usage: python misc/bench_postgresql_signals.py --db postgresql://localhost/parsec \
+    --events 2000 --batch-size 1 --batch-size 100
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import Any, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "server"))
+
+import trio
+
+from parsec._parsec import BackendEventPinged, DeviceID, OrganizationID
+from parsec.backend.postgresql.handler import PGHandler
+from parsec.backend.postgresql.signals import batch_signals, send_signal
+from parsec.event_bus import EventBus
+from parsec.utils import open_service_nursery, trio_run
+
+
+async def bench(dbhs: List[PGHandler], events_count: int, batch_size: int) -> float:
+    received = [0] * len(dbhs)
+    all_received = trio.Event()
+
+    def _make_cb(i: int) -> Any:
+        def _on_pinged(event: Any, event_id: str, payload: BackendEventPinged) -> None:
+            received[i] += 1
+            if all(count == events_count for count in received):
+                all_received.set()
+
+        return _on_pinged
+
+    callbacks = [_make_cb(i) for i in range(len(dbhs))]
+    for dbh, cb in zip(dbhs, callbacks):
+        dbh.event_bus.connect(BackendEventPinged, cb)
+
+    organization_id = OrganizationID("BenchOrg")
+    author = DeviceID("bench@dev1")
+    start = time.perf_counter()
+    async with dbhs[0].pool.acquire() as conn:
+        for batch_start in range(0, events_count, batch_size):
+            async with conn.transaction():
+                async with batch_signals(conn):
+                    for i in range(batch_start, min(batch_start + batch_size, events_count)):
+                        await send_signal(
+                            conn,
+                            BackendEventPinged(
+                                organization_id=organization_id, author=author, ping=str(i)
+                            ),
+                        )
+    await all_received.wait()
+    elapsed = time.perf_counter() - start
+
+    for dbh, cb in zip(dbhs, callbacks):
+        dbh.event_bus.disconnect(BackendEventPinged, cb)
+    return events_count / elapsed
+
+
+async def main(args: argparse.Namespace) -> None:
+    dbhs = [PGHandler(args.db, 1, 1, EventBus()) for _ in range(args.servers)]
+
+    async with open_service_nursery() as nursery:
+        for dbh in dbhs:
+            await dbh.init(nursery, events_component=None)
+        try:
+            for batch_size in args.batch_size or [1, 100]:
+                throughput = await bench(dbhs, args.events, batch_size)
+                print(
+                    f"{args.events} events by batch of {batch_size} to {len(dbhs)} servers:"
+                    f" {throughput:.0f} events/s"
+                )
+        finally:
+            for dbh in dbhs:
+                await dbh.teardown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the PostgreSQL event notifications")
+    parser.add_argument("--db", required=True, help="PostgreSQL URL")
+    parser.add_argument("--servers", type=int, default=3, help="Number of listening servers")
+    parser.add_argument("--events", type=int, default=2000, help="Number of events")
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        action="append",
+        help="Number of events per transaction (can be provided multiple times)",
+    )
+    trio_run(main, parser.parse_args(), use_asyncio=True)
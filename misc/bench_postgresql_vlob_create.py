@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+
+"""
+Measure the throughput of concurrent vlob creations on a single realm:
+- max index: the previous version of `_q_vlob_updated`, which computes the next
+  checkpoint from the existing ones (hence concurrent writers get the same index
+  and must retry on unique violation)
+- realm counter: the current version, the checkpoint being allocated by
+  incrementing the realm's `last_vlob_update_index`
+
+The organization, the device and the realm must already exist in the database (e.g.
+created by a client connected to a server using this database), the device having
+write access to the realm. Note the benchmark creates vlobs in this realm.
+
+Usage: python misc/bench_postgresql_vlob_create.py --db postgresql://localhost/parsec \
+    --organization CoolOrg --device alice@dev1 --realm <realm ID in hex>
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "server"))
+
+import trio
+from triopg import UniqueViolationError
+
+from parsec._parsec import DateTime, DeviceID, OrganizationID, VlobID
+from parsec.backend.postgresql.handler import PGHandler
+from parsec.backend.postgresql.utils import Q
+from parsec.backend.postgresql.vlob_queries import write as vlob_write
+from parsec.event_bus import EventBus
+from parsec.utils import open_service_nursery, trio_run
+
+_q_vlob_updated_with_max_index = Q(
+    """
+INSERT INTO realm_vlob_update (
+realm, index, vlob_atom
+)
+SELECT
+$realm_internal_id,
+(
+    SELECT COALESCE(MAX(index) + 1, 1)
+    FROM realm_vlob_update
+    WHERE realm = $realm_internal_id
+),
+$vlob_atom_internal_id
+RETURNING index
+"""
+)
+
+# The previous version doesn't maintain the realm's counter
+_q_sync_realm_counter = """
+UPDATE realm SET last_vlob_update_index = COALESCE(
+    (SELECT MAX(index) FROM realm_vlob_update WHERE realm_vlob_update.realm = realm._id),
+    0
+)
+WHERE _id = $1
+"""
+
+
+async def bench(
+    dbh: PGHandler,
+    organization_id: OrganizationID,
+    author: DeviceID,
+    realm_id: VlobID,
+    writers: int,
+    vlobs_per_writer: int,
+) -> tuple[float, int]:
+    retries = 0
+
+    async def _writer() -> None:
+        nonlocal retries
+        for _ in range(vlobs_per_writer):
+            vlob_id = VlobID.new()
+            # Same as `retry_on_unique_violation`, but counting the retries
+            while True:
+                try:
+                    async with dbh.pool.acquire() as conn:
+                        await vlob_write.query_create(
+                            conn,
+                            dbh.internal_ids,
+                            organization_id,
+                            author,
+                            realm_id,
+                            1,
+                            vlob_id,
+                            DateTime.now(),
+                            b"<dummy>",
+                        )
+                    break
+                except UniqueViolationError:
+                    retries += 1
+
+    start = time.perf_counter()
+    async with trio.open_nursery() as nursery:
+        for _ in range(writers):
+            nursery.start_soon(_writer)
+    return writers * vlobs_per_writer / (time.perf_counter() - start), retries
+
+
+async def main(args: argparse.Namespace) -> None:
+    organization_id = OrganizationID(args.organization)
+    author = DeviceID(args.device)
+    realm_id = VlobID.from_hex(args.realm)
+    dbh = PGHandler(args.db, args.writers, args.writers, EventBus())
+
+    async with open_service_nursery() as nursery:
+        await dbh.init(nursery, events_component=None)
+        try:
+            vanilla_q_vlob_updated = vlob_write._q_vlob_updated
+            for name, q_vlob_updated in (
+                ("max index", _q_vlob_updated_with_max_index),
+                ("realm counter", vanilla_q_vlob_updated),
+            ):
+                vlob_write._q_vlob_updated = q_vlob_updated
+                try:
+                    throughput, retries = await bench(
+                        dbh, organization_id, author, realm_id, args.writers, args.vlobs_per_writer
+                    )
+                finally:
+                    vlob_write._q_vlob_updated = vanilla_q_vlob_updated
+                    async with dbh.pool.acquire() as conn:
+                        await conn.execute(
+                            _q_sync_realm_counter,
+                            await dbh.internal_ids.realm(conn, organization_id, realm_id),
+                        )
+                print(
+                    f"{args.writers} writers on one realm with {name}:"
+                    f" {throughput:.0f} creates/s, {retries} retries"
+                )
+        finally:
+            await dbh.teardown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the concurrent vlob creations")
+    parser.add_argument("--db", required=True, help="PostgreSQL URL")
+    parser.add_argument("--organization", required=True, help="Organization ID")
+    parser.add_argument("--device", required=True, help="ID of the device doing the writes")
+    parser.add_argument("--realm", required=True, help="ID of the realm (in hex)")
+    parser.add_argument("--writers", type=int, default=20, help="Number of concurrent writers")
+    parser.add_argument(
+        "--vlobs-per-writer", type=int, default=50, help="Number of vlobs created by each writer"
+    )
+    trio_run(main, parser.parse_args(), use_asyncio=True)
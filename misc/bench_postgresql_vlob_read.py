@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+
+"""
+Measure the latency of a vlob read on PostgreSQL:
+- legacy: the previous implementation of `query_read`, i.e. in a transaction one round
+  trip for each of the realm ID, the realm status, the reader's role, the vlob atom
+  and the last role of the vlob's author
+- single statement: the current implementation of `query_read`
+
+The vlob must already exist in the database (e.g. created by a client connected to a
+server using this database).
+
+Usage: python misc/bench_postgresql_vlob_read.py --db postgresql://localhost/parsec \
+    --organization CoolOrg --device alice@dev1 --vlob 10000000000000000000000000000000
+"""
+
+from __future__ import annotations
+
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "server"))
+
+import triopg
+
+from parsec._parsec import DeviceID, OrganizationID, VlobID
+from parsec.backend.postgresql.handler import PGHandler
+from parsec.backend.postgresql.utils import Q, q_device, q_vlob_encryption_revision_internal_id
+from parsec.backend.postgresql.vlob_queries.read import query_read
+from parsec.backend.postgresql.vlob_queries.utils import (
+    _check_realm_and_read_access,
+    _get_realm_id_from_vlob_id,
+    _q_check_realm_access,
+)
+from parsec.event_bus import EventBus
+from parsec.utils import open_service_nursery, trio_run
+
+_q_legacy_read_data = Q(
+    f"""
+SELECT
+    version,
+    blob,
+    { q_device(_id="author", select="device_id") } as author,
+    created_on
+FROM vlob_atom
+WHERE
+    vlob_encryption_revision = {
+        q_vlob_encryption_revision_internal_id(
+            organization_id="$organization_id",
+            realm_id="$realm_id",
+            encryption_revision="$encryption_revision",
+        )
+    }
+    AND vlob_id = $vlob_id
+ORDER BY version DESC
+LIMIT 1
+"""
+)
+
+
+async def legacy_read(
+    conn: triopg._triopg.TrioConnectionProxy,
+    organization_id: OrganizationID,
+    author: DeviceID,
+    encryption_revision: int,
+    vlob_id: VlobID,
+) -> None:
+    async with conn.transaction():
+        realm_id = await _get_realm_id_from_vlob_id(conn, organization_id, vlob_id)
+        await _check_realm_and_read_access(
+            conn, organization_id, author, realm_id, encryption_revision
+        )
+        data = await conn.fetchrow(
+            *_q_legacy_read_data(
+                organization_id=organization_id.str,
+                realm_id=realm_id,
+                encryption_revision=encryption_revision,
+                vlob_id=vlob_id,
+            )
+        )
+        # Last role granted to the vlob's author
+        await conn.fetchrow(
+            *_q_check_realm_access(
+                organization_id=organization_id.str,
+                realm_id=realm_id,
+                user_id=DeviceID(data["author"]).user_id.str,
+            )
+        )
+
+
+async def single_statement_read(
+    conn: triopg._triopg.TrioConnectionProxy,
+    organization_id: OrganizationID,
+    author: DeviceID,
+    encryption_revision: int,
+    vlob_id: VlobID,
+) -> None:
+    await query_read(conn, organization_id, author, encryption_revision, vlob_id)
+
+
+async def bench(fn: Callable[[], Awaitable[None]], count: int, warmup: int = 100) -> List[float]:
+    for _ in range(warmup):
+        await fn()
+    durations = []
+    for _ in range(count):
+        start = time.perf_counter()
+        await fn()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+async def main(args: argparse.Namespace) -> None:
+    organization_id = OrganizationID(args.organization)
+    author = DeviceID(args.device)
+    vlob_id = VlobID.from_hex(args.vlob)
+    dbh = PGHandler(args.db, 1, 1, EventBus())
+
+    async with open_service_nursery() as nursery:
+        await dbh.init(nursery, events_component=None)
+        try:
+            async with dbh.pool.acquire() as conn:
+                print(f"{args.count} reads of vlob {vlob_id.hex}, latency in ms:")
+                for name, read in (
+                    ("legacy", legacy_read),
+                    ("single statement", single_statement_read),
+                ):
+                    durations = await bench(
+                        lambda: read(
+                            conn, organization_id, author, args.encryption_revision, vlob_id
+                        ),
+                        args.count,
+                    )
+                    percentiles = statistics.quantiles(durations, n=100)
+                    print(
+                        f"{name:>18}: mean {statistics.mean(durations) * 1e3:.3f}"
+                        f" p50 {percentiles[49] * 1e3:.3f}"
+                        f" p99 {percentiles[98] * 1e3:.3f}"
+                    )
+        finally:
+            await dbh.teardown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the PostgreSQL vlob read")
+    parser.add_argument("--db", required=True, help="PostgreSQL URL")
+    parser.add_argument("--organization", required=True, help="Organization ID")
+    parser.add_argument("--device", required=True, help="ID of the device doing the reads")
+    parser.add_argument("--vlob", required=True, help="ID of the vlob to read (hex)")
+    parser.add_argument("--encryption-revision", type=int, default=1)
+    parser.add_argument("--count", type=int, default=2000, help="Number of reads")
+    trio_run(main, parser.parse_args(), use_asyncio=True)
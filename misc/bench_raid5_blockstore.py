@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+
+"""
+Measure the throughput (in MB/s, on a single core) of the RAID5 blockstore data path:
+- create: split the block in chunks and compute the checksum chunk
+- read: rebuild the block from all the chunks
+- degraded read: rebuild the block from the checksum chunk and all chunks but one
+
+Usage: python misc/bench_raid5_blockstore.py --nodes 3 --block-size 524288
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Callable
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "server"))
+
+from parsec.backend.raid5_blockstore import (
+    generate_checksum_chunk,
+    rebuild_block_from_chunks,
+    split_block_in_chunks,
+)
+
+
+def bench(fn: Callable[[], object], block_size: int, duration: float) -> float:
+    rounds = 0
+    start = time.perf_counter()
+    while True:
+        fn()
+        rounds += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= duration:
+            return rounds * block_size / elapsed / 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the RAID5 blockstore data path")
+    parser.add_argument("--nodes", type=int, default=3, help="Number of RAID5 nodes")
+    parser.add_argument("--block-size", type=int, default=512 * 1024, help="Block size in bytes")
+    parser.add_argument("--duration", type=float, default=2.0, help="Duration of each benchmark")
+    args = parser.parse_args()
+    if args.nodes < 2:
+        raise SystemExit("RAID5 requires at least 2 nodes")
+
+    nb_chunks = args.nodes - 1
+    block = os.urandom(args.block_size)
+    chunks = split_block_in_chunks(block, nb_chunks)
+    checksum_chunk = generate_checksum_chunk(chunks)
+
+    def _create() -> None:
+        generate_checksum_chunk(split_block_in_chunks(block, nb_chunks))
+
+    def _read() -> None:
+        rebuild_block_from_chunks(list(chunks), None)
+
+    def _degraded_read() -> None:
+        rebuild_block_from_chunks([None, *chunks[1:]], checksum_chunk)
+
+    print(f"RAID5 with {args.nodes} nodes, {args.block_size} bytes blocks")
+    for name, fn in (("create", _create), ("read", _read), ("degraded read", _degraded_read)):
+        print(f"{name:>15}: {bench(fn, args.block_size, args.duration):10.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
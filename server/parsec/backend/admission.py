@@ -0,0 +1,220 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+from __future__ import annotations
+
+from collections import defaultdict, deque
+from functools import wraps
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Awaitable,
+    Callable,
+    DefaultDict,
+    Deque,
+    Dict,
+    FrozenSet,
+    Mapping,
+)
+
+import attr
+import trio
+
+from parsec.backend.config import BackendConfig
+from parsec.backend.metrics import ADMISSION_COMMANDS, ADMISSION_REJECTED
+
+if TYPE_CHECKING:
+    from parsec.backend.client_context import BaseClientContext
+
+# Admission control of the API commands: the number of commands running concurrently
+# is bounded, so that an overloaded server queues the commands here (in a queue that is
+# bounded in time and fair between the organizations) instead of inside the PostgreSQL
+# pool (where the wait is unbounded and first come, first served).
+
+# Commands waiting for a peer or for events, they spend most of their time idle
+# hence are not subject to admission control
+LONG_POLLING_COMMANDS = frozenset(
+    {
+        "events_listen",
+        "invite_1_claimer_wait_peer",
+        "invite_1_greeter_wait_peer",
+        "invite_2a_claimer_send_hash_nonce",
+        "invite_2a_greeter_get_hashed_nonce",
+        "invite_2b_claimer_send_nonce",
+        "invite_2b_greeter_send_nonce",
+        "invite_3a_claimer_signify_trust",
+        "invite_3a_greeter_wait_peer_trust",
+        "invite_3b_claimer_wait_peer_trust",
+        "invite_3b_greeter_signify_trust",
+        "invite_4_claimer_communicate",
+        "invite_4_greeter_communicate",
+    }
+)
+
+# Delay (in seconds) advised to the clients before retrying a rejected command
+ADMISSION_RETRY_AFTER = 1
+
+
+class AdmissionRejected(Exception):
+    """
+    The command has waited too long to be run, the client should retry it later.
+    """
+
+    def __init__(self, cmd: str, retry_after: int = ADMISSION_RETRY_AFTER):
+        super().__init__(cmd)
+        self.cmd = cmd
+        self.retry_after = retry_after
+
+
+@attr.s(slots=True, auto_attribs=True, eq=False)
+class _Waiter:
+    cmd: str
+    priority: bool
+    event: trio.Event = attr.ib(factory=trio.Event)
+    granted: bool = False
+
+
+class AdmissionController:
+    """
+    Commands run concurrently up to `max_concurrent_commands`, with:
+    - `reserved_capacity` slots that only the `priority_commands` can use (so that
+      the reads keep being served when the server is busy with heavier commands)
+    - `command_limits` bounding the concurrency of specific commands
+    - queued commands rejected with `AdmissionRejected` after `queue_timeout` seconds
+    - queued commands of the organization with the fewest running commands served
+      first (in a round robin between organizations in case of tie), so that a
+      single organization cannot starve the others
+    """
+
+    def __init__(
+        self,
+        max_concurrent_commands: int,
+        reserved_capacity: int,
+        priority_commands: FrozenSet[str],
+        command_limits: Mapping[str, int],
+        queue_timeout: float,
+    ):
+        assert 0 <= reserved_capacity < max_concurrent_commands
+        self.max_concurrent_commands = max_concurrent_commands
+        self.reserved_capacity = reserved_capacity
+        self.priority_commands = priority_commands
+        self.command_limits = dict(command_limits)
+        self.queue_timeout = queue_timeout
+        self.running = 0
+        self._running_per_cmd: DefaultDict[str, int] = defaultdict(int)
+        self._running_per_organization: DefaultDict[str, int] = defaultdict(int)
+        # Queued commands per organization, the dict order is the round robin order
+        self._waiters: Dict[str, Deque[_Waiter]] = {}
+
+    @classmethod
+    def from_config(cls, config: BackendConfig) -> AdmissionController | None:
+        if not config.admission_max_concurrent_commands:
+            return None
+        return cls(
+            max_concurrent_commands=config.admission_max_concurrent_commands,
+            reserved_capacity=config.admission_reserved_capacity,
+            priority_commands=config.admission_priority_commands,
+            command_limits=config.admission_command_limits,
+            queue_timeout=config.admission_queue_timeout,
+        )
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    def collect_metrics(self) -> None:
+        ADMISSION_COMMANDS.set("running", value=self.running)
+        ADMISSION_COMMANDS.set("waiting", value=self.waiting)
+
+    def _can_run(self, cmd: str, priority: bool) -> bool:
+        capacity = self.max_concurrent_commands
+        if not priority:
+            capacity -= self.reserved_capacity
+        if self.running >= capacity:
+            return False
+        cmd_limit = self.command_limits.get(cmd)
+        return cmd_limit is None or self._running_per_cmd[cmd] < cmd_limit
+
+    def _start(self, cmd: str, organization: str) -> None:
+        self.running += 1
+        self._running_per_cmd[cmd] += 1
+        self._running_per_organization[organization] += 1
+
+    def _release(self, cmd: str, organization: str) -> None:
+        self.running -= 1
+        self._running_per_cmd[cmd] -= 1
+        self._running_per_organization[organization] -= 1
+        if not self._running_per_organization[organization]:
+            del self._running_per_organization[organization]
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        # Note this is called each time a slot is released, hence a queued command can
+        # only be blocked by the capacity or its command limit (i.e. a new command that
+        # can run right away doesn't overtake anyone)
+        while self._waiters:
+            # Stable sort, so the round robin order is kept between ties
+            for organization in sorted(
+                self._waiters, key=lambda org: self._running_per_organization.get(org, 0)
+            ):
+                waiters = self._waiters[organization]
+                waiter = next((w for w in waiters if self._can_run(w.cmd, w.priority)), None)
+                if waiter is not None:
+                    break
+            else:
+                return
+
+            waiters.remove(waiter)
+            # Move the organization at the end of the round robin
+            del self._waiters[organization]
+            if waiters:
+                self._waiters[organization] = waiters
+            self._start(waiter.cmd, organization)
+            waiter.granted = True
+            waiter.event.set()
+
+    def _remove_waiter(self, organization: str, waiter: _Waiter) -> None:
+        waiters = self._waiters[organization]
+        waiters.remove(waiter)
+        if not waiters:
+            del self._waiters[organization]
+
+    async def _acquire(self, cmd: str, priority: bool, organization: str) -> None:
+        if self._can_run(cmd, priority):
+            self._start(cmd, organization)
+            return
+
+        waiter = _Waiter(cmd=cmd, priority=priority)
+        self._waiters.setdefault(organization, deque()).append(waiter)
+        try:
+            with trio.move_on_after(self.queue_timeout):
+                await waiter.event.wait()
+        except BaseException:
+            # Cancelled (e.g. the client is gone)
+            if waiter.granted:
+                self._release(cmd, organization)
+            else:
+                self._remove_waiter(organization, waiter)
+            raise
+
+        if not waiter.granted:
+            self._remove_waiter(organization, waiter)
+            ADMISSION_REJECTED.inc(cmd)
+            raise AdmissionRejected(cmd)
+
+    def wrap_api(
+        self, cmd: str, fn: Callable[[BaseClientContext, Any], Awaitable[Any]]
+    ) -> Callable[[BaseClientContext, Any], Awaitable[Any]]:
+        if cmd in LONG_POLLING_COMMANDS:
+            return fn
+        priority = cmd in self.priority_commands
+
+        @wraps(fn)
+        async def wrapper(client_ctx: BaseClientContext, req: Any) -> Any:
+            organization_id = getattr(client_ctx, "organization_id", None)
+            organization = organization_id.str if organization_id is not None else ""
+            await self._acquire(cmd, priority, organization)
+            try:
+                return await fn(client_ctx, req)
+            finally:
+                self._release(cmd, organization)
+
+        return wrapper
@@ -8,11 +8,13 @@ from typing import Any, AsyncGenerator, Callable, Dict, Type
 import attr
 
 from parsec._parsec import OrganizationID, RealmRole, UserProfile
+from parsec.backend.admission import AdmissionController
 from parsec.backend.block import BaseBlockComponent
 from parsec.backend.blockstore import BaseBlockStoreComponent
 from parsec.backend.client_context import BaseClientContext
 from parsec.backend.config import BackendConfig
 from parsec.backend.events import EventsComponent
+from parsec.backend.handshake_cache import HandshakeCache
 from parsec.backend.invite import BaseInviteComponent
 from parsec.backend.memory import components_factory as mocked_components_factory
 from parsec.backend.message import BaseMessageComponent
@@ -22,6 +24,7 @@ from parsec.backend.pki import BasePkiEnrollmentComponent
 from parsec.backend.postgresql import components_factory as postgresql_components_factory
 from parsec.backend.realm import BaseRealmComponent, RealmGrantedRole
 from parsec.backend.sequester import BaseSequesterComponent, StorageSequesterService
+from parsec.backend.tracing import open_tracing
 from parsec.backend.user import BaseUserComponent, Device, User
 from parsec.backend.utils import collect_apis
 from parsec.backend.vlob import BaseVlobComponent
@@ -40,24 +43,30 @@ async def backend_app_factory(
     else:
         components_factory = postgresql_components_factory
 
-    async with components_factory(config=config, event_bus=event_bus) as components:
-        yield BackendApp(
-            config=config,
-            event_bus=event_bus,
-            webhooks=components["webhooks"],
-            user=components["user"],
-            invite=components["invite"],
-            organization=components["organization"],
-            message=components["message"],
-            realm=components["realm"],
-            vlob=components["vlob"],
-            ping=components["ping"],
-            blockstore=components["blockstore"],
-            block=components["block"],
-            pki=components["pki"],
-            sequester=components["sequester"],
-            events=components["events"],
-        )
+    async with open_tracing(
+        sample_rate=config.tracing_sample_rate, export_path=config.tracing_export_path
+    ), components_factory(config=config, event_bus=event_bus) as components:
+        handshake_cache = components["handshake_cache"]
+        with handshake_cache.listen_invalidation_events(event_bus):
+            yield BackendApp(
+                config=config,
+                event_bus=event_bus,
+                webhooks=components["webhooks"],
+                user=components["user"],
+                invite=components["invite"],
+                organization=components["organization"],
+                message=components["message"],
+                realm=components["realm"],
+                vlob=components["vlob"],
+                ping=components["ping"],
+                blockstore=components["blockstore"],
+                block=components["block"],
+                pki=components["pki"],
+                sequester=components["sequester"],
+                events=components["events"],
+                handshake_cache=handshake_cache,
+                admission=AdmissionController.from_config(config),
+            )
 
 
 @attr.s(slots=True, auto_attribs=True, kw_only=True, eq=False, repr=False)
@@ -77,6 +86,8 @@ class BackendApp:
     pki: BasePkiEnrollmentComponent
     sequester: BaseSequesterComponent
     events: EventsComponent
+    handshake_cache: HandshakeCache
+    admission: AdmissionController | None = None
 
     apis: Dict[Type[Any], Callable[[BaseClientContext, Any], Any]] = attr.field(init=False)
 
@@ -95,6 +106,7 @@ class BackendApp:
             self.events,
             # Ping command is only used in tests
             include_ping=self.config.debug,
+            admission=self.admission,
         )
 
     def test_duplicate_organization(self, id: OrganizationID, new_id: OrganizationID) -> None:
@@ -122,6 +134,7 @@ class BackendApp:
         self.block.test_drop_organization(id)  # type: ignore[attr-defined]
         self.pki.test_drop_organization(id)  # type: ignore[attr-defined]
         self.sequester.test_drop_organization(id)  # type: ignore[attr-defined]
+        self.handshake_cache.clear()
 
     async def test_load_template(self, template: Any) -> OrganizationID:
         from parsec._parsec import testbed
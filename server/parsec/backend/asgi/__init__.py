@@ -2,8 +2,10 @@
 from __future__ import annotations
 
 import logging
+import os
+import socket
 from pathlib import Path
-from typing import Any, List, Tuple, Type, TypeVar
+from typing import Any, Awaitable, Callable, List, Tuple, Type, TypeVar
 
 import trio
 import trio_typing
@@ -119,13 +121,27 @@ async def serve_backend_with_asgi(
     ssl_keyfile: Path | None = None,
     task_status: trio_typing.TaskStatus[T] = trio.TASK_STATUS_IGNORED,
     app: BackendQuartTrio | None = None,
+    sock: socket.socket | None = None,
+    shutdown_trigger: Callable[[], Awaitable[None]] | None = None,
 ) -> None:
+    """
+    Serve on `host:port`, or on the already listening `sock` if provided (i.e. the
+    socket shared by the workers). `shutdown_trigger` returns to start a graceful
+    shutdown: stop accepting connections and let the running requests finish.
+    """
     app = app or app_factory(backend)
+    if sock is not None:
+        # Hypercorn takes ownership of the file descriptor and closes it once done,
+        # so give it a copy to be able to serve the socket again (e.g. on database
+        # reconnection)
+        bind = f"fd://{os.dup(sock.fileno())}"
+    else:
+        bind = f"{host}:{port}"
     # Note: Hypercorn comes with default values for incoming data size to
     # avoid DoS abuse, so just trust them on that ;-)
     hyper_config = HyperConfig.from_mapping(
         {
-            "bind": [f"{host}:{port}"],
+            "bind": [bind],
             "accesslog": logging.getLogger("hypercorn.access"),
             # Timestamp is added by the log processor configured in `parsec.logging`,
             # here we configure peer address + req line + rep status + rep body size + time
@@ -139,7 +155,7 @@ async def serve_backend_with_asgi(
     )
     _patch_server_header(backend.config, hyper_config=hyper_config)
 
-    await serve(app, hyper_config, task_status=task_status)
+    await serve(app, hyper_config, task_status=task_status, shutdown_trigger=shutdown_trigger)
 
     # `hypercorn.serve` catches KeyboardInterrupt and returns, so re-raise
     # the keyboard interrupt to continue shutdown
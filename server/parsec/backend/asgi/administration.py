@@ -24,6 +24,7 @@ from parsec.api.rest import (
     organization_update_req_serializer,
     server_stats_rep_serializer,
 )
+from parsec.backend.metrics import collect_backend_metrics, render_metrics
 from parsec.backend.organization import (
     OrganizationAlreadyExistsError,
     OrganizationNotFoundError,
@@ -289,3 +290,16 @@ async def administration_server_stats() -> Response:
             },
             status=200,
         )
+
+
+@administration_bp.route("/metrics", methods=["GET"])
+@administration_authenticated
+async def administration_metrics() -> Response:
+    backend: "BackendApp" = g.backend
+    collect_backend_metrics(backend)
+    return current_app.response_class(
+        render_metrics(),
+        # Prometheus text exposition format
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+        status=200,
+    )
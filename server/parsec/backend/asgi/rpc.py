@@ -5,7 +5,8 @@ from __future__ import annotations
 from base64 import b64decode, b64encode
 from contextlib import asynccontextmanager, contextmanager
 from enum import Enum
-from typing import Any, AsyncIterable, AsyncIterator, Iterator, NoReturn, Type
+from functools import wraps
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Iterator, NoReturn, Type
 
 import trio
 from quart import Blueprint, Response, current_app, g, request
@@ -30,6 +31,7 @@ from parsec.api.protocol import (
     IncompatibleAPIVersionsError,
     settle_compatible_versions,
 )
+from parsec.backend.admission import AdmissionRejected
 from parsec.backend.app import BackendApp
 from parsec.backend.client_context import (
     AnonymousClientContext,
@@ -43,17 +45,22 @@ from parsec.backend.invite import (
     InvitationError,
     InvitationNotFoundError,
 )
+from parsec.backend.metrics import CLIENT_CONNECTIONS
 from parsec.backend.organization import (
     Organization,
     OrganizationAlreadyExistsError,
     OrganizationNotFoundError,
 )
+from parsec.backend.tracing import traced_request
 from parsec.backend.user import UserNotFoundError
 from parsec.backend.user_type import Device, User
+from parsec.backend.utils import ConsistencyFence, current_consistency_fence
 
 CONTENT_TYPE_MSGPACK = "application/msgpack"
 ACCEPT_TYPE_SSE = "text/event-stream"
 AUTHORIZATION_PARSEC_ED25519 = "PARSEC-SIGN-ED25519"
+# Opaque to the client, which must send back the greatest value it has received
+CONSISTENCY_FENCE_HEADER = "Consistency-Fence"
 SUPPORTED_API_VERSIONS = (
     ApiVersion.API_V2_VERSION,
     ApiVersion.API_V3_VERSION,
@@ -93,6 +100,31 @@ def _rpc_rep(rep: Any, api_version: ApiVersion) -> Response:
     )
 
 
+def _track_consistency_fence(
+    fn: Callable[..., Awaitable[Response]]
+) -> Callable[..., Awaitable[Response]]:
+    # The reads of the request must be consistent with the fence sent by the client
+    # (i.e. with the previous writes of the client, which may have been done by
+    # another server process), and the reply provides the fence of its writes
+    @wraps(fn)
+    async def wrapper(*args: Any, **kwargs: Any) -> Response:
+        consistency_fence = ConsistencyFence()
+        try:
+            consistency_fence.update(int(request.headers.get(CONSISTENCY_FENCE_HEADER, "0")))
+        except ValueError:
+            pass
+        token = current_consistency_fence.set(consistency_fence)
+        try:
+            response = await fn(*args, **kwargs)
+        finally:
+            current_consistency_fence.reset(token)
+        if consistency_fence.lsn:
+            response.headers[CONSISTENCY_FENCE_HEADER] = str(consistency_fence.lsn)
+        return response
+
+    return wrapper
+
+
 # The HTTP RPC API is divided into two layers: handshake and actual command processing
 # The command processing is based on msgpack and is common with the Websocket API.
 #
@@ -112,6 +144,8 @@ def _rpc_rep(rep: Any, api_version: ApiVersion) -> Response:
 # - 422: Unsupported API version
 # - 460: Organization is expired
 # - 461: User is revoked
+# - 503: Server is overloaded, the request should be retried later (see the
+#        `Retry-After` header)
 
 
 class CustomHttpStatus(Enum):
@@ -123,6 +157,7 @@ class CustomHttpStatus(Enum):
     UnsupportedApiVersion = 422
     OrganizationExpired = 460
     UserRevoked = 461
+    ServerOverloaded = 503
 
 
 def _handshake_abort(status_code: int, api_version: ApiVersion) -> NoReturn:
@@ -131,6 +166,16 @@ def _handshake_abort(status_code: int, api_version: ApiVersion) -> NoReturn:
     )
 
 
+def _admission_abort(exc: AdmissionRejected, api_version: ApiVersion) -> NoReturn:
+    current_app.aborter(
+        Response(
+            response="",
+            status=CustomHttpStatus.ServerOverloaded.value,
+            headers={"Api-Version": str(api_version), "Retry-After": str(exc.retry_after)},
+        )
+    )
+
+
 def _handshake_abort_bad_content(api_version: ApiVersion) -> NoReturn:
     _handshake_abort(
         CustomHttpStatus.BadContentTypeOrInvalidBodyOrUnknownCommand.value, api_version
@@ -195,7 +240,11 @@ async def _do_handshake(
         )
     organization: Organization | None
     try:
-        organization = await backend.organization.get(organization_id)
+        if check_authentication:
+            # Authenticated API is the hot path (each RPC request goes through a handshake !)
+            organization = await backend.handshake_cache.get_organization(organization_id)
+        else:
+            organization = await backend.organization.get(organization_id)
     except OrganizationNotFoundError:
         if not allow_missing_organization:
             _handshake_abort(
@@ -242,7 +291,9 @@ async def _do_handshake(
 
         body: bytes = await request.get_data()
         try:
-            user, device = await backend.user.get_user_with_device(organization_id, device_id)
+            user, device = await backend.handshake_cache.get_user_with_device(
+                organization_id, device_id
+            )
         except UserNotFoundError:
             _handshake_abort(CustomHttpStatus.BadAuthenticationInfo.value, api_version=api_version)
         else:
@@ -282,6 +333,7 @@ async def _do_handshake(
 
 
 @rpc_bp.route("/anonymous/<raw_organization_id>", methods=["GET", "POST"])
+@traced_request("rpc.anonymous")
 async def anonymous_api(raw_organization_id: str) -> Response:
     backend: BackendApp = g.backend
 
@@ -336,6 +388,8 @@ async def anonymous_api(raw_organization_id: str) -> Response:
     # Run command
     try:
         rep = await cmd_func(client_ctx, req)
+    except AdmissionRejected as exc:
+        _admission_abort(exc, api_version=api_version)
     except Exception as exc:
         print("rpc didn't handle this exception:", type(exc))
         raise exc
@@ -344,6 +398,7 @@ async def anonymous_api(raw_organization_id: str) -> Response:
 
 
 @rpc_bp.route("/invited/<raw_organization_id>", methods=["POST"])
+@traced_request("rpc.invited")
 async def invited_api(raw_organization_id: str) -> Response:
     backend: BackendApp = g.backend
 
@@ -380,6 +435,8 @@ async def invited_api(raw_organization_id: str) -> Response:
 
     try:
         rep = await cmd_func(client_ctx, req)
+    except AdmissionRejected as exc:
+        _admission_abort(exc, api_version=api_version)
     except CloseInviteConnection:
         _handshake_abort(
             CustomHttpStatus.InvitationAlreadyUsedOrDeleted.value, api_version=api_version
@@ -392,6 +449,8 @@ async def invited_api(raw_organization_id: str) -> Response:
 
 
 @rpc_bp.route("/authenticated/<raw_organization_id>", methods=["POST"])
+@traced_request("rpc.authenticated")
+@_track_consistency_fence
 async def authenticated_api(raw_organization_id: str) -> Response:
     backend: BackendApp = g.backend
 
@@ -434,6 +493,8 @@ async def authenticated_api(raw_organization_id: str) -> Response:
 
     try:
         rep = await cmd_func(client_ctx, req)
+    except AdmissionRejected as exc:
+        _admission_abort(exc, api_version=api_version)
     except Exception as exc:
         print("rpc didn't handle this exception:", type(exc))
         raise exc
@@ -567,7 +628,7 @@ class SSEResponseIterableBody(ResponseBody):
                                 await self._sse_payload_sender.send(sse_payload)
 
         assert client_ctx.cancel_scope is not None
-        with client_ctx.cancel_scope:
+        with client_ctx.cancel_scope, CLIENT_CONNECTIONS.track_inprogress("sse"):
             async with trio.open_nursery() as nursery:
                 with backend.event_bus.connection_context() as client_ctx.event_bus_ctx:
                     nursery.start_soon(_events_into_sse_payloads)
@@ -18,6 +18,7 @@ from parsec._parsec import (
     OrganizationID,
     ProtocolError,
 )
+from parsec.backend.admission import AdmissionRejected
 from parsec.backend.app import BackendApp
 from parsec.backend.asgi.rpc import (
     AUTHENTICATED_CMDS_LOAD_FN,
@@ -30,6 +31,8 @@ from parsec.backend.client_context import (
 )
 from parsec.backend.handshake import do_handshake
 from parsec.backend.invite import CloseInviteConnection
+from parsec.backend.metrics import CLIENT_CONNECTIONS
+from parsec.backend.tracing import start_trace
 from parsec.backend.utils import CancelledByNewCmd, run_with_cancel_on_client_sending_new_cmd
 from parsec.serde import packb
 
@@ -44,6 +47,11 @@ ws_bp = Blueprint("ws_api", __name__)
 
 @ws_bp.websocket("/ws")
 async def handle_ws() -> None:
+    with CLIENT_CONNECTIONS.track_inprogress("websocket"):
+        await _handle_ws()
+
+
+async def _handle_ws() -> None:
     backend: BackendApp = g.backend
     selected_logger = logger
 
@@ -190,14 +198,15 @@ async def _handle_client_websocket_loop(
             cmd_func = cast(Callable[[Any, Any], Awaitable[Any]], backend.apis[type(req)])
 
             try:
-                if cmd_func._api_info[  # type: ignore[attr-defined]
-                    "cancel_on_client_sending_new_cmd"
-                ]:
-                    rep = await run_with_cancel_on_client_sending_new_cmd(
-                        websocket, cmd_func, client_ctx, req
-                    )
-                else:
-                    rep = await cmd_func(client_ctx, req)
+                with start_trace("ws.command"):
+                    if cmd_func._api_info[  # type: ignore[attr-defined]
+                        "cancel_on_client_sending_new_cmd"
+                    ]:
+                        rep = await run_with_cancel_on_client_sending_new_cmd(
+                            websocket, cmd_func, client_ctx, req
+                        )
+                    else:
+                        rep = await cmd_func(client_ctx, req)
 
                 raw_rep = rep.dump()
 
@@ -207,8 +216,21 @@ async def _handle_client_websocket_loop(
                 raw_req = exc.new_raw_req
                 continue
 
-            # TODO: cmd/response status should be in snakecase...
-            client_ctx.logger.info("Request", cmd=type(req).__name__, status=type(rep).__name__)
+            except AdmissionRejected as exc:
+                raw_rep = packb(
+                    {
+                        "status": "server_overloaded",
+                        "reason": "Server is overloaded, retry later",
+                        "retry_after": exc.retry_after,
+                    }
+                )
+                client_ctx.logger.info(
+                    "Request", cmd=type(req).__name__, status="server_overloaded"
+                )
+
+            else:
+                # TODO: cmd/response status should be in snakecase...
+                client_ctx.logger.info("Request", cmd=type(req).__name__, status=type(rep).__name__)
 
         try:
             await websocket.send(raw_rep)
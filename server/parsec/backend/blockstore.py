@@ -1,9 +1,11 @@
 # Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
 from __future__ import annotations
 
-from typing import TYPE_CHECKING
+import time
+from typing import TYPE_CHECKING, Any, List
 
 from parsec._parsec import BlockID, OrganizationID
+from parsec.backend.block import BlockStoreError
 from parsec.backend.config import (
     BaseBlockStoreConfig,
     MockedBlockStoreConfig,
@@ -11,9 +13,12 @@ from parsec.backend.config import (
     RAID0BlockStoreConfig,
     RAID1BlockStoreConfig,
     RAID5BlockStoreConfig,
+    ReedSolomonBlockStoreConfig,
     S3BlockStoreConfig,
     SWIFTBlockStoreConfig,
 )
+from parsec.backend.metrics import BLOCKSTORE_DURATION, BLOCKSTORE_ERRORS
+from parsec.backend.tracing import span
 
 if TYPE_CHECKING:
     from parsec.backend.postgresql.handler import PGHandler
@@ -63,8 +68,66 @@ class BaseBlockStoreComponent:
         raise NotImplementedError()
 
 
+class MeasuredBlockStoreComponent(BaseBlockStoreComponent):
+    """
+    Record the duration and the errors of the operations of the wrapped blockstore
+    (other attributes are those of the wrapped blockstore).
+    """
+
+    def __init__(self, blockstore: BaseBlockStoreComponent, name: str):
+        self.blockstore = blockstore
+        self.name = name
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.blockstore, name)
+
+    async def read(self, organization_id: OrganizationID, block_id: BlockID) -> bytes:
+        started_at = time.perf_counter()
+        try:
+            with span("blockstore.read", blockstore=self.name):
+                return await self.blockstore.read(organization_id, block_id)
+        except BlockStoreError:
+            BLOCKSTORE_ERRORS.inc(self.name, "read")
+            raise
+        finally:
+            BLOCKSTORE_DURATION.observe(self.name, "read", value=time.perf_counter() - started_at)
+
+    async def create(
+        self, organization_id: OrganizationID, block_id: BlockID, block: bytes
+    ) -> None:
+        started_at = time.perf_counter()
+        try:
+            with span("blockstore.create", blockstore=self.name):
+                await self.blockstore.create(organization_id, block_id, block)
+        except BlockStoreError:
+            BLOCKSTORE_ERRORS.inc(self.name, "create")
+            raise
+        finally:
+            BLOCKSTORE_DURATION.observe(self.name, "create", value=time.perf_counter() - started_at)
+
+
 def blockstore_factory(
-    config: BaseBlockStoreConfig, postgresql_dbh: PGHandler | None = None
+    config: BaseBlockStoreConfig, postgresql_dbh: PGHandler | None = None, name: str | None = None
+) -> BaseBlockStoreComponent:
+    """
+    `name` identifies the blockstore in the metrics, the sub-blockstores of a RAID
+    are named after their index (e.g. `RAID5/0:S3`).
+    """
+    name = name or config.type
+    return MeasuredBlockStoreComponent(_blockstore_factory(config, postgresql_dbh, name), name)
+
+
+def _sub_blockstores_factory(
+    configs: List[BaseBlockStoreConfig], postgresql_dbh: PGHandler | None, name: str
+) -> List[BaseBlockStoreComponent]:
+    return [
+        blockstore_factory(sub_conf, postgresql_dbh, name=f"{name}/{index}:{sub_conf.type}")
+        for index, sub_conf in enumerate(configs)
+    ]
+
+
+def _blockstore_factory(
+    config: BaseBlockStoreConfig, postgresql_dbh: PGHandler | None, name: str
 ) -> BaseBlockStoreComponent:
     if isinstance(config, MockedBlockStoreConfig):
         from parsec.backend.memory import MemoryBlockStoreComponent
@@ -76,7 +139,7 @@ def blockstore_factory(
 
         if not postgresql_dbh:
             raise ValueError("PostgreSQL block store is not available")
-        return PGBlockStoreComponent(postgresql_dbh)
+        return PGBlockStoreComponent(postgresql_dbh, packed=config.packed)
 
     elif isinstance(config, S3BlockStoreConfig):
         try:
@@ -88,6 +151,7 @@ def blockstore_factory(
                 config.s3_key,
                 config.s3_secret,
                 config.s3_endpoint_url,
+                max_connections=config.s3_max_connections,
             )
         except ImportError as exc:
             raise ValueError("S3 block store is not available") from exc
@@ -109,14 +173,14 @@ def blockstore_factory(
     elif isinstance(config, RAID1BlockStoreConfig):
         from parsec.backend.raid1_blockstore import RAID1BlockStoreComponent
 
-        blocks = [blockstore_factory(sub_conf, postgresql_dbh) for sub_conf in config.blockstores]
+        blocks = _sub_blockstores_factory(config.blockstores, postgresql_dbh, name)
 
         return RAID1BlockStoreComponent(blocks, partial_create_ok=config.partial_create_ok)
 
     elif isinstance(config, RAID0BlockStoreConfig):
         from parsec.backend.raid0_blockstore import RAID0BlockStoreComponent
 
-        blocks = [blockstore_factory(sub_conf, postgresql_dbh) for sub_conf in config.blockstores]
+        blocks = _sub_blockstores_factory(config.blockstores, postgresql_dbh, name)
 
         return RAID0BlockStoreComponent(blocks)
 
@@ -126,9 +190,27 @@ def blockstore_factory(
         if len(config.blockstores) < 3:
             raise ValueError(f"RAID5 block store needs at least 3 nodes")
 
-        blocks = [blockstore_factory(sub_conf, postgresql_dbh) for sub_conf in config.blockstores]
+        blocks = _sub_blockstores_factory(config.blockstores, postgresql_dbh, name)
 
         return RAID5BlockStoreComponent(blocks, partial_create_ok=config.partial_create_ok)
 
+    elif isinstance(config, ReedSolomonBlockStoreConfig):
+        from parsec.backend.reed_solomon_blockstore import ReedSolomonBlockStoreComponent
+
+        if config.parity_shards < 1:
+            raise ValueError(f"RS block store needs at least 1 parity node")
+        if len(config.blockstores) <= config.parity_shards:
+            raise ValueError(f"RS block store needs at least 1 data node")
+        if len(config.blockstores) > 256:
+            raise ValueError(f"RS block store cannot have more than 256 nodes")
+
+        blocks = _sub_blockstores_factory(config.blockstores, postgresql_dbh, name)
+
+        return ReedSolomonBlockStoreComponent(
+            blocks,
+            parity_shards=config.parity_shards,
+            partial_create_ok=config.partial_create_ok,
+        )
+
     else:
         raise ValueError(f"Unknown block store configuration `{config}`")
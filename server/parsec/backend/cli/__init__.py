@@ -3,6 +3,7 @@ from __future__ import annotations
 
 import click
 
+from parsec.backend.cli.blockstore import compact_blockstore
 from parsec.backend.cli.migration import migrate
 from parsec.backend.cli.run import run_cmd
 from parsec.backend.cli.sequester import (
@@ -43,5 +44,6 @@ def backend_cmd_group() -> None:
 
 backend_cmd_group.add_command(run_cmd, "run")
 backend_cmd_group.add_command(migrate, "migrate")
+backend_cmd_group.add_command(compact_blockstore, "compact_blockstore")
 backend_cmd_group.add_command(human_accesses, "human_accesses")
 backend_cmd_group.add_command(backend_sequester_cmd, "sequester")
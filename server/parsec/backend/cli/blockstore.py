@@ -0,0 +1,64 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+from __future__ import annotations
+
+import click
+
+from parsec.backend.cli.sequester import BackendDbConfig, run_pg_db_handler
+from parsec.backend.cli.utils import db_backend_options
+from parsec.backend.postgresql.block import (
+    SEGMENT_COMPACTION_LIVE_RATIO,
+    SEGMENT_COMPACTION_MIN_SIZE,
+    PGBlockStoreComponent,
+)
+from parsec.cli_utils import cli_exception_handler, debug_config_options, operation
+from parsec.utils import trio_run
+
+
+async def _compact_blockstore(db_config: BackendDbConfig, live_ratio: float, min_size: int) -> None:
+    async with run_pg_db_handler(db_config) as dbh:
+        blockstore = PGBlockStoreComponent(dbh, packed=True)
+        with operation("Compacting block segments"):
+            removed, created = await blockstore.compact_segments(
+                live_ratio=live_ratio, min_size=min_size
+            )
+    click.echo(f"{removed} segment(s) rewritten into {created} segment(s)")
+
+
+@click.command(short_help="Reclaim the space of the packed blocks stored in PostgreSQL")
+@click.option(
+    "--live-ratio",
+    type=click.FloatRange(min=0, max=1),
+    default=SEGMENT_COMPACTION_LIVE_RATIO,
+    show_default=True,
+    help="Rewrite the segments with less than this ratio of their data still in use",
+)
+@click.option(
+    "--min-size",
+    type=click.IntRange(min=0),
+    default=SEGMENT_COMPACTION_MIN_SIZE,
+    show_default=True,
+    help="Merge together the segments smaller than this size (in bytes)",
+)
+@db_backend_options
+# Add --debug
+@debug_config_options
+def compact_blockstore(
+    live_ratio: float,
+    min_size: int,
+    db: str,
+    db_max_connections: int,
+    db_min_connections: int,
+    debug: bool,
+) -> None:
+    """
+    Compact the segments used by the `postgresql:packed` blockstore.
+
+    This can be run while the server is running.
+    """
+    with cli_exception_handler(debug):
+        if db.upper() == "MOCKED":
+            raise click.BadParameter("MOCKED DB has no blockstore to compact", param_hint="--db")
+        db_config = BackendDbConfig(
+            db_url=db, db_min_connections=db_min_connections, db_max_connections=db_max_connections
+        )
+        trio_run(_compact_blockstore, db_config, live_ratio, min_size, use_asyncio=True)
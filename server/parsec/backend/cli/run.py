@@ -2,10 +2,17 @@
 from __future__ import annotations
 
 import math
+import multiprocessing
+import multiprocessing.connection
+import os
+import shutil
+import signal
+import socket
 import tempfile
+import time
 from functools import partial
 from pathlib import Path
-from typing import Any, Tuple
+from typing import Any, Awaitable, Callable, Dict, Tuple
 
 import click
 import trio
@@ -16,12 +23,16 @@ from parsec.backend import backend_app_factory
 from parsec.backend.asgi import serve_backend_with_asgi
 from parsec.backend.cli.utils import blockstore_backend_options, db_backend_options
 from parsec.backend.config import (
+    DEFAULT_ADMISSION_COMMAND_LIMITS,
+    DEFAULT_ADMISSION_QUEUE_TIMEOUT,
+    DEFAULT_DB_REPLICA_MAX_LAG,
     BackendConfig,
     BaseBlockStoreConfig,
     EmailConfig,
     MockedEmailConfig,
     SmtpEmailConfig,
 )
+from parsec.backend.metrics import REGISTRY, share_worker_metrics
 from parsec.cli_utils import (
     cli_exception_handler,
     debug_config_options,
@@ -34,6 +45,30 @@ logger = get_logger()
 
 DEFAULT_BACKEND_PORT = 6777
 DEFAULT_EMAIL_SENDER = "no-reply@parsec.com"
+# A worker crashing sooner than this after its start is restarted only after this
+# delay, to avoid a restart loop if the worker cannot start at all
+WORKER_MIN_UPTIME = 5.0
+# Time left to the workers to finish their running requests once asked to stop,
+# before they get killed
+WORKER_SHUTDOWN_TIMEOUT = 10.0
+
+
+def _is_mocked_blockstore(config: BaseBlockStoreConfig) -> bool:
+    # RAID & Reed-Solomon blockstores are made of other blockstores
+    return config.type == "MOCKED" or any(
+        _is_mocked_blockstore(sub_config) for sub_config in getattr(config, "blockstores", ())
+    )
+
+
+def _parse_admission_command_limit_params(raw_params: Tuple[str, ...]) -> Dict[str, int]:
+    command_limits = dict(DEFAULT_ADMISSION_COMMAND_LIMITS)
+    for raw_param in raw_params:
+        try:
+            cmd, raw_limit = raw_param.split("=")
+            command_limits[cmd] = int(raw_limit)
+        except ValueError:
+            raise click.BadParameter(f"Invalid format, should be `<command>=<limit>`")
+    return command_limits
 
 
 def _parse_forward_proto_enforce_https_check_param(
@@ -105,7 +140,37 @@ For instance:
     envvar="PARSEC_PORT",
     help="Port to listen on",
 )
+@click.option(
+    "--workers",
+    default=1,
+    type=click.IntRange(min=1),
+    show_default=True,
+    envvar="PARSEC_WORKERS",
+    help=(
+        "Number of processes serving the requests on the same port."
+        " Each worker has its own database connections (i.e. `--db-max-connections`"
+        " is the maximum per worker)"
+    ),
+)
 @db_backend_options
+@click.option(
+    "--db-replica",
+    multiple=True,
+    envvar="PARSEC_DB_REPLICA",
+    metavar="URL",
+    help=(
+        "PostgreSQL streaming replica of `--db` the read-only commands can be routed to"
+        " (can be used multiple times)"
+    ),
+)
+@click.option(
+    "--db-replica-max-lag",
+    default=DEFAULT_DB_REPLICA_MAX_LAG,
+    show_default=True,
+    type=click.FloatRange(min=0.0, min_open=True),
+    envvar="PARSEC_DB_REPLICA_MAX_LAG",
+    help="Replication lag (in seconds) past which a replica no longer serves reads",
+)
 @click.option(
     "--maximum-database-connection-attempts",
     default=10,
@@ -282,15 +347,79 @@ organization_id, device_id, device_label (can be null), human_email (can be null
     envvar="PARSEC_SSE_KEEPALIVE",
     help="Keep SSE connection open by sending keepalive messages to client (pass <= 0 to disable)",
 )
+@click.option(
+    "--admission-max-concurrent-commands",
+    default=0,
+    show_default=True,
+    type=click.IntRange(min=0),
+    envvar="PARSEC_ADMISSION_MAX_CONCURRENT_COMMANDS",
+    help=(
+        "Maximum number of commands running concurrently, the others are queued (pass 0 to"
+        " disable). Note the clients don't retry the commands rejected after"
+        " `--admission-queue-timeout`"
+    ),
+)
+@click.option(
+    "--admission-reserved-capacity",
+    type=click.IntRange(min=0),
+    envvar="PARSEC_ADMISSION_RESERVED_CAPACITY",
+    help=(
+        "Part of `--admission-max-concurrent-commands` reserved to the `vlob_read` and"
+        " `block_read` commands. Defaults to a quarter of it"
+    ),
+)
+@click.option(
+    "--admission-command-limit",
+    multiple=True,
+    envvar="PARSEC_ADMISSION_COMMAND_LIMIT",
+    callback=lambda ctx, param, value: _parse_admission_command_limit_params(value),
+    help=(
+        "Maximum number of concurrent executions of a command, with the form"
+        " `<command>=<limit>` (default: "
+        + ", ".join(f"{cmd}={limit}" for cmd, limit in DEFAULT_ADMISSION_COMMAND_LIMITS.items())
+        + ")"
+    ),
+)
+@click.option(
+    "--admission-queue-timeout",
+    default=DEFAULT_ADMISSION_QUEUE_TIMEOUT,
+    show_default=True,
+    type=click.FloatRange(min=0.0),
+    envvar="PARSEC_ADMISSION_QUEUE_TIMEOUT",
+    help="Time (in seconds) a command can be queued before being rejected as overloaded",
+)
+@click.option(
+    "--tracing-sample-rate",
+    default=0.0,
+    show_default=True,
+    type=click.FloatRange(min=0.0, max=1.0),
+    envvar="PARSEC_TRACING_SAMPLE_RATE",
+    help="Ratio of the requests to trace (pass 0 to disable), requires `--tracing-export-file`",
+)
+@click.option(
+    "--tracing-export-file",
+    type=click.Path(dir_okay=False, path_type=Path),
+    envvar="PARSEC_TRACING_EXPORT_FILE",
+    help="File the traces are appended to, in the OpenTelemetry (OTLP) JSON format",
+)
 # Add --debug
 @debug_config_options
 def run_cmd(
     host: str,
     port: int,
+    workers: int,
     db: str,
     db_min_connections: int,
     db_max_connections: int,
+    db_replica: Tuple[str, ...],
+    db_replica_max_lag: float,
     sse_keepalive: float,
+    admission_max_concurrent_commands: int,
+    admission_reserved_capacity: int | None,
+    admission_command_limit: Dict[str, int],
+    admission_queue_timeout: float,
+    tracing_sample_rate: float,
+    tracing_export_file: Path | None,
     maximum_database_connection_attempts: int,
     pause_before_retry_database_connection: float,
     blockstore: BaseBlockStoreConfig,
@@ -341,11 +470,36 @@ def run_cmd(
                 sender=email_sender,
             )
 
+        if workers > 1:
+            if not hasattr(os, "fork"):
+                raise ValueError("--workers is not supported on this platform")
+            # Each worker would have its own separate in-memory data
+            if db.upper() == "MOCKED" or _is_mocked_blockstore(blockstore):
+                raise ValueError("--workers cannot be used with MOCKED database or blockstore")
+
+        if db_replica and db.upper() == "MOCKED":
+            raise ValueError("--db-replica cannot be used with MOCKED database")
+
+        if admission_reserved_capacity is None:
+            admission_reserved_capacity = admission_max_concurrent_commands // 4
+        if (
+            admission_max_concurrent_commands
+            and admission_reserved_capacity >= admission_max_concurrent_commands
+        ):
+            raise ValueError(
+                "--admission-reserved-capacity must be lower than --admission-max-concurrent-commands"
+            )
+
+        if tracing_sample_rate > 0 and tracing_export_file is None:
+            raise ValueError("--tracing-export-file is required when --tracing-sample-rate is set")
+
         app_config = BackendConfig(
             administration_token=administration_token,
             db_url=db,
             db_min_connections=db_min_connections,
             db_max_connections=db_max_connections,
+            db_replica_urls=db_replica,
+            db_replica_max_lag=db_replica_max_lag,
             sse_keepalive=sse_keepalive,
             blockstore_config=blockstore,
             email_config=email_config,
@@ -360,10 +514,17 @@ def run_cmd(
             if organization_initial_active_users_limit is not None
             else ActiveUsersLimit.NO_LIMIT,
             organization_initial_user_profile_outsider_allowed=organization_initial_user_profile_outsider_allowed,
+            admission_max_concurrent_commands=admission_max_concurrent_commands,
+            admission_reserved_capacity=admission_reserved_capacity,
+            admission_command_limits=admission_command_limit,
+            admission_queue_timeout=admission_queue_timeout,
+            tracing_sample_rate=tracing_sample_rate,
+            tracing_export_path=tracing_export_file,
         )
 
         click.echo(
             f"Starting Parsec Backend on {host}:{port}"
+            f" (workers={workers})"
             f" (db={app_config.db_type}"
             f" blockstore={app_config.blockstore_config.type}"
             f" email={email_config.type}"
@@ -375,6 +536,17 @@ def run_cmd(
             retry_policy = RetryPolicy(
                 maximum_database_connection_attempts, pause_before_retry_database_connection
             )
+            if workers > 1:
+                _run_workers(
+                    workers=workers,
+                    host=host,
+                    port=port,
+                    ssl_certfile=ssl_certfile,
+                    ssl_keyfile=ssl_keyfile,
+                    retry_policy=retry_policy,
+                    app_config=app_config,
+                )
+                return
             trio_run(
                 partial(
                     _run_backend,
@@ -417,6 +589,9 @@ async def _run_backend(
     ssl_keyfile: Path | None,
     retry_policy: RetryPolicy,
     app_config: BackendConfig,
+    sock: socket.socket | None = None,
+    shutdown_trigger: Callable[[], Awaitable[None]] | None = None,
+    share_metrics: bool = False,
 ) -> None:
     # Loop over connection attempts
     while True:
@@ -429,14 +604,21 @@ async def _run_backend(
                 # Connection is successful, reset the retry policy
                 retry_policy.success()
 
-                # Serve backend through TCP
-                await serve_backend_with_asgi(
-                    backend=backend,
-                    host=host,
-                    port=port,
-                    ssl_certfile=ssl_certfile,
-                    ssl_keyfile=ssl_keyfile,
-                )
+                async with trio.open_nursery() as nursery:
+                    if share_metrics:
+                        nursery.start_soon(share_worker_metrics, backend)
+
+                    # Serve backend through TCP
+                    await serve_backend_with_asgi(
+                        backend=backend,
+                        host=host,
+                        port=port,
+                        ssl_certfile=ssl_certfile,
+                        ssl_keyfile=ssl_keyfile,
+                        sock=sock,
+                        shutdown_trigger=shutdown_trigger,
+                    )
+                    nursery.cancel_scope.cancel()
 
         except ConnectionError as exc:
             # The maximum number of attempt is reached
@@ -447,3 +629,136 @@ async def _run_backend(
                 f"Database connection lost ({exc}), retrying in {retry_policy.pause_before_retry} seconds"
             )
             await retry_policy.pause()
+
+
+def _create_workers_socket(host: str, port: int) -> socket.socket:
+    # The socket is created before forking the workers so they all accept connections
+    # on it. `SO_REUSEPORT` allows a new server to bind the port while the previous
+    # one is still draining its connections (e.g. during a rolling restart)
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, "SO_REUSEPORT"):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host.strip("[]"), port))
+    sock.listen(socket.SOMAXCONN)
+    sock.setblocking(False)
+    return sock
+
+
+async def _wait_for_shutdown_signal() -> None:
+    with trio.open_signal_receiver(signal.SIGTERM) as signals:
+        async for _ in signals:
+            return
+
+
+def _worker_main(worker_index: int, metrics_dir: Path, **kwargs: Any) -> None:
+    # The supervisor stops the workers with SIGTERM (which starts the graceful shutdown
+    # once the worker is serving), other signals are handled by the supervisor (e.g. a
+    # Ctrl+C in the terminal is also received by the workers)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logger.info("Worker started", worker_index=worker_index, pid=os.getpid())
+    REGISTRY.set_worker(str(worker_index), metrics_dir)
+    try:
+        trio_run(
+            partial(
+                _run_backend,
+                shutdown_trigger=_wait_for_shutdown_signal,
+                share_metrics=True,
+                **kwargs,
+            ),
+            use_asyncio=True,
+        )
+    except KeyboardInterrupt:
+        # Raised once the graceful shutdown is done
+        pass
+
+
+def _run_workers(
+    workers: int,
+    host: str,
+    port: int,
+    ssl_certfile: Path | None,
+    ssl_keyfile: Path | None,
+    retry_policy: RetryPolicy,
+    app_config: BackendConfig,
+) -> None:
+    """
+    Pre-fork `workers` processes serving the same socket, restart them if they crash
+    and stop them gracefully on SIGTERM/SIGINT.
+
+    Each worker runs its own backend app (hence its own database pool and notification
+    listening connection), so nothing is shared between the workers but the socket.
+    """
+    sock = _create_workers_socket(host, port)
+    # Each worker shares its metrics there, so that any of them can render the metrics
+    # of all the workers
+    metrics_dir = Path(tempfile.mkdtemp(prefix="parsec-backend-metrics-"))
+    # Fork is needed for the workers to inherit the listening socket
+    ctx = multiprocessing.get_context("fork")
+    processes: Dict[int, Tuple[multiprocessing.process.BaseProcess, float]] = {}
+    stopping = False
+
+    def _on_shutdown_signal(*args: Any) -> None:
+        nonlocal stopping
+        stopping = True
+
+    def _start_worker(worker_index: int) -> None:
+        process = ctx.Process(
+            target=_worker_main,
+            name=f"parsec-backend-worker-{worker_index}",
+            args=(worker_index, metrics_dir),
+            kwargs={
+                "host": host,
+                "port": port,
+                "ssl_certfile": ssl_certfile,
+                "ssl_keyfile": ssl_keyfile,
+                "retry_policy": retry_policy,
+                "app_config": app_config,
+                "sock": sock,
+            },
+        )
+        process.start()
+        processes[worker_index] = (process, time.monotonic())
+
+    signal.signal(signal.SIGTERM, _on_shutdown_signal)
+    signal.signal(signal.SIGINT, _on_shutdown_signal)
+    try:
+        for worker_index in range(workers):
+            _start_worker(worker_index)
+
+        while not stopping:
+            sentinels = [process.sentinel for process, _ in processes.values()]
+            multiprocessing.connection.wait(sentinels, timeout=1.0)
+            for worker_index, (process, started_at) in list(processes.items()):
+                if process.is_alive() or stopping:
+                    continue
+                logger.warning(
+                    "Worker has stopped unexpectedly, restarting it",
+                    worker_index=worker_index,
+                    pid=process.pid,
+                    exitcode=process.exitcode,
+                )
+                uptime = time.monotonic() - started_at
+                if uptime < WORKER_MIN_UPTIME:
+                    time.sleep(WORKER_MIN_UPTIME - uptime)
+                if not stopping:
+                    _start_worker(worker_index)
+
+    finally:
+        # Graceful shutdown: the workers stop accepting new connections and wait for
+        # the running requests to finish
+        for process, _ in processes.values():
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + WORKER_SHUTDOWN_TIMEOUT
+        for process, _ in processes.values():
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                logger.warning("Worker didn't stop in time, killing it", pid=process.pid)
+                process.kill()
+                process.join()
+        sock.close()
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        click.echo("bye ;-)")
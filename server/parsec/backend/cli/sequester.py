@@ -1,6 +1,7 @@
 # Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
 from __future__ import annotations
 
+import os
 import textwrap
 from base64 import b64decode, b64encode
 from datetime import datetime
@@ -32,7 +33,13 @@ from parsec.backend.postgresql.handler import PGHandler
 from parsec.backend.postgresql.organization import PGOrganizationComponent
 from parsec.backend.postgresql.realm import PGRealmComponent
 from parsec.backend.postgresql.sequester import PGPSequesterComponent
-from parsec.backend.postgresql.sequester_export import RealmExporter
+from parsec.backend.postgresql.sequester_export import (
+    DEFAULT_BLOCK_FETCH_CONCURRENCY,
+    DEFAULT_EXPORT_BATCH_MAX_SIZE,
+    ExportManifest,
+    ExportStats,
+    RealmExporter,
+)
 from parsec.backend.postgresql.user import PGUserComponent
 from parsec.backend.realm import RealmGrantedRole
 from parsec.backend.sequester import (
@@ -635,10 +642,27 @@ async def _export_realm(
     realm_id: VlobID,
     service_id: SequesterServiceID,
     output: Path,
+    blocks_fetch_concurrency: int = DEFAULT_BLOCK_FETCH_CONCURRENCY,
+    batch_max_size: int = DEFAULT_EXPORT_BATCH_MAX_SIZE,
+    since: Path | None = None,
 ) -> None:
+    def _display_throughput(stats: ExportStats | None) -> str:
+        if not stats:
+            return ""
+        return f"{stats.items_per_second:.1f} items/s, {stats.megabytes_per_second:.2f} MB/s"
+
+    since_manifest = ExportManifest.load(since) if since else None
+
     if output.is_dir():
         # Output is pointing to a directory, use a default name for the database extract
-        output_db_path = output / f"parsec-sequester-export-realm-{realm_id.hex}.sqlite"
+        if since_manifest:
+            # Name must be stable so that the differential export can be resumed
+            output_db_path = (
+                output
+                / f"parsec-sequester-export-realm-{realm_id.hex}-since-{since_manifest.vlob_atom}-{since_manifest.block}.sqlite"
+            )
+        else:
+            output_db_path = output / f"parsec-sequester-export-realm-{realm_id.hex}.sqlite"
     else:
         output_db_path = output
 
@@ -665,6 +689,7 @@ async def _export_realm(
             output_db_path=output_db_path,
             input_dbh=dbh,
             input_blockstore=blockstore_component,
+            since=since_manifest,
         ) as exporter:
             # 1) Export vlobs
 
@@ -679,12 +704,18 @@ async def _export_realm(
             else:
                 vlob_total_count_display = click.style(str(vlob_total_count), fg="green")
                 click.echo(f"About {vlob_total_count_display} vlobs need to be exported")
-                with click.progressbar(length=vlob_total_count, label="Exporting vlobs") as bar:  # type: ignore[var-annotated]
-                    vlobs_exported_count = 0
+                with click.progressbar(  # type: ignore[var-annotated]
+                    length=vlob_total_count,
+                    label="Exporting vlobs",
+                    item_show_func=_display_throughput,
+                ) as bar:
                     vlob_batch_size = 1000
                     while True:
+                        vlobs_exported_count = exporter.vlobs_stats.items
                         new_vlob_batch_offset_marker = await exporter.export_vlobs(
-                            batch_size=vlob_batch_size, batch_offset_marker=vlob_batch_offset_marker
+                            batch_size=vlob_batch_size,
+                            batch_offset_marker=vlob_batch_offset_marker,
+                            batch_max_size=batch_max_size,
                         )
                         if new_vlob_batch_offset_marker <= vlob_batch_offset_marker:
                             break
@@ -692,7 +723,9 @@ async def _export_realm(
                         # Note we might end up with vlobs_exported_count > vlob_total_count
                         # in case additional vlobs are created during the export, this is no
                         # big deal though (progress bar will stay at 100%)
-                        bar.update(vlobs_exported_count)
+                        bar.update(
+                            exporter.vlobs_stats.items - vlobs_exported_count, exporter.vlobs_stats
+                        )
 
             # Export blocks
 
@@ -708,13 +741,21 @@ async def _export_realm(
                 block_total_count_display = click.style(str(block_total_count), fg="green")
 
                 click.echo(f"About {block_total_count_display} blocks need to be exported")
-                with click.progressbar(length=block_total_count, label="Exporting blocks") as bar:  # type: ignore[var-annotated]
-                    blocks_exported_count = 0
-                    block_batch_size = 100
+                with click.progressbar(  # type: ignore[var-annotated]
+                    length=block_total_count,
+                    label="Exporting blocks",
+                    item_show_func=_display_throughput,
+                ) as bar:
+                    # Blocks are fetched concurrently within a batch, so the batch should be
+                    # big enough not to have the fetchers wait for the slowest block too often
+                    block_batch_size = 1000
                     while True:
+                        blocks_exported_count = exporter.blocks_stats.items
                         new_block_batch_offset_marker = await exporter.export_blocks(
                             batch_size=block_batch_size,
                             batch_offset_marker=block_batch_offset_marker,
+                            max_concurrency=blocks_fetch_concurrency,
+                            batch_max_size=batch_max_size,
                         )
                         if new_block_batch_offset_marker <= block_batch_offset_marker:
                             break
@@ -722,7 +763,10 @@ async def _export_realm(
                         # Note we might end up with blocks_exported_count > block_total_count
                         # in case additional blocks are created during the export, this is no
                         # big deal though (progress bar will stay at 100%)
-                        bar.update(blocks_exported_count)
+                        bar.update(
+                            exporter.blocks_stats.items - blocks_exported_count,
+                            exporter.blocks_stats,
+                        )
 
 
 @click.command(short_help="Export a realm to consult it with a sequester service key")
@@ -735,6 +779,26 @@ async def _export_realm(
     required=True,
 )
 @click.option("--output", type=Path, required=True)
+@click.option(
+    "--blocks-fetch-concurrency",
+    type=click.IntRange(min=1),
+    default=DEFAULT_BLOCK_FETCH_CONCURRENCY,
+    show_default=True,
+    help="Number of blocks fetched in parallel from the blockstore",
+)
+@click.option(
+    "--batch-max-size",
+    type=click.IntRange(min=1),
+    default=DEFAULT_EXPORT_BATCH_MAX_SIZE,
+    show_default=True,
+    help="Maximum amount of data (in bytes) exported per batch",
+)
+@click.option(
+    "--since",
+    type=click.Path(exists=True, file_okay=True, dir_okay=False, path_type=Path),
+    required=False,
+    help="Previous export (full or differential) of the realm, only the data added since then are exported",
+)
 @db_backend_options
 @blockstore_backend_options
 # Add --debug
@@ -744,6 +808,9 @@ def export_realm(
     realm: VlobID,
     service: SequesterServiceID,
     output: Path,
+    blocks_fetch_concurrency: int,
+    batch_max_size: int,
+    since: Path | None,
     db: str,
     db_max_connections: int,
     db_min_connections: int,
@@ -760,6 +827,9 @@ def export_realm(
             realm,
             service,
             output,
+            blocks_fetch_concurrency,
+            batch_max_size,
+            since,
             use_asyncio=True,
         )
 
@@ -772,6 +842,12 @@ def export_realm(
     required=True,
 )
 @click.option("--input", type=Path, required=True, help="Realm export archive")
+@click.option(
+    "--delta",
+    type=Path,
+    multiple=True,
+    help="Differential realm export archive to stack on top of the input, can be provided multiple times (in the order the exports have been made)",
+)
 @click.option(
     "--output", type=Path, required=True, help="Directory where to dump the content of the realm"
 )
@@ -781,19 +857,42 @@ def export_realm(
     required=False,
     help="Extract at a specific date; format year-month-day",
 )
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=os.cpu_count() or 1,
+    show_default=True,
+    help="Number of processes used to decrypt the manifests and blocks",
+)
+@click.option(
+    "--checkpoint",
+    type=click.Path(file_okay=True, dir_okay=False, path_type=Path),
+    required=False,
+    help="File recording the extracted files, so that an interrupted extraction is resumed when run again (default: `<output>.checkpoint`)",
+)
+@click.option(
+    "--cache/--no-cache",
+    default=False,
+    show_default=True,
+    help="Keep an index of the vlobs in `<input>.cache` (readable by the current user only) to speed up further extractions of the same realm export, no decrypted data is stored in it",
+)
 # Add --debug
 @debug_config_options
 def extract_realm_export(
     service_decryption_key: Path,
     input: Path,
+    delta: Tuple[Path, ...],
     output: Path,
     filter_date: datetime | None,
+    workers: int,
+    checkpoint: Path | None,
+    cache: bool,
     debug: bool,
 ) -> int:
     with cli_exception_handler(debug):
         # Finally a command that is not async !
-        # This is because here we do only a single thing at a time and sqlite3 provide
-        # a synchronous api anyway
+        # This is because here the extraction is a single pipeline (decryption
+        # is offloaded to worker processes) and sqlite3 provide a synchronous api anyway
         decryption_key = SequesterPrivateKeyDer.load_pem(service_decryption_key.read_text())
 
         # Convert filter_date from click.Datetime to parsec.Datetime
@@ -804,7 +903,14 @@ def extract_realm_export(
             date = DateTime.now()
         ret = 0
         for fs_path, event_type, event_msg in extract_workspace(
-            output=output, export_db=input, decryption_key=decryption_key, filter_on_date=date
+            output=output,
+            export_db=input,
+            deltas=delta,
+            decryption_key=decryption_key,
+            filter_on_date=date,
+            workers=workers,
+            checkpoint=checkpoint or output.with_name(f"{output.name}.checkpoint"),
+            cache=input.with_name(f"{input.name}.cache") if cache else None,
         ):
             if event_type == RealmExportProgress.EXTRACT_IN_PROGRESS:
                 fs_path_display = click.style(str(fs_path), fg="yellow")
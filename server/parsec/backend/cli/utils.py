@@ -1,6 +1,7 @@
 # Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
 from __future__ import annotations
 
+import re
 from collections import defaultdict
 from itertools import count
 from typing import Callable, List, TypeVar
@@ -9,12 +10,14 @@ import click
 from typing_extensions import ParamSpec
 
 from parsec.backend.config import (
+    DEFAULT_S3_MAX_CONNECTIONS,
     BaseBlockStoreConfig,
     MockedBlockStoreConfig,
     PostgreSQLBlockStoreConfig,
     RAID0BlockStoreConfig,
     RAID1BlockStoreConfig,
     RAID5BlockStoreConfig,
+    ReedSolomonBlockStoreConfig,
     S3BlockStoreConfig,
     SWIFTBlockStoreConfig,
 )
@@ -97,14 +100,22 @@ def _parse_blockstore_param(value: str) -> BaseBlockStoreConfig:
         return MockedBlockStoreConfig()
     elif value.upper() == "POSTGRESQL":
         return PostgreSQLBlockStoreConfig()
+    elif value.upper() == "POSTGRESQL:PACKED":
+        return PostgreSQLBlockStoreConfig(packed=True)
     else:
         parts = _split_with_escaping(value)
         if parts[0].upper() == "S3":
+            max_connections = DEFAULT_S3_MAX_CONNECTIONS
             try:
+                if len(parts) == 7:
+                    *parts, raw_max_connections = parts
+                    max_connections = int(raw_max_connections)
+                    if max_connections < 1:
+                        raise ValueError
                 endpoint_url, region, bucket, key, secret = parts[1:]
             except ValueError:
                 raise click.BadParameter(
-                    "Invalid S3 config, must be `s3:[<endpoint_url>]:<region>:<bucket>:<key>:<secret>`"
+                    "Invalid S3 config, must be `s3:[<endpoint_url>]:<region>:<bucket>:<key>:<secret>[:<max_connections>]`"
                 )
             # Provide https by default to avoid annoying escaping for most cases
             if (
@@ -119,6 +130,7 @@ def _parse_blockstore_param(value: str) -> BaseBlockStoreConfig:
                 s3_bucket=bucket,
                 s3_key=key,
                 s3_secret=secret,
+                s3_max_connections=max_connections,
             )
 
         elif parts[0].upper() == "SWIFT":
@@ -146,13 +158,20 @@ def _parse_blockstore_param(value: str) -> BaseBlockStoreConfig:
             raise click.BadParameter(f"Invalid blockstore type `{parts[0]}`")
 
 
+# Reed-Solomon mode also provides the number of parity nodes (e.g. `RS3`)
+_RS_MODE_PATTERN = re.compile(r"RS[0-9]+")
+
+
 def _parse_blockstore_params(raw_params: str) -> BaseBlockStoreConfig:
     raid_configs = defaultdict(list)
     for raw_param in raw_params:
         raid_mode: str | None
         raid_node: int | None
         raw_param_parts = raw_param.split(":", 2)
-        if raw_param_parts[0].upper() in ("RAID0", "RAID1", "RAID5") and len(raw_param_parts) == 3:
+        if (
+            raw_param_parts[0].upper() in ("RAID0", "RAID1", "RAID5")
+            or _RS_MODE_PATTERN.fullmatch(raw_param_parts[0].upper())
+        ) and len(raw_param_parts) == 3:
             raid_mode, raw_raid_node, node_param = raw_param_parts
             try:
                 raid_node = int(raw_raid_node)
@@ -194,6 +213,13 @@ def _parse_blockstore_params(raw_params: str) -> BaseBlockStoreConfig:
         return RAID1BlockStoreConfig(blockstores=blockstores)
     elif raid_mode.upper() == "RAID5":
         return RAID5BlockStoreConfig(blockstores=blockstores)
+    elif _RS_MODE_PATTERN.fullmatch(raid_mode.upper()):
+        parity_shards = int(raid_mode[2:])
+        if not 1 <= parity_shards < len(blockstores):
+            raise click.BadParameter(
+                f"Invalid RS config, the number of parity nodes must be between 1 and {len(blockstores) - 1}"
+            )
+        return ReedSolomonBlockStoreConfig(blockstores=blockstores, parity_shards=parity_shards)
     else:
         raise click.BadParameter(f"Invalid multi blockstore mode `{raid_mode}`")
 
@@ -214,7 +240,8 @@ Allowed values:
 \b
 -`MOCKED`: Mocked in memory
 -`POSTGRESQL`: Use the database specified in the `--db` param
--`s3:[<endpoint_url>]:<region>:<bucket>:<key>:<secret>`: Use S3 storage
+-`postgresql:packed`: Same as `POSTGRESQL`, but pack small blocks created concurrently together
+-`s3:[<endpoint_url>]:<region>:<bucket>:<key>:<secret>[:<max_connections>]`: Use S3 storage
 -`swift:<auth_url>:<tenant>:<container>:<user>:<password>`: Use SWIFT storage
 
 Note endpoint_url/auth_url are considered as https by default (e.g.
@@ -222,10 +249,11 @@ Note endpoint_url/auth_url are considered as https by default (e.g.
 Escaping must be used to provide a custom scheme (e.g. `s3:http\\://foo.com:[...]`).
 
 On top of that, multiple blockstore configurations can be provided to form a
-RAID0/1/5 cluster.
+RAID0/1/5 cluster, or a Reed-Solomon cluster (`RS<m>` with `<m>` the number of
+parity nodes, e.g. 9 nodes with RS3 store 6 data shards and 3 parity shards).
 
 Each configuration must be provided with the form
-`<raid_type>:<node>:<config>` with `<raid_type>` RAID0/RAID1/RAID5, `<node>` a
+`<raid_type>:<node>:<config>` with `<raid_type>` RAID0/RAID1/RAID5/RS<m>, `<node>` a
 integer and `<config>` the MOCKED/POSTGRESQL/S3/SWIFT config.
 
 \b
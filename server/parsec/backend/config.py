@@ -1,12 +1,31 @@
 # Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
 from __future__ import annotations
 
-from typing import List, Tuple, Union
+from pathlib import Path
+from typing import Dict, FrozenSet, List, Mapping, Tuple, Union
 
 import attr
 
 from parsec._parsec import ActiveUsersLimit, BackendAddr
 
+# Number of concurrent requests (and hence of pooled HTTP connections) allowed
+# toward the S3 service by a single blockstore component
+DEFAULT_S3_MAX_CONNECTIONS = 10
+
+# Organizations/users/devices used to authenticate RPC requests are cached
+# in each server process, see `parsec.backend.handshake_cache`
+DEFAULT_HANDSHAKE_CACHE_TTL = 60.0
+DEFAULT_HANDSHAKE_CACHE_MAX_SIZE = 10000
+
+# Maximum replication lag (in seconds) of a PostgreSQL read replica still used to
+# serve reads, see `parsec.backend.postgresql.replicas`
+DEFAULT_DB_REPLICA_MAX_LAG = 5.0
+
+# Admission control of the API commands, see `parsec.backend.admission`
+DEFAULT_ADMISSION_PRIORITY_COMMANDS = frozenset({"vlob_read", "block_read"})
+DEFAULT_ADMISSION_COMMAND_LIMITS: Dict[str, int] = {"organization_stats": 2}
+DEFAULT_ADMISSION_QUEUE_TIMEOUT = 5.0
+
 
 class BaseBlockStoreConfig:
     # Overloaded by children
@@ -38,6 +57,16 @@ class RAID5BlockStoreConfig(BaseBlockStoreConfig):
     partial_create_ok: bool = False
 
 
+@attr.s(frozen=True, auto_attribs=True)
+class ReedSolomonBlockStoreConfig(BaseBlockStoreConfig):
+    type = "RS"
+
+    blockstores: List[BaseBlockStoreConfig]
+    # The other blockstores store the data shards
+    parity_shards: int
+    partial_create_ok: bool = False
+
+
 @attr.s(frozen=True, auto_attribs=True)
 class S3BlockStoreConfig(BaseBlockStoreConfig):
     type = "S3"
@@ -47,6 +76,7 @@ class S3BlockStoreConfig(BaseBlockStoreConfig):
     s3_bucket: str
     s3_key: str
     s3_secret: str
+    s3_max_connections: int = DEFAULT_S3_MAX_CONNECTIONS
 
 
 @attr.s(frozen=True, auto_attribs=True)
@@ -64,6 +94,9 @@ class SWIFTBlockStoreConfig(BaseBlockStoreConfig):
 class PostgreSQLBlockStoreConfig(BaseBlockStoreConfig):
     type = "POSTGRESQL"
 
+    # Pack small blocks together into segments (see `parsec.backend.postgresql.block`)
+    packed: bool = False
+
 
 @attr.s(frozen=True, auto_attribs=True)
 class MockedBlockStoreConfig(BaseBlockStoreConfig):
@@ -122,6 +155,28 @@ class BackendConfig:
     organization_initial_active_users_limit: ActiveUsersLimit = ActiveUsersLimit.NO_LIMIT
     organization_initial_user_profile_outsider_allowed: bool = True
 
+    # Streaming replicas of the `db_url` server the read-only commands can be routed to
+    db_replica_urls: Tuple[str, ...] = ()
+    db_replica_max_lag: float = DEFAULT_DB_REPLICA_MAX_LAG
+
+    handshake_cache_ttl: float = DEFAULT_HANDSHAKE_CACHE_TTL  # Set to 0 if disabled
+    handshake_cache_max_size: int = DEFAULT_HANDSHAKE_CACHE_MAX_SIZE
+
+    # Maximum number of commands running concurrently (0 if disabled), of which
+    # `admission_reserved_capacity` can only be used by the priority commands
+    admission_max_concurrent_commands: int = 0
+    admission_reserved_capacity: int = 0
+    admission_priority_commands: FrozenSet[str] = DEFAULT_ADMISSION_PRIORITY_COMMANDS
+    admission_command_limits: Mapping[str, int] = attr.field(
+        factory=lambda: dict(DEFAULT_ADMISSION_COMMAND_LIMITS)
+    )
+    # Time (in seconds) a command can be queued before being rejected
+    admission_queue_timeout: float = DEFAULT_ADMISSION_QUEUE_TIMEOUT
+
+    # Ratio of the requests to trace (0 if disabled), see `parsec.backend.tracing`
+    tracing_sample_rate: float = 0.0
+    tracing_export_path: Path | None = None
+
     @property
     def db_type(self) -> str:
         if self.db_url.upper() == "MOCKED":
@@ -2,7 +2,7 @@
 from __future__ import annotations
 
 from collections import deque
-from typing import Awaitable, Callable, Type
+from typing import Awaitable, Callable, Hashable, Type
 
 import trio
 
@@ -17,16 +17,37 @@ from parsec._parsec import (
     BackendEventRealmMaintenanceStarted,
     BackendEventRealmRolesUpdated,
     BackendEventRealmVlobsUpdated,
+    VlobID,
     authenticated_cmds,
 )
 from parsec.api.protocol.types import UserProfile
 from parsec.backend.client_context import AuthenticatedClientContext
 from parsec.backend.realm import BaseRealmComponent
 from parsec.backend.utils import api, api_ws_cancel_on_client_sending_new_cmd
+from parsec.event_bus import EventBus
 
 # TODO: make this configurable ?
 BACKEND_EVENTS_LOCAL_CACHE_SIZE = 1024
 
+# Events are dispatched to the clients according to the organization, user or
+# realm they are about, this way the event bus only calls the callbacks of the
+# clients that are going to receive the event (see `_get_event_dispatch_key`)
+EVENTS_DISPATCHED_PER_ORGANIZATION = (
+    BackendEventCertificatesUpdated,
+    BackendEventPinged,
+    BackendEventPkiEnrollmentUpdated,
+)
+EVENTS_DISPATCHED_PER_USER = (
+    BackendEventMessageReceived,
+    BackendEventInviteStatusChanged,
+    BackendEventRealmRolesUpdated,
+)
+EVENTS_DISPATCHED_PER_REALM = (
+    BackendEventRealmVlobsUpdated,
+    BackendEventRealmMaintenanceStarted,
+    BackendEventRealmMaintenanceFinished,
+)
+
 
 def internal_to_api_v2_v3_events(
     event: BackendEvent,
@@ -110,6 +131,22 @@ def internal_to_api_events(
         return event_listen_cmd_mod.APIEventPkiEnrollmentUpdated()
 
 
+def _get_event_dispatch_key(
+    event: Type[BackendEvent], event_id: str, payload: BackendEvent
+) -> Hashable:
+    if isinstance(payload, EVENTS_DISPATCHED_PER_REALM):
+        return (payload.organization_id, payload.realm_id)
+    elif isinstance(payload, BackendEventRealmRolesUpdated):
+        return (payload.organization_id, payload.user)
+    elif isinstance(payload, BackendEventMessageReceived):
+        return (payload.organization_id, payload.recipient)
+    elif isinstance(payload, BackendEventInviteStatusChanged):
+        return (payload.organization_id, payload.greeter)
+    else:
+        assert isinstance(payload, EVENTS_DISPATCHED_PER_ORGANIZATION)
+        return payload.organization_id
+
+
 def _is_event_for_our_client(
     client_ctx: AuthenticatedClientContext,
     event: BackendEvent,
@@ -157,9 +194,18 @@ def _is_event_for_our_client(
 
 class EventsComponent:
     def __init__(
-        self, realm_component: BaseRealmComponent, send_event: Callable[..., Awaitable[None]]
+        self,
+        realm_component: BaseRealmComponent,
+        send_event: Callable[..., Awaitable[None]],
+        event_bus: EventBus,
     ):
         self._realm_component = realm_component
+        for event_type in (
+            *EVENTS_DISPATCHED_PER_ORGANIZATION,
+            *EVENTS_DISPATCHED_PER_USER,
+            *EVENTS_DISPATCHED_PER_REALM,
+        ):
+            event_bus.set_dispatch_key(event_type, _get_event_dispatch_key)  # type: ignore[arg-type]
         # Keep in cache the last dispatched events so that we can handle SSE reconnection
         # with the `Last-Event-Id` header
         self._events_cache: deque[tuple[str, BackendEvent]] = deque(
@@ -198,6 +244,22 @@ class EventsComponent:
     async def connect_events(
         self, client_ctx: AuthenticatedClientContext, last_event_id: str | None = None
     ) -> deque[tuple[str, BackendEvent] | None]:
+        def _connect_realm(realm_id: VlobID) -> None:
+            for event_type in EVENTS_DISPATCHED_PER_REALM:
+                client_ctx.event_bus_ctx.connect(
+                    event_type,
+                    _on_event,  # type: ignore
+                    (client_ctx.organization_id, realm_id),
+                )
+
+        def _disconnect_realm(realm_id: VlobID) -> None:
+            for event_type in EVENTS_DISPATCHED_PER_REALM:
+                client_ctx.event_bus_ctx.disconnect(
+                    event_type,
+                    _on_event,  # type: ignore
+                    (client_ctx.organization_id, realm_id),
+                )
+
         def _on_event(
             event: Type[BackendEvent],
             event_id: str,
@@ -207,9 +269,12 @@ class EventsComponent:
                 # Keep up to date the list of realms the user should be notified of
                 if isinstance(payload, BackendEventRealmRolesUpdated):
                     if payload.role is None:
-                        client_ctx.realms.discard(payload.realm_id)
-                    else:
+                        if payload.realm_id in client_ctx.realms:
+                            client_ctx.realms.discard(payload.realm_id)
+                            _disconnect_realm(payload.realm_id)
+                    elif payload.realm_id not in client_ctx.realms:
                         client_ctx.realms.add(payload.realm_id)
+                        _connect_realm(payload.realm_id)
 
                 try:
                     client_ctx.send_events_channel.send_nowait((event_id, payload))
@@ -221,45 +286,20 @@ class EventsComponent:
             return deque()
 
         # Connect the new callbacks
-        client_ctx.event_bus_ctx.connect(
-            BackendEventCertificatesUpdated,
-            _on_event,  # type: ignore
-        )
-        client_ctx.event_bus_ctx.connect(
-            BackendEventPinged,
-            _on_event,  # type: ignore
-        )
-        client_ctx.event_bus_ctx.connect(
-            BackendEventRealmVlobsUpdated,
-            _on_event,  # type: ignore
-        )
-        client_ctx.event_bus_ctx.connect(
-            BackendEventRealmMaintenanceStarted,
-            _on_event,  # type: ignore
-        )
-        client_ctx.event_bus_ctx.connect(
-            BackendEventRealmMaintenanceFinished,
-            _on_event,  # type: ignore
-        )
-        client_ctx.event_bus_ctx.connect(
-            BackendEventMessageReceived,
-            _on_event,  # type: ignore
-        )
-        client_ctx.event_bus_ctx.connect(
-            BackendEventInviteStatusChanged,
-            _on_event,  # type: ignore
-        )
-
-        client_ctx.event_bus_ctx.connect(
-            BackendEventPkiEnrollmentUpdated,
-            _on_event,  # type: ignore
-        )
-
-        # Final event to keep up to date the list of realm we should listen on
-        client_ctx.event_bus_ctx.connect(
-            BackendEventRealmRolesUpdated,
-            _on_event,  # type: ignore
-        )
+        for event_type in EVENTS_DISPATCHED_PER_ORGANIZATION:
+            client_ctx.event_bus_ctx.connect(
+                event_type,
+                _on_event,  # type: ignore
+                client_ctx.organization_id,
+            )
+        # Note `BackendEventRealmRolesUpdated` is among those events, this is what
+        # keeps up to date the list of realm we should listen on
+        for event_type in EVENTS_DISPATCHED_PER_USER:
+            client_ctx.event_bus_ctx.connect(
+                event_type,
+                _on_event,  # type: ignore
+                (client_ctx.organization_id, client_ctx.user_id),
+            )
 
         # We must do that here to be right after even bus connection, but before any
         # async operation, otherwise a concurrent event may be handled by the registered
@@ -277,7 +317,12 @@ class EventsComponent:
         realms_for_user = await self._realm_component.get_realms_for_user(
             client_ctx.organization_id, client_ctx.user_id
         )
-        client_ctx.realms = set(realms_for_user.keys())
+        new_realms = set(realms_for_user.keys())
+        for realm_id in client_ctx.realms - new_realms:
+            _disconnect_realm(realm_id)
+        for realm_id in new_realms - client_ctx.realms:
+            _connect_realm(realm_id)
+        client_ctx.realms = new_realms
         client_ctx.events_subscribed = True
 
         return new_events
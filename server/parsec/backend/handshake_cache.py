@@ -0,0 +1,182 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+from __future__ import annotations
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from time import monotonic
+from typing import Dict, Iterator, Set, Tuple, Type
+
+from parsec._parsec import (
+    BackendEvent,
+    BackendEventOrganizationExpired,
+    BackendEventUserUpdatedOrRevoked,
+    DeviceID,
+    OrganizationID,
+    UserID,
+)
+from parsec.backend.organization import BaseOrganizationComponent, Organization
+from parsec.backend.user import BaseUserComponent
+from parsec.backend.user_type import Device, User
+from parsec.event_bus import EventBus
+
+
+class HandshakeCache:
+    """
+    Per-process cache of the organizations, users and devices needed to authenticate
+    a client, so that the handshake (done for each HTTP RPC request !) doesn't
+    have to query the database in the steady state.
+
+    The cached data are invalidated by the user & organization components right
+    after a user is updated/revoked or an organization is updated, so revocation &
+    expiration are still taken into account right away. The other server processes
+    get invalidated by the `BackendEventUserUpdatedOrRevoked` and
+    `BackendEventOrganizationExpired` events. On top of that, entries are expired
+    after `ttl` seconds to bound the staleness of the data not covered by those
+    events (e.g. if a notification is lost).
+
+    Only bootstrapped and non-expired organizations are cached: a missing organization
+    can be created at any time, and there is no event when an organization is
+    no longer expired or gets bootstrapped.
+    """
+
+    def __init__(
+        self,
+        organization: BaseOrganizationComponent,
+        user: BaseUserComponent,
+        ttl: float,
+        max_size: int,
+    ):
+        self._organization_component = organization
+        self._user_component = user
+        self.ttl = ttl
+        self.max_size = max_size
+        self._organizations: OrderedDict[OrganizationID, Tuple[float, Organization]] = OrderedDict()
+        self._devices: OrderedDict[
+            Tuple[OrganizationID, DeviceID], Tuple[float, User, Device]
+        ] = OrderedDict()
+        self._user_devices: Dict[Tuple[OrganizationID, UserID], Set[DeviceID]] = {}
+        # Incremented on each invalidation, so that the result of a lookup that was
+        # running concurrently with an invalidation is not cached
+        self._generation = 0
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_size > 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "organizations": len(self._organizations),
+            "devices": len(self._devices),
+            "hits": self._hits,
+            "misses": self._misses,
+        }
+
+    @contextmanager
+    def listen_invalidation_events(self, event_bus: EventBus) -> Iterator[None]:
+        with event_bus.connect_in_context(
+            (BackendEventUserUpdatedOrRevoked, self._on_user_updated_or_revoked),  # type: ignore
+            (BackendEventOrganizationExpired, self._on_organization_expired),  # type: ignore
+        ):
+            yield
+
+    def _on_user_updated_or_revoked(
+        self,
+        event: Type[BackendEvent],
+        event_id: str,
+        payload: BackendEventUserUpdatedOrRevoked,
+    ) -> None:
+        self.invalidate_user(payload.organization_id, payload.user_id)
+
+    def _on_organization_expired(
+        self,
+        event: Type[BackendEvent],
+        event_id: str,
+        payload: BackendEventOrganizationExpired,
+    ) -> None:
+        self.invalidate_organization(payload.organization_id)
+
+    def invalidate_user(self, organization_id: OrganizationID, user_id: UserID) -> None:
+        self._generation += 1
+        for device_id in self._user_devices.pop((organization_id, user_id), ()):
+            self._devices.pop((organization_id, device_id), None)
+
+    def invalidate_organization(self, organization_id: OrganizationID) -> None:
+        self._generation += 1
+        self._organizations.pop(organization_id, None)
+
+    def clear(self) -> None:
+        self._generation += 1
+        self._organizations.clear()
+        self._devices.clear()
+        self._user_devices.clear()
+
+    async def get_organization(self, organization_id: OrganizationID) -> Organization:
+        """
+        Raises:
+            OrganizationNotFoundError
+        """
+        now = monotonic()
+        cached = self._organizations.get(organization_id)
+        if cached is not None:
+            expires_on, organization = cached
+            if expires_on > now:
+                self._hits += 1
+                self._organizations.move_to_end(organization_id)
+                return organization
+            del self._organizations[organization_id]
+
+        self._misses += 1
+        generation = self._generation
+        organization = await self._organization_component.get(organization_id)
+        if (
+            self.enabled
+            and generation == self._generation
+            and organization.is_bootstrapped()
+            and not organization.is_expired
+        ):
+            self._organizations[organization_id] = (now + self.ttl, organization)
+            if len(self._organizations) > self.max_size:
+                self._organizations.popitem(last=False)
+        return organization
+
+    async def get_user_with_device(
+        self, organization_id: OrganizationID, device_id: DeviceID
+    ) -> Tuple[User, Device]:
+        """
+        Raises:
+            UserNotFoundError
+        """
+        now = monotonic()
+        key = (organization_id, device_id)
+        cached = self._devices.get(key)
+        if cached is not None:
+            expires_on, user, device = cached
+            if expires_on > now:
+                self._hits += 1
+                self._devices.move_to_end(key)
+                return user, device
+            self._pop_device(key)
+
+        self._misses += 1
+        generation = self._generation
+        user, device = await self._user_component.get_user_with_device(organization_id, device_id)
+        if self.enabled and generation == self._generation:
+            self._devices[key] = (now + self.ttl, user, device)
+            self._user_devices.setdefault((organization_id, device_id.user_id), set()).add(
+                device_id
+            )
+            if len(self._devices) > self.max_size:
+                self._pop_device(next(iter(self._devices)))
+        return user, device
+
+    def _pop_device(self, key: Tuple[OrganizationID, DeviceID]) -> None:
+        del self._devices[key]
+        organization_id, device_id = key
+        user_key = (organization_id, device_id.user_id)
+        user_devices = self._user_devices.get(user_key)
+        if user_devices is not None:
+            user_devices.discard(device_id)
+            if not user_devices:
+                del self._user_devices[user_key]
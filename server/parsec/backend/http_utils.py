@@ -7,6 +7,8 @@ from typing import Any, Dict
 
 import trio
 
+from parsec.backend.tracing import span
+
 
 async def http_request(
     url: str,
@@ -27,4 +29,10 @@ async def http_request(
         with urllib.request.urlopen(request) as rep:
             return rep.read()
 
-    return await trio.to_thread.run_sync(_target)
+    # Only the host is recorded given the url may contain credentials
+    with span(
+        "http.request",
+        method=method or ("POST" if data is not None else "GET"),
+        host=urllib.parse.urlsplit(url).hostname or "",
+    ):
+        return await trio.to_thread.run_sync(_target)
@@ -1,8 +1,9 @@
 # Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
 from __future__ import annotations
 
+from collections import defaultdict
 from copy import deepcopy
-from typing import TYPE_CHECKING, Any, Dict, Tuple
+from typing import TYPE_CHECKING, Any, DefaultDict, Dict, Tuple
 
 import attr
 
@@ -33,6 +34,8 @@ class BlockMeta:
 class MemoryBlockComponent(BaseBlockComponent):
     def __init__(self) -> None:
         self._blockmetas: dict[Tuple[OrganizationID, BlockID], BlockMeta] = {}
+        # Size of all the blocks of each realm
+        self._realm_blocks_size: DefaultDict[Tuple[OrganizationID, VlobID], int] = defaultdict(int)
         self._blockstore_component: MemoryBlockStoreComponent | None = None
         self._realm_component: MemoryRealmComponent | None = None
 
@@ -45,6 +48,9 @@ class MemoryBlockComponent(BaseBlockComponent):
         self._blockstore_component = blockstore
         self._realm_component = realm
 
+    def _get_realm_blocks_size(self, organization_id: OrganizationID, realm_id: VlobID) -> int:
+        return self._realm_blocks_size.get((organization_id, realm_id), 0)
+
     def _check_realm_read_access(
         self, organization_id: OrganizationID, realm_id: VlobID, user_id: UserID
     ) -> None:
@@ -128,6 +134,7 @@ class MemoryBlockComponent(BaseBlockComponent):
         await self._blockstore_component.create(organization_id, block_id, block)
 
         self._blockmetas[(organization_id, block_id)] = BlockMeta(realm_id, len(block), created_on)
+        self._realm_blocks_size[(organization_id, realm_id)] += len(block)
 
     def test_duplicate_organization(self, id: OrganizationID, new_id: OrganizationID) -> None:
         self._blockmetas.update(
@@ -137,6 +144,13 @@ class MemoryBlockComponent(BaseBlockComponent):
                 if candidate_org_id == id
             }
         )
+        self._realm_blocks_size.update(
+            {
+                (new_id, realm_id): size
+                for (candidate_org_id, realm_id), size in self._realm_blocks_size.items()
+                if candidate_org_id == id
+            }
+        )
 
     def test_drop_organization(self, id: OrganizationID) -> None:
         self._blockmetas = {
@@ -144,6 +158,14 @@ class MemoryBlockComponent(BaseBlockComponent):
             for (candidate_org_id, block_id), block_meta in self._blockmetas.items()
             if candidate_org_id != id
         }
+        self._realm_blocks_size = defaultdict(
+            int,
+            (
+                ((candidate_org_id, realm_id), size)
+                for (candidate_org_id, realm_id), size in self._realm_blocks_size.items()
+                if candidate_org_id != id
+            ),
+        )
 
 
 class MemoryBlockStoreComponent(BaseBlockStoreComponent):
@@ -11,6 +11,7 @@ import trio
 from parsec.backend.blockstore import blockstore_factory
 from parsec.backend.config import BackendConfig
 from parsec.backend.events import BackendEvent, EventsComponent
+from parsec.backend.handshake_cache import HandshakeCache
 from parsec.backend.memory.block import MemoryBlockComponent
 from parsec.backend.memory.invite import MemoryInviteComponent
 from parsec.backend.memory.message import MemoryMessageComponent
@@ -50,7 +51,14 @@ async def components_factory(  # type: ignore[misc]
     sequester = MemorySequesterComponent()
     block = MemoryBlockComponent()
     blockstore = blockstore_factory(config.blockstore_config)
-    events = EventsComponent(realm, send_event=_send_event)
+    events = EventsComponent(realm, send_event=_send_event, event_bus=event_bus)
+
+    handshake_cache = HandshakeCache(
+        organization=organization,
+        user=user,
+        ttl=config.handshake_cache_ttl,
+        max_size=config.handshake_cache_max_size,
+    )
 
     components = {
         "events": events,
@@ -66,6 +74,7 @@ async def components_factory(  # type: ignore[misc]
         "sequester": sequester,
         "block": block,
         "blockstore": blockstore,
+        "handshake_cache": handshake_cache,
     }
     for component in components.values():
         method = getattr(component, "register_components", None)
@@ -31,6 +31,7 @@ from parsec.backend.user import Device, User, UserError
 from parsec.backend.utils import Unset, UnsetType
 
 if TYPE_CHECKING:
+    from parsec.backend.handshake_cache import HandshakeCache
     from parsec.backend.memory.block import MemoryBlockComponent
     from parsec.backend.memory.realm import MemoryRealmComponent
     from parsec.backend.memory.user import MemoryUserComponent
@@ -46,6 +47,7 @@ class MemoryOrganizationComponent(BaseOrganizationComponent):
         self._vlob_component: MemoryVlobComponent | None = None
         self._block_component: MemoryBlockComponent | None = None
         self._realm_component: MemoryRealmComponent | None = None
+        self._handshake_cache: HandshakeCache | None = None
         self._organizations: dict[OrganizationID, Organization] = {}
         self._send_event = send_event
         self._organization_bootstrap_lock: dict[OrganizationID, trio.Lock] = defaultdict(trio.Lock)
@@ -56,12 +58,14 @@ class MemoryOrganizationComponent(BaseOrganizationComponent):
         vlob: MemoryVlobComponent,
         block: MemoryBlockComponent,
         realm: MemoryRealmComponent,
+        handshake_cache: HandshakeCache,
         **other_components: Any,
     ) -> None:
         self._user_component = user
         self._vlob_component = vlob
         self._block_component = block
         self._realm_component = realm
+        self._handshake_cache = handshake_cache
 
     async def create(
         self,
@@ -127,10 +131,18 @@ class MemoryOrganizationComponent(BaseOrganizationComponent):
             if organization.bootstrap_token != bootstrap_token:
                 raise OrganizationInvalidBootstrapTokenError()
 
+            # Sequester authority certificate comes first in the certificates log,
+            # given it is needed to validate the rest of the organization
+            certificates_index = self._user_component.get_current_certificate_index(id)
+            if sequester_authority:
+                await self._user_component.add_certificate(id, sequester_authority.certificate)
+
             try:
                 await self._user_component.create_user(id, user, first_device)
 
             except UserError as exc:
+                # Bootstrap is cancelled, so is the sequester authority certificate
+                del self._user_component._organizations[id].certificates[certificates_index:]
                 raise OrganizationFirstUserCreationError(exc) from exc
 
             self._organizations[organization.organization_id] = organization.evolve(
@@ -241,6 +253,8 @@ class MemoryOrganizationComponent(BaseOrganizationComponent):
 
         assert isinstance(organization.active_users_limit, ActiveUsersLimit)
         self._organizations[id] = organization
+        assert self._handshake_cache is not None
+        self._handshake_cache.invalidate_organization(id)
 
         if self._organizations[id].is_expired:
             await self._send_event(BackendEventOrganizationExpired(organization_id=id))
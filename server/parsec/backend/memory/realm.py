@@ -1,8 +1,9 @@
 # Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
 from __future__ import annotations
 
+from collections import defaultdict
 from copy import deepcopy
-from typing import TYPE_CHECKING, Any, Callable, Coroutine, Dict, List, Tuple
+from typing import TYPE_CHECKING, Any, Callable, Coroutine, DefaultDict, Dict, List, Set, Tuple
 
 import attr
 
@@ -49,8 +50,28 @@ if TYPE_CHECKING:
 class Realm:
     status: RealmStatus = attr.ib(factory=lambda: RealmStatus(None, None, None, 1))
     checkpoint: int = attr.ib(default=0)
+    # Must only be modified through `add_granted_role` to keep the indexes below up to date
     granted_roles: List[RealmGrantedRole] = attr.ib(factory=list)
     last_role_change_per_user: Dict[UserID, DateTime] = attr.ib(factory=dict)
+    _last_role_per_user: Dict[UserID, RealmGrantedRole] = attr.ib(init=False, factory=dict)
+    _roles: Dict[UserID, RealmRole] = attr.ib(init=False, factory=dict)
+
+    def __attrs_post_init__(self) -> None:
+        granted_roles = self.granted_roles
+        self.granted_roles = []
+        for granted_role in granted_roles:
+            self.add_granted_role(granted_role)
+
+    def add_granted_role(self, granted_role: RealmGrantedRole) -> None:
+        self.granted_roles.append(granted_role)
+        last_role = self._last_role_per_user.get(granted_role.user_id)
+        if last_role is not None and last_role.granted_on > granted_role.granted_on:
+            return
+        self._last_role_per_user[granted_role.user_id] = granted_role
+        if granted_role.role is None:
+            self._roles.pop(granted_role.user_id, None)
+        else:
+            self._roles[granted_role.user_id] = granted_role.role
 
     @property
     def created_on(self) -> DateTime:
@@ -58,20 +79,11 @@ class Realm:
 
     @property
     def roles(self) -> Dict[UserID, RealmRole]:
-        roles: Dict[UserID, RealmRole] = {}
-        for x in sorted(self.granted_roles, key=lambda x: x.granted_on):
-            if x.role is None:
-                roles.pop(x.user_id, None)
-            else:
-                roles[x.user_id] = x.role
-        return roles
+        # Index maintained by `add_granted_role`, must not be modified
+        return self._roles
 
     def get_last_role(self, user_id: UserID) -> RealmGrantedRole | None:
-        filtered_roles = [role for role in self.granted_roles if role.user_id == user_id]
-        try:
-            return max(filtered_roles, key=lambda role: role.granted_on)
-        except ValueError:
-            return None
+        return self._last_role_per_user.get(user_id)
 
 
 class MemoryRealmComponent(BaseRealmComponent):
@@ -82,6 +94,10 @@ class MemoryRealmComponent(BaseRealmComponent):
         self._vlob_component: MemoryVlobComponent | None = None
         self._block_component: MemoryBlockComponent | None = None
         self._realms: Dict[Tuple[OrganizationID, VlobID], Realm] = {}
+        # Realms each user has (or had) a role in
+        self._realms_per_user: DefaultDict[
+            Tuple[OrganizationID, UserID], Set[VlobID]
+        ] = defaultdict(set)
         self._maintenance_reencryption_is_finished_hook = None
 
     def register_components(
@@ -114,10 +130,12 @@ class MemoryRealmComponent(BaseRealmComponent):
         key = (organization_id, self_granted_role.realm_id)
         if key not in self._realms:
             self._realms[key] = Realm(granted_roles=[self_granted_role])
+            self._realms_per_user[(organization_id, self_granted_role.user_id)].add(
+                self_granted_role.realm_id
+            )
 
-            await self._user_component.notify_certificates_update(
-                organization_id=organization_id,
-                index=self._user_component.get_current_certificate_index(organization_id),
+            await self._user_component.add_certificate(
+                organization_id, self_granted_role.certificate
             )
             await self._send_event(
                 BackendEventRealmRolesUpdated(
@@ -150,28 +168,16 @@ class MemoryRealmComponent(BaseRealmComponent):
         if author.user_id not in realm.roles:
             raise RealmAccessError()
 
-        blocks_size = 0
-        vlobs_size = 0
-        for value in self._block_component._blockmetas.values():
-            if value.realm_id == realm_id:
-                blocks_size += value.size
-        for value in self._vlob_component._vlobs.values():
-            if value.realm_id == realm_id:
-                vlobs_size += sum(len(blob) for (blob, _, _, _) in value.data)
-
-        return RealmStats(blocks_size=blocks_size, vlobs_size=vlobs_size)
+        return RealmStats(
+            blocks_size=self._block_component._get_realm_blocks_size(organization_id, realm_id),
+            vlobs_size=self._vlob_component._get_realm_vlobs_size(organization_id, realm_id),
+        )
 
     async def get_current_roles(
         self, organization_id: OrganizationID, realm_id: VlobID
     ) -> Dict[UserID, RealmRole]:
         realm = self._get_realm(organization_id, realm_id)
-        roles: Dict[UserID, RealmRole] = {}
-        for x in realm.granted_roles:
-            if x.role is None:
-                roles.pop(x.user_id, None)
-            else:
-                roles[x.user_id] = x.role
-        return roles
+        return dict(realm.roles)
 
     async def get_role_certificates(
         self, organization_id: OrganizationID, author: DeviceID, realm_id: VlobID
@@ -254,7 +260,8 @@ class MemoryRealmComponent(BaseRealmComponent):
                 raise RealmRoleRequireGreaterTimestampError(realm_last_role_change)
 
         # Update role and record last change timestamp for this user
-        realm.granted_roles.append(new_role)
+        realm.add_granted_role(new_role)
+        self._realms_per_user[(organization_id, new_role.user_id)].add(new_role.realm_id)
         author_user_id = new_role.granted_by.user_id
         current_value = realm.last_role_change_per_user.get(author_user_id)
         realm.last_role_change_per_user[author_user_id] = (
@@ -263,10 +270,7 @@ class MemoryRealmComponent(BaseRealmComponent):
             else max(current_value, new_role.granted_on)
         )
 
-        await self._user_component.notify_certificates_update(
-            organization_id=organization_id,
-            index=self._user_component.get_current_certificate_index(organization_id),
-        )
+        await self._user_component.add_certificate(organization_id, new_role.certificate)
         await self._send_event(
             BackendEventRealmRolesUpdated(
                 organization_id=organization_id,
@@ -382,11 +386,9 @@ class MemoryRealmComponent(BaseRealmComponent):
         self, organization_id: OrganizationID, user: UserID
     ) -> Dict[VlobID, RealmRole]:
         user_realms = {}
-        for (realm_org_id, realm_id), realm in self._realms.items():
-            if realm_org_id != organization_id:
-                continue
+        for realm_id in self._realms_per_user.get((organization_id, user), ()):
             try:
-                user_realms[realm_id] = realm.roles[user]
+                user_realms[realm_id] = self._realms[(organization_id, realm_id)].roles[user]
             except KeyError:
                 pass
         return user_realms
@@ -410,6 +412,13 @@ class MemoryRealmComponent(BaseRealmComponent):
                 if candidate_org_id == id
             }
         )
+        self._realms_per_user.update(
+            {
+                (new_id, user_id): set(realm_ids)
+                for (candidate_org_id, user_id), realm_ids in self._realms_per_user.items()
+                if candidate_org_id == id
+            }
+        )
 
     def test_drop_organization(self, id: OrganizationID) -> None:
         self._realms = {
@@ -417,3 +426,11 @@ class MemoryRealmComponent(BaseRealmComponent):
             for (candidate_org_id, realm_id), realm in self._realms.items()
             if candidate_org_id != id
         }
+        self._realms_per_user = defaultdict(
+            set,
+            (
+                ((candidate_org_id, user_id), realm_ids)
+                for (candidate_org_id, user_id), realm_ids in self._realms_per_user.items()
+                if candidate_org_id != id
+            ),
+        )
@@ -29,6 +29,7 @@ from parsec.backend.sequester import (
 
 if TYPE_CHECKING:
     from parsec.backend.memory.organization import MemoryOrganizationComponent
+    from parsec.backend.memory.user import MemoryUserComponent
     from parsec.backend.memory.vlob import MemoryVlobComponent
 
 
@@ -36,6 +37,7 @@ class MemorySequesterComponent(BaseSequesterComponent):
     def __init__(self) -> None:
         self._organization_component: MemoryOrganizationComponent | None = None
         self._vlob_component: MemoryVlobComponent | None = None
+        self._user_component: MemoryUserComponent | None = None
         self._services: Dict[
             OrganizationID, Dict[SequesterServiceID, BaseSequesterService]
         ] = defaultdict(dict)
@@ -44,10 +46,12 @@ class MemorySequesterComponent(BaseSequesterComponent):
         self,
         organization: MemoryOrganizationComponent,
         vlob: MemoryVlobComponent,
+        user: MemoryUserComponent,
         **other_components: Any,
     ) -> None:
         self._organization_component = organization
         self._vlob_component = vlob
+        self._user_component = user
 
     def _enabled_services(self, organization_id: OrganizationID) -> List[BaseSequesterService]:
         return [s for s in self._services[organization_id].values() if s.is_enabled]
@@ -72,6 +76,7 @@ class MemorySequesterComponent(BaseSequesterComponent):
         service: BaseSequesterService,
     ) -> None:
         assert self._organization_component is not None
+        assert self._user_component is not None
 
         try:
             organization = self._organization_component._organizations[organization_id]
@@ -103,6 +108,7 @@ class MemorySequesterComponent(BaseSequesterComponent):
         org_services[service.service_id] = service
         # Also don't forget to update Organization structure in organization component
         self._refresh_services_in_organization_component(organization_id)
+        await self._user_component.add_certificate(organization_id, service.service_certificate)
 
     async def disable_service(
         self,
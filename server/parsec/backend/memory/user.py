@@ -33,6 +33,7 @@ from parsec.backend.user import (
 from parsec.backend.user_type import User, UserUpdate
 
 if TYPE_CHECKING:
+    from parsec.backend.handshake_cache import HandshakeCache
     from parsec.backend.memory.organization import MemoryOrganizationComponent
     from parsec.backend.memory.realm import MemoryRealmComponent
     from parsec.backend.memory.sequester import MemorySequesterComponent
@@ -43,6 +44,10 @@ class OrganizationStore:
     human_handle_to_user_id: Dict[HumanHandle, UserID] = attr.ib(factory=dict)
     users: Dict[UserID, User] = attr.ib(factory=dict)
     devices: Dict[UserID, Dict[DeviceName, Device]] = attr.ib(factory=lambda: defaultdict(dict))
+    # Append-only log of the certificates, in the order they must be provided to the
+    # clients. Each entry is a (certificate, redacted certificate) couple, the index
+    # of a certificate being its position in the log plus one.
+    certificates: List[Tuple[bytes, bytes]] = attr.ib(factory=list)
 
 
 class MemoryUserComponent(BaseUserComponent):
@@ -60,26 +65,31 @@ class MemoryUserComponent(BaseUserComponent):
         organization: MemoryOrganizationComponent,
         realm: MemoryRealmComponent,
         sequester: MemorySequesterComponent,
+        handshake_cache: HandshakeCache,
         **other_components: Any,
     ) -> None:
         self._organization_component = organization
         self._realm_component = realm
         self._sequester_component = sequester
+        self._handshake_cache = handshake_cache
 
     def get_current_certificate_index(self, organization_id: OrganizationID) -> int:
-        org = self._organizations[organization_id]
-
-        index = len(org.devices)
-
-        for user in org.users.values():
-            index += 2 if user.revoked_user_certificate else 1
-
-        for (realm_orgid, _), realm in self._realm_component._realms.items():
-            if realm_orgid != organization_id:
-                continue
-            for granted_role in realm.granted_roles:
-                index += len((granted_role.granted_on, granted_role.certificate))
+        return len(self._organizations[organization_id].certificates)
 
+    async def add_certificate(
+        self,
+        organization_id: OrganizationID,
+        certificate: bytes,
+        redacted_certificate: bytes | None = None,
+    ) -> int:
+        """
+        Append the certificate to the log of the organization, notify about it and
+        return its index.
+        """
+        certificates = self._organizations[organization_id].certificates
+        certificates.append((certificate, redacted_certificate or certificate))
+        index = len(certificates)
+        await self.notify_certificates_update(organization_id=organization_id, index=index)
         return index
 
     async def notify_certificates_update(
@@ -119,13 +129,13 @@ class MemoryUserComponent(BaseUserComponent):
         if user.human_handle:
             org.human_handle_to_user_id[user.human_handle] = user.user_id
 
-        await self.notify_certificates_update(
-            organization_id=organization_id,
-            index=self.get_current_certificate_index(organization_id),
+        await self.add_certificate(
+            organization_id, user.user_certificate, user.redacted_user_certificate
         )
-        await self.notify_certificates_update(
-            organization_id=organization_id,
-            index=self.get_current_certificate_index(organization_id),
+        await self.add_certificate(
+            organization_id,
+            first_device.device_certificate,
+            first_device.redacted_device_certificate,
         )
 
     async def create_device(
@@ -142,9 +152,8 @@ class MemoryUserComponent(BaseUserComponent):
 
         user_devices[device.device_name] = device
 
-        await self.notify_certificates_update(
-            organization_id=organization_id,
-            index=self.get_current_certificate_index(organization_id),
+        await self.add_certificate(
+            organization_id, device.device_certificate, device.redacted_device_certificate
         )
 
     async def _get_trustchain(
@@ -377,10 +386,8 @@ class MemoryUserComponent(BaseUserComponent):
         if user.human_handle:
             del org.human_handle_to_user_id[user.human_handle]
 
-        await self.notify_certificates_update(
-            organization_id=organization_id,
-            index=self.get_current_certificate_index(organization_id),
-        )
+        await self.add_certificate(organization_id, revoked_user_certificate)
+        self._handshake_cache.invalidate_user(organization_id, user_id)
         await self._send_event(
             BackendEventUserUpdatedOrRevoked(
                 organization_id=organization_id, user_id=user_id, profile=None
@@ -449,6 +456,7 @@ class MemoryUserComponent(BaseUserComponent):
             organization_id=organization_id,
             index=self.get_current_certificate_index(organization_id),
         )
+        self._handshake_cache.invalidate_user(organization_id, user_id)
         await self._send_event(
             BackendEventUserUpdatedOrRevoked(
                 organization_id=organization_id, user_id=user_id, profile=new_profile
@@ -468,66 +476,11 @@ class MemoryUserComponent(BaseUserComponent):
         """
         Raises: Nothing !
         """
-        certificates = []
-
-        # Certificates with the same timestamp will be ordered by priority (lower first)
-        # Multiple certificates can have the same timestamp if they have been created
-        # together: so far this is only the case for organization bootstrap and user creation.
-        # In such cases the events should also be ordered by they event types (e.g.
-        # `UserCertificate` must always be before `DeviceCertificate`)
-        SEQUESTER_AUTHORITY_PRIORITY = 0  # Max prio
-        USER_PRIORITY = 1
-        DEFAULT_PRIORITY = 2
-
-        # 1) Add sequester authority certificate
-        org = self._organization_component._organizations[organization_id]
-
-        # 2) Add sequester service certificates
-        if org.sequester_authority:
-            certificates.append(
-                (
-                    org.bootstrapped_on,
-                    SEQUESTER_AUTHORITY_PRIORITY,
-                    org.sequester_authority.certificate,
-                )
-            )
-            for service in self._sequester_component._services[organization_id].values():
-                certificates.append(
-                    (service.created_on, DEFAULT_PRIORITY, service.service_certificate)
-                )
-
-        # 3) Add user & revoked user certificates
-        org = self._organizations[organization_id]
-        for user in org.users.values():
-            certif = user.redacted_user_certificate if redacted else user.user_certificate
-            certificates.append((user.created_on, USER_PRIORITY, certif))
-            if user.revoked_user_certificate:
-                assert user.revoked_on is not None
-                certificates.append(
-                    (user.revoked_on, DEFAULT_PRIORITY, user.revoked_user_certificate)
-                )
-
-        # 4) Add device certificates
-        for devices in org.devices.values():
-            for device in devices.values():
-                certif = (
-                    device.redacted_device_certificate if redacted else device.device_certificate
-                )
-                certificates.append((device.created_on, DEFAULT_PRIORITY, certif))
-
-        # 5) Add realm role certificates
-        for (realm_orgid, _), realm in self._realm_component._realms.items():
-            if realm_orgid != organization_id:
-                continue
-            for granted_role in realm.granted_roles:
-                certificates.append(
-                    (granted_role.granted_on, DEFAULT_PRIORITY, granted_role.certificate)
-                )
-
-        # Sort certificates by timestamp... and also type (see priority) !
-        certificates.sort()
-
-        return [certif for _, _, certif in certificates[offset:]]
+        certificates = self._organizations[organization_id].certificates
+        return [
+            redacted_certif if redacted else certif
+            for certif, redacted_certif in certificates[offset:]
+        ]
 
     def test_duplicate_organization(self, id: OrganizationID, new_id: OrganizationID) -> None:
         self._organizations[new_id] = deepcopy(self._organizations[id])
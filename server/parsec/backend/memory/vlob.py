@@ -123,9 +123,15 @@ class Reencryption:
 @dataclass
 class Changes:
     checkpoint: int = dataclass_field(default=0)
+    # Last change of each vlob of the realm (hence also the list of the realm's vlobs)
     changes: Dict[VlobID, Tuple[DeviceID, int, int]] = dataclass_field(default_factory=dict)
+    # Vlob concerned by each change, the change at index `i` being the one of
+    # checkpoint `i + 1` (so the changes since a checkpoint are a simple slice)
+    changes_log: List[VlobID] = dataclass_field(default_factory=list)
     reencryption: Reencryption | None = dataclass_field(default=None)
     last_vlob_update_per_user: Dict[UserID, DateTime] = dataclass_field(default_factory=dict)
+    # Size of all the versions of all the vlobs of the realm
+    vlobs_size: int = dataclass_field(default=0)
 
 
 class MemoryVlobComponent(BaseVlobComponent):
@@ -159,9 +165,7 @@ class MemoryVlobComponent(BaseVlobComponent):
         changes = self._per_realm_changes[(organization_id, realm_id)]
         assert not changes.reencryption
         realm_vlobs = {
-            vlob_id: vlob
-            for (org_id, vlob_id), vlob in self._vlobs.items()
-            if org_id == organization_id and vlob.realm_id == realm_id
+            vlob_id: self._vlobs[(organization_id, vlob_id)] for vlob_id in changes.changes
         }
         changes.reencryption = Reencryption(realm_id, realm_vlobs)
 
@@ -177,6 +181,12 @@ class MemoryVlobComponent(BaseVlobComponent):
         for vlob_id, vlob in realm_vlobs.items():
             self._vlobs[(organization_id, vlob_id)] = vlob
         changes.reencryption = None
+        # Reencryption is the only operation modifying existing vlobs
+        changes.vlobs_size = sum(
+            len(blob)
+            for vlob_id in changes.changes
+            for (blob, _, _, _) in self._vlobs[(organization_id, vlob_id)].data
+        )
         return True
 
     def _get_vlob(self, organization_id: OrganizationID, vlob_id: VlobID) -> Vlob:
@@ -390,6 +400,10 @@ class MemoryVlobComponent(BaseVlobComponent):
             organization_id, realm_id, user_id, encryption_revision, None, OperationKind.MAINTENANCE
         )
 
+    def _get_realm_vlobs_size(self, organization_id: OrganizationID, realm_id: VlobID) -> int:
+        changes = self._per_realm_changes.get((organization_id, realm_id))
+        return changes.vlobs_size if changes else 0
+
     def _get_last_vlob_update(
         self, organization_id: OrganizationID, realm_id: VlobID, user_id: UserID
     ) -> DateTime | None:
@@ -403,11 +417,15 @@ class MemoryVlobComponent(BaseVlobComponent):
         realm_id: VlobID,
         src_id: VlobID,
         timestamp: DateTime,
+        blob_size: int,
         src_version: int = 1,
     ) -> None:
         changes = self._per_realm_changes[(organization_id, realm_id)]
         changes.checkpoint += 1
         changes.changes[src_id] = (author, changes.checkpoint, src_version)
+        changes.changes_log.append(src_id)
+        assert len(changes.changes_log) == changes.checkpoint
+        changes.vlobs_size += blob_size
 
         current_value = changes.last_vlob_update_per_user.get(author.user_id)
         changes.last_vlob_update_per_user[author.user_id] = (
@@ -463,7 +481,7 @@ class MemoryVlobComponent(BaseVlobComponent):
             realm_id, [(blob, author, timestamp, certificate_index)], sequestered_data
         )
 
-        await self._update_changes(organization_id, author, realm_id, vlob_id, timestamp)
+        await self._update_changes(organization_id, author, realm_id, vlob_id, timestamp, len(blob))
 
     async def read(
         self,
@@ -548,7 +566,7 @@ class MemoryVlobComponent(BaseVlobComponent):
             vlob.sequestered_data.append(sequestered_data)
 
         await self._update_changes(
-            organization_id, author, vlob.realm_id, vlob_id, timestamp, version
+            organization_id, author, vlob.realm_id, vlob_id, timestamp, len(blob), version
         )
 
     async def poll_changes(
@@ -557,10 +575,11 @@ class MemoryVlobComponent(BaseVlobComponent):
         self._check_realm_read_access(organization_id, realm_id, author.user_id, None, None)
 
         changes = self._per_realm_changes[(organization_id, realm_id)]
+        # The log may contain multiple entries for a given vlob, its last change
+        # being the one stored in `changes.changes`
         changes_since_checkpoint = {
-            src_id: src_version
-            for src_id, (_, change_checkpoint, src_version) in changes.changes.items()
-            if change_checkpoint > checkpoint
+            src_id: changes.changes[src_id][2]
+            for src_id in changes.changes_log[max(checkpoint, 0) :]
         }
         return (changes.checkpoint, changes_since_checkpoint)
 
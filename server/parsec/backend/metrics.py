@@ -0,0 +1,430 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+from __future__ import annotations
+
+import json
+import math
+import os
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from enum import Enum
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, DefaultDict, Dict, Iterator, List, Sequence, Tuple
+
+import trio
+from structlog import get_logger
+
+if TYPE_CHECKING:
+    from parsec.backend.app import BackendApp
+
+# Metrics of the server process, rendered in the Prometheus text format by the
+# `/metrics` administration route.
+#
+# Counters and histograms are updated by the code being measured, while gauges are
+# typically set by the collectors (see `register_collector`) right before rendering.
+#
+# With `--workers`, each worker process has its own metrics, labelled with the worker
+# index. As a scrape only reaches one of them, each worker periodically shares its
+# rendered samples in a directory common to all the workers (see `share_worker_metrics`),
+# and the samples of the other workers are merged with its own ones at render time.
+
+logger = get_logger()
+
+# Upper bounds (in seconds) of the latency histogram buckets, the last bucket
+# (i.e. `+Inf`) is implicit
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+WORKER_METRICS_SHARE_INTERVAL = 1.0
+
+Labels = Tuple[str, ...]
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, int) or value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    escaped = (
+        value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+class Registry:
+    """
+    Metrics and collectors of a process (see `REGISTRY`), along with the worker
+    it is when the server runs several worker processes.
+    """
+
+    def __init__(self) -> None:
+        self.metrics: Dict[str, Metric] = {}
+        self.collectors: List[Callable[[], None]] = []
+        self.worker: str | None = None
+        self.workers_dir: Path | None = None
+
+    def set_worker(self, worker: str, workers_dir: Path) -> None:
+        """
+        Label the samples with `worker`, and merge the ones shared in `workers_dir`
+        by the other workers.
+        """
+        self.worker = worker
+        self.workers_dir = workers_dir
+
+    def register(self, metric: Metric) -> None:
+        self.metrics[metric.name] = metric
+
+    @contextmanager
+    def register_collector(self, collector: Callable[[], None]) -> Iterator[None]:
+        self.collectors.append(collector)
+        try:
+            yield
+        finally:
+            self.collectors.remove(collector)
+
+    def collect(self) -> None:
+        for collector in list(self.collectors):
+            collector()
+
+    def format_labels(self, names: Sequence[str], values: Sequence[str]) -> str:
+        if self.worker is not None:
+            names = ("worker", *names)
+            values = (self.worker, *values)
+        return _format_labels(names, values)
+
+    def render_samples(self) -> Dict[str, List[str]]:
+        return {name: list(metric.render_samples()) for name, metric in self.metrics.items()}
+
+    def share_samples(self, samples: Dict[str, List[str]]) -> None:
+        assert self.worker is not None and self.workers_dir is not None
+        path = self.workers_dir / f"{self.worker}.json"
+        # Atomic replace, so that the other workers never read a partial file
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(samples))
+        os.replace(tmp_path, path)
+
+    def load_shared_samples(self) -> List[Dict[str, List[str]]]:
+        """
+        Samples shared by the other workers (i.e. as of their last share).
+        """
+        if self.workers_dir is None:
+            return []
+        loaded = []
+        for path in sorted(self.workers_dir.glob("*.json")):
+            if path.stem == self.worker:
+                continue
+            try:
+                loaded.append(json.loads(path.read_text()))
+            except (OSError, ValueError) as exc:
+                logger.warning("Cannot load worker metrics", path=str(path), exc_info=exc)
+        return loaded
+
+    def render(self, shared_samples: Sequence[Dict[str, List[str]]] = ()) -> str:
+        lines: List[str] = []
+        for name, samples in self.render_samples().items():
+            metric = self.metrics[name]
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            lines += samples
+            for other_samples in shared_samples:
+                lines += other_samples.get(name, ())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    type: str
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        registry: Registry | None = None,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._registry = registry or REGISTRY
+        self._registry.register(self)
+
+    def clear(self) -> None:
+        raise NotImplementedError()
+
+    def render_samples(self) -> Iterator[str]:
+        raise NotImplementedError()
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        registry: Registry | None = None,
+    ):
+        super().__init__(name, documentation, labelnames, registry)
+        self._values: DefaultDict[Labels, float] = defaultdict(float)
+
+    def inc(self, *labels: str, value: float = 1) -> None:
+        assert len(labels) == len(self.labelnames)
+        self._values[labels] += value
+
+    def set(self, *labels: str, value: float) -> None:
+        # For counters maintained elsewhere, and copied by a collector
+        assert len(labels) == len(self.labelnames)
+        self._values[labels] = value
+
+    def get(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def clear(self) -> None:
+        self._values.clear()
+
+    def render_samples(self) -> Iterator[str]:
+        for labels, value in sorted(self._values.items()):
+            formatted_labels = self._registry.format_labels(self.labelnames, labels)
+            yield f"{self.name}{formatted_labels} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, *labels: str, value: float = 1) -> None:
+        self.inc(*labels, value=-value)
+
+    @contextmanager
+    def track_inprogress(self, *labels: str) -> Iterator[None]:
+        self.inc(*labels)
+        try:
+            yield
+        finally:
+            self.dec(*labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+        registry: Registry | None = None,
+    ):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(buckets)
+        # Number of observations per bucket (not cumulative), and sum of the observations
+        self._values: Dict[Labels, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, *labels: str, value: float) -> None:
+        assert len(labels) == len(self.labelnames)
+        try:
+            counts, total = self._values[labels]
+        except KeyError:
+            counts, total = self._values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts[bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def set_buckets(self, *labels: str, counts: Sequence[int], total: float) -> None:
+        """
+        Replace the observations, for histograms whose data is recorded elsewhere (e.g.
+        the stats of the PostgreSQL queries).
+        """
+        assert len(counts) == len(self.buckets) + 1
+        self._values[labels] = (list(counts), [total])
+
+    def get_count(self, *labels: str) -> int:
+        values = self._values.get(labels)
+        return sum(values[0]) if values else 0
+
+    def clear(self) -> None:
+        self._values.clear()
+
+    def render_samples(self) -> Iterator[str]:
+        bucket_labelnames = (*self.labelnames, "le")
+        for labels, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for upper_bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                formatted_labels = self._registry.format_labels(
+                    bucket_labelnames, (*labels, _format_value(upper_bound))
+                )
+                yield f"{self.name}_bucket{formatted_labels} {cumulative}"
+            formatted_labels = self._registry.format_labels(self.labelnames, labels)
+            yield f"{self.name}_sum{formatted_labels} {_format_value(total[0])}"
+            yield f"{self.name}_count{formatted_labels} {cumulative}"
+
+
+@contextmanager
+def register_collector(collector: Callable[[], None]) -> Iterator[None]:
+    """
+    Have `collector` called before each rendering of the metrics (typically to
+    set gauges from the stats of a component), as long as the context is open.
+    """
+    with REGISTRY.register_collector(collector):
+        yield
+
+
+def collect_backend_metrics(backend: BackendApp) -> None:
+    """
+    Set the gauges of the backend app and of the trio scheduler (hence must be
+    called from the trio thread).
+    """
+    for event, (sent, dispatched) in backend.event_bus.dispatch_stats().items():
+        event_name = event.value if isinstance(event, Enum) else event.__name__
+        EVENTS_SENT.set(event_name, value=sent)
+        EVENTS_DISPATCHED.set(event_name, value=dispatched)
+    EVENTS_LISTENERS.clear()
+    for event, listeners in backend.event_bus.stats().items():
+        event_name = event.value if isinstance(event, Enum) else event.__name__
+        EVENTS_LISTENERS.set(event_name, value=listeners)
+    for kind, value in backend.handshake_cache.stats().items():
+        HANDSHAKE_CACHE.set(kind, value=value)
+    if backend.admission is not None:
+        backend.admission.collect_metrics()
+
+    statistics = trio.lowlevel.current_statistics()
+    TRIO_TASKS_LIVING.set(value=statistics.tasks_living)
+    TRIO_TASKS_RUNNABLE.set(value=statistics.tasks_runnable)
+    TRIO_RUN_SYNC_SOON_QUEUE_SIZE.set(value=statistics.run_sync_soon_queue_size)
+
+
+def render_metrics() -> str:
+    REGISTRY.collect()
+    return REGISTRY.render(REGISTRY.load_shared_samples())
+
+
+async def share_worker_metrics(
+    backend: BackendApp, interval: float = WORKER_METRICS_SHARE_INTERVAL
+) -> None:
+    """
+    Periodically share the samples of this worker with the other ones (see
+    `Registry.set_worker`), until cancelled.
+    """
+    while True:
+        collect_backend_metrics(backend)
+        REGISTRY.collect()
+        samples = REGISTRY.render_samples()
+        try:
+            await trio.to_thread.run_sync(REGISTRY.share_samples, samples)
+        except OSError as exc:
+            logger.warning("Cannot share worker metrics", exc_info=exc)
+        await trio.sleep(interval)
+
+
+COMMAND_DURATION = Histogram(
+    "parsec_command_duration_seconds",
+    "Duration of the API commands, by command",
+    ("cmd",),
+)
+COMMAND_REPLIES = Counter(
+    "parsec_command_replies_total",
+    "Number of API command replies, by command and reply status",
+    ("cmd", "status"),
+)
+ADMISSION_COMMANDS = Gauge(
+    "parsec_admission_commands",
+    "Number of commands subject to admission control, by state (running/waiting)",
+    ("state",),
+)
+ADMISSION_REJECTED = Counter(
+    "parsec_admission_rejected_total",
+    "Number of commands rejected after having been queued too long, by command",
+    ("cmd",),
+)
+CLIENT_CONNECTIONS = Gauge(
+    "parsec_client_connections",
+    "Number of clients connected to listen to events, by transport",
+    ("transport",),
+)
+DB_POOL_ACQUIRE_DURATION = Histogram(
+    "parsec_db_pool_acquire_duration_seconds",
+    "Time spent waiting for a connection of the PostgreSQL pool",
+)
+DB_POOL_CONNECTIONS = Gauge(
+    "parsec_db_pool_connections",
+    "Number of connections of the PostgreSQL pool, by state",
+    ("state",),
+)
+DB_POOL_WAITING = Gauge(
+    "parsec_db_pool_waiting",
+    "Number of tasks waiting for a connection of the PostgreSQL pool",
+)
+DB_QUERY_DURATION = Histogram(
+    "parsec_db_query_duration_seconds",
+    "Duration of the PostgreSQL queries, by query",
+    ("query",),
+)
+DB_REPLICA_LAG = Gauge(
+    "parsec_db_replica_lag_seconds",
+    "Replication lag of the PostgreSQL read replicas (+Inf if unreachable), by replica",
+    ("replica",),
+)
+DB_REPLICA_HEALTHY = Gauge(
+    "parsec_db_replica_healthy",
+    "Whether the PostgreSQL read replica is used to serve reads (1) or not (0), by replica",
+    ("replica",),
+)
+DB_READS = Counter(
+    "parsec_db_reads_total",
+    "Number of reads that could be served by a replica, by target (primary/replica)",
+    ("target",),
+)
+BLOCKSTORE_DURATION = Histogram(
+    "parsec_blockstore_operation_duration_seconds",
+    "Duration of the blockstore operations, by blockstore and operation",
+    ("blockstore", "operation"),
+)
+BLOCKSTORE_ERRORS = Counter(
+    "parsec_blockstore_errors_total",
+    "Number of failed blockstore operations, by blockstore and operation",
+    ("blockstore", "operation"),
+)
+EVENTS_SENT = Counter(
+    "parsec_events_sent_total",
+    "Number of events sent on the event bus, by event type",
+    ("event",),
+)
+EVENTS_DISPATCHED = Counter(
+    "parsec_events_dispatched_total",
+    "Number of event bus callbacks called (i.e. events fan-out), by event type",
+    ("event",),
+)
+EVENTS_LISTENERS = Gauge(
+    "parsec_events_listeners",
+    "Number of callbacks connected to the event bus, by event type",
+    ("event",),
+)
+HANDSHAKE_CACHE = Gauge(
+    "parsec_handshake_cache",
+    "Size and number of lookups (hits/misses) of the handshake cache",
+    ("kind",),
+)
+DB_INTERNAL_IDS_CACHE = Gauge(
+    "parsec_db_internal_ids_cache",
+    "Size and number of lookups (hits/misses) of the PostgreSQL internal ids cache",
+    ("kind",),
+)
+TRIO_TASKS_LIVING = Gauge(
+    "parsec_trio_tasks_living",
+    "Number of tasks running in the trio event loop",
+)
+TRIO_TASKS_RUNNABLE = Gauge(
+    "parsec_trio_tasks_runnable",
+    "Number of tasks waiting to be scheduled by the trio event loop",
+)
+TRIO_RUN_SYNC_SOON_QUEUE_SIZE = Gauge(
+    "parsec_trio_run_sync_soon_queue_size",
+    "Number of callbacks queued from other threads in the trio event loop",
+)
@@ -1,6 +1,10 @@
 # Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
 from __future__ import annotations
 
+from typing import Dict, List, Tuple
+
+import attr
+import trio
 import triopg
 from triopg.exceptions import UniqueViolationError
 
@@ -15,18 +19,15 @@ from parsec.backend.block import (
     BlockStoreError,
 )
 from parsec.backend.blockstore import BaseBlockStoreComponent
-from parsec.backend.postgresql.handler import PGHandler
+from parsec.backend.postgresql.handler import MeasuredPool, PGHandler
 from parsec.backend.postgresql.realm_queries.maintenance import RealmNotFoundError, get_realm_status
+from parsec.backend.postgresql.usage import add_realm_usage
 from parsec.backend.postgresql.utils import (
     Q,
     q_block,
-    q_device_internal_id,
-    q_organization_internal_id,
     q_realm,
-    q_realm_internal_id,
     q_user_can_read_vlob,
     q_user_can_write_vlob,
-    q_user_internal_id,
 )
 from parsec.backend.utils import OperationKind
 
@@ -36,7 +37,7 @@ SELECT
     { q_realm(_id="block.realm", select="realm.realm_id") }
 FROM block
 WHERE
-    organization = { q_organization_internal_id("$organization_id") }
+    organization = $organization_internal_id
     AND block_id = $block_id
 """
 )
@@ -48,16 +49,13 @@ SELECT
     deleted_on,
     {
         q_user_can_read_vlob(
-            user=q_user_internal_id(
-                organization_id="$organization_id",
-                user_id="$user_id"
-            ),
+            user="$user_internal_id",
             realm="block.realm"
         )
     } as has_access
 FROM block
 WHERE
-    organization = { q_organization_internal_id("$organization_id") }
+    organization = $organization_internal_id
     AND block_id = $block_id
 """
 )
@@ -68,14 +66,13 @@ _q_get_block_write_right_and_unicity = Q(
 SELECT
     {
         q_user_can_write_vlob(
-            organization_id="$organization_id",
-            user_id="$user_id",
-            realm_id="$realm_id"
+            user="$user_internal_id",
+            realm="$realm_internal_id"
         )
     } as has_access,
     EXISTS({
         q_block(
-            organization_id="$organization_id",
+            organization="$organization_internal_id",
             block_id="$block_id"
         )
     }) as exists
@@ -84,13 +81,13 @@ SELECT
 
 
 _q_insert_block = Q(
-    f"""
+    """
 INSERT INTO block (organization, block_id, realm, author, size, created_on)
 VALUES (
-    { q_organization_internal_id("$organization_id") },
+    $organization_internal_id,
     $block_id,
-    { q_realm_internal_id(organization_id="$organization_id", realm_id="$realm_id") },
-    { q_device_internal_id(organization_id="$organization_id", device_id="$author") },
+    $realm_internal_id,
+    $author_internal_id,
     $size,
     $created_on
 )
@@ -127,10 +124,33 @@ class PGBlockComponent(BaseBlockComponent):
     async def read(
         self, organization_id: OrganizationID, author: DeviceID, block_id: BlockID
     ) -> bytes:
-        async with self.dbh.pool.acquire() as conn, conn.transaction():
+        pool = self.dbh.read_pool(organization_id)
+        try:
+            await self._check_read(pool, organization_id, author, block_id)
+        except (BlockNotFoundError, BlockAccessError):
+            if pool is self.dbh.pool:
+                raise
+            # The read replica may not be up to date with a change not notified to this
+            # server process yet (e.g. the block creation, which sends no event)
+            await self._check_read(self.dbh.pool, organization_id, author, block_id)
+
+        # We can do the blockstore read outside of the transaction given the block
+        # are never modified/removed
+        return await self._blockstore_component.read(organization_id, block_id)
+
+    async def _check_read(
+        self,
+        pool: MeasuredPool,
+        organization_id: OrganizationID,
+        author: DeviceID,
+        block_id: BlockID,
+    ) -> None:
+        internal_ids = self.dbh.internal_ids
+        async with pool.acquire() as conn, conn.transaction(readonly=True):
+            organization_internal_id = await internal_ids.organization(conn, organization_id)
             realm_id_uuid = await conn.fetchval(
                 *_q_get_realm_id_from_block_id(
-                    organization_id=organization_id.str, block_id=block_id
+                    organization_internal_id=organization_internal_id, block_id=block_id
                 )
             )
             if not realm_id_uuid:
@@ -139,9 +159,9 @@ class PGBlockComponent(BaseBlockComponent):
             await _check_realm(conn, organization_id, realm_id, OperationKind.DATA_READ)
             ret = await conn.fetchrow(
                 *_q_get_block_meta(
-                    organization_id=organization_id.str,
+                    organization_internal_id=organization_internal_id,
                     block_id=block_id,
-                    user_id=author.user_id.str,
+                    user_internal_id=await internal_ids.user(conn, organization_id, author.user_id),
                 )
             )
             if not ret or ret["deleted_on"]:
@@ -150,10 +170,6 @@ class PGBlockComponent(BaseBlockComponent):
             elif not ret["has_access"]:
                 raise BlockAccessError()
 
-        # We can do the blockstore read outside of the transaction given the block
-        # are never modified/removed
-        return await self._blockstore_component.read(organization_id, block_id)
-
     async def create(
         self,
         organization_id: OrganizationID,
@@ -164,17 +180,20 @@ class PGBlockComponent(BaseBlockComponent):
         created_on: DateTime | None = None,
     ) -> None:
         created_on = created_on or DateTime.now()
+        internal_ids = self.dbh.internal_ids
         async with self.dbh.pool.acquire() as conn, conn.transaction():
             await _check_realm(conn, organization_id, realm_id, OperationKind.DATA_WRITE)
+            organization_internal_id = await internal_ids.organization(conn, organization_id)
+            realm_internal_id = await internal_ids.realm(conn, organization_id, realm_id)
 
             # 1) Check access rights and block unicity
             # Note it's important to check unicity here because blockstore create
             # overwrite existing data !
             ret = await conn.fetchrow(
                 *_q_get_block_write_right_and_unicity(
-                    organization_id=organization_id.str,
-                    user_id=author.user_id.str,
-                    realm_id=realm_id,
+                    organization_internal_id=organization_internal_id,
+                    user_internal_id=await internal_ids.user(conn, organization_id, author.user_id),
+                    realm_internal_id=realm_internal_id,
                     block_id=block_id,
                 )
             )
@@ -202,10 +221,10 @@ class PGBlockComponent(BaseBlockComponent):
             try:
                 ret = await conn.execute(
                     *_q_insert_block(
-                        organization_id=organization_id.str,
+                        organization_internal_id=organization_internal_id,
                         block_id=block_id,
-                        realm_id=realm_id,
-                        author=author.str,
+                        realm_internal_id=realm_internal_id,
+                        author_internal_id=await internal_ids.device(conn, organization_id, author),
                         size=len(block),
                         created_on=created_on,
                     )
@@ -218,15 +237,40 @@ class PGBlockComponent(BaseBlockComponent):
             if ret != "INSERT 0 1":
                 raise BlockError(f"Insertion error: {ret}")
 
+            await add_realm_usage(
+                conn,
+                organization_internal_id,
+                realm_internal_id,
+                created_on,
+                blocks_size=len(block),
+            )
+
+
+# Blocks smaller than this are packed into segments (if packing is enabled)...
+PACKED_BLOCK_MAX_SIZE = 64 * 1024
+# ...that are written once enough blocks are pending or when no other segment is
+# being written (see `PGBlockStoreComponent.create`)
+SEGMENT_MAX_SIZE = 8 * 1024 * 1024
+# Segments are rewritten by the compaction if less than this ratio of their data is
+# still referenced, or if they are too small (typically when few blocks are created
+# concurrently, each segment contains only a couple of blocks)
+SEGMENT_COMPACTION_LIVE_RATIO = 0.5
+SEGMENT_COMPACTION_MIN_SIZE = SEGMENT_MAX_SIZE // 4
+
 
 _q_get_block_data = Q(
     """
 SELECT
-    data
+    COALESCE(
+        block_data.data,
+        -- Segment data is not compressed, so only the needed chunks are fetched
+        SUBSTRING(block_segment.data FROM block_data.segment_offset + 1 FOR block_data.size)
+    )
 FROM block_data
+LEFT JOIN block_segment ON block_segment._id = block_data.segment
 WHERE
-    organization_id = $organization_id
-    AND block_id = $block_id
+    block_data.organization_id = $organization_id
+    AND block_data.block_id = $block_id
 """
 )
 
@@ -239,9 +283,123 @@ VALUES ($organization_id, $block_id, $data)
 )
 
 
+_q_insert_block_segment = Q(
+    """
+INSERT INTO block_segment (data)
+VALUES ($data)
+RETURNING _id
+"""
+)
+
+
+# Blocks already stored are left untouched, their copy in the segment is dead data
+_q_insert_packed_block_data = Q(
+    """
+INSERT INTO block_data (organization_id, block_id, segment, segment_offset, size)
+SELECT
+    organization_id,
+    block_id,
+    $segment,
+    segment_offset,
+    size
+FROM UNNEST(
+    $organization_ids::VARCHAR[],
+    $block_ids::UUID[],
+    $segment_offsets::INTEGER[],
+    $sizes::INTEGER[]
+) AS t(organization_id, block_id, segment_offset, size)
+ON CONFLICT DO NOTHING
+"""
+)
+
+
+_q_get_segments_to_compact = Q(
+    """
+SELECT
+    block_segment._id,
+    OCTET_LENGTH(block_segment.data) AS size,
+    COALESCE(SUM(block_data.size), 0) AS live_size
+FROM block_segment
+LEFT JOIN block_data ON block_data.segment = block_segment._id
+GROUP BY block_segment._id
+HAVING
+    COALESCE(SUM(block_data.size), 0) < OCTET_LENGTH(block_segment.data) * $live_ratio
+    OR OCTET_LENGTH(block_segment.data) < $min_size
+ORDER BY block_segment._id
+"""
+)
+
+
+# Segments being compacted concurrently are skipped
+_q_lock_segments = Q(
+    """
+SELECT _id
+FROM block_segment
+WHERE _id = ANY($segments::INTEGER[])
+FOR UPDATE SKIP LOCKED
+"""
+)
+
+
+_q_get_segments_live_blocks = Q(
+    """
+SELECT
+    block_data._id,
+    SUBSTRING(block_segment.data FROM block_data.segment_offset + 1 FOR block_data.size)
+FROM block_data
+INNER JOIN block_segment ON block_segment._id = block_data.segment
+WHERE block_data.segment = ANY($segments::INTEGER[])
+ORDER BY block_data._id
+"""
+)
+
+
+_q_move_packed_block_data = Q(
+    """
+UPDATE block_data
+SET
+    segment = $segment,
+    segment_offset = t.segment_offset
+FROM UNNEST($ids::INTEGER[], $segment_offsets::INTEGER[]) AS t(_id, segment_offset)
+WHERE block_data._id = t._id
+"""
+)
+
+
+_q_delete_segments = Q(
+    """
+DELETE FROM block_segment
+WHERE _id = ANY($segments::INTEGER[])
+"""
+)
+
+
+@attr.s(slots=True, auto_attribs=True)
+class _PendingSegment:
+    blocks: Dict[Tuple[OrganizationID, BlockID], bytes] = attr.ib(factory=dict)
+    size: int = 0
+    written: bool = False
+
+
 class PGBlockStoreComponent(BaseBlockStoreComponent):
-    def __init__(self, dbh: PGHandler):
+    """
+    Store the blocks' data in the database.
+
+    If `packed` is set, small blocks are not stored in their own row but packed
+    together into segments, which means less rows (and index entries) to write,
+    vacuum and backup. In turn, the space of the blocks no longer referenced (or
+    written multiple times) must be reclaimed with `compact_segments`.
+
+    Note only the blocks created concurrently are packed together (see `create`):
+    a block created alone (e.g. by a single client uploading its blocks one after
+    the other) is stored in its own row, as if packing was disabled.
+    """
+
+    def __init__(self, dbh: PGHandler, packed: bool = False):
         self.dbh = dbh
+        self.packed = packed
+        self._pending_segment = _PendingSegment()
+        self._segment_write_lock = trio.Lock()
 
     async def read(self, organization_id: OrganizationID, block_id: BlockID) -> bytes:
         async with self.dbh.pool.acquire() as conn:
@@ -255,6 +413,39 @@ class PGBlockStoreComponent(BaseBlockStoreComponent):
 
     async def create(
         self, organization_id: OrganizationID, block_id: BlockID, block: bytes
+    ) -> None:
+        if not self.packed or len(block) > PACKED_BLOCK_MAX_SIZE:
+            await self._create_unpacked(organization_id, block_id, block)
+            return
+
+        segment = self._pending_segment
+        if segment.size + len(block) > SEGMENT_MAX_SIZE:
+            segment = self._pending_segment = _PendingSegment()
+        if (organization_id, block_id) not in segment.blocks:
+            segment.blocks[(organization_id, block_id)] = block
+            segment.size += len(block)
+
+        # Concurrent creates are written together: the first one to get the lock
+        # writes all the blocks pending at this time in a single segment, while the
+        # blocks created in the meantime are pending for the next segment.
+        # Note that if the segment write fails, the other creates waiting for this
+        # segment will try to write it in turn.
+        async with self._segment_write_lock:
+            if segment.written:
+                return
+            if self._pending_segment is segment:
+                self._pending_segment = _PendingSegment()
+            if len(segment.blocks) == 1:
+                # A segment for a single block would cost one more row than storing
+                # the block on its own
+                (organization_id, block_id), block = next(iter(segment.blocks.items()))
+                await self._create_unpacked(organization_id, block_id, block)
+            else:
+                await self._write_segment(segment)
+            segment.written = True
+
+    async def _create_unpacked(
+        self, organization_id: OrganizationID, block_id: BlockID, block: bytes
     ) -> None:
         async with self.dbh.pool.acquire() as conn:
             try:
@@ -269,3 +460,85 @@ class PGBlockStoreComponent(BaseBlockStoreComponent):
             except UniqueViolationError:
                 # Keep calm and stay idempotent
                 pass
+
+    async def _write_segment(self, segment: _PendingSegment) -> None:
+        offsets = []
+        offset = 0
+        for block in segment.blocks.values():
+            offsets.append(offset)
+            offset += len(block)
+
+        async with self.dbh.pool.acquire() as conn, conn.transaction():
+            segment_internal_id = await conn.fetchval(
+                *_q_insert_block_segment(data=b"".join(segment.blocks.values()))
+            )
+            await conn.execute(
+                *_q_insert_packed_block_data(
+                    segment=segment_internal_id,
+                    organization_ids=[organization_id.str for organization_id, _ in segment.blocks],
+                    block_ids=[block_id for _, block_id in segment.blocks],
+                    segment_offsets=offsets,
+                    sizes=[len(block) for block in segment.blocks.values()],
+                )
+            )
+
+    async def compact_segments(
+        self,
+        live_ratio: float = SEGMENT_COMPACTION_LIVE_RATIO,
+        min_size: int = SEGMENT_COMPACTION_MIN_SIZE,
+    ) -> Tuple[int, int]:
+        """
+        Rewrite the segments with less than `live_ratio` of their data still referenced
+        or smaller than `min_size`, merging their live blocks into new segments.
+
+        Return the number of segments removed and created.
+        """
+        async with self.dbh.pool.acquire() as conn:
+            rows = await conn.fetch(
+                *_q_get_segments_to_compact(live_ratio=live_ratio, min_size=min_size)
+            )
+
+        # Group the segments so that each group's live data fits in a new segment
+        groups: List[List[int]] = [[]]
+        groups_size = 0
+        sparse_segments = {
+            row["_id"] for row in rows if row["live_size"] < row["size"] * live_ratio
+        }
+        for row in rows:
+            if groups[-1] and groups_size + row["live_size"] > SEGMENT_MAX_SIZE:
+                groups.append([])
+                groups_size = 0
+            groups[-1].append(row["_id"])
+            groups_size += row["live_size"]
+
+        removed = created = 0
+        for group in groups:
+            if not group or (len(group) == 1 and group[0] not in sparse_segments):
+                # Rewriting a single small segment as is would be pointless
+                continue
+            async with self.dbh.pool.acquire() as conn, conn.transaction():
+                locked = [row["_id"] for row in await conn.fetch(*_q_lock_segments(segments=group))]
+                if not locked:
+                    continue
+                blocks = await conn.fetch(*_q_get_segments_live_blocks(segments=locked))
+                if blocks:
+                    offsets = []
+                    offset = 0
+                    for block in blocks:
+                        offsets.append(offset)
+                        offset += len(block[1])
+                    segment_internal_id = await conn.fetchval(
+                        *_q_insert_block_segment(data=b"".join(block[1] for block in blocks))
+                    )
+                    await conn.execute(
+                        *_q_move_packed_block_data(
+                            segment=segment_internal_id,
+                            ids=[block[0] for block in blocks],
+                            segment_offsets=offsets,
+                        )
+                    )
+                    created += 1
+                await conn.execute(*_q_delete_segments(segments=locked))
+                removed += len(locked)
+
+        return removed, created
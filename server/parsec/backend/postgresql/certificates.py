@@ -0,0 +1,90 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+from __future__ import annotations
+
+from typing import List
+
+import triopg
+
+from parsec._parsec import BackendEventCertificatesUpdated, OrganizationID
+from parsec.backend.postgresql.handler import send_signal
+from parsec.backend.postgresql.utils import Q, q_organization_internal_id, query
+
+# The certificates of an organization are stored in an append-only log, in the order
+# they must be provided to the clients. Hence `certificate_get` is a simple range read
+# on the log, and the index of the last certificate is the one sent to the clients in
+# `BackendEventCertificatesUpdated`.
+
+
+_q_add_certificate = Q(
+    """
+WITH cte_index AS (
+    UPDATE organization
+    SET last_certificate_index = last_certificate_index + 1
+    WHERE organization_id = $organization_id
+    RETURNING _id, last_certificate_index
+)
+INSERT INTO certificate (organization, index, certificate, redacted_certificate)
+SELECT
+    _id,
+    last_certificate_index,
+    $certificate,
+    $redacted_certificate
+FROM cte_index
+RETURNING index
+"""
+)
+
+
+_q_get_certificates = Q(
+    f"""
+SELECT
+    certificate,
+    redacted_certificate
+FROM certificate
+WHERE
+    organization = { q_organization_internal_id("$organization_id") }
+    AND index > $offset
+ORDER BY index
+"""
+)
+
+
+async def add_certificate(
+    conn: triopg._triopg.TrioConnectionProxy,
+    organization_id: OrganizationID,
+    certificate: bytes,
+    redacted_certificate: bytes | None = None,
+) -> int:
+    """
+    Append the certificate to the log of the organization and return its index.
+
+    Must be called in the transaction creating the certified item. Note the
+    organization row is locked until the end of the transaction, so the certificates
+    are appended in the same order the transactions are committed.
+    """
+    index = await conn.fetchval(
+        *_q_add_certificate(
+            organization_id=organization_id.str,
+            certificate=certificate,
+            redacted_certificate=redacted_certificate,
+        )
+    )
+    await send_signal(
+        conn, BackendEventCertificatesUpdated(organization_id=organization_id, index=index)
+    )
+    return index
+
+
+@query(read_only=True)
+async def query_get_certificates(
+    conn: triopg._triopg.TrioConnectionProxy,
+    organization_id: OrganizationID,
+    offset: int,
+    redacted: bool,
+) -> List[bytes]:
+    rows = await conn.fetch(
+        *_q_get_certificates(organization_id=organization_id.str, offset=offset)
+    )
+    if redacted:
+        return [row["redacted_certificate"] or row["certificate"] for row in rows]
+    return [row["certificate"] for row in rows]
@@ -11,6 +11,7 @@ from parsec._parsec import BackendEvent
 from parsec.backend.blockstore import blockstore_factory
 from parsec.backend.config import BackendConfig
 from parsec.backend.events import EventsComponent
+from parsec.backend.handshake_cache import HandshakeCache
 from parsec.backend.postgresql.block import PGBlockComponent
 from parsec.backend.postgresql.handler import PGHandler, send_signal
 from parsec.backend.postgresql.invite import PGInviteComponent
@@ -31,7 +32,14 @@ from parsec.utils import open_service_nursery
 async def components_factory(  # type: ignore[misc]
     config: BackendConfig, event_bus: EventBus
 ) -> AsyncGenerator[dict[str, Any], None]:
-    dbh = PGHandler(config.db_url, config.db_min_connections, config.db_max_connections, event_bus)
+    dbh = PGHandler(
+        config.db_url,
+        config.db_min_connections,
+        config.db_max_connections,
+        event_bus,
+        replica_urls=config.db_replica_urls,
+        replica_max_lag=config.db_replica_max_lag,
+    )
 
     async def _send_event(
         event: BackendEvent,
@@ -55,7 +63,14 @@ async def components_factory(  # type: ignore[misc]
     block = PGBlockComponent(dbh=dbh, blockstore_component=blockstore)
     pki = PGPkiEnrollmentComponent(dbh)
     sequester = PGPSequesterComponent(dbh)
-    events = EventsComponent(realm_component=realm, send_event=_send_event)
+    events = EventsComponent(realm_component=realm, send_event=_send_event, event_bus=event_bus)
+
+    handshake_cache = HandshakeCache(
+        organization=organization,
+        user=user,
+        ttl=config.handshake_cache_ttl,
+        max_size=config.handshake_cache_max_size,
+    )
 
     components = {
         "events": events,
@@ -71,6 +86,7 @@ async def components_factory(  # type: ignore[misc]
         "blockstore": blockstore,
         "pki": pki,
         "sequester": sequester,
+        "handshake_cache": handshake_cache,
     }
     for component in components.values():
         method = getattr(component, "register_components", None)
@@ -2,24 +2,45 @@
 from __future__ import annotations
 
 import importlib.resources
+import math
 import re
-from base64 import b64decode, b64encode
+import time
 from datetime import datetime
 from functools import wraps
-from typing import Awaitable, Callable, Coroutine, Iterable, List, Tuple
-from uuid import uuid4
+from typing import Any, Awaitable, Callable, Coroutine, Iterable, List, Optional, Sequence, Tuple
 
 import attr
 import trio
 import trio_typing
 import triopg
 from structlog import get_logger
-from triopg import PostgresError, UndefinedTableError, UniqueViolationError
+from triopg import InterfaceError, PostgresError, UndefinedTableError, UniqueViolationError
 from typing_extensions import ParamSpec
 
-from parsec._parsec import ActiveUsersLimit, BackendEvent, DateTime
+from parsec._parsec import ActiveUsersLimit, BackendEvent, DateTime, OrganizationID
+from parsec.backend.config import DEFAULT_DB_REPLICA_MAX_LAG
 from parsec.backend.events import EventsComponent
+from parsec.backend.metrics import (
+    DB_INTERNAL_IDS_CACHE,
+    DB_POOL_ACQUIRE_DURATION,
+    DB_POOL_CONNECTIONS,
+    DB_POOL_WAITING,
+    DB_QUERY_DURATION,
+    register_collector,
+)
 from parsec.backend.postgresql import migrations as migrations_module
+from parsec.backend.postgresql.internal_ids import InternalIdCache
+from parsec.backend.postgresql.replicas import ReplicaRouter
+from parsec.backend.postgresql.signals import (
+    NOTIFICATION_CHANNEL,
+    fetch_notification_frame,
+    load_notification_frame,
+    load_notification_payload,
+    parse_notification_reference,
+)
+from parsec.backend.postgresql.signals import send_signal as send_signal
+from parsec.backend.postgresql.statements import PreparedStatementsConnection, get_queries_stats
+from parsec.backend.tracing import span
 from parsec.event_bus import EventBus
 from parsec.utils import TaskStatus, start_task
 
@@ -200,18 +221,101 @@ async def handle_integer(conn: triopg._triopg.TrioConnectionProxy) -> None:
     )
 
 
+async def _init_connection(conn: triopg._triopg.TrioConnectionProxy) -> None:
+    # By default AsyncPG only work with Python standard `datetime.DateTime`
+    # for timestamp types, here we override this behavior to uses our own custom
+    # - DateTime type
+    # - Uuid type
+    await handle_datetime(conn)
+    await handle_uuid(conn)
+    await handle_integer(conn)
+    # Must be done last given prepared statements depend on the type codecs
+    await conn.prepare_registered_statements()
+
+
+class _MeasuredPoolAcquireContext:
+    def __init__(self, pool: MeasuredPool, acquire_context: Any):
+        self._pool = pool
+        self._acquire_context = acquire_context
+        self._conn: triopg._triopg.TrioConnectionProxy | None = None
+
+    async def __aenter__(self) -> triopg._triopg.TrioConnectionProxy:
+        self._pool.waiting += 1
+        started_at = time.perf_counter()
+        try:
+            with span("db.pool.acquire"):
+                self._conn = await self._acquire_context.__aenter__()
+                return self._conn
+        finally:
+            self._pool.waiting -= 1
+            DB_POOL_ACQUIRE_DURATION.observe(value=time.perf_counter() - started_at)
+
+    async def __aexit__(self, exc_type: Any, exc: Any, tb: Any) -> Any:
+        assert self._conn is not None
+        # The `PreparedStatementsConnection` behind the proxy
+        asyncpg_conn = self._conn._asyncpg_conn
+        try:
+            if asyncpg_conn.has_written:
+                asyncpg_conn.has_written = False
+                if self._pool.replicas is not None:
+                    await self._pool.replicas.record_write(self._conn, committed=exc_type is None)
+        finally:
+            result = await self._acquire_context.__aexit__(exc_type, exc, tb)
+        return result
+
+
+class MeasuredPool(triopg._triopg.TrioPoolProxy):  # type: ignore[misc]
+    """
+    Connection pool recording the time spent waiting for a connection, and the
+    writes for the read replicas (if any) to stay causally consistent.
+    """
+
+    waiting = 0
+    replicas: ReplicaRouter | None = None
+
+    def acquire(self) -> _MeasuredPoolAcquireContext:
+        return _MeasuredPoolAcquireContext(self, super().acquire())
+
+    def collect_metrics(self) -> None:
+        asyncpg_pool = self._asyncpg_pool
+        size = asyncpg_pool.get_size()
+        idle = asyncpg_pool.get_idle_size()
+        DB_POOL_CONNECTIONS.set("in_use", value=size - idle)
+        DB_POOL_CONNECTIONS.set("idle", value=idle)
+        DB_POOL_CONNECTIONS.set("max", value=asyncpg_pool.get_max_size())
+        DB_POOL_WAITING.set(value=self.waiting)
+
+
 # TODO: replace by a function
 class PGHandler:
-    def __init__(self, url: str, min_connections: int, max_connections: int, event_bus: EventBus):
+    def __init__(
+        self,
+        url: str,
+        min_connections: int,
+        max_connections: int,
+        event_bus: EventBus,
+        replica_urls: Sequence[str] = (),
+        replica_max_lag: float = DEFAULT_DB_REPLICA_MAX_LAG,
+    ):
         self.url = url
         self.min_connections = min_connections
         self.max_connections = max_connections
         self.event_bus = event_bus
-        self.pool: triopg._triopg.TrioPoolProxy
+        self.replicas = ReplicaRouter(replica_urls, replica_max_lag) if replica_urls else None
+        self.pool: MeasuredPool
         self.notification_conn: triopg._triopg.TrioConnectionProxy
         self._task_status: TaskStatus[None] | None = None
         self._connection_lost = False
         self._events_component: EventsComponent | None = None
+        self.internal_ids = InternalIdCache()
+        # Notifications whose events must be fetched from the database (see
+        # `parsec.backend.postgresql.signals`), and the ones received after them
+        # (so that events are dispatched in order)
+        self._deferred_notifications_count = 0
+        (
+            self._deferred_notifications_send,
+            self._deferred_notifications_receive,
+        ) = trio.open_memory_channel[Tuple[Optional[int], List[Tuple[str, BackendEvent]]]](math.inf)
 
     async def init(self, nursery: trio.Nursery, events_component: EventsComponent | None) -> None:
         self._task_status = await start_task(nursery, self._run_connections)
@@ -220,35 +324,65 @@ class PGHandler:
     async def _run_connections(
         self, task_status: trio_typing.TaskStatus[None] = trio.TASK_STATUS_IGNORED
     ) -> None:
-        # By default AsyncPG only work with Python standard `datetime.DateTime`
-        # for timestamp types, here we override this behavior to uses our own custom
-        # - DateTime type
-        # - Uuid type
-        async def _init_connection(conn: triopg._triopg.TrioConnectionProxy) -> None:
-            await handle_datetime(conn)
-            await handle_uuid(conn)
-            await handle_integer(conn)
-
-        async with triopg.create_pool(
-            self.url,
-            min_size=self.min_connections,
-            max_size=self.max_connections,
-            init=_init_connection,
-        ) as self.pool:
+        async with self._create_pool(self.url, self.min_connections) as self.pool:
+            self.pool.replicas = self.replicas
             # This connection is dedicated to the notifications listening, so it
             # would only complicate stuff to include it into the connection pool
             async with triopg.connect(self.url) as self.notification_conn:
                 self.notification_conn.add_termination_listener(
                     self._on_notification_conn_termination
                 )
-                await self.notification_conn.add_listener("app_notification", self._on_notification)
-                task_status.started()
+                await self.notification_conn.add_listener(
+                    NOTIFICATION_CHANNEL, self._on_notification
+                )
                 try:
-                    await trio.sleep_forever()
+                    with register_collector(self._collect_metrics):
+                        async with trio.open_nursery() as nursery:
+                            nursery.start_soon(self._process_deferred_notifications)
+                            if self.replicas is not None:
+                                # Replicas connect lazily, so that an unreachable one
+                                # doesn't prevent the server from starting
+                                await nursery.start(
+                                    self.replicas.run,
+                                    self.pool,
+                                    lambda url: self._create_pool(url, min_connections=0),
+                                )
+                            task_status.started()
+                            await trio.sleep_forever()
                 finally:
                     if self._connection_lost:
                         raise ConnectionError("PostgreSQL notification query has been lost")
 
+    def _create_pool(self, url: str, min_connections: int) -> MeasuredPool:
+        return MeasuredPool(
+            url,
+            min_size=min_connections,
+            max_size=self.max_connections,
+            init=_init_connection,
+            connection_class=PreparedStatementsConnection,
+        )
+
+    def read_pool(self, organization_id: OrganizationID | None) -> MeasuredPool:
+        """
+        Pool to run the read-only queries of the organization (`None` if they are not
+        tied to an organization): a read replica if one is consistent with the
+        organization's writes, the primary otherwise.
+        """
+        if self.replicas is not None:
+            pool = self.replicas.pick(organization_id)
+            if pool is not None:
+                return pool
+        return self.pool
+
+    def _collect_metrics(self) -> None:
+        self.pool.collect_metrics()
+        if self.replicas is not None:
+            self.replicas.collect_metrics()
+        for kind, value in self.internal_ids.stats().items():
+            DB_INTERNAL_IDS_CACHE.set(kind, value=value)
+        for name, stats in get_queries_stats().items():
+            DB_QUERY_DURATION.set_buckets(name, counts=stats.buckets, total=stats.total_duration)
+
     # Notification listening is achieve by a never-ending LISTEN
     # query to PostgreSQL.
     # If this query is terminated (most likely because the database has
@@ -265,27 +399,51 @@ class PGHandler:
         self, conn: triopg._triopg.TrioConnectionProxy, pid: int, channel: str, payload: str
     ) -> None:
         try:
-            event_id, raw_event = payload.split(":")
-            event = BackendEvent.load(b64decode(raw_event.encode("ascii")))
+            row_id = parse_notification_reference(payload)
+            events = load_notification_payload(payload) if row_id is None else []
         except ValueError as exc:
             logger.warning(
                 "Invalid notif received", pid=pid, channel=channel, payload=payload, exc_info=exc
             )
             return
 
-        if self._events_component:
-            self._events_component.add_event_to_cache(event_id, event)
-        self.event_bus.send(type(event), event_id=event_id, payload=event)
+        if row_id is None and not self._deferred_notifications_count:
+            self._dispatch_events(events)
+        else:
+            if row_id is not None and self.replicas is not None:
+                # The organizations of the events are only known once they are fetched
+                self.replicas.mark_written(None)
+            self._deferred_notifications_count += 1
+            self._deferred_notifications_send.send_nowait((row_id, events))
+
+    async def _process_deferred_notifications(self) -> None:
+        async for row_id, events in self._deferred_notifications_receive:
+            if row_id is not None:
+                try:
+                    async with self.pool.acquire() as conn:
+                        frame = await fetch_notification_frame(conn, row_id)
+                    events = load_notification_frame(frame)
+                except (OSError, PostgresError, InterfaceError) as exc:
+                    # Just like a notification missed by the listener, the events are lost
+                    # but the server must keep running
+                    logger.error("Cannot fetch notif payload", row_id=row_id, exc_info=exc)
+                except ValueError as exc:
+                    logger.warning("Invalid notif payload", row_id=row_id, exc_info=exc)
+            self._deferred_notifications_count -= 1
+            self._dispatch_events(events)
+
+    def _dispatch_events(self, events: List[Tuple[str, BackendEvent]]) -> None:
+        for event_id, event in events:
+            if self.replicas is not None:
+                # The event reveals a write (possibly from another server process), this
+                # must be known before the listeners get the event and read the changes
+                organization_id = getattr(event, "organization_id", None)
+                if organization_id is not None:
+                    self.replicas.mark_written(organization_id)
+            if self._events_component:
+                self._events_component.add_event_to_cache(event_id, event)
+            self.event_bus.send(type(event), event_id=event_id, payload=event)
 
     async def teardown(self) -> None:
         if self._task_status:
             await self._task_status.cancel_and_join()
-
-
-async def send_signal(conn: triopg._triopg.TrioConnectionProxy, event: BackendEvent) -> None:
-    # PostgreSQL's NOTIFY only accept string as payload, hence we must
-    # use base64 on our payload...
-    raw_event = b64encode(event.dump()).decode("ascii")
-    event_id = uuid4().hex
-    payload = f"{event_id}:{raw_event}"
-    await conn.execute("SELECT pg_notify($1, $2)", "app_notification", payload)
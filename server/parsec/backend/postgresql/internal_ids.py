@@ -0,0 +1,148 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Tuple
+
+import triopg
+
+from parsec._parsec import DeviceID, OrganizationID, UserID, VlobID
+from parsec.backend.postgresql.utils import Q
+
+DEFAULT_INTERNAL_ID_CACHE_MAX_SIZE = 100000
+
+
+_q_get_organization_internal_id = Q(
+    """
+SELECT _id FROM organization WHERE organization_id = $organization_id
+"""
+)
+
+
+_q_get_realm_internal_id = Q(
+    """
+SELECT _id FROM realm WHERE organization = $organization_internal_id AND realm_id = $realm_id
+"""
+)
+
+
+_q_get_user_internal_id = Q(
+    """
+SELECT _id FROM user_ WHERE organization = $organization_internal_id AND user_id = $user_id
+"""
+)
+
+
+_q_get_device_internal_id = Q(
+    """
+SELECT _id FROM device WHERE organization = $organization_internal_id AND device_id = $device_id
+"""
+)
+
+
+class InternalIdCache:
+    """
+    Per-process cache of the internal IDs (i.e. `_id` primary keys) of the
+    organizations, realms, users and devices.
+
+    Those never change once the row is created, so the queries on the hot paths
+    resolve them once through this cache and then take them as parameters, instead of
+    embedding a `(SELECT _id FROM ... WHERE ...)` sub-query for each of them.
+
+    Missing rows are not cached (they can be created at any time). Note an ID
+    must not be resolved within the transaction creating the row, otherwise a
+    rollback would leave a dangling ID in the cache.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_INTERNAL_ID_CACHE_MAX_SIZE):
+        self.max_size = max_size
+        self._ids: OrderedDict[Tuple[str, str, str], int] = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._ids), "hits": self._hits, "misses": self._misses}
+
+    def clear(self) -> None:
+        self._ids.clear()
+
+    async def _get(
+        self, key: Tuple[str, str, str], fetch: Callable[[], Awaitable[int | None]]
+    ) -> int | None:
+        internal_id = self._ids.get(key)
+        if internal_id is not None:
+            self._hits += 1
+            self._ids.move_to_end(key)
+            return internal_id
+
+        self._misses += 1
+        internal_id = await fetch()
+        if internal_id is not None and self.max_size > 0:
+            self._ids[key] = internal_id
+            if len(self._ids) > self.max_size:
+                self._ids.popitem(last=False)
+        return internal_id
+
+    async def organization(
+        self, conn: triopg._triopg.TrioConnectionProxy, organization_id: OrganizationID
+    ) -> int | None:
+        return await self._get(
+            ("organization", organization_id.str, ""),
+            lambda: conn.fetchval(
+                *_q_get_organization_internal_id(organization_id=organization_id.str)
+            ),
+        )
+
+    async def realm(
+        self,
+        conn: triopg._triopg.TrioConnectionProxy,
+        organization_id: OrganizationID,
+        realm_id: VlobID,
+    ) -> int | None:
+        async def _fetch() -> int | None:
+            organization_internal_id = await self.organization(conn, organization_id)
+            if organization_internal_id is None:
+                return None
+            return await conn.fetchval(
+                *_q_get_realm_internal_id(
+                    organization_internal_id=organization_internal_id, realm_id=realm_id
+                )
+            )
+
+        return await self._get(("realm", organization_id.str, realm_id.hex), _fetch)
+
+    async def user(
+        self,
+        conn: triopg._triopg.TrioConnectionProxy,
+        organization_id: OrganizationID,
+        user_id: UserID,
+    ) -> int | None:
+        async def _fetch() -> int | None:
+            organization_internal_id = await self.organization(conn, organization_id)
+            if organization_internal_id is None:
+                return None
+            return await conn.fetchval(
+                *_q_get_user_internal_id(
+                    organization_internal_id=organization_internal_id, user_id=user_id.str
+                )
+            )
+
+        return await self._get(("user", organization_id.str, user_id.str), _fetch)
+
+    async def device(
+        self,
+        conn: triopg._triopg.TrioConnectionProxy,
+        organization_id: OrganizationID,
+        device_id: DeviceID,
+    ) -> int | None:
+        async def _fetch() -> int | None:
+            organization_internal_id = await self.organization(conn, organization_id)
+            if organization_internal_id is None:
+                return None
+            return await conn.fetchval(
+                *_q_get_device_internal_id(
+                    organization_internal_id=organization_internal_id, device_id=device_id.str
+                )
+            )
+
+        return await self._get(("device", organization_id.str, device_id.str), _fetch)
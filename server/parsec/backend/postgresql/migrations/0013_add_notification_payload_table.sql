@@ -0,0 +1,10 @@
+-- Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+
+-------------------------------------------------------
+--  Migration
+-------------------------------------------------------
+CREATE TABLE notification_payload (
+    _id SERIAL PRIMARY KEY,
+    payload BYTEA NOT NULL,
+    created_on TIMESTAMPTZ NOT NULL
+);
@@ -0,0 +1,6 @@
+-- Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+
+-------------------------------------------------------
+--  Migration
+-------------------------------------------------------
+CREATE INDEX block_realm_idx ON block (realm, _id);
@@ -0,0 +1,15 @@
+-- Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+
+-------------------------------------------------------
+--  Migration
+-------------------------------------------------------
+
+-- Last index allocated in `realm_vlob_update` for the realm, incremented with
+-- an `UPDATE` so that concurrent vlob writes on the same realm wait on the row
+-- lock instead of computing the same `MAX(index) + 1` and conflicting.
+ALTER TABLE realm ADD last_vlob_update_index INTEGER NOT NULL DEFAULT 0;
+
+UPDATE realm SET last_vlob_update_index = COALESCE(
+    (SELECT MAX(index) FROM realm_vlob_update WHERE realm_vlob_update.realm = realm._id),
+    0
+);
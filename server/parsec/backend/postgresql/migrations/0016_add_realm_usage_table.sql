@@ -0,0 +1,80 @@
+-- Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+
+-------------------------------------------------------
+--  Migration
+-------------------------------------------------------
+
+-- Usage counters of the realms, updated in the same transaction as the vlob
+-- atoms, blocks and realms they count (see `parsec.backend.postgresql.usage`).
+-- Counters are bucketed by day of creation of the counted items, so that the
+-- stats at a given date only have to scan the items of a single day.
+CREATE TABLE realm_usage (
+    _id SERIAL PRIMARY KEY,
+    organization INTEGER REFERENCES organization (_id) NOT NULL,
+    realm INTEGER REFERENCES realm (_id) NOT NULL,
+    bucket TIMESTAMPTZ NOT NULL,
+    -- Vlob atoms referenced by the realm changes
+    vlobs_size BIGINT NOT NULL,
+    -- Vlob atoms created by reencryption maintenances
+    reencrypted_vlobs_size BIGINT NOT NULL,
+    blocks_size BIGINT NOT NULL,
+    -- 1 for the bucket the realm has been created in, 0 otherwise
+    realms_created INTEGER NOT NULL,
+
+    UNIQUE(realm, bucket)
+);
+
+CREATE INDEX realm_usage_organization_idx ON realm_usage (organization, bucket);
+
+-- Used to compute the stats of the last (partial) bucket
+CREATE INDEX vlob_atom_organization_created_on_idx ON vlob_atom (organization, created_on);
+CREATE INDEX block_organization_created_on_idx ON block (organization, created_on);
+
+-- Initialize the counters from the existing data
+INSERT INTO realm_usage (
+    organization,
+    realm,
+    bucket,
+    vlobs_size,
+    reencrypted_vlobs_size,
+    blocks_size,
+    realms_created
+)
+SELECT
+    organization,
+    realm,
+    date_trunc('day', created_on AT TIME ZONE 'UTC') AT TIME ZONE 'UTC',
+    SUM(vlobs_size),
+    SUM(reencrypted_vlobs_size),
+    SUM(blocks_size),
+    SUM(realms_created)
+FROM (
+    SELECT
+        vlob_atom.organization,
+        vlob_encryption_revision.realm,
+        vlob_atom.created_on,
+        CASE WHEN realm_vlob_update._id IS NULL THEN 0 ELSE vlob_atom.size END AS vlobs_size,
+        CASE WHEN realm_vlob_update._id IS NULL THEN vlob_atom.size ELSE 0 END AS reencrypted_vlobs_size,
+        0 AS blocks_size,
+        0 AS realms_created
+    FROM vlob_atom
+    INNER JOIN vlob_encryption_revision
+    ON vlob_atom.vlob_encryption_revision = vlob_encryption_revision._id
+    LEFT JOIN realm_vlob_update
+    ON realm_vlob_update.vlob_atom = vlob_atom._id
+
+    UNION ALL
+
+    SELECT organization, realm, created_on, 0, 0, size, 0
+    FROM block
+
+    UNION ALL
+
+    -- Realms have no creation date, use their first role certification instead
+    SELECT realm.organization, realm._id, MIN(realm_user_role.certified_on), 0, 0, 0, 1
+    FROM realm
+    INNER JOIN realm_user_role
+    ON realm_user_role.realm = realm._id
+    GROUP BY realm._id
+) AS usage
+GROUP BY organization, realm, date_trunc('day', created_on AT TIME ZONE 'UTC') AT TIME ZONE 'UTC';
@@ -0,0 +1,64 @@
+-- Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+
+-------------------------------------------------------
+--  Migration
+-------------------------------------------------------
+
+-- Append-only log of the certificates of the organization, in the order they
+-- must be provided to the clients (see `parsec.backend.postgresql.certificates`).
+-- `index` starts at 1, so the certificates after a given offset are the ones
+-- with an index greater than it.
+CREATE TABLE certificate (
+    _id SERIAL PRIMARY KEY,
+    organization INTEGER REFERENCES organization (_id) NOT NULL,
+    index INTEGER NOT NULL,
+    certificate BYTEA NOT NULL,
+    -- NULL if the certificate has no redacted version
+    redacted_certificate BYTEA,
+
+    UNIQUE(organization, index)
+);
+
+-- Last index allocated in `certificate` for this organization
+ALTER TABLE organization ADD last_certificate_index INTEGER NOT NULL DEFAULT 0;
+
+-- Certificates with the same timestamp are ordered by priority, the sequester
+-- authority first and then the users (that are created alongside their first device)
+INSERT INTO certificate (organization, index, certificate, redacted_certificate)
+SELECT
+    organization,
+    ROW_NUMBER() OVER (PARTITION BY organization ORDER BY timestamp, priority, kind, _id),
+    certificate,
+    redacted_certificate
+FROM (
+    SELECT
+        _id AS organization,
+        _bootstrapped_on AS timestamp,
+        0 AS priority,
+        0 AS kind,
+        _id,
+        sequester_authority_certificate AS certificate,
+        NULL::BYTEA AS redacted_certificate
+    FROM organization
+    WHERE sequester_authority_certificate IS NOT NULL
+    UNION ALL
+    SELECT organization, created_on, 2, 1, _id, service_certificate, NULL
+    FROM sequester_service
+    UNION ALL
+    SELECT organization, created_on, 1, 2, _id, user_certificate, redacted_user_certificate
+    FROM user_
+    UNION ALL
+    SELECT organization, revoked_on, 2, 3, _id, revoked_user_certificate, NULL
+    FROM user_
+    WHERE revoked_user_certificate IS NOT NULL
+    UNION ALL
+    SELECT organization, created_on, 2, 4, _id, device_certificate, redacted_device_certificate
+    FROM device
+    UNION ALL
+    SELECT realm.organization, certified_on, 2, 5, realm_user_role._id, certificate, NULL
+    FROM realm_user_role INNER JOIN realm ON realm._id = realm_user_role.realm
+) AS certificates;
+
+UPDATE organization SET last_certificate_index = (
+    SELECT COUNT(*) FROM certificate WHERE certificate.organization = organization._id
+);
@@ -0,0 +1,27 @@
+-- Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+
+-------------------------------------------------------
+--  Migration
+-------------------------------------------------------
+
+-- Small blocks can be packed together into segments when blocks' data are
+-- stored in database (see `parsec.backend.postgresql.block`)
+CREATE TABLE block_segment (
+    _id SERIAL PRIMARY KEY,
+    data BYTEA NOT NULL
+);
+
+-- Blocks are read by ranges within the segment, which is only efficient if the
+-- segment is stored out of line and not compressed (blocks are encrypted anyway)
+ALTER TABLE block_segment ALTER COLUMN data SET STORAGE EXTERNAL;
+
+-- Block data are now either stored in `data` or in a segment
+ALTER TABLE block_data ALTER COLUMN data DROP NOT NULL;
+ALTER TABLE block_data ADD segment INTEGER REFERENCES block_segment (_id);
+ALTER TABLE block_data ADD segment_offset INTEGER;
+ALTER TABLE block_data ADD size INTEGER;
+ALTER TABLE block_data ADD CONSTRAINT block_data_data_or_segment CHECK (
+    (data IS NULL) != (segment IS NULL)
+);
+
+CREATE INDEX block_data_segment_idx ON block_data (segment);
@@ -0,0 +1,15 @@
+-- Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+
+-------------------------------------------------------
+--  Migration
+-------------------------------------------------------
+
+-- Index of the last certificate of the organization when the vlob atom has been
+-- created, so that the client knows which certificates it needs to validate it.
+-- The index is unknown for the existing vlob atoms, the current one is the most
+-- conservative value.
+ALTER TABLE vlob_atom ADD certificate_index INTEGER;
+UPDATE vlob_atom SET certificate_index = organization.last_certificate_index
+FROM organization
+WHERE organization._id = vlob_atom.organization;
+ALTER TABLE vlob_atom ALTER COLUMN certificate_index SET NOT NULL;
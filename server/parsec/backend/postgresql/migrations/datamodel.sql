@@ -25,7 +25,25 @@ CREATE TABLE organization (
     _bootstrapped_on TIMESTAMPTZ,
     _created_on TIMESTAMPTZ NOT NULL,
     sequester_authority_certificate BYTEA, -- NULL for non-sequestered organization
-    sequester_authority_verify_key_der BYTEA -- NULL for non-sequestered organization
+    sequester_authority_verify_key_der BYTEA, -- NULL for non-sequestered organization
+    -- Last index allocated in `certificate` for this organization
+    last_certificate_index INTEGER NOT NULL DEFAULT 0
+);
+
+
+-- Append-only log of the certificates of the organization, in the order they
+-- must be provided to the clients (see `parsec.backend.postgresql.certificates`).
+-- `index` starts at 1, so the certificates after a given offset are the ones
+-- with an index greater than it.
+CREATE TABLE certificate (
+    _id SERIAL PRIMARY KEY,
+    organization INTEGER REFERENCES organization (_id) NOT NULL,
+    index INTEGER NOT NULL,
+    certificate BYTEA NOT NULL,
+    -- NULL if the certificate has no redacted version
+    redacted_certificate BYTEA,
+
+    UNIQUE(organization, index)
 );
 
 -------------------------------------------------------
@@ -235,6 +253,8 @@ CREATE TABLE realm (
     maintenance_started_by INTEGER REFERENCES device (_id),
     maintenance_started_on TIMESTAMPTZ,
     maintenance_type maintenance_type,
+    -- Last index allocated in `realm_vlob_update` for this realm
+    last_vlob_update_index INTEGER NOT NULL DEFAULT 0,
 
     UNIQUE(organization, realm_id)
 );
@@ -294,6 +314,8 @@ CREATE TABLE vlob_atom (
     created_on TIMESTAMPTZ NOT NULL,
     -- NULL if not deleted
     deleted_on TIMESTAMPTZ,
+    -- Index of the last certificate of the organization when created
+    certificate_index INTEGER NOT NULL,
 
     UNIQUE(vlob_encryption_revision, vlob_id, version)
 );
@@ -335,17 +357,83 @@ CREATE TABLE block (
     UNIQUE(organization, block_id)
 );
 
+-- Used to iterate over a realm's blocks (e.g. sequester export)
+CREATE INDEX block_realm_idx ON block (realm, _id);
+
 
 -- Only used if we store blocks' data in database
+-- Small blocks can be packed together into segments (see `parsec.backend.postgresql.block`)
+CREATE TABLE block_segment (
+    _id SERIAL PRIMARY KEY,
+    data BYTEA NOT NULL
+);
+
+-- Blocks are read by ranges within the segment, which is only efficient if the
+-- segment is stored out of line and not compressed (blocks are encrypted anyway)
+ALTER TABLE block_segment ALTER COLUMN data SET STORAGE EXTERNAL;
+
 CREATE TABLE block_data (
     _id SERIAL PRIMARY KEY,
     -- No reference with organization&block tables given this table
     -- should stay isolated
     organization_id VARCHAR NOT NULL,
     block_id UUID NOT NULL,
-    data BYTEA NOT NULL,
+    -- Block data are either stored here or in a segment
+    data BYTEA,
+    segment INTEGER REFERENCES block_segment (_id),
+    segment_offset INTEGER,
+    size INTEGER,
+
+    UNIQUE(organization_id, block_id),
+    CONSTRAINT block_data_data_or_segment CHECK ((data IS NULL) != (segment IS NULL))
+);
+
+CREATE INDEX block_data_segment_idx ON block_data (segment);
 
-    UNIQUE(organization_id, block_id)
+
+-------------------------------------------------------
+--  Usage
+-------------------------------------------------------
+
+
+-- Usage counters of the realms, updated in the same transaction as the vlob
+-- atoms, blocks and realms they count (see `parsec.backend.postgresql.usage`).
+-- Counters are bucketed by day of creation of the counted items, so that the
+-- stats at a given date only have to scan the items of a single day.
+CREATE TABLE realm_usage (
+    _id SERIAL PRIMARY KEY,
+    organization INTEGER REFERENCES organization (_id) NOT NULL,
+    realm INTEGER REFERENCES realm (_id) NOT NULL,
+    bucket TIMESTAMPTZ NOT NULL,
+    -- Vlob atoms referenced by the realm changes
+    vlobs_size BIGINT NOT NULL,
+    -- Vlob atoms created by reencryption maintenances
+    reencrypted_vlobs_size BIGINT NOT NULL,
+    blocks_size BIGINT NOT NULL,
+    -- 1 for the bucket the realm has been created in, 0 otherwise
+    realms_created INTEGER NOT NULL,
+
+    UNIQUE(realm, bucket)
+);
+
+CREATE INDEX realm_usage_organization_idx ON realm_usage (organization, bucket);
+
+-- Used to compute the stats of the last (partial) bucket
+CREATE INDEX vlob_atom_organization_created_on_idx ON vlob_atom (organization, created_on);
+CREATE INDEX block_organization_created_on_idx ON block (organization, created_on);
+
+
+-------------------------------------------------------
+--  Notification
+-------------------------------------------------------
+
+
+-- Backend events too big to fit in a NOTIFY payload
+-- (see `parsec.backend.postgresql.signals`)
+CREATE TABLE notification_payload (
+    _id SERIAL PRIMARY KEY,
+    payload BYTEA NOT NULL,
+    created_on TIMESTAMPTZ NOT NULL
 );
 
 
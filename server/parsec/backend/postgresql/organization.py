@@ -2,7 +2,7 @@
 from __future__ import annotations
 
 from functools import lru_cache
-from typing import Any, Union
+from typing import TYPE_CHECKING, Any, Union
 
 import triopg
 from triopg import UniqueViolationError
@@ -29,12 +29,17 @@ from parsec.backend.organization import (
     OrganizationNotFoundError,
     SequesterAuthority,
 )
+from parsec.backend.postgresql.certificates import add_certificate
 from parsec.backend.postgresql.handler import PGHandler, send_signal
+from parsec.backend.postgresql.usage import q_usage_bucket
 from parsec.backend.postgresql.user_queries.create import q_create_user
 from parsec.backend.postgresql.utils import Q, q_organization_internal_id
 from parsec.backend.user import Device, User, UserError
 from parsec.backend.utils import Unset, UnsetType
 
+if TYPE_CHECKING:
+    from parsec.backend.handshake_cache import HandshakeCache
+
 _q_insert_organization = Q(
     """
 INSERT INTO organization (
@@ -132,53 +137,100 @@ WHERE
 """
 )
 
+# Sizes and realm count come from the `realm_usage` counters of the buckets
+# before the one `at` is in, the items of this last (partial) bucket are
+# counted directly. Note vlob atoms and blocks are never deleted.
+#
 # Note the `profile::text` casting here, this is a limitation of asyncpg which doesn't support
 # enum within an anonymous record (see https://github.com/MagicStack/asyncpg/issues/360)
 _q_get_stats = Q(
     f"""
+WITH cte_organization AS (
+    SELECT _id, organization_id
+    FROM organization
+    WHERE
+        ($organization_id::VARCHAR IS NULL OR organization_id = $organization_id)
+        AND _created_on <= $at
+),
+cte_bucket AS (
+    SELECT { q_usage_bucket("$at") } AS bucket
+),
+cte_usage AS (
+    SELECT
+        organization,
+        SUM(vlobs_size + reencrypted_vlobs_size) AS metadata_size,
+        SUM(blocks_size) AS data_size,
+        SUM(realms_created) AS realms
+    FROM realm_usage
+    WHERE
+        organization IN (SELECT _id FROM cte_organization)
+        AND bucket < (SELECT bucket FROM cte_bucket)
+    GROUP BY organization
+),
+cte_last_bucket_metadata_size AS (
+    SELECT organization, SUM(size) AS metadata_size
+    FROM vlob_atom
+    WHERE
+        organization IN (SELECT _id FROM cte_organization)
+        AND created_on >= (SELECT bucket FROM cte_bucket)
+        AND created_on <= $at
+    GROUP BY organization
+),
+cte_last_bucket_data_size AS (
+    SELECT organization, SUM(size) AS data_size
+    FROM block
+    WHERE
+        organization IN (SELECT _id FROM cte_organization)
+        AND created_on >= (SELECT bucket FROM cte_bucket)
+        AND created_on <= $at
+    GROUP BY organization
+),
+cte_last_bucket_realms AS (
+    SELECT organization, COUNT(*) AS realms
+    FROM realm_usage
+    WHERE
+        organization IN (SELECT _id FROM cte_organization)
+        AND bucket = (SELECT bucket FROM cte_bucket)
+        AND realms_created > 0
+        AND (
+            SELECT MIN(certified_on)
+            FROM realm_user_role
+            WHERE realm_user_role.realm = realm_usage.realm
+        ) <= $at
+    GROUP BY organization
+),
+cte_users AS (
+    SELECT organization, ARRAY_AGG((revoked_on, profile::text)) AS users
+    FROM user_
+    WHERE
+        organization IN (SELECT _id FROM cte_organization)
+        AND created_on <= $at
+    GROUP BY organization
+)
 SELECT
+    cte_organization.organization_id,
+    cte_users.users,
     (
-        SELECT COALESCE(_created_on <= $at, false)
-        FROM organization
-        WHERE organization_id = $organization_id
-    ) exist,
-    (
-        SELECT ARRAY(
-            SELECT (revoked_on, profile::text)
-            FROM user_
-            WHERE organization = { q_organization_internal_id("$organization_id") }
-            AND created_on <= $at
-        )
-    ) users,
-    (
-        SELECT COUNT(DISTINCT(realm._id))
-        FROM realm
-        LEFT JOIN realm_user_role
-        ON realm_user_role.realm = realm._id
-        WHERE realm.organization = { q_organization_internal_id("$organization_id") }
-        AND realm_user_role.certified_on <= $at
-    ) realms,
+        COALESCE(cte_usage.realms, 0) + COALESCE(cte_last_bucket_realms.realms, 0)
+    )::BIGINT AS realms,
     (
-        SELECT COALESCE(SUM(size), 0)
-        FROM vlob_atom
-        WHERE
-            organization = { q_organization_internal_id("$organization_id") }
-            AND created_on <= $at
-            AND (deleted_on IS NULL OR deleted_on > $at)
-    ) metadata_size,
+        COALESCE(cte_usage.metadata_size, 0)
+        + COALESCE(cte_last_bucket_metadata_size.metadata_size, 0)
+    )::BIGINT AS metadata_size,
     (
-        SELECT COALESCE(SUM(size), 0)
-        FROM block
-        WHERE
-            organization = { q_organization_internal_id("$organization_id") }
-            AND created_on <= $at
-            AND (deleted_on IS NULL OR deleted_on > $at)
-    ) data_size
+        COALESCE(cte_usage.data_size, 0) + COALESCE(cte_last_bucket_data_size.data_size, 0)
+    )::BIGINT AS data_size
+FROM cte_organization
+LEFT JOIN cte_usage ON cte_usage.organization = cte_organization._id
+LEFT JOIN cte_last_bucket_metadata_size
+ON cte_last_bucket_metadata_size.organization = cte_organization._id
+LEFT JOIN cte_last_bucket_data_size ON cte_last_bucket_data_size.organization = cte_organization._id
+LEFT JOIN cte_last_bucket_realms ON cte_last_bucket_realms.organization = cte_organization._id
+LEFT JOIN cte_users ON cte_users.organization = cte_organization._id
+ORDER BY cte_organization.organization_id
 """
 )
 
-_q_get_organizations = Q("SELECT organization_id AS id from organization ORDER BY id")
-
 # There's no `created_on` or similar field for realm. So we get an estimation by
 # taking the oldest certification in the `realm_user_role`
 _q_get_average_realm_creation_date = Q(
@@ -216,46 +268,55 @@ def _q_update_factory(
     )
 
 
-async def _organization_stats(
+async def _organizations_stats(
     conn: triopg._triopg.TrioConnectionProxy,
-    id: OrganizationID,
     at: DateTime,
-) -> OrganizationStats | None:
-    result = await conn.fetchrow(*_q_get_stats(organization_id=id.str, at=at))
-    if not result["exist"]:
-        return None
-
-    users = 0
-    active_users = 0
-    users_per_profile_detail = {p: {"active": 0, "revoked": 0} for p in UserProfile.VALUES}
-    for u in result["users"]:
-        is_revoked, profile = u
-        users += 1
-        if is_revoked:
-            users_per_profile_detail[UserProfile.from_str(profile)]["revoked"] += 1
-        else:
-            active_users += 1
-            users_per_profile_detail[UserProfile.from_str(profile)]["active"] += 1
-
-    users_per_profile_detail = tuple(
-        UsersPerProfileDetailItem(profile=profile, **data)
-        for profile, data in users_per_profile_detail.items()
+    id: OrganizationID | None = None,
+) -> dict[OrganizationID, OrganizationStats]:
+    """
+    Stats of the organization `id` (or of all the organizations if `None`) that existed at `at`
+    """
+    rows = await conn.fetch(
+        *_q_get_stats(organization_id=id.str if id is not None else None, at=at)
     )
 
-    return OrganizationStats(
-        data_size=result["data_size"],
-        metadata_size=result["metadata_size"],
-        realms=result["realms"],
-        users=users,
-        active_users=active_users,
-        users_per_profile_detail=users_per_profile_detail,
-    )
+    results = {}
+    for result in rows:
+        users = 0
+        active_users = 0
+        users_per_profile_detail = {p: {"active": 0, "revoked": 0} for p in UserProfile.VALUES}
+        for u in result["users"] or ():
+            is_revoked, profile = u
+            users += 1
+            if is_revoked:
+                users_per_profile_detail[UserProfile.from_str(profile)]["revoked"] += 1
+            else:
+                active_users += 1
+                users_per_profile_detail[UserProfile.from_str(profile)]["active"] += 1
+
+        results[OrganizationID(result["organization_id"])] = OrganizationStats(
+            data_size=result["data_size"],
+            metadata_size=result["metadata_size"],
+            realms=result["realms"],
+            users=users,
+            active_users=active_users,
+            users_per_profile_detail=tuple(
+                UsersPerProfileDetailItem(profile=profile, **data)
+                for profile, data in users_per_profile_detail.items()
+            ),
+        )
+
+    return results
 
 
 class PGOrganizationComponent(BaseOrganizationComponent):
     def __init__(self, dbh: PGHandler, *args: Any, **kwargs: Any) -> None:
         super().__init__(*args, **kwargs)
         self.dbh = dbh
+        self._handshake_cache: HandshakeCache | None = None
+
+    def register_components(self, handshake_cache: HandshakeCache, **other_components: Any) -> None:
+        self._handshake_cache = handshake_cache
 
     async def create(
         self,
@@ -361,6 +422,11 @@ class PGOrganizationComponent(BaseOrganizationComponent):
             if organization.bootstrap_token != bootstrap_token:
                 raise OrganizationInvalidBootstrapTokenError()
 
+            # Sequester authority certificate comes first in the certificates log,
+            # given it is needed to validate the rest of the organization
+            if sequester_authority:
+                await add_certificate(conn, id, sequester_authority.certificate)
+
             try:
                 await q_create_user(conn, id, user, first_device)
             except UserError as exc:
@@ -390,26 +456,18 @@ class PGOrganizationComponent(BaseOrganizationComponent):
         at: DateTime | None = None,
     ) -> OrganizationStats:
         at = at or DateTime.now()
-        async with self.dbh.pool.acquire() as conn:
-            stats = await _organization_stats(conn, id, at)
-            if not stats:
+        async with self.dbh.read_pool(id).acquire() as conn:
+            stats = await _organizations_stats(conn, at, id)
+            if id not in stats:
                 raise OrganizationNotFoundError()
-            return stats
+            return stats[id]
 
     async def server_stats(
         self, at: DateTime | None = None
     ) -> dict[OrganizationID, OrganizationStats]:
         at = at or DateTime.now()
-        results = {}
-
-        async with self.dbh.pool.acquire() as conn, conn.transaction():
-            for org in await conn.fetch(*_q_get_organizations()):
-                org_id = OrganizationID(org["id"])
-                org_stats = await _organization_stats(conn, org_id, at)
-                if org_stats:
-                    results[org_id] = org_stats
-
-        return results
+        async with self.dbh.read_pool(None).acquire() as conn:
+            return await _organizations_stats(conn, at)
 
     async def update(
         self,
@@ -464,3 +522,7 @@ class PGOrganizationComponent(BaseOrganizationComponent):
 
             if with_is_expired and is_expired:
                 await send_signal(conn, BackendEventOrganizationExpired(organization_id=id))
+
+        # Don't wait for the expiration event to be notified back by PostgreSQL
+        assert self._handshake_cache is not None
+        self._handshake_cache.invalidate_organization(id)
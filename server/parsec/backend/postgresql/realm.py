@@ -33,13 +33,13 @@ class PGRealmComponent(BaseRealmComponent):
     async def get_status(
         self, organization_id: OrganizationID, author: DeviceID, realm_id: VlobID
     ) -> RealmStatus:
-        async with self.dbh.pool.acquire() as conn:
+        async with self.dbh.read_pool(organization_id).acquire() as conn:
             return await query_get_status(conn, organization_id, author, realm_id)
 
     async def get_stats(
         self, organization_id: OrganizationID, author: DeviceID, realm_id: VlobID
     ) -> RealmStats:
-        async with self.dbh.pool.acquire() as conn:
+        async with self.dbh.read_pool(organization_id).acquire() as conn:
             return await query_get_stats(conn, organization_id, author, realm_id)
 
     async def get_current_roles(
@@ -4,7 +4,9 @@ from __future__ import annotations
 import triopg
 
 from parsec._parsec import BackendEventRealmRolesUpdated, OrganizationID, RealmRole
+from parsec.backend.postgresql.certificates import add_certificate
 from parsec.backend.postgresql.handler import send_signal
+from parsec.backend.postgresql.usage import add_realm_usage
 from parsec.backend.postgresql.utils import (
     Q,
     q_device_internal_id,
@@ -25,7 +27,7 @@ INSERT INTO realm (
     $realm_id,
     1
 ON CONFLICT (organization, realm_id) DO NOTHING
-RETURNING _id
+RETURNING _id, organization
 """
 )
 
@@ -74,11 +76,12 @@ async def query_create(
     assert self_granted_role.granted_by.user_id == self_granted_role.user_id
     assert self_granted_role.role == RealmRole.OWNER
 
-    realm_internal_id = await conn.fetchval(
+    row = await conn.fetchrow(
         *_q_insert_realm(organization_id=organization_id.str, realm_id=self_granted_role.realm_id)
     )
-    if not realm_internal_id:
+    if not row:
         raise RealmAlreadyExistsError()
+    realm_internal_id = row["_id"]
 
     await conn.execute(
         *_q_insert_realm_role(
@@ -93,6 +96,16 @@ async def query_create(
 
     await conn.execute(*_q_insert_realm_encryption_revision(_id=realm_internal_id))
 
+    await add_certificate(conn, organization_id, self_granted_role.certificate)
+
+    await add_realm_usage(
+        conn,
+        row["organization"],
+        realm_internal_id,
+        self_granted_role.granted_on,
+        realms_created=1,
+    )
+
     await send_signal(
         conn,
         BackendEventRealmRolesUpdated(
@@ -58,27 +58,17 @@ _q_has_realm_access = Q(
 """
 )
 
-_q_get_blocks_size_from_realm = Q(
+_q_get_realm_usage = Q(
     f"""
-    SELECT SUM(size)
-    FROM block
+    SELECT
+        COALESCE(SUM(blocks_size), 0)::BIGINT AS blocks_size,
+        COALESCE(SUM(vlobs_size), 0)::BIGINT AS vlobs_size
+    FROM realm_usage
     WHERE
         realm = { q_realm_internal_id(organization_id="$organization_id", realm_id="$realm_id") }
 """
 )
 
-_q_get_vlob_size_from_realm = Q(
-    f"""
-    SELECT SUM(size)
-    FROM
-        vlob_atom
-    INNER JOIN
-        realm_vlob_update ON vlob_atom._id = realm_vlob_update.vlob_atom
-    WHERE
-        realm_vlob_update.realm = { q_realm_internal_id(organization_id="$organization_id", realm_id="$realm_id") }
-"""
-)
-
 _q_get_current_roles = Q(
     f"""
 SELECT DISTINCT ON(user_) { q_user(_id="realm_user_role.user_", select="user_id") }, role
@@ -127,7 +117,7 @@ WHERE
 )
 
 
-@query()
+@query(read_only=True)
 async def query_get_status(
     conn: triopg._triopg.TrioConnectionProxy,
     organization_id: OrganizationID,
@@ -157,7 +147,7 @@ async def query_get_status(
     )
 
 
-@query(in_transaction=True)
+@query(in_transaction=True, read_only=True)
 async def query_get_stats(
     conn: triopg._triopg.TrioConnectionProxy,
     organization_id: OrganizationID,
@@ -174,17 +164,11 @@ async def query_get_stats(
 
     if not ret["has_access"]:
         raise RealmAccessError()
-    blocks_size_rep = await conn.fetchrow(
-        *_q_get_blocks_size_from_realm(organization_id=organization_id.str, realm_id=realm_id)
+    usage = await conn.fetchrow(
+        *_q_get_realm_usage(organization_id=organization_id.str, realm_id=realm_id)
     )
-    vlobs_size_rep = await conn.fetchrow(
-        *_q_get_vlob_size_from_realm(organization_id=organization_id.str, realm_id=realm_id)
-    )
-
-    blocks_size = blocks_size_rep["sum"] or 0
-    vlobs_size = vlobs_size_rep["sum"] or 0
 
-    return RealmStats(blocks_size=blocks_size, vlobs_size=vlobs_size)
+    return RealmStats(blocks_size=usage["blocks_size"], vlobs_size=usage["vlobs_size"])
 
 
 @query()
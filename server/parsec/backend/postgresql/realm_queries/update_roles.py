@@ -6,6 +6,7 @@ from typing import Tuple
 import triopg
 
 from parsec._parsec import BackendEventRealmRolesUpdated, OrganizationID, RealmRole, UserProfile
+from parsec.backend.postgresql.certificates import add_certificate
 from parsec.backend.postgresql.handler import send_signal
 from parsec.backend.postgresql.message import send_message
 from parsec.backend.postgresql.utils import (
@@ -237,6 +238,8 @@ async def query_update_roles(
         )
     )
 
+    await add_certificate(conn, organization_id, new_role.certificate)
+
     await conn.execute(
         *_q_set_last_role_change(
             organization_id=organization_id.str,
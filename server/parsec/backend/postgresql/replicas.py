@@ -0,0 +1,265 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+from __future__ import annotations
+
+import math
+from collections import deque
+from contextlib import AsyncExitStack
+from typing import TYPE_CHECKING, Callable, Deque, Dict, Sequence, Tuple
+from urllib.parse import urlsplit
+
+import attr
+import trio
+import trio_typing
+import triopg
+from structlog import get_logger
+from triopg import InterfaceError, PostgresError
+
+from parsec._parsec import OrganizationID
+from parsec.backend.config import DEFAULT_DB_REPLICA_MAX_LAG
+from parsec.backend.metrics import DB_READS, DB_REPLICA_HEALTHY, DB_REPLICA_LAG
+from parsec.backend.utils import current_consistency_fence, current_organization_id
+
+if TYPE_CHECKING:
+    from parsec.backend.postgresql.handler import MeasuredPool
+
+logger = get_logger()
+
+# The read-only commands can be served by PostgreSQL streaming replicas (see
+# `PGHandler.read_pool`). Replicas lag behind the primary, so the reads must stay
+# causally consistent: once an organization has written something, its reads are
+# only served by the replicas that have replayed this write. This is tracked per
+# organization with a WAL position (LSN) fence:
+# - a command writing through the primary sets the fence to the primary's LSN
+#   fetched right after the commit (i.e. before the client gets the reply)
+# - a notification for the organization (i.e. a write from another server process)
+#   routes its reads to the primary until the next health check, which sets the
+#   fence to the primary's LSN at that time. A notification whose events are in the
+#   side table doesn't tell its organization before they are fetched, so it does
+#   that for all the organizations.
+#
+# The notifications are received asynchronously, so a client whose next request
+# reaches another server process (e.g. another worker) could read from a replica
+# that hasn't replayed its write yet. Hence the client also gets the LSN fence of
+# its writes (see `current_consistency_fence`) and sends it back with its next
+# requests, whichever server process they reach.
+#
+# The health check periodically fetches the primary's LSN and each replica's replayed
+# LSN, the lag of a replica being the age of the oldest primary LSN it hasn't replayed
+# yet. A replica lagging more than `max_lag` (or unreachable) is not used.
+
+REPLICA_HEALTH_CHECK_INTERVAL = 0.5
+
+# Insert position rather than write position, so that it is past the commit record
+# even with `synchronous_commit = off`
+_q_get_primary_lsn = "SELECT pg_wal_lsn_diff(pg_current_wal_insert_lsn(), '0/0')::bigint"
+# A server not in recovery is a primary (e.g. a replica that has been promoted)
+_q_get_replayed_lsn = """
+SELECT pg_wal_lsn_diff(
+    CASE
+        WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn()
+        ELSE pg_current_wal_insert_lsn()
+    END,
+    '0/0'
+)::bigint
+"""
+
+
+def _replica_name(url: str) -> str:
+    # Credentials must not end up in the logs and metrics
+    parsed = urlsplit(url)
+    return f"{parsed.hostname or 'localhost'}:{parsed.port or 5432}"
+
+
+@attr.s(slots=True, auto_attribs=True, eq=False)
+class Replica:
+    url: str
+    name: str
+    pool: MeasuredPool | None = None
+    replayed_lsn: int = 0
+    lag: float = math.inf
+    healthy: bool = False
+
+
+class ReplicaRouter:
+    """
+    Route the reads of an organization to the healthy replicas that are causally
+    consistent with its writes, the primary being used otherwise.
+    """
+
+    def __init__(
+        self,
+        urls: Sequence[str],
+        max_lag: float = DEFAULT_DB_REPLICA_MAX_LAG,
+        health_check_interval: float = REPLICA_HEALTH_CHECK_INTERVAL,
+    ):
+        self.replicas = [Replica(url=url, name=_replica_name(url)) for url in urls]
+        self.max_lag = max_lag
+        self.health_check_interval = health_check_interval
+        # Minimal LSN a replica must have replayed to serve the organization
+        self._fences: Dict[OrganizationID, int] = {}
+        # Organizations with a write whose LSN is unknown, and the time of the last one
+        self._pending: Dict[OrganizationID, float] = {}
+        # Same as above, for writes whose organization is unknown (i.e. any organization)
+        self._global_fence = 0
+        self._global_pending: float | None = None
+        # (time, LSN) samples of the primary, oldest first
+        self._primary_lsns: Deque[Tuple[float, int]] = deque()
+        self._round_robin = 0
+
+    def mark_written(self, organization_id: OrganizationID | None) -> None:
+        """
+        Route the reads of the organization (of all of them if `None`) to the primary
+        until the LSN of its last write is known.
+        """
+        if organization_id is None:
+            self._global_pending = trio.current_time()
+        else:
+            self._pending[organization_id] = trio.current_time()
+
+    def set_fence(self, organization_id: OrganizationID, lsn: int) -> None:
+        if lsn > self._fences.get(organization_id, 0):
+            self._fences[organization_id] = lsn
+
+    async def record_write(self, conn: triopg._triopg.TrioConnectionProxy, committed: bool) -> None:
+        """
+        Called once the primary connection `conn` is done with a transaction that has
+        (or may have) modified data.
+        """
+        organization_id = current_organization_id.get()
+        if organization_id is None:
+            # Not run by a command, only the notifications can tell what has been written
+            return
+        if not committed:
+            self.mark_written(organization_id)
+            return
+        lsn = None
+        try:
+            lsn = await conn.fetchval(_q_get_primary_lsn)
+        except (OSError, PostgresError, InterfaceError) as exc:
+            # The write is committed, so the command must not fail because of this
+            logger.warning("Cannot fetch PostgreSQL primary LSN", exc_info=exc)
+        finally:
+            if lsn is None:
+                self.mark_written(organization_id)
+            else:
+                self.set_fence(organization_id, lsn)
+                consistency_fence = current_consistency_fence.get()
+                if consistency_fence is not None:
+                    consistency_fence.update(lsn)
+
+    def pick(self, organization_id: OrganizationID | None) -> MeasuredPool | None:
+        """
+        Returns the pool of a replica that can serve the reads of the organization
+        (any replica if `None`), or `None` if the primary must be used.
+        """
+        if self._global_pending is not None or organization_id in self._pending:
+            DB_READS.inc("primary")
+            return None
+        fence = self._global_fence
+        if organization_id is not None:
+            fence = max(fence, self._fences.get(organization_id, 0))
+        consistency_fence = current_consistency_fence.get()
+        if consistency_fence is not None:
+            fence = max(fence, consistency_fence.lsn)
+        candidates = [r for r in self.replicas if r.healthy and r.replayed_lsn >= fence]
+        if not candidates:
+            DB_READS.inc("primary")
+            return None
+        self._round_robin += 1
+        DB_READS.inc("replica")
+        return candidates[self._round_robin % len(candidates)].pool
+
+    def collect_metrics(self) -> None:
+        for replica in self.replicas:
+            DB_REPLICA_LAG.set(replica.name, value=replica.lag)
+            DB_REPLICA_HEALTHY.set(replica.name, value=int(replica.healthy))
+
+    def _lag(self, replayed_lsn: int, now: float) -> float:
+        for sampled_at, lsn in self._primary_lsns:
+            if lsn > replayed_lsn:
+                return now - sampled_at
+        return 0.0
+
+    def _update_primary_lsn(self, sampled_at: float, lsn: int) -> None:
+        # The LSN has been fetched after `sampled_at`, hence it covers the writes
+        # of the organizations marked up to this time
+        for organization_id, written_at in list(self._pending.items()):
+            self.set_fence(organization_id, lsn)
+            if written_at <= sampled_at:
+                del self._pending[organization_id]
+        if self._global_pending is not None:
+            self._global_fence = max(self._global_fence, lsn)
+            if self._global_pending <= sampled_at:
+                self._global_pending = None
+
+        self._primary_lsns.append((sampled_at, lsn))
+        # Older samples are only needed to tell how much a replica lags past `max_lag`
+        while len(self._primary_lsns) > 1 and self._primary_lsns[1][0] < sampled_at - self.max_lag:
+            self._primary_lsns.popleft()
+
+    def _set_health(self, replica: Replica, healthy: bool, lag: float) -> None:
+        replica.lag = lag
+        if healthy != replica.healthy:
+            if healthy:
+                logger.info("PostgreSQL replica is used for reads", replica=replica.name, lag=lag)
+            else:
+                logger.warning(
+                    "PostgreSQL replica is no longer used for reads", replica=replica.name, lag=lag
+                )
+        replica.healthy = healthy
+
+    async def _check_replica(self, replica: Replica) -> None:
+        assert replica.pool is not None
+        replayed_lsn = None
+        with trio.move_on_after(self.max_lag):
+            try:
+                async with replica.pool.acquire() as conn:
+                    replayed_lsn = await conn.fetchval(_q_get_replayed_lsn)
+            except (OSError, PostgresError, InterfaceError) as exc:
+                logger.debug("Cannot reach PostgreSQL replica", replica=replica.name, exc_info=exc)
+
+        if replayed_lsn is None:
+            self._set_health(replica, healthy=False, lag=math.inf)
+            return
+        replica.replayed_lsn = max(replica.replayed_lsn, replayed_lsn)
+        lag = self._lag(replica.replayed_lsn, trio.current_time())
+        self._set_health(replica, healthy=lag <= self.max_lag, lag=lag)
+
+    async def check_health(self, primary_pool: MeasuredPool) -> None:
+        sampled_at = trio.current_time()
+        try:
+            async with primary_pool.acquire() as conn:
+                primary_lsn = await conn.fetchval(_q_get_primary_lsn)
+        except (OSError, PostgresError, InterfaceError) as exc:
+            # Pending organizations keep using the primary
+            logger.warning("Cannot fetch PostgreSQL primary LSN", exc_info=exc)
+            return
+        self._update_primary_lsn(sampled_at, primary_lsn)
+
+        async with trio.open_nursery() as nursery:
+            for replica in self.replicas:
+                nursery.start_soon(self._check_replica, replica)
+
+        # Fences passed by all the replicas (including the unhealthy ones, which
+        # can become healthy again) are no longer needed
+        replayed_by_all = min(replica.replayed_lsn for replica in self.replicas)
+        for organization_id, fence in list(self._fences.items()):
+            if fence <= replayed_by_all:
+                del self._fences[organization_id]
+        if self._global_fence <= replayed_by_all:
+            self._global_fence = 0
+
+    async def run(
+        self,
+        primary_pool: MeasuredPool,
+        pool_factory: Callable[[str], MeasuredPool],
+        task_status: trio_typing.TaskStatus[None] = trio.TASK_STATUS_IGNORED,
+    ) -> None:
+        async with AsyncExitStack() as stack:
+            for replica in self.replicas:
+                replica.pool = await stack.enter_async_context(pool_factory(replica.url))
+            await self.check_health(primary_pool)
+            task_status.started()
+            while True:
+                await trio.sleep(self.health_check_interval)
+                await self.check_health(primary_pool)
@@ -16,6 +16,7 @@ from parsec._parsec import (
 )
 from parsec.api.data import DataError, SequesterServiceCertificate
 from parsec.backend.organization import SequesterAuthority
+from parsec.backend.postgresql.certificates import add_certificate
 from parsec.backend.postgresql.handler import PGHandler
 from parsec.backend.postgresql.utils import Q, q_organization_internal_id, q_realm_internal_id
 from parsec.backend.sequester import (
@@ -280,6 +281,8 @@ class PGPSequesterComponent(BaseSequesterComponent):
             if result != "INSERT 0 1":
                 raise SequesterError(f"Insertion Error: {result}")
 
+            await add_certificate(conn, organization_id, service.service_certificate)
+
     async def _assert_service_enabled(
         self, conn: triopg._triopg.TrioConnectionProxy, organization_id: OrganizationID
     ) -> None:
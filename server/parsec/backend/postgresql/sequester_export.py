@@ -2,16 +2,19 @@
 from __future__ import annotations
 
 import sqlite3
+import time
 from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import AsyncGenerator, NewType, Tuple, cast
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, List, NewType, Tuple, TypeVar, cast
 
+import attr
 import trio
 import triopg
 
-from parsec._parsec import BlockID, OrganizationID, SequesterServiceID, VlobID
+from parsec._parsec import BlockID, DateTime, OrganizationID, SequesterServiceID, VlobID
 from parsec.backend.blockstore import BaseBlockStoreComponent
 from parsec.backend.postgresql import PGHandler
+from parsec.utils import BALLPARK_CLIENT_LATE_OFFSET
 
 
 class RealmExporterError(Exception):
@@ -28,6 +31,22 @@ class RealmExporterOutputDbError(RealmExporterError):
 
 BatchOffsetMarker = NewType("BatchOffsetMarker", int)
 
+T = TypeVar("T")
+
+# Number of blocks fetched in parallel from the blockstore (which is typically
+# a remote object storage with high latency but good parallel throughput)
+DEFAULT_BLOCK_FETCH_CONCURRENCY = 16
+# Exported items are written in the output database by chunks of this size...
+OUTPUT_DB_WRITE_CHUNK_SIZE = 8 * 1024 * 1024
+# ...and the transaction is only committed once this much data have been written
+# (or when the export stops), so that we don't pay a fsync for each batch
+OUTPUT_DB_COMMIT_THRESHOLD = 128 * 1024 * 1024
+# Number of rows retrieved per round-trip when streaming from a server-side cursor,
+# kept small given vlob rows can contain multi-megabyte blobs
+EXPORT_CURSOR_FETCH_SIZE = 16
+# Default amount of data (in bytes) exported per batch by the CLI
+DEFAULT_EXPORT_BATCH_MAX_SIZE = 64 * 1024 * 1024
+
 
 OUTPUT_DB_MAGIC_NUMBER = 87947
 OUTPUT_DB_VERSION = 1
@@ -106,7 +125,169 @@ CREATE TABLE device (
     _id PRIMARY KEY,
     device_certificate BLOB NOT NULL
 );
+
+
+-- Differential export
+
+
+-- Single row containing the markers of the export this one is based on (all zero
+-- for a full export) and the markers taken when this export started: the export
+-- contains the items following the former, up to the latter.
+-- Markers are the last `_id` of each table, along with a timestamp (us since UNIX
+-- epoch) for the users revoked since the previous export.
+CREATE TABLE IF NOT EXISTS export_range(
+    vlob_atom_after INTEGER NOT NULL,
+    block_after INTEGER NOT NULL,
+    user_after INTEGER NOT NULL,
+    device_after INTEGER NOT NULL,
+    realm_role_after INTEGER NOT NULL,
+    revoked_user_after INTEGER NOT NULL,
+    vlob_atom_until INTEGER NOT NULL,
+    block_until INTEGER NOT NULL,
+    user_until INTEGER NOT NULL,
+    device_until INTEGER NOT NULL,
+    realm_role_until INTEGER NOT NULL,
+    revoked_user_until INTEGER NOT NULL
+);
+"""
+
+
+# Tables in the order of their markers in the `export_range` table (the last marker
+# being the user revocations timestamp)
+EXPORT_RANGE_TABLES = ("vlob_atom", "block", "user_", "device", "realm_role")
+
+ExportRange = Tuple[int, int, int, int, int, int]
+
+
+def _get_export_range(con: sqlite3.Connection) -> Tuple[ExportRange, ExportRange] | None:
+    """
+    Return the markers the export is based on and the markers it goes up to (None
+    for databases created before differential exports).
+    """
+    try:
+        row = con.execute(
+            """
+SELECT
+    vlob_atom_after, block_after, user_after, device_after, realm_role_after, revoked_user_after,
+    vlob_atom_until, block_until, user_until, device_until, realm_role_until, revoked_user_until
+FROM export_range
 """
+        ).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    if not row:
+        return None
+    return row[:6], row[6:]
+
+
+@attr.s(slots=True, frozen=True, auto_attribs=True)
+class ExportManifest:
+    """
+    Markers describing what an export (full or differential) contains up to, i.e. the
+    realm it is about, the last `_id` of each of its tables and the timestamp the user
+    revocations are exported up to (us since UNIX epoch).
+
+    The markers are taken when the export starts (see `_get_export_markers`) and
+    are the starting point of a differential export: only the items with an `_id`
+    greater than the corresponding marker are exported, along with the users
+    revoked after `revoked_user`.
+    """
+
+    realm_id: VlobID
+    root_verify_key: bytes
+    vlob_atom: int = 0
+    block: int = 0
+    user_: int = 0
+    device: int = 0
+    realm_role: int = 0
+    revoked_user: int = 0
+
+    @classmethod
+    def load(cls, export_db_path: Path) -> ExportManifest:
+        try:
+            con = sqlite3.connect(f"file:{export_db_path}?mode=ro", uri=True)
+        except sqlite3.Error as exc:
+            raise RealmExporterInputError(f"Cannot open previous export database: {exc}") from exc
+        try:
+            row = con.execute(
+                "SELECT version, realm_id, root_verify_key FROM info WHERE magic = ?",
+                (OUTPUT_DB_MAGIC_NUMBER,),
+            ).fetchone()
+            if not row or row[0] != OUTPUT_DB_VERSION:
+                raise RealmExporterInputError(
+                    f"Previous export `{export_db_path}` is not a valid export database"
+                )
+            _, realm_id, root_verify_key = row
+            export_range = _get_export_range(con)
+            if export_range:
+                _, markers = export_range
+            else:
+                # Databases created before differential exports are always full exports,
+                # the revoked users are exported again given we don't know when it was done
+                markers = (
+                    *(
+                        con.execute(f"SELECT coalesce(max(_id), 0) FROM {table}").fetchone()[0]
+                        for table in EXPORT_RANGE_TABLES
+                    ),
+                    0,
+                )
+        except sqlite3.Error as exc:
+            raise RealmExporterInputError(
+                f"Previous export `{export_db_path}` is not a valid export database: {exc}"
+            ) from exc
+        finally:
+            con.close()
+
+        return cls(VlobID.from_bytes(realm_id), root_verify_key, *markers)
+
+    @property
+    def export_range(self) -> ExportRange:
+        return (
+            self.vlob_atom,
+            self.block,
+            self.user_,
+            self.device,
+            self.realm_role,
+            self.revoked_user,
+        )
+
+
+async def _get_export_markers(
+    conn: triopg._triopg.TrioConnectionProxy,
+    realm_id: VlobID,
+    root_verify_key: bytes,
+    realm_internal_id: int,
+) -> ExportManifest:
+    """
+    Take the markers up to which the realm is exported.
+
+    `_id` are allocated by a sequence when the row is inserted, not when it is
+    committed: a row can be committed after another one with a greater `_id`. So
+    the tables are locked to wait for the in-progress writes (and block the new
+    ones in the meantime), this way no row can show up below the markers later.
+
+    The vlobs don't need this given their `realm_vlob_update.index` is allocated
+    from the realm's counter, hence in commit order.
+    """
+    async with conn.transaction():
+        await conn.execute("LOCK TABLE block, user_, device, realm_user_role IN SHARE MODE")
+        row = await conn.fetchrow(
+            """
+SELECT
+    (SELECT coalesce(max(index), 0) FROM realm_vlob_update WHERE realm = $1),
+    (SELECT coalesce(max(_id), 0) FROM block),
+    (SELECT coalesce(max(_id), 0) FROM user_),
+    (SELECT coalesce(max(_id), 0) FROM device),
+    (SELECT coalesce(max(_id), 0) FROM realm_user_role),
+    clock_timestamp()
+""",
+            realm_internal_id,
+        )
+    # Revocation timestamps are provided by the client and only checked to be in the
+    # ballpark of the server time: a revocation committed from now on can be dated
+    # up to `BALLPARK_CLIENT_LATE_OFFSET` in the past
+    revoked_user = int(row[5].timestamp() * 1000000) - BALLPARK_CLIENT_LATE_OFFSET * 1000000
+    return ExportManifest(realm_id, root_verify_key, *row[:5], revoked_user)
 
 
 async def _init_output_db(
@@ -115,7 +296,11 @@ async def _init_output_db(
     service_id: SequesterServiceID,
     output_db_path: Path,
     input_conn: triopg._triopg.TrioConnectionProxy,
-) -> None:
+    since: ExportManifest | None = None,
+) -> Tuple[ExportManifest, ExportManifest]:
+    """
+    Return the markers the export is based on and the markers it goes up to.
+    """
     # 0) Retrieve organization/realm/sequester service from input database
 
     row = await input_conn.fetchrow(
@@ -134,7 +319,7 @@ async def _init_output_db(
         )
 
     row = await input_conn.fetchrow(
-        "SELECT 1 FROM realm WHERE organization = $1 AND realm_id = $2",
+        "SELECT _id FROM realm WHERE organization = $1 AND realm_id = $2",
         organization_internal_id,
         realm_id,
     )
@@ -142,6 +327,7 @@ async def _init_output_db(
         raise RealmExporterInputError(
             f"Realm `{realm_id.hex}` doesn't exist in organization `{organization_id.str}`"
         )
+    realm_internal_id = row["_id"]
 
     row = await input_conn.fetchrow(
         "SELECT 1 FROM sequester_service WHERE organization = $1 AND service_id = $2",
@@ -153,9 +339,18 @@ async def _init_output_db(
             f"Sequester service `{service_id}` doesn't exist in organization `{organization_id.str}`"
         )
 
+    if since is None:
+        since = ExportManifest(realm_id=realm_id, root_verify_key=root_verify_key)
+    elif since.realm_id != realm_id or since.root_verify_key != root_verify_key:
+        raise RealmExporterInputError(
+            f"Previous export is not about realm `{realm_id.hex}` of organization `{organization_id.str}`"
+        )
+
+    until = await _get_export_markers(input_conn, realm_id, root_verify_key, realm_internal_id)
+
     # 1) Check the output database and create it if needed
 
-    def _sqlite_init_db() -> None:
+    def _sqlite_init_db() -> ExportManifest:
         try:
             con = sqlite3.connect(f"file:{output_db_path}?mode=rw", uri=True)
         except sqlite3.Error:
@@ -169,6 +364,10 @@ async def _init_output_db(
                     "INSERT INTO info (realm_id, root_verify_key) VALUES (?, ?)",
                     (realm_id.bytes, root_verify_key),
                 )
+                con.execute(
+                    "INSERT INTO export_range VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (*since.export_range, *until.export_range),
+                )
                 con.commit()
             except sqlite3.Error as exc:
                 raise RealmExporterOutputDbError(f"Cannot create export database: {exc}") from exc
@@ -203,23 +402,45 @@ async def _init_output_db(
                 raise RealmExporterOutputDbError(
                     f"Existing output export database is for a different realm: realm ID `{db_realm_id}` is the same but root verify key differs"
                 )
+            export_range = _get_export_range(con)
+            if export_range:
+                db_since, db_until = export_range
+            else:
+                # Databases created before differential exports are always full exports
+                db_since = ExportManifest(realm_id, root_verify_key).export_range
+                db_until = until.export_range
+            if db_since != since.export_range:
+                raise RealmExporterOutputDbError(
+                    "Existing output export database is not based on the same previous export"
+                )
+            # A resumed export goes up to the markers taken when it was started
+            return ExportManifest(realm_id, root_verify_key, *db_until)
         finally:
             con.close()
 
-    await trio.to_thread.run_sync(_sqlite_init_db)
+    until = await trio.to_thread.run_sync(_sqlite_init_db)
 
     # 2) Export the certificates
     # Note in all those exports we keep the `_id` primary key from the input database,
     # this is a trick so we don't have to modify the `author` field in block/vlob_atom
 
     # User certificates
+    # Revocation updates the existing user row, so the users revoked since the previous
+    # export are exported again (the reader keeps the revoked certificate when stacking
+    # differential exports)
     rows = await input_conn.fetch(
         """
 SELECT _id, user_certificate, revoked_user_certificate
 FROM user_
-WHERE organization = (SELECT _id FROM organization WHERE organization_id = $1)
+WHERE
+    organization = (SELECT _id FROM organization WHERE organization_id = $1)
+    AND (_id > $2 OR revoked_on > $3)
+    AND _id <= $4
 """,
         organization_id.str,
+        since.user_,
+        DateTime.from_timestamp(since.revoked_user / 1000000),
+        until.user_,
     )
 
     def _sqlite_save_user_certifs() -> None:
@@ -246,8 +467,13 @@ SELECT _id, device_certificate
 FROM device
 WHERE organization = (
 SELECT _id FROM organization WHERE organization_id = $1
-)""",
+)
+AND _id > $2
+AND _id <= $3
+""",
         organization_id.str,
+        since.device,
+        until.device,
     )
 
     def _sqlite_save_device_certifs() -> None:
@@ -275,9 +501,13 @@ WHERE
 realm_id = $2
 AND organization = (SELECT _id FROM organization WHERE organization_id = $1)
 )
+AND _id > $3
+AND _id <= $4
 """,
         organization_id.str,
         realm_id,
+        since.realm_role,
+        until.realm_role,
     )
 
     def _sqlite_save_realm_role_certifs() -> None:
@@ -293,6 +523,122 @@ AND organization = (SELECT _id FROM organization WHERE organization_id = $1)
 
     await trio.to_thread.run_sync(_sqlite_save_realm_role_certifs)
 
+    return since, until
+
+
+@attr.s(slots=True, auto_attribs=True)
+class ExportStats:
+    items: int = 0
+    size: int = 0
+    duration: float = 0.0
+
+    @property
+    def items_per_second(self) -> float:
+        return self.items / self.duration if self.duration else 0.0
+
+    @property
+    def megabytes_per_second(self) -> float:
+        return self.size / self.duration / 1024 / 1024 if self.duration else 0.0
+
+
+class OutputDb:
+    """
+    Single connection to the output database used for the whole export.
+
+    Batches are written into savepoints of a long-running transaction that is
+    committed only once enough data have been written: this way a batch is
+    either fully committed or not at all, which is required to be able to
+    resume the export from the highest exported `_id`.
+
+    SQLite calls are blocking, so they are run in a thread (with a lock given
+    the connection is not thread-safe).
+    """
+
+    def __init__(self, con: sqlite3.Connection):
+        self._con = con
+        self._lock = trio.Lock()
+        self._uncommitted_size = 0
+
+    @classmethod
+    @asynccontextmanager
+    async def open(cls, output_db_path: Path) -> AsyncIterator["OutputDb"]:
+        def _open() -> sqlite3.Connection:
+            # Transactions are handled manually (see `batch`)
+            con = sqlite3.connect(output_db_path, isolation_level=None, check_same_thread=False)
+            try:
+                con.execute("PRAGMA journal_mode=WAL")
+                con.execute("PRAGMA synchronous=NORMAL")
+            except sqlite3.Error:
+                con.close()
+                raise
+            return con
+
+        try:
+            con = await trio.to_thread.run_sync(_open)
+        except sqlite3.Error as exc:
+            raise RealmExporterOutputDbError(f"Cannot open export database: {exc}") from exc
+
+        output_db = cls(con)
+        try:
+            yield output_db
+        finally:
+            with trio.CancelScope(shield=True):
+                await output_db._close()
+
+    async def _run(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        async with self._lock:
+            return await trio.to_thread.run_sync(fn, self._con)
+
+    async def _close(self) -> None:
+        def _close(con: sqlite3.Connection) -> None:
+            try:
+                if con.in_transaction:
+                    con.execute("COMMIT")
+                # Go back to a single file database now the export is over
+                con.execute("PRAGMA journal_mode=DELETE")
+            finally:
+                con.close()
+
+        await self._run(_close)
+
+    async def fetchone(self, sql: str) -> Any:
+        return await self._run(lambda con: con.execute(sql).fetchone())
+
+    async def executemany(self, sql: str, rows: List[Tuple[Any, ...]], size: int) -> None:
+        await self._run(lambda con: con.executemany(sql, rows))
+        self._uncommitted_size += size
+
+    @asynccontextmanager
+    async def batch(self) -> AsyncIterator[None]:
+        def _begin(con: sqlite3.Connection) -> None:
+            if not con.in_transaction:
+                con.execute("BEGIN")
+            con.execute("SAVEPOINT batch")
+
+        await self._run(_begin)
+        try:
+            yield
+
+        except BaseException:
+
+            def _rollback(con: sqlite3.Connection) -> None:
+                con.execute("ROLLBACK TO batch")
+                con.execute("RELEASE batch")
+
+            with trio.CancelScope(shield=True):
+                await self._run(_rollback)
+            raise
+
+        def _release(con: sqlite3.Connection, commit: bool) -> None:
+            con.execute("RELEASE batch")
+            if commit:
+                con.execute("COMMIT")
+
+        commit = self._uncommitted_size >= OUTPUT_DB_COMMIT_THRESHOLD
+        await self._run(lambda con: _release(con, commit))
+        if commit:
+            self._uncommitted_size = 0
+
 
 class RealmExporter:
     def __init__(
@@ -303,6 +649,9 @@ class RealmExporter:
         output_db_path: Path,
         input_dbh: PGHandler,
         input_blockstore: BaseBlockStoreComponent,
+        output_db: OutputDb,
+        since: ExportManifest,
+        until: ExportManifest,
     ):
         self.organization_id = organization_id
         self.realm_id = realm_id
@@ -310,6 +659,11 @@ class RealmExporter:
         self.output_db_path = output_db_path
         self.input_dbh = input_dbh
         self.input_blockstore = input_blockstore
+        self.output_db = output_db
+        self.since = since
+        self.until = until
+        self.vlobs_stats = ExportStats()
+        self.blocks_stats = ExportStats()
 
     @classmethod
     @asynccontextmanager
@@ -321,37 +675,44 @@ class RealmExporter:
         output_db_path: Path,
         input_dbh: PGHandler,
         input_blockstore: BaseBlockStoreComponent,
+        since: ExportManifest | None = None,
     ) -> AsyncGenerator["RealmExporter", None]:
+        """
+        Export the realm into `output_db_path`, resuming the export if the database
+        already exists. If `since` is provided, only the data following this previous
+        export are exported (i.e. differential export).
+
+        Only the data present when the export is started are exported, a resumed
+        export goes up to the same point (see `_get_export_markers`).
+        """
         async with input_dbh.pool.acquire() as input_conn:
-            await _init_output_db(
+            since, until = await _init_output_db(
                 organization_id=organization_id,
                 realm_id=realm_id,
                 service_id=service_id,
                 output_db_path=output_db_path,
                 input_conn=input_conn,
+                since=since,
             )
 
-        yield cls(
-            organization_id=organization_id,
-            realm_id=realm_id,
-            service_id=service_id,
-            output_db_path=output_db_path,
-            input_dbh=input_dbh,
-            input_blockstore=input_blockstore,
-        )
+        async with OutputDb.open(output_db_path) as output_db:
+            yield cls(
+                organization_id=organization_id,
+                realm_id=realm_id,
+                service_id=service_id,
+                output_db_path=output_db_path,
+                input_dbh=input_dbh,
+                input_blockstore=input_blockstore,
+                output_db=output_db,
+                since=since,
+                until=until,
+            )
 
     # Vlobs export
 
     async def compute_vlobs_export_status(self) -> Tuple[int, BatchOffsetMarker]:
-        def _retrieve_vlobs_export_status() -> int:
-            con = sqlite3.connect(self.output_db_path)
-            try:
-                row = con.execute("SELECT max(_id) FROM vlob_atom").fetchone()
-            finally:
-                con.close()
-            return row[0] or 0
-
-        last_exported_index = await trio.to_thread.run_sync(_retrieve_vlobs_export_status)
+        row = await self.output_db.fetchone("SELECT max(_id) FROM vlob_atom")
+        last_exported_index = row[0] or self.since.vlob_atom
 
         async with self.input_dbh.pool.acquire() as conn:
             rows = await conn.fetch(
@@ -368,22 +729,62 @@ WHERE
             realm_id = $1
             AND organization = (SELECT _id FROM organization WHERE organization_id = $2)
     )
+    AND index > $3
+    AND index <= $4
 """,
                 self.realm_id,
                 self.organization_id.str,
+                self.since.vlob_atom,
+                self.until.vlob_atom,
             )
             to_export_count = rows[0][0]
 
         return (cast(int, to_export_count), cast(BatchOffsetMarker, last_exported_index))
 
     async def export_vlobs(
-        self, batch_size: int = 1000, batch_offset_marker: BatchOffsetMarker | None = None
+        self,
+        batch_size: int = 1000,
+        batch_offset_marker: BatchOffsetMarker | None = None,
+        batch_max_size: int | None = None,
     ) -> BatchOffsetMarker:
+        """
+        Export the vlobs following `batch_offset_marker` (i.e. the index of the last
+        exported vlob) and return the marker of the last vlob of the batch.
+
+        The batch stops after `batch_size` vlobs or once `batch_max_size` bytes of
+        blobs have been exported (at least one vlob is always exported). Vlobs are
+        streamed from a server-side cursor and written as they arrive, so memory
+        usage doesn't depend on the batch size.
+        """
         batch_offset_marker = batch_offset_marker or 0
+        last_exported_index = batch_offset_marker
+        started = time.monotonic()
+        items = 0
+        size = 0
 
-        async with self.input_dbh.pool.acquire() as conn:
-            rows = await conn.fetch(
+        async def _write_vlobs(chunk: List[Tuple[int, bytes, int, bytes, int, int]]) -> None:
+            await self.output_db.executemany(
                 """
+INSERT INTO vlob_atom (
+    _id,
+    vlob_id,
+    version,
+    blob,
+    author,
+    timestamp
+)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT DO NOTHING
+""",
+                chunk,
+                size=sum(len(r[3]) for r in chunk),
+            )
+
+        async with self.input_dbh.pool.acquire() as conn:
+            # Server-side cursors only live within a transaction
+            async with conn.transaction():
+                cursor = await conn.cursor(
+                    """
 SELECT
     -- Return index instead of `vlob_atom.id` given it is more readable and we export only a single realm
     realm_vlob_update.index AS _id,
@@ -406,68 +807,67 @@ WHERE
             realm_id = $1
             AND organization = (SELECT _id FROM organization WHERE organization_id = $2)
     )
-    AND realm_vlob_update.index >= $3
-    AND sequester_service_vlob_atom.service = (SELECT _id FROM sequester_service WHERE service_id = $4)
-LIMIT $5
+    -- Keyset pagination: (realm, index) is unique and indexed
+    AND realm_vlob_update.index > $3
+    AND realm_vlob_update.index <= $4
+    AND sequester_service_vlob_atom.service = (SELECT _id FROM sequester_service WHERE service_id = $5)
+ORDER BY realm_vlob_update.index
+LIMIT $6
 """,
-                self.realm_id,
-                self.organization_id.str,
-                batch_offset_marker,
-                self.service_id,
-                batch_size,
-            )
-
-            def _save_in_output_db() -> None:
-                # Must convert `vlob_id`` fields from UUID to bytes given SQLite doesn't handle the former
-                # Must also convert datetime to a number of ms since UNIX epoch
-                cooked_rows = [
-                    (
-                        r[0],
-                        VlobID.from_hex(r[1]).bytes,
-                        r[2],
-                        r[3],
-                        r[4],
-                        int(r[5].timestamp() * 1000000),
-                    )
-                    for r in rows
-                ]
-                con = sqlite3.connect(self.output_db_path)
-                try:
-                    con.executemany(
-                        """
-INSERT INTO vlob_atom (
-    _id,
-    vlob_id,
-    version,
-    blob,
-    author,
-    timestamp
-)
-VALUES (?, ?, ?, ?, ?, ?)
-ON CONFLICT DO NOTHING
-""",
-                        cooked_rows,
-                    )
-                    con.commit()
-                finally:
-                    con.close()
-
-            await trio.to_thread.run_sync(_save_in_output_db)
+                    self.realm_id,
+                    self.organization_id.str,
+                    batch_offset_marker,
+                    self.until.vlob_atom,
+                    self.service_id,
+                    batch_size,
+                )
 
-        return max(r["_id"] for r in rows)
+                async with self.output_db.batch():
+                    chunk: List[Tuple[int, bytes, int, bytes, int, int]] = []
+                    chunk_size = 0
+                    while batch_max_size is None or size + chunk_size < batch_max_size:
+                        rows = await cursor.fetch(EXPORT_CURSOR_FETCH_SIZE)
+                        if not rows:
+                            break
+                        for r in rows:
+                            # Must convert `vlob_id`` fields from UUID to bytes given SQLite doesn't handle the former
+                            # Must also convert datetime to a number of ms since UNIX epoch
+                            chunk.append(
+                                (
+                                    r[0],
+                                    VlobID.from_hex(r[1]).bytes,
+                                    r[2],
+                                    r[3],
+                                    r[4],
+                                    int(r[5].timestamp() * 1000000),
+                                )
+                            )
+                            chunk_size += len(r[3])
+                            last_exported_index = r[0]
+                            if batch_max_size is not None and size + chunk_size >= batch_max_size:
+                                break
+                        if chunk_size >= OUTPUT_DB_WRITE_CHUNK_SIZE:
+                            await _write_vlobs(chunk)
+                            items += len(chunk)
+                            size += chunk_size
+                            chunk = []
+                            chunk_size = 0
+                    if chunk:
+                        await _write_vlobs(chunk)
+                        items += len(chunk)
+                        size += chunk_size
+
+        self.vlobs_stats.items += items
+        self.vlobs_stats.size += size
+        self.vlobs_stats.duration += time.monotonic() - started
+
+        return cast(BatchOffsetMarker, last_exported_index)
 
     # Blocks export
 
     async def compute_blocks_export_status(self) -> Tuple[int, BatchOffsetMarker]:
-        def _retrieve_vlobs_export_status() -> int:
-            con = sqlite3.connect(self.output_db_path)
-            try:
-                row = con.execute("SELECT max(_id) FROM block").fetchone()
-            finally:
-                con.close()
-            return row[0] or 0
-
-        last_exported_index = await trio.to_thread.run_sync(_retrieve_vlobs_export_status)
+        row = await self.output_db.fetchone("SELECT max(_id) FROM block")
+        last_exported_index = row[0] or self.since.block
 
         async with self.input_dbh.pool.acquire() as conn:
             rows = await conn.fetch(
@@ -484,26 +884,47 @@ WHERE
             realm_id = $1
             AND organization = (SELECT _id FROM organization WHERE organization_id = $2)
     )
+    AND _id > $3
+    AND _id <= $4
 """,
                 self.realm_id,
                 self.organization_id.str,
+                self.since.block,
+                self.until.block,
             )
             to_export_count = rows[0][0]
 
         return (cast(int, to_export_count), cast(BatchOffsetMarker, last_exported_index))
 
     async def export_blocks(
-        self, batch_size: int = 100, batch_offset_marker: BatchOffsetMarker | None = None
+        self,
+        batch_size: int = 100,
+        batch_offset_marker: BatchOffsetMarker | None = None,
+        max_concurrency: int = DEFAULT_BLOCK_FETCH_CONCURRENCY,
+        batch_max_size: int | None = None,
     ) -> BatchOffsetMarker:
+        """
+        Export the blocks following `batch_offset_marker` (i.e. the internal ID of the
+        last exported block) and return the marker of the last block of the batch.
+
+        The batch stops after `batch_size` blocks or once they add up to `batch_max_size`
+        bytes (at least one block is always exported).
+        """
         batch_offset_marker = batch_offset_marker or 0
 
+        # Don't keep the connection while fetching the blocks, this can take a long time
+        rows: List[Tuple[int, BlockID, int]] = []
+        rows_size = 0
         async with self.input_dbh.pool.acquire() as conn:
-            rows = await conn.fetch(
-                """
+            # Server-side cursors only live within a transaction
+            async with conn.transaction():
+                cursor = await conn.cursor(
+                    """
 SELECT
     _id,
     block_id,
-    author
+    author,
+    size
 FROM
     block
 WHERE
@@ -514,35 +935,61 @@ WHERE
             realm_id = $1
             AND organization = (SELECT _id FROM organization WHERE organization_id = $2)
     )
-    AND _id >= $3
-LIMIT $4
+    -- Keyset pagination, see `block_realm_idx` index
+    AND _id > $3
+    AND _id <= $4
+ORDER BY _id
+LIMIT $5
 """,
-                self.realm_id,
-                self.organization_id.str,
-                batch_offset_marker,
-                batch_size,
-            )
-            cooked_rows = []
-            for row in rows:
-                block = await self.input_blockstore.read(
-                    organization_id=self.organization_id, block_id=BlockID.from_hex(row["block_id"])
+                    self.realm_id,
+                    self.organization_id.str,
+                    batch_offset_marker,
+                    self.until.block,
+                    batch_size,
                 )
-                cooked_rows.append(
-                    (
-                        row["_id"],
-                        # Must convert `block_id`` fields from UUID to bytes given SQLite doesn't handle the former
-                        VlobID.from_hex(row["block_id"]).bytes,
-                        block,
-                        row["author"],
+                while batch_max_size is None or rows_size < batch_max_size:
+                    fetched = await cursor.fetch(EXPORT_CURSOR_FETCH_SIZE)
+                    if not fetched:
+                        break
+                    for row in fetched:
+                        rows.append((row["_id"], BlockID.from_hex(row["block_id"]), row["author"]))
+                        rows_size += row["size"]
+                        if batch_max_size is not None and rows_size >= batch_max_size:
+                            break
+        if not rows:
+            return batch_offset_marker
+
+        started = time.monotonic()
+        size = 0
+
+        # Blocks are fetched concurrently and written (in no particular order) as soon as
+        # they arrive. The channel's buffer bounds the number of blocks kept in memory.
+        to_fetch_send, to_fetch_receive = trio.open_memory_channel[Tuple[int, BlockID, int]](
+            len(rows)
+        )
+        for row in rows:
+            to_fetch_send.send_nowait(row)
+        to_fetch_send.close()
+        blocks_send, blocks_receive = trio.open_memory_channel[Tuple[int, bytes, bytes, int]](
+            max_concurrency
+        )
+
+        async def _fetch_blocks(
+            blocks_send: trio.MemorySendChannel[Tuple[int, bytes, bytes, int]]
+        ) -> None:
+            async with blocks_send:
+                async for internal_id, block_id, author in to_fetch_receive:
+                    block = await self.input_blockstore.read(
+                        organization_id=self.organization_id, block_id=block_id
                     )
-                )
+                    # Must convert `block_id`` fields from UUID to bytes given SQLite doesn't handle the former
+                    await blocks_send.send((internal_id, block_id.bytes, block, author))
 
-            def _save_in_output_db() -> None:
-                con = sqlite3.connect(self.output_db_path)
-                try:
-                    # Must convert `vlob_id`` fields from UUID to bytes given SQLite doesn't handle the former
-                    con.executemany(
-                        """
+        async def _write_blocks(
+            chunk: List[Tuple[int, bytes, bytes, int]], chunk_size: int
+        ) -> None:
+            await self.output_db.executemany(
+                """
 INSERT INTO block (
     _id,
     block_id,
@@ -552,12 +999,33 @@ INSERT INTO block (
 VALUES (?, ?, ?, ?)
 ON CONFLICT DO NOTHING
 """,
-                        cooked_rows,
-                    )
-                    con.commit()
-                finally:
-                    con.close()
-
-            await trio.to_thread.run_sync(_save_in_output_db)
+                chunk,
+                size=chunk_size,
+            )
 
-        return max(r["_id"] for r in rows)
+        async with self.output_db.batch():
+            async with trio.open_nursery() as nursery:
+                async with blocks_send:
+                    for _ in range(min(max_concurrency, len(rows))):
+                        nursery.start_soon(_fetch_blocks, blocks_send.clone())
+
+                chunk: List[Tuple[int, bytes, bytes, int]] = []
+                chunk_size = 0
+                async for item in blocks_receive:
+                    chunk.append(item)
+                    chunk_size += len(item[2])
+                    if chunk_size >= OUTPUT_DB_WRITE_CHUNK_SIZE:
+                        await _write_blocks(chunk, chunk_size)
+                        size += chunk_size
+                        chunk = []
+                        chunk_size = 0
+                if chunk:
+                    await _write_blocks(chunk, chunk_size)
+                    size += chunk_size
+
+        self.blocks_stats.items += len(rows)
+        self.blocks_stats.size += size
+        self.blocks_stats.duration += time.monotonic() - started
+
+        # Rows are ordered by internal ID
+        return cast(BatchOffsetMarker, rows[-1][0])
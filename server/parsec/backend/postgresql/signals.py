@@ -0,0 +1,200 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+from __future__ import annotations
+
+import struct
+import zlib
+from base64 import b64decode, b85decode, b85encode
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Tuple
+from uuid import UUID, uuid4
+
+import triopg
+
+from parsec._parsec import BackendEvent
+
+# Backend events are broadcasted to all the server processes through PostgreSQL's
+# LISTEN/NOTIFY. All the events sent within a transaction are coalesced into a
+# single notification, whose payload is a frame:
+#
+#     <flags: u8> <body>
+#     body: <batch ID: 16 bytes> (<event size: u32> <event: BackendEvent.dump()>)*
+#
+# The body is zlib-compressed if it is worth it (see `FRAME_FLAG_ZLIB`). Given
+# NOTIFY only accepts text, the frame is base85-encoded (which is more compact
+# than base64), unless it is too big for NOTIFY in which case it is stored in the
+# `notification_payload` table and the notification only contains a reference to it.
+
+NOTIFICATION_CHANNEL = "app_notification"
+# NOTIFY payload must be shorter than 8000 bytes (with default PostgreSQL configuration)
+NOTIFICATION_PAYLOAD_MAX_SIZE = 7999
+# Side table entries are only needed until all the server processes have fetched
+# them, so they are cleaned up opportunistically once older than this
+NOTIFICATION_PAYLOAD_RETENTION = "5 minutes"
+
+PAYLOAD_KIND_INLINE = "i"
+PAYLOAD_KIND_REFERENCE = "r"
+
+FRAME_FLAG_ZLIB = 0x01
+FRAME_COMPRESSION_THRESHOLD = 256
+
+_EVENT_SIZE = struct.Struct("!I")
+
+_q_insert_notification_payload = f"""
+WITH cleanup AS (
+    DELETE FROM notification_payload
+    WHERE created_on < now() - INTERVAL '{NOTIFICATION_PAYLOAD_RETENTION}'
+)
+INSERT INTO notification_payload (payload, created_on)
+VALUES ($1, now())
+RETURNING _id
+"""
+
+_q_get_notification_payload = "SELECT payload FROM notification_payload WHERE _id = $1"
+
+
+def dump_notification_frame(batch_id: UUID, events: List[BackendEvent]) -> bytes:
+    chunks = [batch_id.bytes]
+    for event in events:
+        raw = event.dump()
+        chunks.append(_EVENT_SIZE.pack(len(raw)))
+        chunks.append(raw)
+    body = b"".join(chunks)
+
+    flags = 0
+    if len(body) >= FRAME_COMPRESSION_THRESHOLD:
+        compressed = zlib.compress(body, 1)
+        if len(compressed) < len(body):
+            flags |= FRAME_FLAG_ZLIB
+            body = compressed
+
+    return bytes((flags,)) + body
+
+
+def load_notification_frame(frame: bytes) -> List[Tuple[str, BackendEvent]]:
+    """
+    Raises:
+        ValueError
+    """
+    if not frame:
+        raise ValueError("Empty notification frame")
+    flags = frame[0]
+    body = frame[1:]
+    if flags & FRAME_FLAG_ZLIB:
+        try:
+            body = zlib.decompress(body)
+        except zlib.error as exc:
+            raise ValueError("Invalid notification frame compression") from exc
+    if len(body) < 16:
+        raise ValueError("Invalid notification frame")
+
+    batch_id = UUID(bytes=body[:16]).hex
+    view = memoryview(body)
+    offset = 16
+    events = []
+    while offset < len(body):
+        try:
+            (size,) = _EVENT_SIZE.unpack_from(view, offset)
+        except struct.error as exc:
+            raise ValueError("Invalid notification frame") from exc
+        offset += _EVENT_SIZE.size
+        raw = view[offset : offset + size]
+        if len(raw) != size:
+            raise ValueError("Invalid notification frame")
+        offset += size
+        # Event ID must be unique across all the notifications
+        events.append((f"{batch_id}.{len(events)}", BackendEvent.load(bytes(raw))))
+
+    return events
+
+
+def dump_notification_payload(frame: bytes) -> str:
+    return PAYLOAD_KIND_INLINE + b85encode(frame).decode("ascii")
+
+
+def parse_notification_reference(payload: str) -> int | None:
+    """
+    Returns the `notification_payload` row ID if the notification is a reference,
+    `None` if it contains the events.
+
+    Raises:
+        ValueError
+    """
+    if payload.startswith(PAYLOAD_KIND_REFERENCE):
+        return int(payload[len(PAYLOAD_KIND_REFERENCE) :])
+    return None
+
+
+def load_notification_payload(payload: str) -> List[Tuple[str, BackendEvent]]:
+    """
+    Raises:
+        ValueError
+    """
+    # Legacy format `<event_id>:<base64 event>`, only one event per notification.
+    # Kept so that server processes of different versions can cohabit during an upgrade.
+    if len(payload) > 32 and payload[32] == ":":
+        event_id, raw_event = payload.split(":")
+        return [(event_id, BackendEvent.load(b64decode(raw_event.encode("ascii"))))]
+
+    if not payload.startswith(PAYLOAD_KIND_INLINE):
+        raise ValueError("Unknown notification payload kind")
+    return load_notification_frame(b85decode(payload[len(PAYLOAD_KIND_INLINE) :]))
+
+
+async def fetch_notification_frame(conn: triopg._triopg.TrioConnectionProxy, row_id: int) -> bytes:
+    """
+    Returns an empty frame if the payload is no longer available
+    """
+    return await conn.fetchval(_q_get_notification_payload, row_id) or b""
+
+
+# Events waiting for the end of their transaction, see `batch_signals`
+_pending_signals: Dict[int, List[BackendEvent]] = {}
+
+
+async def _notify(conn: triopg._triopg.TrioConnectionProxy, events: List[BackendEvent]) -> None:
+    frame = dump_notification_frame(uuid4(), events)
+    payload = dump_notification_payload(frame)
+    if len(payload) > NOTIFICATION_PAYLOAD_MAX_SIZE:
+        row_id = await conn.fetchval(_q_insert_notification_payload, frame)
+        payload = f"{PAYLOAD_KIND_REFERENCE}{row_id}"
+    await conn.execute("SELECT pg_notify($1, $2)", NOTIFICATION_CHANNEL, payload)
+
+
+async def send_signal(conn: triopg._triopg.TrioConnectionProxy, event: BackendEvent) -> None:
+    pending = _pending_signals.get(id(conn))
+    if pending is not None:
+        pending.append(event)
+    else:
+        await _notify(conn, [event])
+
+
+@asynccontextmanager
+async def batch_signals(conn: triopg._triopg.TrioConnectionProxy) -> AsyncIterator[None]:
+    """
+    Coalesce the signals sent on `conn` into a single notification sent when
+    leaving the context. This must be used inside a transaction: PostgreSQL
+    only delivers the notification once it is committed, so this doesn't change
+    when the events are received.
+
+    On error the signals are dropped, just like PostgreSQL does with the
+    notifications of a rolled back transaction (or savepoint for nested batches).
+    """
+    key = id(conn)
+    pending = _pending_signals.get(key)
+    if pending is not None:
+        # Nested batch, the outermost one is in charge of sending the notification
+        start = len(pending)
+        try:
+            yield
+        except BaseException:
+            del pending[start:]
+            raise
+        return
+
+    pending = _pending_signals[key] = []
+    try:
+        yield
+    finally:
+        del _pending_signals[key]
+    if pending:
+        await _notify(conn, pending)
@@ -0,0 +1,201 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+from __future__ import annotations
+
+import re
+import sys
+import time
+import zlib
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional
+
+import asyncpg
+import attr
+from asyncpg.prepared_stmt import PreparedStatement
+from structlog import get_logger
+
+from parsec.backend.metrics import LATENCY_BUCKETS
+from parsec.backend.tracing import span
+
+logger = get_logger()
+
+# Queries modifying data, for the commit of their transaction to be tracked (see
+# `parsec.backend.postgresql.replicas`). Note `SELECT ... FOR UPDATE` is considered
+# as a write, which is fine given it is only used by the writing commands.
+_WRITE_QUERY_PATTERN = re.compile(r"\b(INSERT|UPDATE|DELETE|TRUNCATE)\b", re.IGNORECASE)
+
+
+@attr.s(slots=True, auto_attribs=True)
+class QueryStats:
+    count: int = 0
+    total_duration: float = 0.0
+    # Number of executions per latency bucket (not cumulative)
+    buckets: List[int] = attr.ib(factory=lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+
+    def record(self, duration: float) -> None:
+        self.count += 1
+        self.total_duration += duration
+        self.buckets[bisect_left(LATENCY_BUCKETS, duration)] += 1
+
+
+@attr.s(slots=True, auto_attribs=True)
+class RegisteredQuery:
+    sql: str
+    module: str
+    # Name of the function that declared the query, `<module>` for module-level queries
+    function: str
+    is_write: bool = False
+    stats: QueryStats = attr.ib(factory=QueryStats)
+    _name: Optional[str] = None
+
+    @property
+    def name(self) -> str:
+        """
+        Name of the global variable the query has been assigned to (e.g.
+        `parsec.backend.postgresql.block._q_insert_block`), or of the function
+        that generated it followed by a hash of the SQL.
+        """
+        if self._name is None:
+            module = sys.modules.get(self.module)
+            if self.function == "<module>" and module:
+                for attr_name, value in vars(module).items():
+                    if getattr(value, "registered", None) is self:
+                        self._name = f"{self.module}.{attr_name}"
+                        break
+            if self._name is None:
+                self._name = f"{self.module}.{self.function}:{zlib.crc32(self.sql.encode()):08x}"
+        return self._name
+
+
+# Queries declared with `Q`, indexed by their SQL
+_registered_queries: Dict[str, RegisteredQuery] = {}
+
+
+def register_query(sql: str, module: str, function: str) -> RegisteredQuery:
+    registered = _registered_queries.get(sql)
+    if registered is None:
+        registered = _registered_queries[sql] = RegisteredQuery(
+            sql=sql,
+            module=module,
+            function=function,
+            is_write=_WRITE_QUERY_PATTERN.search(sql) is not None,
+        )
+    return registered
+
+
+def get_queries_stats() -> Dict[str, QueryStats]:
+    """
+    Execution stats of the registered queries (only those executed at least once),
+    indexed by name.
+    """
+    stats: Dict[str, QueryStats] = {}
+    for registered in _registered_queries.values():
+        if registered.stats.count:
+            stats[registered.name] = registered.stats
+    return stats
+
+
+class PreparedStatementsConnection(asyncpg.Connection):  # type: ignore[misc]
+    """
+    Connection that prepares all the queries declared with `Q` once (see
+    `prepare_registered_statements`), then executes them with their prepared
+    statement. This way they don't compete for asyncpg's (small) per-connection
+    statement cache, and we get to record their execution stats.
+
+    Queries registered after the connection has been initialized (i.e. generated
+    by a function) are executed the regular way, but their stats are still recorded.
+
+    `has_written` is set once a query modifying data has been executed, it is up
+    to the connection's user to reset it.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._prepared_statements: Dict[str, PreparedStatement] = {}
+        self.has_written = False
+
+    def _lookup(self, query: str) -> RegisteredQuery | None:
+        registered = _registered_queries.get(query)
+        if registered is None:
+            if _WRITE_QUERY_PATTERN.search(query):
+                self.has_written = True
+        elif registered.is_write:
+            self.has_written = True
+        return registered
+
+    async def prepare_registered_statements(self) -> None:
+        for sql in list(_registered_queries):
+            if sql in self._prepared_statements:
+                continue
+            try:
+                self._prepared_statements[sql] = await self.prepare(sql)
+            except asyncpg.PostgresError as exc:
+                # The query will be executed the regular way, this is typically
+                # because it relies on a migration that hasn't been applied yet
+                logger.warning(
+                    "cannot prepare query",
+                    query=_registered_queries[sql].name,
+                    exc_info=exc,
+                )
+
+    async def execute(self, query: str, *args: Any, timeout: float | None = None) -> str:
+        registered = self._lookup(query)
+        if registered is None:
+            return await super().execute(query, *args, timeout=timeout)
+        started = time.monotonic()
+        try:
+            with span("db.query", query=registered.name):
+                statement = self._prepared_statements.get(query)
+                if statement is None:
+                    return await super().execute(query, *args, timeout=timeout)
+                await statement.fetch(*args, timeout=timeout)
+                return statement.get_statusmsg()
+        finally:
+            registered.stats.record(time.monotonic() - started)
+
+    async def fetch(
+        self, query: str, *args: Any, timeout: float | None = None, **kwargs: Any
+    ) -> Any:
+        registered = self._lookup(query)
+        if registered is None:
+            return await super().fetch(query, *args, timeout=timeout, **kwargs)
+        started = time.monotonic()
+        try:
+            with span("db.query", query=registered.name):
+                statement = self._prepared_statements.get(query)
+                if statement is None or kwargs:
+                    return await super().fetch(query, *args, timeout=timeout, **kwargs)
+                return await statement.fetch(*args, timeout=timeout)
+        finally:
+            registered.stats.record(time.monotonic() - started)
+
+    async def fetchrow(
+        self, query: str, *args: Any, timeout: float | None = None, **kwargs: Any
+    ) -> Any:
+        registered = self._lookup(query)
+        if registered is None:
+            return await super().fetchrow(query, *args, timeout=timeout, **kwargs)
+        started = time.monotonic()
+        try:
+            with span("db.query", query=registered.name):
+                statement = self._prepared_statements.get(query)
+                if statement is None or kwargs:
+                    return await super().fetchrow(query, *args, timeout=timeout, **kwargs)
+                return await statement.fetchrow(*args, timeout=timeout)
+        finally:
+            registered.stats.record(time.monotonic() - started)
+
+    async def fetchval(
+        self, query: str, *args: Any, column: int = 0, timeout: float | None = None
+    ) -> Any:
+        registered = self._lookup(query)
+        if registered is None:
+            return await super().fetchval(query, *args, column=column, timeout=timeout)
+        started = time.monotonic()
+        try:
+            with span("db.query", query=registered.name):
+                statement = self._prepared_statements.get(query)
+                if statement is None:
+                    return await super().fetchval(query, *args, column=column, timeout=timeout)
+                return await statement.fetchval(*args, column=column, timeout=timeout)
+        finally:
+            registered.stats.record(time.monotonic() - started)
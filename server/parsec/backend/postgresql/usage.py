@@ -0,0 +1,79 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+from __future__ import annotations
+
+import triopg
+
+from parsec._parsec import DateTime
+from parsec.backend.postgresql.utils import Q
+
+# Usage counters are bucketed by the day (in UTC) the counted items have been created on
+USAGE_BUCKET_PRECISION = "day"
+
+
+def q_usage_bucket(timestamp: str) -> str:
+    """
+    Start of the usage bucket `timestamp` (a TIMESTAMPTZ expression) is in.
+    """
+    return f"""(
+    date_trunc('{USAGE_BUCKET_PRECISION}', ({timestamp})::TIMESTAMPTZ AT TIME ZONE 'UTC')
+    AT TIME ZONE 'UTC'
+)"""
+
+
+_q_add_realm_usage = Q(
+    f"""
+INSERT INTO realm_usage (
+    organization,
+    realm,
+    bucket,
+    vlobs_size,
+    reencrypted_vlobs_size,
+    blocks_size,
+    realms_created
+)
+VALUES (
+    $organization_internal_id,
+    $realm_internal_id,
+    { q_usage_bucket("$timestamp") },
+    $vlobs_size,
+    $reencrypted_vlobs_size,
+    $blocks_size,
+    $realms_created
+)
+ON CONFLICT (realm, bucket) DO UPDATE SET
+    vlobs_size = realm_usage.vlobs_size + EXCLUDED.vlobs_size,
+    reencrypted_vlobs_size = realm_usage.reencrypted_vlobs_size + EXCLUDED.reencrypted_vlobs_size,
+    blocks_size = realm_usage.blocks_size + EXCLUDED.blocks_size,
+    realms_created = realm_usage.realms_created + EXCLUDED.realms_created
+"""
+)
+
+
+async def add_realm_usage(
+    conn: triopg._triopg.TrioConnectionProxy,
+    organization_internal_id: int | None,
+    realm_internal_id: int | None,
+    timestamp: DateTime,
+    vlobs_size: int = 0,
+    reencrypted_vlobs_size: int = 0,
+    blocks_size: int = 0,
+    realms_created: int = 0,
+) -> None:
+    """
+    Add to the usage counters of the realm, in the bucket of `timestamp` (i.e. the
+    creation date of the counted item).
+
+    Must be called in the transaction creating the counted item, so that the
+    counters are always consistent with the vlob atoms, blocks and realms they sum up.
+    """
+    await conn.execute(
+        *_q_add_realm_usage(
+            organization_internal_id=organization_internal_id,
+            realm_internal_id=realm_internal_id,
+            timestamp=timestamp,
+            vlobs_size=vlobs_size,
+            reencrypted_vlobs_size=reencrypted_vlobs_size,
+            blocks_size=blocks_size,
+            realms_created=realms_created,
+        )
+    )
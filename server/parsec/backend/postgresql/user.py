@@ -1,9 +1,10 @@
 # Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
 from __future__ import annotations
 
-from typing import Any, List, Tuple
+from typing import TYPE_CHECKING, Any, List, Tuple
 
 from parsec._parsec import DateTime, DeviceID, OrganizationID, UserID
+from parsec.backend.postgresql.certificates import query_get_certificates
 from parsec.backend.postgresql.handler import PGHandler
 from parsec.backend.postgresql.user_queries import (
     query_create_device,
@@ -26,11 +27,18 @@ from parsec.backend.user import (
     User,
 )
 
+if TYPE_CHECKING:
+    from parsec.backend.handshake_cache import HandshakeCache
+
 
 class PGUserComponent(BaseUserComponent):
     def __init__(self, dbh: PGHandler, *args: Any, **kwargs: Any) -> None:
         super().__init__(*args, **kwargs)
         self.dbh = dbh
+        self._handshake_cache: HandshakeCache | None = None
+
+    def register_components(self, handshake_cache: HandshakeCache, **other_components: Any) -> None:
+        self._handshake_cache = handshake_cache
 
     async def create_user(
         self, organization_id: OrganizationID, user: User, first_device: Device
@@ -83,7 +91,7 @@ class PGUserComponent(BaseUserComponent):
         omit_revoked: bool = False,
         omit_non_human: bool = False,
     ) -> Tuple[List[HumanFindResultItem], int]:
-        async with self.dbh.pool.acquire() as conn:
+        async with self.dbh.read_pool(organization_id).acquire() as conn:
             return await query_find_humans(
                 conn,
                 organization_id=organization_id,
@@ -103,7 +111,7 @@ class PGUserComponent(BaseUserComponent):
         revoked_on: DateTime | None = None,
     ) -> None:
         async with self.dbh.pool.acquire() as conn:
-            return await query_revoke_user(
+            await query_revoke_user(
                 conn,
                 organization_id,
                 user_id,
@@ -111,7 +119,17 @@ class PGUserComponent(BaseUserComponent):
                 revoked_user_certifier,
                 revoked_on,
             )
+        # The event only reaches the other server processes once notified back by
+        # PostgreSQL, the revoked user must not be able to connect in the meantime
+        assert self._handshake_cache is not None
+        self._handshake_cache.invalidate_user(organization_id, user_id)
 
     async def dump_users(self, organization_id: OrganizationID) -> Tuple[List[User], List[Device]]:
         async with self.dbh.pool.acquire() as conn:
             return await query_dump_users(conn, organization_id)
+
+    async def get_certificates(
+        self, organization_id: OrganizationID, offset: int, redacted: bool
+    ) -> List[bytes]:
+        async with self.dbh.read_pool(organization_id).acquire() as conn:
+            return await query_get_certificates(conn, organization_id, offset, redacted)
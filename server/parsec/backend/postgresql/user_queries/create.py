@@ -10,6 +10,7 @@ from parsec._parsec import (
     DateTime,
     OrganizationID,
 )
+from parsec.backend.postgresql.certificates import add_certificate
 from parsec.backend.postgresql.utils import (
     Q,
     q_device_internal_id,
@@ -288,6 +289,9 @@ async def q_create_user(
         await _do_create_user_with_human_handle(conn, organization_id, user, first_device)
     else:
         await _do_create_user_without_human_handle(conn, organization_id, user, first_device)
+    await add_certificate(
+        conn, organization_id, user.user_certificate, user.redacted_user_certificate
+    )
 
     await _create_device(conn, organization_id, first_device, first_device=True)
 
@@ -337,6 +341,10 @@ async def _create_device(
     if result != "INSERT 0 1":
         raise UserError(f"Insertion error: {result}")
 
+    await add_certificate(
+        conn, organization_id, device.device_certificate, device.redacted_device_certificate
+    )
+
 
 @query(in_transaction=True)
 async def query_create_device(
@@ -118,7 +118,7 @@ async def query_retrieve_active_human_by_email(
     return None
 
 
-@query()
+@query(read_only=True)
 async def query_find_humans(
     conn: triopg._triopg.TrioConnectionProxy,
     organization_id: OrganizationID,
@@ -10,6 +10,7 @@ from parsec._parsec import (
     OrganizationID,
     UserID,
 )
+from parsec.backend.postgresql.certificates import add_certificate
 from parsec.backend.postgresql.handler import send_signal
 from parsec.backend.postgresql.user_queries.create import q_take_user_device_write_lock
 from parsec.backend.postgresql.utils import (
@@ -74,6 +75,7 @@ async def query_revoke_user(
         else:
             raise UserError(f"Update error: {result}")
     else:
+        await add_certificate(conn, organization_id, revoked_user_certificate)
         await send_signal(
             conn,
             BackendEventUserUpdatedOrRevoked(
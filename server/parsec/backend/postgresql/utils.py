@@ -2,12 +2,16 @@
 from __future__ import annotations
 
 import re
+import sys
 from functools import wraps
 from typing import Any, Awaitable, Callable, Dict, List, Tuple, TypeVar
 
 import triopg
 from typing_extensions import Concatenate, ParamSpec
 
+from parsec.backend.postgresql.signals import batch_signals
+from parsec.backend.postgresql.statements import register_query
+
 T = TypeVar("T")
 P = ParamSpec("P")
 
@@ -36,6 +40,14 @@ class Q:
 
         self._sql = src
         self._stripped_sql = " ".join([x.strip() for x in src.split()])
+        # Registered queries are prepared on each new connection and have their
+        # execution stats recorded (see `parsec.backend.postgresql.statements`)
+        caller = sys._getframe(1)
+        self.registered = register_query(
+            self._stripped_sql,
+            module=caller.f_globals.get("__name__", ""),
+            function=caller.f_code.co_name,
+        )
 
     @property
     def sql(self) -> str:
@@ -231,11 +243,17 @@ COALESCE(
 
 def query(
     in_transaction: bool = False,
+    read_only: bool = False,
 ) -> Callable[
     [Callable[Concatenate[triopg._triopg.TrioConnectionProxy, P], Awaitable[T]]],
     Callable[Concatenate[triopg._triopg.TrioConnectionProxy, P], Awaitable[T]],
 ]:
-    if in_transaction:
+    """
+    `read_only` queries can be run on a read replica (see `PGHandler.read_pool`),
+    their transaction (if any) is declared as read only so that PostgreSQL
+    enforces it.
+    """
+    if in_transaction and read_only:
 
         def decorator(
             fn: Callable[Concatenate[triopg._triopg.TrioConnectionProxy, P], Awaitable[T]]
@@ -244,11 +262,27 @@ def query(
             async def wrapper(
                 conn: triopg._triopg.TrioConnectionProxy, *args: P.args, **kwargs: P.kwargs
             ) -> T:
-                async with conn.transaction():
+                async with conn.transaction(readonly=True):
                     return await fn(conn, *args, **kwargs)
 
             return wrapper
 
+    elif in_transaction:
+
+        def decorator(
+            fn: Callable[Concatenate[triopg._triopg.TrioConnectionProxy, P], Awaitable[T]]
+        ) -> Callable[Concatenate[triopg._triopg.TrioConnectionProxy, P], Awaitable[T]]:
+            @wraps(fn)
+            async def wrapper(
+                conn: triopg._triopg.TrioConnectionProxy, *args: P.args, **kwargs: P.kwargs
+            ) -> T:
+                async with conn.transaction():
+                    # Events sent by the query are coalesced into a single notification
+                    async with batch_signals(conn):
+                        return await fn(conn, *args, **kwargs)
+
+            return wrapper
+
     else:
 
         def decorator(
@@ -15,6 +15,7 @@ from parsec.backend.postgresql.vlob_queries import (
     query_maintenance_get_reencryption_batch,
     query_maintenance_save_reencryption_batch,
     query_poll_changes,
+    query_read,
     query_update,
 )
 from parsec.backend.sequester import BaseSequesterService, SequesterDisabledError
@@ -141,6 +142,7 @@ class PGVlobComponent(BaseVlobComponent):
 
             await query_create(
                 conn,
+                self.dbh.internal_ids,
                 organization_id,
                 author,
                 realm_id,
@@ -160,12 +162,10 @@ class PGVlobComponent(BaseVlobComponent):
         version: int | None = None,
         timestamp: DateTime | None = None,
     ) -> Tuple[int, bytes, DeviceID, DateTime, DateTime, int]:
-        # TODO: fix me !
-        raise NotImplementedError
-        # async with self.dbh.pool.acquire() as conn:
-        # return await query_read(
-        #     conn, organization_id, author, encryption_revision, vlob_id, version, timestamp
-        # )
+        async with self.dbh.read_pool(organization_id).acquire() as conn:
+            return await query_read(
+                conn, organization_id, author, encryption_revision, vlob_id, version, timestamp
+            )
 
     @retry_on_unique_violation
     async def update(
@@ -192,6 +192,7 @@ class PGVlobComponent(BaseVlobComponent):
 
             return await query_update(
                 conn,
+                self.dbh.internal_ids,
                 organization_id,
                 author,
                 encryption_revision,
@@ -205,13 +206,13 @@ class PGVlobComponent(BaseVlobComponent):
     async def poll_changes(
         self, organization_id: OrganizationID, author: DeviceID, realm_id: VlobID, checkpoint: int
     ) -> Tuple[int, Dict[VlobID, int]]:
-        async with self.dbh.pool.acquire() as conn:
+        async with self.dbh.read_pool(organization_id).acquire() as conn:
             return await query_poll_changes(conn, organization_id, author, realm_id, checkpoint)
 
     async def list_versions(
         self, organization_id: OrganizationID, author: DeviceID, vlob_id: VlobID
     ) -> Dict[int, Tuple[DateTime, DeviceID]]:
-        async with self.dbh.pool.acquire() as conn:
+        async with self.dbh.read_pool(organization_id).acquire() as conn:
             return await query_list_versions(conn, organization_id, author, vlob_id)
 
     async def maintenance_get_reencryption_batch(
@@ -6,6 +6,7 @@ from typing import List, Tuple
 import triopg
 
 from parsec._parsec import DeviceID, OrganizationID, VlobID
+from parsec.backend.postgresql.usage import add_realm_usage
 from parsec.backend.postgresql.utils import (
     Q,
     q_organization_internal_id,
@@ -64,7 +65,8 @@ INSERT INTO vlob_atom(
     size,
     author,
     created_on,
-    deleted_on
+    deleted_on,
+    certificate_index
 )
 SELECT
     organization,
@@ -81,13 +83,22 @@ SELECT
     $blob_len,
     author,
     created_on,
-    deleted_on
+    deleted_on,
+    certificate_index
 FROM vlob_atom
 WHERE
     organization = { q_organization_internal_id("$organization_id") }
     AND vlob_id = $vlob_id
     AND version = $version
 ON CONFLICT DO NOTHING
+RETURNING
+    organization,
+    (
+        SELECT realm
+        FROM vlob_encryption_revision
+        WHERE vlob_encryption_revision._id = vlob_atom.vlob_encryption_revision
+    ) AS realm,
+    created_on
 """
 )
 
@@ -170,7 +181,7 @@ async def query_maintenance_save_reencryption_batch(
         conn, organization_id, author, realm_id, encryption_revision
     )
     for vlob_id, version, blob in batch:
-        await conn.execute(
+        row = await conn.fetchrow(
             *_q_maintenance_save_reencryption_batch(
                 organization_id=organization_id.str,
                 realm_id=realm_id,
@@ -181,6 +192,15 @@ async def query_maintenance_save_reencryption_batch(
                 blob_len=len(blob),
             )
         )
+        # No row if the vlob atom has already been reencrypted
+        if row:
+            await add_realm_usage(
+                conn,
+                row["organization"],
+                row["realm"],
+                row["created_on"],
+                reencrypted_vlobs_size=len(blob),
+            )
 
     rep = await conn.fetchrow(
         *_q_maintenance_save_reencryption_batch_get_stat(
@@ -15,81 +15,109 @@ from parsec.backend.postgresql.utils import (
     query,
 )
 from parsec.backend.postgresql.vlob_queries.utils import (
+    CAN_READ_ROLES,
     _check_realm_and_read_access,
-    _get_last_role_granted_on,
+    _check_realm_status,
+    _check_role,
     _get_realm_id_from_vlob_id,
 )
+from parsec.backend.realm import MaintenanceType, RealmStatus
+from parsec.backend.utils import OperationKind
 from parsec.backend.vlob import VlobNotFoundError, VlobVersionError
 
-_q_read_data_without_timestamp = Q(
+# Everything needed by a vlob read is fetched in a single statement: the status
+# of the vlob's realm, the current role of the user doing the read, the vlob
+# atom (with the certificate index at its creation) and the last role change
+# of its author. No row is returned if the vlob
+# doesn't exist, and vlob atom fields are NULL if the requested version doesn't exist.
+_q_read = Q(
     f"""
-SELECT
-    version,
-    blob,
-    { q_device(_id="author", select="device_id") } as author,
-    created_on
-FROM vlob_atom
-WHERE
-    vlob_encryption_revision = {
-        q_vlob_encryption_revision_internal_id(
-            organization_id="$organization_id",
-            realm_id="$realm_id",
-            encryption_revision="$encryption_revision",
-        )
-    }
-    AND vlob_id = $vlob_id
-ORDER BY version DESC
-LIMIT 1
-"""
-)
-
-_q_read_data_with_timestamp = Q(
-    f"""
-SELECT
-    version,
-    blob,
-    { q_device(_id="author", select="device_id") } as author,
-    created_on
-FROM vlob_atom
-WHERE
-    vlob_encryption_revision = {
-        q_vlob_encryption_revision_internal_id(
-            organization_id="$organization_id",
-            realm_id="$realm_id",
-            encryption_revision="$encryption_revision",
-        )
-    }
-    AND vlob_id = $vlob_id
-    AND created_on <= $timestamp
-ORDER BY version DESC
-LIMIT 1
-"""
+WITH cte_realm AS (
+    SELECT
+        realm._id,
+        realm.realm_id,
+        realm.encryption_revision,
+        { q_device(_id="realm.maintenance_started_by", select="device_id") } AS maintenance_started_by,
+        realm.maintenance_started_on,
+        realm.maintenance_type
+    FROM vlob_atom
+    INNER JOIN vlob_encryption_revision
+    ON vlob_atom.vlob_encryption_revision = vlob_encryption_revision._id
+    INNER JOIN realm
+    ON vlob_encryption_revision.realm = realm._id
+    WHERE
+        vlob_atom.organization = { q_organization_internal_id("$organization_id") }
+        AND vlob_atom.vlob_id = $vlob_id
+    LIMIT 1
+),
+cte_user AS (
+    SELECT _id
+    FROM user_
+    WHERE
+        organization = { q_organization_internal_id("$organization_id") }
+        AND user_id = $user_id
+),
+cte_vlob AS (
+    SELECT
+        vlob_atom.version,
+        vlob_atom.blob,
+        device.device_id AS author,
+        device.user_ AS author_user,
+        vlob_atom.created_on,
+        vlob_atom.certificate_index
+    FROM vlob_atom
+    INNER JOIN device
+    ON vlob_atom.author = device._id
+    WHERE
+        vlob_atom.vlob_encryption_revision = {
+            q_vlob_encryption_revision_internal_id(
+                realm="(SELECT _id FROM cte_realm)",
+                encryption_revision="$encryption_revision",
+            )
+        }
+        AND vlob_atom.vlob_id = $vlob_id
+        AND ($version::INTEGER IS NULL OR vlob_atom.version = $version)
+        AND ($timestamp::TIMESTAMPTZ IS NULL OR vlob_atom.created_on <= $timestamp)
+    ORDER BY vlob_atom.version DESC
+    LIMIT 1
 )
-
-
-_q_read_data_with_version = Q(
-    f"""
 SELECT
-    version,
-    blob,
-    { q_device(_id="author", select="device_id") } as author,
-    created_on
-FROM vlob_atom
-WHERE
-    vlob_encryption_revision = {
-        q_vlob_encryption_revision_internal_id(
-            organization_id="$organization_id",
-            realm_id="$realm_id",
-            encryption_revision="$encryption_revision",
-        )
-    }
-    AND vlob_id = $vlob_id
-    AND version = $version
+    cte_realm.realm_id,
+    cte_realm.encryption_revision,
+    cte_realm.maintenance_started_by,
+    cte_realm.maintenance_started_on,
+    cte_realm.maintenance_type,
+    EXISTS(SELECT 1 FROM cte_user) AS user_exists,
+    (
+        SELECT realm_user_role.role
+        FROM realm_user_role
+        WHERE
+            realm_user_role.realm = cte_realm._id
+            AND realm_user_role.user_ = (SELECT _id FROM cte_user)
+        ORDER BY realm_user_role.certified_on DESC
+        LIMIT 1
+    ) AS role,
+    cte_vlob.version,
+    cte_vlob.blob,
+    cte_vlob.author,
+    cte_vlob.created_on,
+    cte_vlob.certificate_index,
+    (
+        SELECT realm_user_role.certified_on
+        FROM realm_user_role
+        WHERE
+            realm_user_role.realm = cte_realm._id
+            AND realm_user_role.user_ = cte_vlob.author_user
+        ORDER BY realm_user_role.certified_on DESC
+        LIMIT 1
+    ) AS author_last_role_granted_on
+FROM cte_realm
+LEFT JOIN cte_vlob ON TRUE
 """
 )
 
 
-@query(in_transaction=True)
+@query(read_only=True)
 async def query_read(
     conn: triopg._triopg.TrioConnectionProxy,
     organization_id: OrganizationID,
@@ -98,58 +126,55 @@ async def query_read(
     vlob_id: VlobID,
     version: int | None = None,
     timestamp: DateTime | None = None,
-) -> Tuple[int, bytes, DeviceID, DateTime, DateTime]:
-    realm_id = await _get_realm_id_from_vlob_id(conn, organization_id, vlob_id)
-    await _check_realm_and_read_access(conn, organization_id, author, realm_id, encryption_revision)
-
-    if version is None:
-        if timestamp is None:
-            data = await conn.fetchrow(
-                *_q_read_data_without_timestamp(
-                    organization_id=organization_id.str,
-                    realm_id=realm_id,
-                    encryption_revision=encryption_revision,
-                    vlob_id=vlob_id,
-                )
-            )
-            assert data  # _get_realm_id_from_vlob_id checks vlob presence
-
-        else:
-            data = await conn.fetchrow(
-                *_q_read_data_with_timestamp(
-                    organization_id=organization_id.str,
-                    realm_id=realm_id,
-                    encryption_revision=encryption_revision,
-                    vlob_id=vlob_id,
-                    timestamp=timestamp,
-                )
-            )
-            if not data:
-                raise VlobVersionError()
-
-    else:
-        data = await conn.fetchrow(
-            *_q_read_data_with_version(
-                organization_id=organization_id.str,
-                realm_id=realm_id,
-                encryption_revision=encryption_revision,
-                vlob_id=vlob_id,
-                version=version,
-            )
+) -> Tuple[int, bytes, DeviceID, DateTime, DateTime, int]:
+    # Single statement, hence no need for a transaction to get a consistent view
+    row = await conn.fetchrow(
+        *_q_read(
+            organization_id=organization_id.str,
+            user_id=author.user_id.str,
+            encryption_revision=encryption_revision,
+            vlob_id=vlob_id,
+            version=version,
+            timestamp=timestamp,
         )
-        if not data:
-            raise VlobVersionError()
+    )
+    if not row:
+        raise VlobNotFoundError(f"Vlob `{vlob_id.hex}` doesn't exist")
+
+    # Checks are done in the same order than for the other vlob operations
+    status = RealmStatus(
+        maintenance_type=MaintenanceType.from_str(row["maintenance_type"])
+        if row["maintenance_type"]
+        else None,
+        maintenance_started_on=row["maintenance_started_on"],
+        maintenance_started_by=DeviceID(row["maintenance_started_by"])
+        if row["maintenance_started_by"]
+        else None,
+        encryption_revision=row["encryption_revision"],
+    )
+    _check_realm_status(
+        status,
+        VlobID.from_hex(row["realm_id"]),
+        encryption_revision,
+        OperationKind.DATA_READ,
+    )
+    if not row["user_exists"]:
+        raise VlobNotFoundError(f"User `{author.user_id.str}` doesn't exist")
+    _check_role(row["role"], CAN_READ_ROLES)
 
-    version, blob, vlob_author, created_on = data
-    assert isinstance(version, int)
-    assert isinstance(blob, bytes)
-    vlob_author = DeviceID(vlob_author)
+    if row["version"] is None:
+        raise VlobVersionError()
 
-    author_last_role_granted_on = await _get_last_role_granted_on(
-        conn, organization_id, realm_id, vlob_author
+    # Given the vlob exists, its author must have had a role
+    assert isinstance(row["author_last_role_granted_on"], DateTime)
+    return (
+        row["version"],
+        row["blob"],
+        DeviceID(row["author"]),
+        row["created_on"],
+        row["author_last_role_granted_on"],
+        row["certificate_index"],
     )
-    assert isinstance(author_last_role_granted_on, DateTime)
-    return version, blob, vlob_author, created_on, author_last_role_granted_on
 
 
 _q_poll_changes = Q(
@@ -183,7 +208,7 @@ ORDER BY version DESC
 )
 
 
-@query(in_transaction=True)
+@query(in_transaction=True, read_only=True)
 async def query_poll_changes(
     conn: triopg._triopg.TrioConnectionProxy,
     organization_id: OrganizationID,
@@ -206,7 +231,7 @@ async def query_poll_changes(
     return (new_checkpoint, changes_since_checkpoint)
 
 
-@query(in_transaction=True)
+@query(in_transaction=True, read_only=True)
 async def query_list_versions(
     conn: triopg._triopg.TrioConnectionProxy,
     organization_id: OrganizationID,
@@ -13,7 +13,7 @@ from parsec.backend.postgresql.utils import (
     q_realm_internal_id,
     q_user_internal_id,
 )
-from parsec.backend.realm import RealmRole
+from parsec.backend.realm import RealmRole, RealmStatus
 from parsec.backend.utils import OperationKind
 from parsec.backend.vlob import (
     VlobAccessError,
@@ -39,6 +39,15 @@ async def _check_realm(
     except RealmNotFoundError as exc:
         raise VlobRealmNotFoundError(*exc.args) from exc
 
+    _check_realm_status(status, realm_id, encryption_revision, operation_kind)
+
+
+def _check_realm_status(
+    status: RealmStatus,
+    realm_id: VlobID,
+    encryption_revision: int | None,
+    operation_kind: OperationKind,
+) -> None:
     # Special case of reading while in reencryption
     if operation_kind == OperationKind.DATA_READ and status.in_reencryption:
         # Starting a reencryption maintenance bumps the encryption revision.
@@ -92,6 +101,9 @@ WHERE user_._id = { q_user_internal_id(organization_id="$organization_id", user_
 )
 
 
+CAN_READ_ROLES = (RealmRole.OWNER, RealmRole.MANAGER, RealmRole.CONTRIBUTOR, RealmRole.READER)
+
+
 async def _check_realm_access(
     conn: triopg._triopg.TrioConnectionProxy,
     organization_id: OrganizationID,
@@ -108,14 +120,18 @@ async def _check_realm_access(
     if not rep:
         raise VlobNotFoundError(f"User `{author.user_id.str}` doesn't exist")
 
-    role = RealmRole.from_str(rep[0]) if rep[0] is not None else None
-    if role not in allowed_roles:
-        raise VlobAccessError()
+    _check_role(rep[0], allowed_roles)
 
     role_granted_on = rep[1]
     return role_granted_on
 
 
+def _check_role(raw_role: str | None, allowed_roles: Tuple[RealmRole, ...]) -> None:
+    role = RealmRole.from_str(raw_role) if raw_role is not None else None
+    if role not in allowed_roles:
+        raise VlobAccessError()
+
+
 async def _check_realm_and_read_access(
     conn: triopg._triopg.TrioConnectionProxy,
     organization_id: OrganizationID,
@@ -126,8 +142,7 @@ async def _check_realm_and_read_access(
     await _check_realm(
         conn, organization_id, realm_id, encryption_revision, OperationKind.DATA_READ
     )
-    can_read_roles = (RealmRole.OWNER, RealmRole.MANAGER, RealmRole.CONTRIBUTOR, RealmRole.READER)
-    await _check_realm_access(conn, organization_id, realm_id, author, can_read_roles)
+    await _check_realm_access(conn, organization_id, realm_id, author, CAN_READ_ROLES)
 
 
 async def _check_realm_and_write_access(
@@ -181,17 +196,3 @@ async def _get_realm_id_from_vlob_id(
     if not realm_id_uuid:
         raise VlobNotFoundError(f"Vlob `{vlob_id.hex}` doesn't exist")
     return VlobID.from_hex(realm_id_uuid)
-
-
-async def _get_last_role_granted_on(
-    conn: triopg._triopg.TrioConnectionProxy,
-    organization_id: OrganizationID,
-    realm_id: VlobID,
-    author: DeviceID,
-) -> DateTime | None:
-    rep = await conn.fetchrow(
-        *_q_check_realm_access(
-            organization_id=organization_id.str, realm_id=realm_id, user_id=author.user_id.str
-        )
-    )
-    return None if rep is None else rep[1]
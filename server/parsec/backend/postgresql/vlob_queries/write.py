@@ -1,7 +1,7 @@
 # Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
 from __future__ import annotations
 
-from typing import Dict
+from typing import Dict, Tuple
 
 import triopg
 from triopg import UniqueViolationError
@@ -15,12 +15,10 @@ from parsec._parsec import (
     VlobID,
 )
 from parsec.backend.postgresql.handler import send_signal
+from parsec.backend.postgresql.internal_ids import InternalIdCache
+from parsec.backend.postgresql.usage import add_realm_usage
 from parsec.backend.postgresql.utils import (
     Q,
-    q_device_internal_id,
-    q_organization_internal_id,
-    q_realm_internal_id,
-    q_user_internal_id,
     q_vlob_encryption_revision_internal_id,
     query,
 )
@@ -35,30 +33,60 @@ from parsec.backend.vlob import (
     VlobVersionError,
 )
 
+# Organization, realm, user and device internal IDs are resolved through
+# `InternalIdCache` (see `_get_internal_ids`) and passed as parameters, which
+# saves a sub-query for each of them in those hot path queries.
+
+
+async def _get_internal_ids(
+    conn: triopg._triopg.TrioConnectionProxy,
+    internal_ids: InternalIdCache,
+    organization_id: OrganizationID,
+    author: DeviceID,
+    realm_id: VlobID,
+) -> Tuple[int | None, int | None, int | None, int | None]:
+    """
+    Returns: organization, realm, author's user and author's device internal IDs
+    """
+    return (
+        await internal_ids.organization(conn, organization_id),
+        await internal_ids.realm(conn, organization_id, realm_id),
+        await internal_ids.user(conn, organization_id, author.user_id),
+        await internal_ids.device(conn, organization_id, author),
+    )
+
+
+# Checkpoints are allocated by incrementing the realm's counter: concurrent
+# writers on the same realm wait on the realm row lock (held until commit, hence
+# the update is done as late as possible in the transaction) instead of all
+# computing the same `MAX(index) + 1` and having to retry on unique violation.
 _q_vlob_updated = Q(
-    f"""
+    """
+WITH cte_index AS (
+    UPDATE realm
+    SET last_vlob_update_index = last_vlob_update_index + 1
+    WHERE _id = $realm_internal_id
+    RETURNING last_vlob_update_index
+)
 INSERT INTO realm_vlob_update (
 realm, index, vlob_atom
 )
 SELECT
-{ q_realm_internal_id(organization_id="$organization_id", realm_id="$realm_id") },
-(
-    SELECT COALESCE(MAX(index) + 1, 1)
-    FROM realm_vlob_update
-    WHERE realm = { q_realm_internal_id(organization_id="$organization_id", realm_id="$realm_id") }
-),
+$realm_internal_id,
+last_vlob_update_index,
 $vlob_atom_internal_id
+FROM cte_index
 RETURNING index
 """
 )
 
 
 _q_set_last_vlob_update = Q(
-    f"""
+    """
 INSERT INTO realm_user_change(realm, user_, last_role_change, last_vlob_update)
 VALUES (
-    { q_realm_internal_id(organization_id="$organization_id", realm_id="$realm_id") },
-    { q_user_internal_id(organization_id="$organization_id", user_id="$user_id") },
+    $realm_internal_id,
+    $user_internal_id,
     NULL,
     $timestamp
 )
@@ -66,8 +94,8 @@ ON CONFLICT (realm, user_)
 DO UPDATE SET last_vlob_update = (
     SELECT GREATEST($timestamp, last_vlob_update)
     FROM realm_user_change
-    WHERE realm={ q_realm_internal_id(organization_id="$organization_id", realm_id="$realm_id") }
-    AND user_={ q_user_internal_id(organization_id="$organization_id", user_id="$user_id") }
+    WHERE realm=$realm_internal_id
+    AND user_=$user_internal_id
     LIMIT 1
 )
 """
@@ -77,6 +105,8 @@ DO UPDATE SET last_vlob_update = (
 async def _set_vlob_updated(
     conn: triopg._triopg.TrioConnectionProxy,
     vlob_atom_internal_id: int,
+    realm_internal_id: int | None,
+    user_internal_id: int | None,
     organization_id: OrganizationID,
     author: DeviceID,
     realm_id: VlobID,
@@ -84,23 +114,21 @@ async def _set_vlob_updated(
     timestamp: DateTime,
     src_version: int = 1,
 ) -> None:
-    index = await conn.fetchval(
-        *_q_vlob_updated(
-            organization_id=organization_id.str,
-            realm_id=realm_id,
-            vlob_atom_internal_id=vlob_atom_internal_id,
-        )
-    )
-
     await conn.execute(
         *_q_set_last_vlob_update(
-            organization_id=organization_id.str,
-            realm_id=realm_id,
-            user_id=author.user_id.str,
+            realm_internal_id=realm_internal_id,
+            user_internal_id=user_internal_id,
             timestamp=timestamp,
         )
     )
 
+    index = await conn.fetchval(
+        *_q_vlob_updated(
+            realm_internal_id=realm_internal_id,
+            vlob_atom_internal_id=vlob_atom_internal_id,
+        )
+    )
+
     await send_signal(
         conn,
         BackendEventRealmVlobsUpdated(
@@ -115,13 +143,13 @@ async def _set_vlob_updated(
 
 
 _q_get_vlob_version = Q(
-    f"""
+    """
 SELECT
     version,
     created_on
 FROM vlob_atom
 WHERE
-    organization = { q_organization_internal_id("$organization_id") }
+    organization = $organization_internal_id
     AND vlob_id = $vlob_id
 ORDER BY version DESC LIMIT 1
 """
@@ -138,14 +166,14 @@ INSERT INTO vlob_atom (
     blob,
     size,
     author,
-    created_on
+    created_on,
+    certificate_index
 )
 SELECT
-    { q_organization_internal_id(organization_id="$organization_id") },
+    $organization_internal_id,
     {
         q_vlob_encryption_revision_internal_id(
-            organization_id="$organization_id",
-            realm_id="$realm_id",
+            realm="$realm_internal_id",
             encryption_revision="$encryption_revision"
         )
     },
@@ -153,8 +181,9 @@ SELECT
     $version,
     $blob,
     $blob_len,
-    { q_device_internal_id(organization_id="$organization_id", device_id="$author") },
-    $timestamp
+    $author_internal_id,
+    $timestamp,
+    (SELECT last_certificate_index FROM organization WHERE _id = $organization_internal_id)
 RETURNING _id
 """
 )
@@ -163,6 +192,7 @@ RETURNING _id
 @query(in_transaction=True)
 async def query_update(
     conn: triopg._triopg.TrioConnectionProxy,
+    internal_ids: InternalIdCache,
     organization_id: OrganizationID,
     author: DeviceID,
     encryption_revision: int,
@@ -176,9 +206,15 @@ async def query_update(
     await _check_realm_and_write_access(
         conn, organization_id, author, realm_id, encryption_revision, timestamp
     )
+    (
+        organization_internal_id,
+        realm_internal_id,
+        user_internal_id,
+        author_internal_id,
+    ) = await _get_internal_ids(conn, internal_ids, organization_id, author, realm_id)
 
     previous = await conn.fetchrow(
-        *_q_get_vlob_version(organization_id=organization_id.str, vlob_id=vlob_id)
+        *_q_get_vlob_version(organization_internal_id=organization_internal_id, vlob_id=vlob_id)
     )
     if not previous:
         raise VlobNotFoundError(f"Vlob `{vlob_id.hex}` doesn't exist")
@@ -192,9 +228,9 @@ async def query_update(
     try:
         vlob_atom_internal_id = await conn.fetchval(
             *_q_insert_vlob_atom(
-                organization_id=organization_id.str,
-                author=author.str,
-                realm_id=realm_id,
+                organization_internal_id=organization_internal_id,
+                author_internal_id=author_internal_id,
+                realm_internal_id=realm_internal_id,
                 encryption_revision=encryption_revision,
                 vlob_id=vlob_id,
                 blob=blob,
@@ -209,17 +245,31 @@ async def query_update(
         raise VlobVersionError()
 
     if sequester_blob:
-        for service_id, blob in sequester_blob.items():
+        for service_id, service_blob in sequester_blob.items():
             await conn.fetchval(
                 *_q_create_sequester_blob(
-                    organization_id=organization_id.str,
+                    organization_internal_id=organization_internal_id,
                     service_id=service_id,
                     vlob_atom_internal_id=vlob_atom_internal_id,
-                    blob=blob,
+                    blob=service_blob,
                 )
             )
+    # Usage counter and realm checkpoint rows are locked until commit, hence
+    # they are updated last
+    await add_realm_usage(
+        conn, organization_internal_id, realm_internal_id, timestamp, vlobs_size=len(blob)
+    )
     await _set_vlob_updated(
-        conn, vlob_atom_internal_id, organization_id, author, realm_id, vlob_id, timestamp, version
+        conn,
+        vlob_atom_internal_id,
+        realm_internal_id,
+        user_internal_id,
+        organization_id,
+        author,
+        realm_id,
+        vlob_id,
+        timestamp,
+        version,
     )
 
 
@@ -233,14 +283,14 @@ INSERT INTO vlob_atom (
     blob,
     size,
     author,
-    created_on
+    created_on,
+    certificate_index
 )
 SELECT
-    { q_organization_internal_id("$organization_id") },
+    $organization_internal_id,
     {
         q_vlob_encryption_revision_internal_id(
-            organization_id="$organization_id",
-            realm_id="$realm_id",
+            realm="$realm_internal_id",
             encryption_revision="$encryption_revision"
         )
     },
@@ -248,22 +298,23 @@ SELECT
     1,
     $blob,
     $blob_len,
-    { q_device_internal_id(organization_id="$organization_id", device_id="$author") },
-    $timestamp
+    $author_internal_id,
+    $timestamp,
+    (SELECT last_certificate_index FROM organization WHERE _id = $organization_internal_id)
 RETURNING _id
 """
 )
 
 
 _q_create_sequester_blob = Q(
-    f"""
+    """
     INSERT INTO sequester_service_vlob_atom(service, vlob_atom, blob)
     SELECT
         (SELECT _id
             FROM sequester_service
             WHERE
                 sequester_service.service_id=$service_id
-                AND sequester_service.organization={ q_organization_internal_id("$organization_id") }),
+                AND sequester_service.organization=$organization_internal_id),
         $vlob_atom_internal_id,
         $blob
     RETURNING _id
@@ -274,6 +325,7 @@ _q_create_sequester_blob = Q(
 @query(in_transaction=True)
 async def query_create(
     conn: triopg._triopg.TrioConnectionProxy,
+    internal_ids: InternalIdCache,
     organization_id: OrganizationID,
     author: DeviceID,
     realm_id: VlobID,
@@ -286,14 +338,20 @@ async def query_create(
     await _check_realm_and_write_access(
         conn, organization_id, author, realm_id, encryption_revision, timestamp
     )
+    (
+        organization_internal_id,
+        realm_internal_id,
+        user_internal_id,
+        author_internal_id,
+    ) = await _get_internal_ids(conn, internal_ids, organization_id, author, realm_id)
 
     # Actually create the vlob
     try:
         vlob_atom_internal_id = await conn.fetchval(
             *_q_create(
-                organization_id=organization_id.str,
-                author=author.str,
-                realm_id=realm_id,
+                organization_internal_id=organization_internal_id,
+                author_internal_id=author_internal_id,
+                realm_internal_id=realm_internal_id,
                 encryption_revision=encryption_revision,
                 vlob_id=vlob_id,
                 blob=blob,
@@ -306,15 +364,28 @@ async def query_create(
         raise VlobAlreadyExistsError()
 
     if sequester_blob:
-        for service_id, blob in sequester_blob.items():
+        for service_id, service_blob in sequester_blob.items():
             await conn.fetchval(
                 *_q_create_sequester_blob(
-                    organization_id=organization_id.str,
+                    organization_internal_id=organization_internal_id,
                     service_id=service_id,
                     vlob_atom_internal_id=vlob_atom_internal_id,
-                    blob=blob,
+                    blob=service_blob,
                 )
             )
+    # Usage counter and realm checkpoint rows are locked until commit, hence
+    # they are updated last
+    await add_realm_usage(
+        conn, organization_internal_id, realm_internal_id, timestamp, vlobs_size=len(blob)
+    )
     await _set_vlob_updated(
-        conn, vlob_atom_internal_id, organization_id, author, realm_id, vlob_id, timestamp
+        conn,
+        vlob_atom_internal_id,
+        realm_internal_id,
+        user_internal_id,
+        organization_id,
+        author,
+        realm_id,
+        vlob_id,
+        timestamp,
     )
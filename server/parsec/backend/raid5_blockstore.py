@@ -3,7 +3,7 @@ from __future__ import annotations
 
 import struct
 from sys import byteorder
-from typing import List, Union
+from typing import Iterable, List, Union
 
 from structlog import get_logger
 from trio import Nursery
@@ -16,7 +16,10 @@ from parsec.utils import open_service_nursery
 logger = get_logger()
 
 
-def _xor_buffers(*buffers: bytes) -> bytes:
+def _xor_buffers(*buffers: bytes | memoryview) -> bytes:
+    # Converting the buffers into big integers makes the XOR done in a single pass over
+    # the whole buffers (instead of byte per byte) by CPython, which is the closest thing
+    # to a vectorized XOR available without a compiled dependency
     buff_len = len(buffers[0])
     xored = int.from_bytes(buffers[0], byteorder)
     for buff in buffers[1:]:
@@ -25,6 +28,25 @@ def _xor_buffers(*buffers: bytes) -> bytes:
     return xored.to_bytes(buff_len, byteorder)
 
 
+def _join_range(buffers: Iterable[bytes | memoryview], start: int, stop: int) -> bytes:
+    """
+    Return the `[start, stop[` range of the concatenation of `buffers`, without
+    building the concatenation: each byte of the range is copied only once.
+    """
+    parts = []
+    offset = 0
+    for buff in buffers:
+        buff_len = len(buff)
+        buff_start = max(start - offset, 0)
+        buff_stop = min(stop - offset, buff_len)
+        if buff_stop > buff_start:
+            parts.append(memoryview(buff)[buff_start:buff_stop])
+        offset += buff_len
+        if offset >= stop:
+            break
+    return b"".join(parts)
+
+
 def split_block_in_chunks(block: bytes, nb_chunks: int) -> List[bytes]:
     payload_size = len(block) + 4  # encode block len as a uint32
     chunk_len = payload_size // nb_chunks
@@ -32,9 +54,11 @@ def split_block_in_chunks(block: bytes, nb_chunks: int) -> List[bytes]:
         chunk_len += 1
     padding_len = chunk_len * nb_chunks - payload_size
 
-    payload = struct.pack("!I", len(block)) + block + b"\x00" * padding_len
+    # The payload is `<block len><block><padding>`, each chunk is copied from a view
+    # on those parts instead of building the payload and then slicing it
+    payload = (struct.pack("!I", len(block)), memoryview(block), bytes(padding_len))
 
-    return [payload[chunk_len * i : chunk_len * (i + 1)] for i in range(nb_chunks)]
+    return [_join_range(payload, chunk_len * i, chunk_len * (i + 1)) for i in range(nb_chunks)]
 
 
 def generate_checksum_chunk(chunks: List[bytes]) -> bytes:
@@ -52,9 +76,9 @@ def rebuild_block_from_chunks(chunks: List[bytes | None], checksum_chunk: bytes
         pass
     # By now, all chunks are valid
     chunks: List[bytes]
-    payload = b"".join(chunks)
-    (block_len,) = struct.unpack("!I", payload[:4])
-    return payload[4 : 4 + block_len]
+    # The block is copied straight from the chunks, the payload is never built
+    (block_len,) = struct.unpack("!I", _join_range(chunks, 0, 4))
+    return _join_range(chunks, 4, 4 + block_len)
 
 
 class RAID5BlockStoreComponent(BaseBlockStoreComponent):
@@ -0,0 +1,248 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+from __future__ import annotations
+
+from typing import Dict, List, Sequence, Tuple
+
+import trio
+from structlog import get_logger
+
+from parsec._parsec import BlockID, OrganizationID
+from parsec.backend.block import BlockStoreError
+from parsec.backend.blockstore import BaseBlockStoreComponent
+from parsec.backend.raid5_blockstore import rebuild_block_from_chunks, split_block_in_chunks
+from parsec.utils import open_service_nursery
+
+logger = get_logger()
+
+# When reading a block, an extra shard is requested each time this delay (in seconds)
+# elapses without having received enough shards, so a slow node doesn't slow down the read
+DEFAULT_HEDGE_DELAY = 0.2
+
+
+def _generate_gf_tables() -> Tuple[List[int], List[int]]:
+    # Arithmetic in GF(2^8), using the 0x11d polynomial
+    exp = [0] * 512
+    log = [0] * 256
+    x = 1
+    for i in range(255):
+        exp[i] = x
+        log[x] = i
+        x <<= 1
+        if x & 0x100:
+            x ^= 0x11D
+    # Exponents are duplicated so that the sum of two logs can be used as index
+    exp[255:] = exp[:257]
+    return exp, log
+
+
+_GF_EXP, _GF_LOG = _generate_gf_tables()
+
+
+def _gf_mul(a: int, b: int) -> int:
+    if a == 0 or b == 0:
+        return 0
+    return _GF_EXP[_GF_LOG[a] + _GF_LOG[b]]
+
+
+def _gf_inv(a: int) -> int:
+    return _GF_EXP[255 - _GF_LOG[a]]
+
+
+# Multiplying a buffer by a constant is a byte to byte mapping, hence it is done
+# with `bytes.translate` on the whole buffer using the constant's multiplication table
+_GF_MUL_TABLES = [bytes(_gf_mul(c, x) for x in range(256)) for c in range(256)]
+
+
+def _gf_linear_combination(coefficients: Sequence[int], buffers: Sequence[bytes]) -> bytes:
+    # Addition is a XOR, done on the whole buffers converted into big integers
+    buff_len = len(buffers[0])
+    combined = 0
+    for coefficient, buff in zip(coefficients, buffers):
+        if len(buff) != buff_len:
+            raise BlockStoreError("Inconsistent shard sizes")
+        if coefficient == 1:
+            combined ^= int.from_bytes(buff, "little")
+        elif coefficient:
+            combined ^= int.from_bytes(buff.translate(_GF_MUL_TABLES[coefficient]), "little")
+    return combined.to_bytes(buff_len, "little")
+
+
+def _gf_invert_matrix(matrix: List[List[int]]) -> List[List[int]]:
+    # Gauss-Jordan elimination
+    size = len(matrix)
+    rows = [row + [int(i == j) for j in range(size)] for i, row in enumerate(matrix)]
+    for col in range(size):
+        pivot = next(i for i in range(col, size) if rows[i][col])
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        pivot_inv = _gf_inv(rows[col][col])
+        rows[col] = [_gf_mul(pivot_inv, x) for x in rows[col]]
+        for i in range(size):
+            factor = rows[i][col]
+            if i != col and factor:
+                rows[i] = [x ^ _gf_mul(factor, y) for x, y in zip(rows[i], rows[col])]
+    return [row[size:] for row in rows]
+
+
+def generate_parity_matrix(data_shards: int, parity_shards: int) -> List[List[int]]:
+    """
+    The code is systematic: the first shards are the data chunks, the parity shards
+    are computed with a Cauchy matrix so that any `data_shards` shards are enough
+    to rebuild the block.
+    """
+    if data_shards + parity_shards > 256:
+        raise ValueError("Reed-Solomon code cannot have more than 256 shards")
+    return [
+        [_gf_inv(i ^ (parity_shards + j)) for j in range(data_shards)] for i in range(parity_shards)
+    ]
+
+
+def encode_block(block: bytes, parity_matrix: List[List[int]]) -> List[bytes]:
+    chunks = split_block_in_chunks(block, len(parity_matrix[0]))
+    return [*chunks, *(_gf_linear_combination(row, chunks) for row in parity_matrix)]
+
+
+def decode_block(shards: Dict[int, bytes], parity_matrix: List[List[int]]) -> bytes:
+    data_shards = len(parity_matrix[0])
+    # Data chunks are used first, so no decoding is needed if they are all available
+    indexes = sorted(shards)[:data_shards]
+    assert len(indexes) == data_shards
+    if indexes[-1] < data_shards:
+        return rebuild_block_from_chunks([shards[i] for i in indexes], None)
+
+    # Each available shard is a linear combination of the data chunks, so the missing
+    # data chunks are the combinations of the available shards given by the inverse
+    matrix = [
+        [int(i == j) for j in range(data_shards)]
+        if i < data_shards
+        else parity_matrix[i - data_shards]
+        for i in indexes
+    ]
+    inverse = _gf_invert_matrix(matrix)
+    available = [shards[i] for i in indexes]
+    chunks = [
+        shards[i] if i in shards else _gf_linear_combination(inverse[i], available)
+        for i in range(data_shards)
+    ]
+    return rebuild_block_from_chunks(chunks, None)  # type: ignore[arg-type]
+
+
+class ReedSolomonBlockStoreComponent(BaseBlockStoreComponent):
+    """
+    Split the blocks into `len(blockstores) - parity_shards` data shards and
+    `parity_shards` parity shards, one per blockstore. Any `parity_shards`
+    blockstores can fail without losing data.
+    """
+
+    def __init__(
+        self,
+        blockstores: List[BaseBlockStoreComponent],
+        parity_shards: int,
+        partial_create_ok: bool = False,
+        hedge_delay: float = DEFAULT_HEDGE_DELAY,
+    ):
+        self.blockstores = blockstores
+        self.parity_shards = parity_shards
+        self.data_shards = len(blockstores) - parity_shards
+        self._parity_matrix = generate_parity_matrix(self.data_shards, parity_shards)
+        self._partial_create_ok = partial_create_ok
+        self._hedge_delay = hedge_delay
+        self._logger = logger.bind(
+            blockstore_type="RS",
+            data_shards=self.data_shards,
+            parity_shards=parity_shards,
+            partial_create_ok=partial_create_ok,
+        )
+
+    async def read(self, organization_id: OrganizationID, block_id: BlockID) -> bytes:
+        shards: Dict[int, bytes] = {}
+        error_count = 0
+        # Data shards are fetched first (no decoding needed), then the parity shards
+        to_fetch = list(range(len(self.blockstores)))
+
+        async with open_service_nursery() as nursery:
+
+            def _fetch_next_shard() -> bool:
+                if not to_fetch:
+                    return False
+                nursery.start_soon(_fetch_shard, to_fetch.pop(0))
+                return True
+
+            async def _fetch_shard(blockstore_index: int) -> None:
+                nonlocal error_count
+                try:
+                    shard = await self.blockstores[blockstore_index].read(organization_id, block_id)
+                except BlockStoreError:
+                    error_count += 1
+                    if error_count > self.parity_shards:
+                        nursery.cancel_scope.cancel()
+                    else:
+                        # Try to fetch another shard instead
+                        _fetch_next_shard()
+                    return
+                shards[blockstore_index] = shard
+                if len(shards) >= self.data_shards:
+                    nursery.cancel_scope.cancel()
+
+            for _ in range(self.data_shards):
+                _fetch_next_shard()
+            while True:
+                await trio.sleep(self._hedge_delay)
+                if not _fetch_next_shard():
+                    break
+
+        if len(shards) < self.data_shards:
+            # No need to log the detail of the nodes errors, they should have
+            # already been logged before raising their exceptions
+            self._logger.warning(
+                f"Block read error: More than {self.parity_shards} nodes have failed",
+                organization_id=organization_id.str,
+                block_id=block_id.hex,
+            )
+            raise BlockStoreError(f"More than {self.parity_shards} RS nodes have failed")
+
+        return decode_block(shards, self._parity_matrix)
+
+    async def create(
+        self, organization_id: OrganizationID, block_id: BlockID, block: bytes
+    ) -> None:
+        shards = encode_block(block, self._parity_matrix)
+        assert len(shards) == len(self.blockstores)
+
+        # Actually do the upload
+        error_count = 0
+
+        async def _sub_blockstore_create(
+            nursery: trio.Nursery, blockstore_index: int, shard: bytes
+        ) -> None:
+            nonlocal error_count
+            try:
+                await self.blockstores[blockstore_index].create(organization_id, block_id, shard)
+            except BlockStoreError:
+                error_count += 1
+                if error_count > self.parity_shards or not self._partial_create_ok:
+                    # Early exit
+                    nursery.cancel_scope.cancel()
+
+        async with open_service_nursery() as nursery:
+            for i, shard in enumerate(shards):
+                nursery.start_soon(_sub_blockstore_create, nursery, i, shard)
+
+        if self._partial_create_ok:
+            # Up to `parity_shards` blockstores are allowed to fail (see RAID5 regarding
+            # the blockstores that may have written the block anyway)
+            if error_count > self.parity_shards:
+                self._logger.warning(
+                    f"Block create error: More than {self.parity_shards} nodes have failed",
+                    organization_id=organization_id.str,
+                    block_id=block_id.hex,
+                )
+                raise BlockStoreError(f"More than {self.parity_shards} RS nodes have failed")
+
+        else:
+            if error_count:
+                self._logger.warning(
+                    "Block create error: A node have failed",
+                    organization_id=organization_id.str,
+                    block_id=block_id.hex,
+                )
+                raise BlockStoreError("A RS node have failed")
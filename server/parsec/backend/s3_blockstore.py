@@ -2,18 +2,27 @@
 from __future__ import annotations
 
 from functools import partial
+from typing import Any, Callable, Dict, TypeVar
 
 import boto3
 import trio
+from botocore.config import Config as BotoConfig
 from botocore.exceptions import BotoCoreError, ClientError
 from structlog import get_logger
 
 from parsec._parsec import BlockID, OrganizationID
 from parsec.backend.block import BlockStoreError
 from parsec.backend.blockstore import BaseBlockStoreComponent
+from parsec.backend.config import DEFAULT_S3_MAX_CONNECTIONS
 
 logger = get_logger()
 
+T = TypeVar("T")
+
+# Blocks are at most ~512Ko, so reading them by 64Ko chunks keeps the memory
+# footprint of a given request low while not doing too many system calls
+S3_BODY_READ_CHUNK_SIZE = 64 * 1024
+
 
 def build_s3_slug(organization_id: OrganizationID, block_id: BlockID) -> str:
     # The slug uses the UUID canonical textual representation (eg.
@@ -21,7 +30,27 @@ def build_s3_slug(organization_id: OrganizationID, block_id: BlockID) -> str:
     return f"{organization_id.str}/{block_id.hyphenated}"
 
 
+def _read_streaming_body(body: Any) -> bytes:
+    try:
+        buffer = bytearray()
+        for chunk in body.iter_chunks(chunk_size=S3_BODY_READ_CHUNK_SIZE):
+            buffer += chunk
+        return bytes(buffer)
+    finally:
+        # Release the HTTP connection back to the pool as soon as possible
+        body.close()
+
+
 class S3BlockStoreComponent(BaseBlockStoreComponent):
+    """
+    boto3 is a synchronous library, so every request is run in a worker thread
+    to never block the trio event loop.
+
+    The number of concurrent requests is bounded by `max_connections`, which also
+    sizes botocore's HTTP connection pool so that a request never has to wait
+    for (or create) a connection once it has been allowed to run.
+    """
+
     def __init__(
         self,
         s3_region: str,
@@ -29,6 +58,7 @@ class S3BlockStoreComponent(BaseBlockStoreComponent):
         s3_key: str,
         s3_secret: str,
         s3_endpoint_url: str | None = None,
+        max_connections: int = DEFAULT_S3_MAX_CONNECTIONS,
     ):
         self._s3 = None
         self._s3_bucket = None
@@ -38,16 +68,62 @@ class S3BlockStoreComponent(BaseBlockStoreComponent):
             aws_access_key_id=s3_key,
             aws_secret_access_key=s3_secret,
             endpoint_url=s3_endpoint_url,
+            config=BotoConfig(max_pool_connections=max_connections),
         )
         self._s3_bucket = s3_bucket
         self._s3.head_bucket(Bucket=s3_bucket)
         self._logger = logger.bind(blockstore_type="S3", s3_region=s3_region, s3_bucket=s3_bucket)
+        # Requests waiting for a slot are queued by this limiter...
+        self._limiter = trio.CapacityLimiter(max_connections)
+        # ...while this one provides the worker threads, it is never contended given
+        # it has the same size as `self._limiter` (but doing so prevent us from
+        # competing with the rest of the application for trio's default thread limiter)
+        self._thread_limiter = trio.CapacityLimiter(max_connections)
+        self._in_flight = 0
+        self._queued = 0
+        self._requests_count = 0
+        self._total_queue_wait_time = 0.0
+        self._max_queue_wait_time = 0.0
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "max_connections": self._limiter.total_tokens,
+            "in_flight": self._in_flight,
+            "queued": self._queued,
+            "requests": self._requests_count,
+            "total_queue_wait_time": self._total_queue_wait_time,
+            "max_queue_wait_time": self._max_queue_wait_time,
+        }
+
+    async def _run_in_thread(self, fn: Callable[[], T]) -> T:
+        self._queued += 1
+        queued_on = trio.current_time()
+        try:
+            await self._limiter.acquire()
+        finally:
+            self._queued -= 1
+        try:
+            queue_wait_time = trio.current_time() - queued_on
+            self._requests_count += 1
+            self._total_queue_wait_time += queue_wait_time
+            self._max_queue_wait_time = max(self._max_queue_wait_time, queue_wait_time)
+            self._in_flight += 1
+            try:
+                return await trio.to_thread.run_sync(fn, limiter=self._thread_limiter)
+            finally:
+                self._in_flight -= 1
+        finally:
+            self._limiter.release()
+
+    def _get_object_data(self, slug: str) -> bytes:
+        assert self._s3 is not None
+        obj = self._s3.get_object(Bucket=self._s3_bucket, Key=slug)
+        return _read_streaming_body(obj["Body"])
 
     async def read(self, organization_id: OrganizationID, block_id: BlockID) -> bytes:
         slug = build_s3_slug(organization_id=organization_id, block_id=block_id)
         try:
-            assert self._s3 is not None
-            obj = self._s3.get_object(Bucket=self._s3_bucket, Key=slug)
+            return await self._run_in_thread(partial(self._get_object_data, slug))
         except (BotoCoreError, ClientError) as exc:
             self._logger.warning(
                 "Block read error",
@@ -57,15 +133,13 @@ class S3BlockStoreComponent(BaseBlockStoreComponent):
             )
             raise BlockStoreError(exc) from exc
 
-        return obj["Body"].read()
-
     async def create(
         self, organization_id: OrganizationID, block_id: BlockID, block: bytes
     ) -> None:
         slug = build_s3_slug(organization_id=organization_id, block_id=block_id)
         try:
             assert self._s3 is not None
-            await trio.to_thread.run_sync(
+            await self._run_in_thread(
                 partial(self._s3.put_object, Bucket=self._s3_bucket, Key=slug, Body=block)
             )
         except (BotoCoreError, ClientError) as exc:
@@ -0,0 +1,299 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+from __future__ import annotations
+
+import json
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from functools import wraps
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, TypeVar, Union
+
+import trio
+from structlog import get_logger
+
+from parsec.utils import open_service_nursery
+
+logger = get_logger()
+
+# Request-scoped tracing: a sampled request gets a tree of spans (API command,
+# PostgreSQL pool acquire and queries, blockstore operations, outgoing HTTP requests)
+# which is exported in the OTLP/JSON format once the request is done.
+#
+# The current span is stored in a context variable, hence it is inherited by the
+# trio tasks started while it is open, and by the coroutines run on the asyncio
+# loop (i.e. asyncpg). When the request is not sampled there is no current span,
+# and each instrumentation point boils down to a context variable lookup.
+
+# Spans created past this limit are dropped (e.g. a command looping on queries)
+MAX_SPANS_PER_TRACE = 1000
+
+AttributeValue = Union[str, bool, int, float]
+T = TypeVar("T")
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, *args: Any) -> None:
+        return None
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    __slots__ = ("trace_id", "spans", "dropped_spans", "exported", "_tracer")
+
+    def __init__(self, tracer: Tracer):
+        self.trace_id = os.urandom(16).hex()
+        self.spans: List[Span] = []
+        self.dropped_spans = 0
+        self.exported = False
+        self._tracer = tracer
+
+    def add_span(self, span: Span) -> None:
+        if self.exported:
+            # Spans ending after their root (e.g. in a task started by the request)
+            # are not exported
+            return
+        if len(self.spans) < MAX_SPANS_PER_TRACE or span.parent_span_id is None:
+            self.spans.append(span)
+        else:
+            self.dropped_spans += 1
+        if span.parent_span_id is None:
+            self.exported = True
+            self._tracer.exporter.export(self)
+
+
+class Span:
+    __slots__ = (
+        "trace",
+        "name",
+        "span_id",
+        "parent_span_id",
+        "attributes",
+        "start_time",
+        "end_time",
+        "error",
+        "_token",
+    )
+
+    def __init__(
+        self,
+        trace: Trace,
+        name: str,
+        parent_span_id: str | None,
+        attributes: Dict[str, AttributeValue],
+    ):
+        self.trace = trace
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_span_id = parent_span_id
+        self.attributes = attributes
+        self.start_time = 0
+        self.end_time = 0
+        self.error: str | None = None
+
+    def set_attribute(self, key: str, value: AttributeValue) -> None:
+        self.attributes[key] = value
+
+    def __enter__(self) -> Span:
+        self.start_time = time.time_ns()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        self.end_time = time.time_ns()
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        self.trace.add_span(self)
+
+
+class Tracer:
+    def __init__(self, sample_rate: float, exporter: OTLPJsonFileExporter):
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+
+
+_current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+_tracer: Tracer | None = None
+
+
+def current_span() -> Span | None:
+    return _current_span.get()
+
+
+def start_trace(name: str, **attributes: AttributeValue) -> Span | _NoopSpan:
+    """
+    Start the root span of a request if it gets sampled (the span is a child one if
+    a trace is already in progress).
+    """
+    parent = _current_span.get()
+    if parent is not None:
+        return Span(parent.trace, name, parent.span_id, attributes)
+    tracer = _tracer
+    if tracer is None or random.random() >= tracer.sample_rate:
+        return _NOOP_SPAN
+    return Span(Trace(tracer), name, None, attributes)
+
+
+def span(name: str, **attributes: AttributeValue) -> Span | _NoopSpan:
+    """
+    Start a child span of the current span, the returned context manager
+    provides `None` if the request is not traced.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return _NOOP_SPAN
+    return Span(parent.trace, name, parent.span_id, attributes)
+
+
+def traced_request(
+    name: str,
+) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]]:
+    def decorator(fn: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        @wraps(fn)
+        async def wrapper(*args: Any, **kwargs: Any) -> T:
+            with start_trace(name):
+                return await fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _encode_attributes(attributes: Dict[str, AttributeValue]) -> List[Dict[str, Any]]:
+    encoded = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            encoded_value: Dict[str, Any] = {"boolValue": value}
+        elif isinstance(value, int):
+            # 64bits integers are encoded as strings in OTLP/JSON
+            encoded_value = {"intValue": str(value)}
+        elif isinstance(value, float):
+            encoded_value = {"doubleValue": value}
+        else:
+            encoded_value = {"stringValue": str(value)}
+        encoded.append({"key": key, "value": encoded_value})
+    return encoded
+
+
+def encode_trace(trace: Trace, service_name: str) -> Dict[str, Any]:
+    """
+    Encode the trace as an OTLP/JSON `ExportTraceServiceRequest`.
+    """
+    spans = []
+    for span in trace.spans:
+        encoded: Dict[str, Any] = {
+            "traceId": trace.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            # SPAN_KIND_SERVER for the root span, SPAN_KIND_INTERNAL otherwise
+            "kind": 2 if span.parent_span_id is None else 1,
+            "startTimeUnixNano": str(span.start_time),
+            "endTimeUnixNano": str(span.end_time),
+            "attributes": _encode_attributes(span.attributes),
+            # STATUS_CODE_ERROR or STATUS_CODE_UNSET
+            "status": {"code": 2, "message": span.error} if span.error else {},
+        }
+        if span.parent_span_id is not None:
+            encoded["parentSpanId"] = span.parent_span_id
+        if span.parent_span_id is None and trace.dropped_spans:
+            encoded["attributes"] += _encode_attributes(
+                {"parsec.dropped_spans": trace.dropped_spans}
+            )
+        spans.append(encoded)
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": _encode_attributes({"service.name": service_name})},
+                "scopeSpans": [{"scope": {"name": "parsec.backend"}, "spans": spans}],
+            }
+        ]
+    }
+
+
+class OTLPJsonFileExporter:
+    """
+    Append the traces to a file in the OTLP/JSON format (one trace per line), as a
+    local stand-in for an OpenTelemetry collector (which can read such a file with
+    its `otlpjsonfile` receiver).
+
+    Traces are written by batch from a thread, and dropped if they are produced
+    faster than they can be written.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        service_name: str = "parsec-backend",
+        flush_interval: float = 1.0,
+        max_queue_size: int = 2048,
+    ):
+        self.path = path
+        self.service_name = service_name
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self.dropped_traces = 0
+        self._queue: List[Trace] = []
+
+    def export(self, trace: Trace) -> None:
+        if len(self._queue) < self.max_queue_size:
+            self._queue.append(trace)
+        else:
+            self.dropped_traces += 1
+
+    def _write(self, traces: List[Trace]) -> None:
+        data = "".join(
+            json.dumps(encode_trace(trace, self.service_name), separators=(",", ":")) + "\n"
+            for trace in traces
+        )
+        with open(self.path, "a", encoding="utf8") as fd:
+            fd.write(data)
+
+    async def flush(self) -> None:
+        traces, self._queue = self._queue, []
+        if not traces:
+            return
+        try:
+            await trio.to_thread.run_sync(self._write, traces)
+        except OSError as exc:
+            logger.warning("Cannot export traces", path=str(self.path), exc_info=exc)
+
+    async def run(self) -> None:
+        while True:
+            await trio.sleep(self.flush_interval)
+            await self.flush()
+
+
+@asynccontextmanager
+async def open_tracing(sample_rate: float, export_path: Path | None) -> AsyncIterator[None]:
+    """
+    Trace a `sample_rate` ratio of the requests (tracing is disabled if 0),
+    exporting the traces to `export_path`.
+    """
+    global _tracer
+
+    if sample_rate <= 0 or export_path is None:
+        yield
+        return
+
+    exporter = OTLPJsonFileExporter(export_path)
+    previous_tracer = _tracer
+    _tracer = Tracer(sample_rate, exporter)
+    try:
+        async with open_service_nursery() as nursery:
+            nursery.start_soon(exporter.run)
+            yield
+            nursery.cancel_scope.cancel()
+    finally:
+        _tracer = previous_tracer
+        with trio.CancelScope(shield=True):
+            await exporter.flush()
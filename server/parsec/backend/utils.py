@@ -1,7 +1,10 @@
 # Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
 from __future__ import annotations
 
+import time
+from contextvars import ContextVar
 from enum import Enum
+from functools import wraps
 from typing import (
     TYPE_CHECKING,
     Any,
@@ -15,14 +18,18 @@ from typing import (
     get_type_hints,
 )
 
+import attr
 from quart import Websocket
 from trio import CancelScope
 from typing_extensions import Final, Literal, ParamSpec
 
-from parsec._parsec import ApiVersion
+from parsec._parsec import ApiVersion, OrganizationID
+from parsec.backend.metrics import COMMAND_DURATION, COMMAND_REPLIES
+from parsec.backend.tracing import span
 from parsec.utils import open_service_nursery
 
 if TYPE_CHECKING:
+    from parsec.backend.admission import AdmissionController
     from parsec.backend.client_context import BaseClientContext
 
     Ctx = TypeVar("Ctx", bound=BaseClientContext)
@@ -88,8 +95,67 @@ def api_ws_cancel_on_client_sending_new_cmd(fn: Callable[P, T]) -> Callable[P, T
     return fn
 
 
+# Organization of the client whose command is being run, for the components tracking
+# what an organization has done across its commands
+current_organization_id: ContextVar[OrganizationID | None] = ContextVar(
+    "current_organization_id", default=None
+)
+
+
+@attr.s(slots=True, auto_attribs=True)
+class ConsistencyFence:
+    """
+    Database position (PostgreSQL LSN) the reads of the client must be consistent
+    with: the client gets it along the replies and sends it back with its next
+    requests, whichever server process they reach.
+    """
+
+    lsn: int = 0
+
+    def update(self, lsn: int) -> None:
+        self.lsn = max(self.lsn, lsn)
+
+
+# Fence of the client whose request is being processed (`None` if the client
+# doesn't keep track of it)
+current_consistency_fence: ContextVar[ConsistencyFence | None] = ContextVar(
+    "current_consistency_fence", default=None
+)
+
+
+def _measure_api(
+    cmd: str, fn: Callable[[BaseClientContext, Any], Awaitable[Any]]
+) -> Callable[[BaseClientContext, Any], Awaitable[Any]]:
+    # Record the reply status of the command, and its duration if it has returned
+    # a reply (e.g. a long-polling command cancelled because its client is gone
+    # would only skew the latencies). The client's organization is exposed to the
+    # components through `current_organization_id` while the command runs.
+    @wraps(fn)
+    async def wrapper(client_ctx: BaseClientContext, req: Any) -> Any:
+        started_at = time.perf_counter()
+        organization_id = getattr(client_ctx, "organization_id", None)
+        token = current_organization_id.set(organization_id)
+        try:
+            with span(f"api.{cmd}") as cmd_span:
+                if cmd_span is not None:
+                    cmd_span.set_attribute("conn_id", client_ctx.conn_id)
+                    if organization_id is not None:
+                        cmd_span.set_attribute("organization_id", organization_id.str)
+                rep = await fn(client_ctx, req)
+        except Exception as exc:
+            COMMAND_REPLIES.inc(cmd, type(exc).__name__)
+            raise
+        finally:
+            current_organization_id.reset(token)
+        COMMAND_DURATION.observe(cmd, value=time.perf_counter() - started_at)
+        COMMAND_REPLIES.inc(cmd, type(rep).__name__)
+        return rep
+
+    return wrapper
+
+
 def collect_apis(
-    *components: Any, include_ping: bool
+    *components: Any, include_ping: bool, admission: AdmissionController | None = None
 ) -> Dict[Type[Any], Callable[[BaseClientContext, Any], Any]]:
     apis: Dict[Type[Any], Callable[[BaseClientContext, Any], Any]] = {}
     for component in components:
@@ -103,8 +169,10 @@ def collect_apis(
             if info["cmd"] == "ping" and not include_ping:
                 continue
 
-            already_present = apis.setdefault(info["req_type"], meth)
-            assert already_present is meth
+            assert info["req_type"] not in apis
+            if admission is not None:
+                meth = admission.wrap_api(info["cmd"], meth)
+            apis[info["req_type"]] = _measure_api(info["cmd"], meth)
 
     return apis
 
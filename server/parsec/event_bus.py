@@ -1,7 +1,17 @@
 # Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
 from __future__ import annotations
 
-from typing import ContextManager, DefaultDict, Dict, Iterator, List, Tuple, Type, Union
+from typing import (
+    Any,
+    ContextManager,
+    DefaultDict,
+    Dict,
+    Hashable,
+    Iterator,
+    Tuple,
+    Type,
+    Union,
+)
 
 try:
     # Introduced in Python 3.8
@@ -39,6 +49,11 @@ class EventFilterCallback(Protocol):
         ...
 
 
+class EventDispatchKeyCallback(Protocol):
+    def __call__(self, event: EventTypes, **kwargs: object) -> Hashable:
+        ...
+
+
 class EventWaiter:
     def __init__(self, filter: EventFilterCallback | None):
         self._filter = filter
@@ -66,12 +81,80 @@ class EventWaiter:
         self._event_result = None
 
 
+# Callbacks are stored in an (insertion ordered) dict so that connection and
+# disconnection are O(1) while keeping the dispatch order.
+# A callback connected multiple times to the same event is stored once along with
+# its number of connections: it is called once per connection (consecutively) and
+# stays connected until all the connections have been undone.
+#
+# `send` iterates over the handlers without copying them, so a callback connecting or
+# disconnecting callbacks during a dispatch modifies a copy of the handlers instead
+# (see `EventBus._get_handlers_for_update`).
+EventHandlers = Dict[EventCallback, int]
+
+
+def _add_handler(handlers: EventHandlers, cb: EventCallback) -> None:
+    handlers[cb] = handlers.get(cb, 0) + 1
+
+
+def _remove_handler(handlers: EventHandlers, cb: EventCallback) -> None:
+    try:
+        count = handlers[cb]
+    except KeyError:
+        raise ValueError(f"{cb} is not connected")
+    if count > 1:
+        handlers[cb] = count - 1
+    else:
+        del handlers[cb]
+
+
 class EventBus:
+    """
+    Callbacks are either connected to all the occurrences of an event, or only to
+    the ones matching a given dispatch key (e.g. `(organization_id, realm_id)`).
+
+    The latter allows `send` to only reach the concerned callbacks instead of
+    having each of them filter out the events it is not interested in, which
+    is what makes dispatching scale with the number of connected clients.
+    The dispatch key of an event occurrence is computed from `send`'s arguments
+    by the callback registered with `set_dispatch_key`.
+    """
+
     def __init__(self) -> None:
-        self._event_handlers: DefaultDict[EventTypes, List[EventCallback]] = defaultdict(list)
+        self._event_handlers: DefaultDict[EventTypes, EventHandlers] = defaultdict(dict)
+        self._keyed_event_handlers: DefaultDict[
+            EventTypes, Dict[Hashable, EventHandlers]
+        ] = defaultdict(dict)
+        self._dispatch_keys: Dict[EventTypes, EventDispatchKeyCallback] = {}
+        # Number of `send` in progress (i.e. nested ones sent by callbacks included)
+        self._dispatching = 0
+        # Number of occurrences sent, and of callbacks they have been dispatched to
+        self._sent_count: DefaultDict[EventTypes, int] = defaultdict(int)
+        self._dispatched_count: DefaultDict[EventTypes, int] = defaultdict(int)
+
+    def dispatch_stats(self) -> Dict[EventTypes, Tuple[int, int]]:
+        """
+        Number of occurrences sent and number of callbacks called (i.e. the fan-out),
+        per event.
+        """
+        return {
+            event: (sent, self._dispatched_count[event]) for event, sent in self._sent_count.items()
+        }
 
     def stats(self) -> Dict[EventTypes, int]:
-        return {event: len(cbs) for event, cbs in self._event_handlers.items() if cbs}
+        stats: Dict[EventTypes, int] = {}
+        for event, cbs in self._event_handlers.items():
+            if cbs:
+                stats[event] = sum(cbs.values())
+        for event, keyed_cbs in self._keyed_event_handlers.items():
+            if keyed_cbs:
+                stats[event] = stats.get(event, 0) + sum(
+                    sum(cbs.values()) for cbs in keyed_cbs.values()
+                )
+        return stats
+
+    def set_dispatch_key(self, event: EventTypes, get_key: EventDispatchKeyCallback) -> None:
+        self._dispatch_keys[event] = get_key
 
     def connection_context(self) -> "EventBusConnectionContext":
         return EventBusConnectionContext(self)
@@ -80,16 +163,45 @@ class EventBus:
         # Do not log meta events (event.connected and event.disconnected)
         if "event_type" not in kwargs:
             logger.debug("Send event", event_type=event, **kwargs)
-        for cb in self._event_handlers[event]:
-            try:
-                cb(event, **kwargs)
-            except Exception:
-                logger.exception(
-                    "Unhandled exception in event bus callback",
-                    callback=cb,
-                    event_type=event,
-                    **kwargs,
-                )
+        self._sent_count[event] += 1
+        self._dispatching += 1
+        try:
+            self._dispatch(event, self._event_handlers.get(event), kwargs)
+            keyed_cbs = self._keyed_event_handlers.get(event)
+            if keyed_cbs:
+                key = self._dispatch_keys[event](event, **kwargs)
+                self._dispatch(event, keyed_cbs.get(key), kwargs)
+        finally:
+            self._dispatching -= 1
+
+    def _dispatch(
+        self, event: EventTypes, cbs: EventHandlers | None, kwargs: Dict[str, object]
+    ) -> None:
+        if not cbs:
+            return
+        for cb, count in cbs.items():
+            self._dispatched_count[event] += count
+            for _ in range(count):
+                try:
+                    cb(event, **kwargs)
+                except Exception:
+                    logger.exception(
+                        "Unhandled exception in event bus callback",
+                        callback=cb,
+                        event_type=event,
+                        **kwargs,
+                    )
+
+    def _get_handlers_for_update(
+        self, handlers_per_key: Dict[Any, EventHandlers], key: Hashable
+    ) -> EventHandlers:
+        handlers = handlers_per_key.get(key)
+        if handlers is None:
+            handlers = handlers_per_key[key] = {}
+        elif self._dispatching:
+            # The handlers may be being iterated over by `send`
+            handlers = handlers_per_key[key] = dict(handlers)
+        return handlers
 
     @contextmanager
     def waiter_on(
@@ -117,8 +229,12 @@ class EventBus:
             for event in events:
                 self.disconnect(event, ew._cb)
 
-    def connect(self, event: EventTypes, cb: EventCallback) -> None:
-        self._event_handlers[event].append(cb)
+    def connect(self, event: EventTypes, cb: EventCallback, key: Hashable = None) -> None:
+        if key is None:
+            _add_handler(self._get_handlers_for_update(self._event_handlers, event), cb)
+        else:
+            assert event in self._dispatch_keys, f"No dispatch key configured for {event}"
+            _add_handler(self._get_handlers_for_update(self._keyed_event_handlers[event], key), cb)
         self.send(MetaEvent.EVENT_CONNECTED, event_type=event)
 
     @contextmanager
@@ -132,15 +248,27 @@ class EventBus:
             for event, cb in events:
                 self.disconnect(event, cb)
 
-    def disconnect(self, event: EventTypes, cb: EventCallback) -> None:
-        self._event_handlers[event].remove(cb)
+    def disconnect(self, event: EventTypes, cb: EventCallback, key: Hashable = None) -> None:
+        if key is None:
+            _remove_handler(self._get_handlers_for_update(self._event_handlers, event), cb)
+        else:
+            keyed_cbs = self._keyed_event_handlers[event]
+            if key not in keyed_cbs:
+                raise ValueError(f"{cb} is not connected")
+            cbs = self._get_handlers_for_update(keyed_cbs, key)
+            _remove_handler(cbs, cb)
+            # Don't keep track of empty keys given they are typically short lived
+            # (e.g. a realm that has no longer any connected members)
+            if not cbs:
+                del keyed_cbs[key]
         self.send(MetaEvent.EVENT_DISCONNECTED, event_type=event)
 
 
 class EventBusConnectionContext:
     def __init__(self, event_bus: EventBus):
         self.event_bus = event_bus
-        self.to_disconnect: List[Tuple[EventTypes, EventCallback]] = []
+        # Use a dict to have O(1) disconnection, see `EventHandlers`
+        self.to_disconnect: Dict[Tuple[EventTypes, EventCallback, Hashable], int] = {}
 
     def __enter__(self) -> "EventBusConnectionContext":
         return self
@@ -149,8 +277,9 @@ class EventBusConnectionContext:
         self.clear()
 
     def clear(self) -> None:
-        for event, cb in self.to_disconnect:
-            self.event_bus.disconnect(event, cb)
+        for (event, cb, key), count in self.to_disconnect.items():
+            for _ in range(count):
+                self.event_bus.disconnect(event, cb, key)
         self.to_disconnect.clear()
 
     def send(self, event: EventTypes, **kwargs: object) -> None:
@@ -162,13 +291,17 @@ class EventBusConnectionContext:
     def waiter_on_first(self, *events: EventTypes) -> ContextManager[EventWaiter]:
         return self.event_bus.waiter_on_first(*events)
 
-    def connect(self, event: EventTypes, cb: EventCallback) -> None:
-        self.to_disconnect.append((event, cb))
-        self.event_bus.connect(event, cb)
+    def connect(self, event: EventTypes, cb: EventCallback, key: Hashable = None) -> None:
+        to_disconnect_key = (event, cb, key)
+        self.to_disconnect[to_disconnect_key] = self.to_disconnect.get(to_disconnect_key, 0) + 1
+        self.event_bus.connect(event, cb, key)
 
     def connect_in_context(self, *events: Tuple[EventTypes, EventCallback]) -> ContextManager[None]:
         return self.event_bus.connect_in_context(*events)
 
-    def disconnect(self, event: EventTypes, cb: EventCallback) -> None:
-        self.event_bus.disconnect(event, cb)
-        self.to_disconnect.remove((event, cb))
+    def disconnect(self, event: EventTypes, cb: EventCallback, key: Hashable = None) -> None:
+        self.event_bus.disconnect(event, cb, key)
+        to_disconnect_key = (event, cb, key)
+        count = self.to_disconnect.pop(to_disconnect_key)
+        if count > 1:
+            self.to_disconnect[to_disconnect_key] = count - 1
@@ -3,12 +3,28 @@ from __future__ import annotations
 
 import enum
 import sqlite3
-from contextlib import contextmanager
-from dataclasses import dataclass
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass, field
+from itertools import islice
 from pathlib import Path, PurePath
-from typing import Callable, Dict, Iterator, List, Mapping, Tuple, TypeVar
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Sequence,
+    Set,
+    TextIO,
+    Tuple,
+    TypeVar,
+)
 
 from parsec._parsec import (
+    BlockAccess,
     CryptoError,
     DataError,
     DateTime,
@@ -19,6 +35,7 @@ from parsec._parsec import (
     FolderManifest,
     RealmRoleCertificate,
     RevokedUserCertificate,
+    SecretKey,
     SequesterPrivateKeyDer,
     UserCertificate,
     VerifyKey,
@@ -31,6 +48,13 @@ from parsec.api.data.manifest import ChildManifest
 REALM_EXPORT_DB_MAGIC_NUMBER = 87947
 REALM_EXPORT_DB_VERSION = 1  # Only supported version so far
 
+# Manifests and blocks are fetched from the export database (and decrypted) by batches
+MANIFESTS_BATCH_SIZE = 100
+BLOCKS_BATCH_SIZE = 32
+
+# SQLite default limit on the number of parameters of a query is 999
+assert MANIFESTS_BATCH_SIZE < 999 and BLOCKS_BATCH_SIZE < 999
+
 
 class RealmExportProgress(enum.Enum):
     GENERIC_ERROR = "Error"
@@ -52,6 +76,127 @@ class InconsistentWorkspaceError(RealmExportReaderError):
     pass
 
 
+# Columns of the export database tables (see `OUTPUT_DB_INIT_QUERY` in the backend)
+REALM_EXPORT_DB_TABLES = {
+    "vlob_atom": "_id, vlob_id, version, blob, author, timestamp",
+    "block": "_id, block_id, data, author",
+    "user_": "_id, user_certificate, revoked_user_certificate",
+    "device": "_id, device_certificate",
+    "realm_role": "_id, role_certificate",
+}
+
+
+def _check_export_db(con: sqlite3.Connection, schema: str) -> Tuple[VlobID, VerifyKey]:
+    # Run sanity checks to make sure the open file is a valid SQLite DB containing a realm export
+    try:
+        row = con.execute(
+            f"SELECT version, realm_id, root_verify_key FROM {schema}.info WHERE magic = ?",
+            (REALM_EXPORT_DB_MAGIC_NUMBER,),
+        ).fetchone()
+    except sqlite3.Error as exc:
+        # Multiple reasons we might end up here:
+        # - The file exists but is not a valid SQLite DB
+        # - The SQLite DB is missing the expected table
+        # - The SQLite DB have the expected table but it misses some columns
+        raise InvalidRealmExportDatabaseError(f"Invalid realm export database: {exc}") from exc
+    if not row:
+        # `info` table exists and is valid, but magic number doesn't match
+        raise InvalidRealmExportDatabaseError(
+            f"Invalid realm export database: invalid magic number"
+        )
+    db_version, db_realm_id, db_root_verify_key = row
+    if db_version != REALM_EXPORT_DB_VERSION:
+        raise InvalidRealmExportDatabaseError(
+            f"Unsupported realm export database format: got version `{db_version}` but only version `{REALM_EXPORT_DB_VERSION}` is accepted"
+        )
+    try:
+        realm_id = VlobID.from_bytes(db_realm_id)
+    except ValueError as exc:
+        raise InvalidRealmExportDatabaseError(
+            f"Invalid realm export database: cannot parse realm ID"
+        ) from exc
+    try:
+        root_verify_key = VerifyKey(db_root_verify_key)
+    except CryptoError as exc:
+        raise InvalidRealmExportDatabaseError(
+            f"Invalid realm export database: cannot parse root verify key"
+        ) from exc
+    return realm_id, root_verify_key
+
+
+def _get_export_range(
+    con: sqlite3.Connection, schema: str
+) -> Tuple[Tuple[int, ...], Tuple[int, ...]]:
+    """
+    Return the markers of the export the database is based on (all zero for a full
+    export) and the markers the database goes up to, i.e. the last `_id` of each
+    table followed by the user revocations timestamp.
+    """
+    try:
+        row = con.execute(
+            f"""
+SELECT
+    vlob_atom_after, block_after, user_after, device_after, realm_role_after, revoked_user_after,
+    vlob_atom_until, block_until, user_until, device_until, realm_role_until, revoked_user_until
+FROM {schema}.export_range
+"""
+        ).fetchone()
+    except sqlite3.OperationalError:
+        # Databases created before differential exports are always full exports
+        row = None
+    if row:
+        return tuple(row[:6]), tuple(row[6:])
+    last_ids = []
+    for table in REALM_EXPORT_DB_TABLES:
+        (last_id,) = con.execute(f"SELECT max(_id) FROM {schema}.{table}").fetchone()
+        last_ids.append(last_id or 0)
+    return (0,) * (len(REALM_EXPORT_DB_TABLES) + 1), (*last_ids, 0)
+
+
+def _stack_deltas(
+    con: sqlite3.Connection, deltas: Sequence[Path], realm_id: VlobID, root_verify_key: VerifyKey
+) -> None:
+    """
+    Attach the differential exports to the connection and shadow the tables of the
+    main database by temporary views over the whole stack, so that the queries don't
+    have to know about the differential exports.
+
+    Note SQLite limits the number of attached databases (10 by default).
+    """
+    schemas = ["main"]
+    try:
+        _, until = _get_export_range(con, "main")
+        for i, delta in enumerate(deltas):
+            schema = f"delta{i}"
+            con.execute(f"ATTACH DATABASE ? AS {schema}", (f"file:{delta}?mode=ro",))
+            if _check_export_db(con, schema) != (realm_id, root_verify_key):
+                raise InvalidRealmExportDatabaseError(
+                    f"Differential realm export `{delta}` is for a different realm"
+                )
+            after, delta_until = _get_export_range(con, schema)
+            if after != until:
+                raise InvalidRealmExportDatabaseError(
+                    f"Differential realm export `{delta}` doesn't follow the previous exports"
+                )
+            until = delta_until
+            schemas.append(schema)
+
+        for table, columns in REALM_EXPORT_DB_TABLES.items():
+            union = " UNION ALL ".join(f"SELECT {columns} FROM {s}.{table}" for s in schemas)
+            if table == "user_":
+                # A user revoked after the previous export is present in both exports
+                view = f"SELECT _id, user_certificate, MAX(revoked_user_certificate) AS revoked_user_certificate FROM ({union}) GROUP BY _id"
+            else:
+                # Otherwise the exports contain distinct rows
+                view = union
+            con.execute(f"CREATE TEMP VIEW {table} AS {view}")
+
+    except sqlite3.Error as exc:
+        raise InvalidRealmExportDatabaseError(
+            f"Invalid differential realm export database: {exc}"
+        ) from exc
+
+
 @dataclass
 class RealmExportDb:
     con: sqlite3.Connection
@@ -60,48 +205,22 @@ class RealmExportDb:
 
     @classmethod
     @contextmanager
-    def open(cls, path: Path) -> Iterator[RealmExportDb]:
+    def open(cls, path: Path, deltas: Sequence[Path] = ()) -> Iterator[RealmExportDb]:
+        """
+        `deltas` are the differential exports to stack, in order, on top of the
+        export (which itself can be a differential export if the first ones are
+        not provided).
+        """
         try:
             con = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
         except sqlite3.Error as exc:
             # Database doesn't exists
             raise InvalidRealmExportDatabaseError(f"Invalid realm export database: {exc}") from exc
-        # Run sanity checks to make sure the open file is a valid SQLite DB containing a realm export
-        try:
-            row = con.execute(
-                "SELECT version, realm_id, root_verify_key FROM info WHERE magic = ?",
-                (REALM_EXPORT_DB_MAGIC_NUMBER,),
-            ).fetchone()
-        except sqlite3.Error as exc:
-            # Multiple reasons we might end up here:
-            # - The file exists but is not a valid SQLite DB
-            # - The SQLite DB is missing the expected table
-            # - The SQLite DB have the expected table but it misses some columns
-            raise InvalidRealmExportDatabaseError(f"Invalid realm export database: {exc}") from exc
-        if not row:
-            # `info` table exists and is valid, but magic number doesn't match
-            raise InvalidRealmExportDatabaseError(
-                f"Invalid realm export database: invalid magic number"
-            )
-        db_version, db_realm_id, db_root_verify_key = row
-        if db_version != REALM_EXPORT_DB_VERSION:
-            raise InvalidRealmExportDatabaseError(
-                f"Unsupported realm export database format: got version `{db_version}` but only version `{REALM_EXPORT_DB_VERSION}` is accepted"
-            )
-        try:
-            realm_id = VlobID.from_bytes(db_realm_id)
-        except ValueError as exc:
-            raise InvalidRealmExportDatabaseError(
-                f"Invalid realm export database: cannot parse realm ID"
-            ) from exc
-        try:
-            root_verify_key = VerifyKey(db_root_verify_key)
-        except CryptoError as exc:
-            raise InvalidRealmExportDatabaseError(
-                f"Invalid realm export database: cannot parse root verify key"
-            ) from exc
 
         try:
+            realm_id, root_verify_key = _check_export_db(con, "main")
+            if deltas:
+                _stack_deltas(con, deltas, realm_id, root_verify_key)
             yield cls(con=con, realm_id=realm_id, root_verify_key=root_verify_key)
 
         finally:
@@ -173,22 +292,271 @@ class RealmExportDb:
                 )
 
 
+REALM_EXPORT_CACHE_VERSION = 1
+REALM_EXPORT_CACHE_INIT_QUERY = """
+CREATE TABLE IF NOT EXISTS info(
+    version INTEGER NOT NULL,
+    realm_id BLOB NOT NULL,
+    -- Last `vlob_atom._id` of the export added to `vlob_version`
+    last_indexed_vlob_atom INTEGER NOT NULL
+);
+
+-- Copy of the export's `vlob_atom` table without the blobs, indexed to retrieve
+-- the last version of a vlob at a given date
+CREATE TABLE IF NOT EXISTS vlob_version(
+    vlob_atom INTEGER PRIMARY KEY,
+    vlob_id BLOB NOT NULL,
+    version INTEGER NOT NULL,
+    author INTEGER NOT NULL,
+    timestamp INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS vlob_version_idx ON vlob_version(vlob_id, timestamp);
+"""
+
+
+@dataclass
+class RealmExportCache:
+    """
+    Database kept alongside a realm export, so that extracting the export multiple
+    times (typically at different dates) doesn't redo the same work.
+
+    It only contains an index of the vlob versions per date: no decrypted data
+    are kept, so the cache doesn't weaken the protection of the export by the
+    sequester service key. It is still readable by its owner only, given it
+    reveals the history of the realm (vlob IDs and modification dates).
+    """
+
+    con: sqlite3.Connection
+
+    @classmethod
+    @contextmanager
+    def open(cls, path: Path, db: RealmExportDb) -> Iterator[RealmExportCache]:
+        try:
+            if not path.exists():
+                path.touch(mode=0o600)
+            con = sqlite3.connect(path)
+            con.executescript(REALM_EXPORT_CACHE_INIT_QUERY)
+            row = con.execute(
+                "SELECT version, realm_id, last_indexed_vlob_atom FROM info"
+            ).fetchone()
+            first_vlob_atom, last_vlob_atom = db.con.execute(
+                "SELECT min(_id), max(_id) FROM vlob_atom"
+            ).fetchone()
+            (first_indexed_vlob_atom,) = con.execute(
+                "SELECT min(vlob_atom) FROM vlob_version"
+            ).fetchone()
+            if row and (
+                row[:2] != (REALM_EXPORT_CACHE_VERSION, db.realm_id.bytes)
+                # Cache has indexed exports that are no longer stacked (see `RealmExportDb.open`)
+                or row[2] > (last_vlob_atom or 0)
+                or (first_indexed_vlob_atom or 0) < (first_vlob_atom or 0)
+            ):
+                # Cache has been created for another export
+                con.executescript("DELETE FROM info; DELETE FROM vlob_version;")
+                row = None
+            if not row:
+                con.execute(
+                    "INSERT INTO info (version, realm_id, last_indexed_vlob_atom) VALUES (?, ?, ?)",
+                    (REALM_EXPORT_CACHE_VERSION, db.realm_id.bytes, -1),
+                )
+        except sqlite3.Error as exc:
+            raise RealmExportReaderError(f"Invalid realm export cache database: {exc}") from exc
+
+        try:
+            cache = cls(con=con)
+            cache.update_index(db)
+            yield cache
+
+        finally:
+            con.close()
+
+    def update_index(self, db: RealmExportDb) -> None:
+        """
+        Index the vlob atoms added to the export since the last update (the export
+        being done in increasing order of `vlob_atom._id`).
+        """
+        (last_indexed_vlob_atom,) = self.con.execute(
+            "SELECT last_indexed_vlob_atom FROM info"
+        ).fetchone()
+        cursor = db.con.execute(
+            "SELECT _id, vlob_id, version, author, timestamp FROM vlob_atom WHERE _id > ? ORDER BY _id",
+            (last_indexed_vlob_atom,),
+        )
+        while True:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                break
+            self.con.executemany(
+                "INSERT OR REPLACE INTO vlob_version (vlob_atom, vlob_id, version, author, timestamp) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            last_indexed_vlob_atom = rows[-1][0]
+        self.con.execute("UPDATE info SET last_indexed_vlob_atom = ?", (last_indexed_vlob_atom,))
+        self.con.commit()
+
+    def find_manifests(
+        self, manifest_ids: Sequence[VlobID], filter_timestamp: int
+    ) -> Dict[bytes, Tuple[int, int, int, int]]:
+        # Note SQLite returns the other columns from the row with the max version
+        rows = self.con.execute(
+            f"SELECT vlob_id, MAX(version), author, timestamp, vlob_atom FROM vlob_version WHERE vlob_id IN ({', '.join('?' * len(manifest_ids))}) and timestamp <= ? GROUP BY vlob_id",
+            (*(manifest_id.bytes for manifest_id in manifest_ids), filter_timestamp),
+        ).fetchall()
+        return {row[0]: row[1:] for row in rows}
+
+
+T = TypeVar("T")
+
+
+def _batched(iterable: Iterable[T], size: int) -> Iterator[List[T]]:
+    it = iter(iterable)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+# Decryption is CPU bound (especially manifests that are decrypted with the sequester
+# service RSA key), so it can be done by a pool of worker processes.
+# Note the workers return an error message instead of raising given the exceptions
+# from `parsec._parsec` are not guaranteed to be picklable.
+
+
+def _decrypt(key: SequesterPrivateKeyDer | SecretKey, data: bytes) -> Tuple[bytes | None, str]:
+    try:
+        return key.decrypt(data), ""
+    except CryptoError as exc:
+        return None, str(exc)
+
+
+_worker_decryption_key: SequesterPrivateKeyDer | None = None
+
+
+def _init_decryption_worker(raw_decryption_key: bytes) -> None:
+    global _worker_decryption_key
+    _worker_decryption_key = SequesterPrivateKeyDer(raw_decryption_key)
+
+
+def _decrypt_manifest(blob: bytes) -> Tuple[bytes | None, str]:
+    assert _worker_decryption_key is not None
+    return _decrypt(_worker_decryption_key, blob)
+
+
+def _decrypt_block(raw_key: bytes, data: bytes) -> Tuple[bytes | None, str]:
+    return _decrypt(SecretKey(raw_key), data)
+
+
+def decryption_executor_factory(
+    decryption_key: SequesterPrivateKeyDer, workers: int
+) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_decryption_worker,
+        initargs=(decryption_key.dump(),),
+    )
+
+
+@dataclass
+class ExtractCheckpoint:
+    """
+    Record of the files already extracted, so that an interrupted extraction can be
+    resumed instead of starting over.
+
+    The checkpoint file is append-only, each line identifying the manifest (i.e. vlob
+    ID and version) of a file that has been fully extracted.
+    """
+
+    fd: TextIO
+    extracted: Set[str] = field(default_factory=set)
+
+    @classmethod
+    @contextmanager
+    def open(cls, path: Path) -> Iterator[ExtractCheckpoint]:
+        try:
+            extracted = set(path.read_text().split())
+        except FileNotFoundError:
+            extracted = set()
+        with open(path, "a") as fd:
+            yield cls(fd=fd, extracted=extracted)
+
+    @staticmethod
+    def _key(manifest: FileManifest) -> str:
+        return f"{manifest.id.hex}:{manifest.version}"
+
+    def is_extracted(self, manifest: FileManifest) -> bool:
+        return self._key(manifest) in self.extracted
+
+    def mark_extracted(self, manifest: FileManifest) -> None:
+        key = self._key(manifest)
+        self.extracted.add(key)
+        self.fd.write(f"{key}\n")
+        # The extraction can be interrupted at any time
+        self.fd.flush()
+
+
 @dataclass
 class WorkspaceExport:
     db: RealmExportDb
     decryption_key: SequesterPrivateKeyDer
     devices_form_internal_id: Dict[int, Tuple[DeviceID, VerifyKey]]
     filter_on_date: DateTime
+    # Decryption is done in the current process if no executor is provided
+    executor: Executor | None = None
+    checkpoint: ExtractCheckpoint | None = None
+    cache: RealmExportCache | None = None
 
     M = TypeVar("M", WorkspaceManifest, ChildManifest)
 
-    def load_manifest(self, manifest_id: VlobID, verify_and_load: Callable[..., M]) -> M:
+    def _decrypt_manifests(self, blobs: Sequence[bytes]) -> Iterable[Tuple[bytes | None, str]]:
+        if self.executor is None:
+            return [_decrypt(self.decryption_key, blob) for blob in blobs]
+        return self.executor.map(_decrypt_manifest, blobs)
+
+    def _decrypt_blocks(
+        self, blocks: Sequence[Tuple[BlockAccess, bytes]]
+    ) -> Iterable[Tuple[bytes | None, str]]:
+        if self.executor is None:
+            return [_decrypt(block.key, data) for block, data in blocks]
+        return self.executor.map(
+            _decrypt_block, [block.key.secret for block, _ in blocks], [data for _, data in blocks]
+        )
+
+    def _fetch_manifests(
+        self, manifest_ids: Sequence[VlobID]
+    ) -> Dict[bytes, Tuple[int, int, int, int]]:
         # Convert datetime to integer timestamp with us precision (format used in sqlite dump).
         filter_timestamp = int(self.filter_on_date.timestamp() * 1000000)
-        row = self.db.con.execute(
-            "SELECT version, blob, author, timestamp FROM vlob_atom WHERE vlob_id = ? and timestamp <= ? ORDER BY version DESC LIMIT 1",
-            (manifest_id.bytes, filter_timestamp),
-        ).fetchone()
+        if self.cache is not None:
+            return self.cache.find_manifests(manifest_ids, filter_timestamp)
+        # Note SQLite returns the other columns from the row with the max version
+        rows = self.db.con.execute(
+            f"SELECT vlob_id, MAX(version), author, timestamp, _id FROM vlob_atom WHERE vlob_id IN ({', '.join('?' * len(manifest_ids))}) and timestamp <= ? GROUP BY vlob_id",
+            (*(manifest_id.bytes for manifest_id in manifest_ids), filter_timestamp),
+        ).fetchall()
+        return {row[0]: row[1:] for row in rows}
+
+    def _fetch_blobs(self, vlob_atoms: Sequence[int]) -> Dict[int, bytes]:
+        rows = self.db.con.execute(
+            f"SELECT _id, blob FROM vlob_atom WHERE _id IN ({', '.join('?' * len(vlob_atoms))})",
+            tuple(vlob_atoms),
+        ).fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    def _fetch_blocks(self, blocks: Sequence[BlockAccess]) -> Dict[bytes, bytes]:
+        rows = self.db.con.execute(
+            f"SELECT block_id, data FROM block WHERE block_id IN ({', '.join('?' * len(blocks))})",
+            tuple(block.id.bytes for block in blocks),
+        ).fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    def _verify_manifest(
+        self,
+        manifest_id: VlobID,
+        row: Tuple[int, int, int, int] | None,
+        decrypted: Tuple[bytes | None, str],
+        verify_and_load: Callable[..., M],
+    ) -> M:
         if not row:
             raise InconsistentWorkspaceError(
                 f"Cannot retrieve workspace manifest: vlob {manifest_id.hex} doesn't exist"
@@ -196,9 +564,8 @@ class WorkspaceExport:
 
         try:
             version: int | None = row[0]
-            blob: bytes = row[1]
-            author_internal_id: int = row[2]
-            raw_timestamp: int = row[3]
+            author_internal_id: int = row[1]
+            raw_timestamp: int = row[2]
 
             try:
                 author, author_verify_key = self.devices_form_internal_id[author_internal_id]
@@ -208,7 +575,9 @@ class WorkspaceExport:
                 )
             timestamp = DateTime.from_timestamp(raw_timestamp / 1000000)
 
-            decrypted_blob = self.decryption_key.decrypt(blob)
+            decrypted_blob, decryption_error = decrypted
+            if decrypted_blob is None:
+                raise InconsistentWorkspaceError(decryption_error)
 
             manifest = verify_and_load(
                 signed=decrypted_blob,
@@ -226,6 +595,43 @@ class WorkspaceExport:
                 f"Invalid manifest data from vlob {manifest_id.hex}: {exc}"
             ) from exc
 
+    def load_manifests(
+        self, manifest_ids: Sequence[VlobID], verify_and_load: Callable[..., M]
+    ) -> List[M | InconsistentWorkspaceError]:
+        """
+        Load the manifests by batch, the decryption being done in parallel if an
+        executor is provided.
+        """
+        rows = self._fetch_manifests(manifest_ids)
+        decrypted: Dict[bytes, Tuple[bytes | None, str]] = {}
+        if rows:
+            blobs = self._fetch_blobs([row[3] for row in rows.values()])
+            decrypted.update(
+                zip(rows, self._decrypt_manifests([blobs[row[3]] for row in rows.values()]))
+            )
+
+        manifests: List[Any] = []
+        for manifest_id in manifest_ids:
+            vlob_id = manifest_id.bytes
+            try:
+                manifests.append(
+                    self._verify_manifest(
+                        manifest_id,
+                        rows.get(vlob_id),
+                        decrypted.get(vlob_id, (None, "")),
+                        verify_and_load,
+                    )
+                )
+            except InconsistentWorkspaceError as exc:
+                manifests.append(exc)
+        return manifests
+
+    def load_manifest(self, manifest_id: VlobID, verify_and_load: Callable[..., M]) -> M:
+        (manifest,) = self.load_manifests([manifest_id], verify_and_load)
+        if isinstance(manifest, InconsistentWorkspaceError):
+            raise manifest
+        return manifest
+
     def load_workspace_manifest(self) -> WorkspaceManifest:
         manifest = self.load_manifest(self.db.realm_id, WorkspaceManifest.verify_and_load)
         if not isinstance(manifest, WorkspaceManifest):
@@ -251,35 +657,55 @@ class WorkspaceExport:
                 f"Failed to create folder {output}: {exc}",
             )
 
-        for child_name, child_id in children.items():
-            child_fs_path = fs_path / child_name.str
-            # TODO: this may cause issue on Windows (e.g. `AUX`, `COM1`, `<!>`)
-            child_output = output / child_name.str
-            child_manifest_version = None
-            try:
-                child_manifest = self.load_manifest(child_id, child_manifest_verify_and_load)
-                child_manifest_version = child_manifest.version
-                if isinstance(child_manifest, FileManifest):
-                    yield from self.extract_file(
-                        output=child_output, fs_path=child_fs_path, manifest=child_manifest
-                    )
-                elif isinstance(child_manifest, FolderManifest):
-                    yield from self.extract_children(
-                        output=child_output, fs_path=child_fs_path, children=child_manifest.children
+        for batch in _batched(children.items(), MANIFESTS_BATCH_SIZE):
+            child_manifests = self.load_manifests(
+                [child_id for _, child_id in batch], child_manifest_verify_and_load
+            )
+            for (child_name, child_id), child_manifest in zip(batch, child_manifests):
+                child_fs_path = fs_path / child_name.str
+                # TODO: this may cause issue on Windows (e.g. `AUX`, `COM1`, `<!>`)
+                child_output = output / child_name.str
+                if isinstance(child_manifest, InconsistentWorkspaceError):
+                    yield (
+                        child_fs_path,
+                        RealmExportProgress.INCONSISTENT_MANIFEST,
+                        f"Vlob {child_id.hex} version <unknown>: {child_manifest}",
                     )
-                else:
+                    continue
+
+                try:
+                    if isinstance(child_manifest, FileManifest):
+                        yield from self.extract_file(
+                            output=child_output, fs_path=child_fs_path, manifest=child_manifest
+                        )
+                    elif isinstance(child_manifest, FolderManifest):
+                        yield from self.extract_children(
+                            output=child_output,
+                            fs_path=child_fs_path,
+                            children=child_manifest.children,
+                        )
+                    else:
+                        yield (
+                            child_fs_path,
+                            RealmExportProgress.INCONSISTENT_MANIFEST,
+                            f"Vlob {child_id.hex} version {child_manifest.version}: Expected file or folder manifest, got instead {child_manifest}",
+                        )
+
+                except Exception as exc:
                     yield (
                         child_fs_path,
                         RealmExportProgress.INCONSISTENT_MANIFEST,
-                        f"Vlob {child_id.hex} version {child_manifest.version}: Expected file or folder manifest, got instead {child_manifest}",
+                        f"Vlob {child_id.hex} version {child_manifest.version}: {exc}",
                     )
 
-            except Exception as exc:
-                yield (
-                    child_fs_path,
-                    RealmExportProgress.INCONSISTENT_MANIFEST,
-                    f"Vlob {child_id.hex} version {child_manifest_version or '<unknown>'}: {exc}",
-                )
+    def _is_already_extracted(self, output: Path, manifest: FileManifest) -> bool:
+        if not self.checkpoint or not self.checkpoint.is_extracted(manifest):
+            return False
+        # The file may have been modified or removed since then
+        try:
+            return output.stat().st_size == manifest.size
+        except OSError:
+            return False
 
     def extract_file(
         self, output: Path, fs_path: PurePath, manifest: FileManifest
@@ -289,6 +715,10 @@ class WorkspaceExport:
         """
         yield (fs_path, RealmExportProgress.EXTRACT_IN_PROGRESS, "Extracting file...")
 
+        if self._is_already_extracted(output, manifest):
+            yield (fs_path, RealmExportProgress.EXTRACT_IN_PROGRESS, "File already extracted")
+            return
+
         try:
             fd = open(output, "bw")
         except OSError as exc:
@@ -299,51 +729,62 @@ class WorkspaceExport:
             )
             return
 
+        # Inconsistent blocks won't get better by extracting the file again, however
+        # we should retry if the file couldn't be written
+        write_failed = False
         fd.truncate(manifest.size)
-        for i, block in enumerate(manifest.blocks):
-            yield (
-                fs_path,
-                RealmExportProgress.EXTRACT_IN_PROGRESS,
-                f"Extracting blocks {i+1}/{len(manifest.blocks)}",
+        block_index = 0
+        for batch in _batched(manifest.blocks, BLOCKS_BATCH_SIZE):
+            blocks_data = self._fetch_blocks(batch)
+            found = [block for block in batch if block.id.bytes in blocks_data]
+            decrypted = dict(
+                zip(
+                    (block.id.bytes for block in found),
+                    self._decrypt_blocks([(block, blocks_data[block.id.bytes]) for block in found]),
+                )
             )
 
-            row = self.db.con.execute(
-                "SELECT data FROM block WHERE block_id = ?", (block.id.bytes,)
-            ).fetchone()
-            if not row:
+            for block in batch:
+                block_index += 1
                 yield (
                     fs_path,
-                    RealmExportProgress.INCONSISTENT_BLOCK,
-                    f"Block {block.id.hex} is missing",
+                    RealmExportProgress.EXTRACT_IN_PROGRESS,
+                    f"Extracting blocks {block_index}/{len(manifest.blocks)}",
                 )
-                continue
-
-            try:
-                clear_data = block.key.decrypt(row[0])
 
-            except CryptoError as exc:
-                yield (
-                    fs_path,
-                    RealmExportProgress.INCONSISTENT_BLOCK,
-                    f"Block {block.id.hex}: {exc}",
-                )
-                continue
+                if block.id.bytes not in decrypted:
+                    yield (
+                        fs_path,
+                        RealmExportProgress.INCONSISTENT_BLOCK,
+                        f"Block {block.id.hex} is missing",
+                    )
+                    continue
 
-            try:
-                if fd.tell() != block.offset:
-                    fd.seek(block.offset)
-                if block.size < len(clear_data):
-                    # Shouldn't happen, block.size should be equal to len(clear_data)
-                    fd.write(clear_data[: block.size])
-                else:
-                    fd.write(clear_data)
-            except OSError as exc:
-                yield (
-                    fs_path,
-                    RealmExportProgress.GENERIC_ERROR,
-                    f"Failed to write block {block.id.hex} at offset {block.offset}: {exc}",
-                )
-                continue
+                clear_data, decryption_error = decrypted[block.id.bytes]
+                if clear_data is None:
+                    yield (
+                        fs_path,
+                        RealmExportProgress.INCONSISTENT_BLOCK,
+                        f"Block {block.id.hex}: {decryption_error}",
+                    )
+                    continue
+
+                try:
+                    if fd.tell() != block.offset:
+                        fd.seek(block.offset)
+                    if block.size < len(clear_data):
+                        # Shouldn't happen, block.size should be equal to len(clear_data)
+                        fd.write(clear_data[: block.size])
+                    else:
+                        fd.write(clear_data)
+                except OSError as exc:
+                    write_failed = True
+                    yield (
+                        fs_path,
+                        RealmExportProgress.GENERIC_ERROR,
+                        f"Failed to write block {block.id.hex} at offset {block.offset}: {exc}",
+                    )
+                    continue
 
         try:
             fd.close()
@@ -353,6 +794,10 @@ class WorkspaceExport:
                 RealmExportProgress.GENERIC_ERROR,
                 f"Failed to close file {output}: {exc}",
             )
+            return
+
+        if self.checkpoint and not write_failed:
+            self.checkpoint.mark_extracted(manifest)
 
     def extract_workspace(
         self, output: Path
@@ -381,9 +826,24 @@ class WorkspaceExport:
 
 
 def extract_workspace(
-    output: Path, export_db: Path, decryption_key: SequesterPrivateKeyDer, filter_on_date: DateTime
+    output: Path,
+    export_db: Path,
+    decryption_key: SequesterPrivateKeyDer,
+    filter_on_date: DateTime,
+    workers: int = 1,
+    checkpoint: Path | None = None,
+    cache: Path | None = None,
+    deltas: Sequence[Path] = (),
 ) -> Iterator[Tuple[PurePath | None, RealmExportProgress, str]]:
-    with RealmExportDb.open(export_db) as db:
+    """
+    `deltas` are the differential exports to stack on top of `export_db`, in order.
+    `workers` is the number of processes used for decryption (no pool is used if 1).
+    If `checkpoint` is provided, the files already extracted according to it are
+    skipped, so that an interrupted extraction can be resumed.
+    If `cache` is provided, it is used as `RealmExportCache` database.
+    """
+    with ExitStack() as stack:
+        db = stack.enter_context(RealmExportDb.open(export_db, deltas))
         out_certificates: list[Tuple[int, DeviceCertificate]] = []
         yield from db.load_device_certificates(out_certificates=out_certificates)
         devices_form_internal_id = {
@@ -394,5 +854,14 @@ def extract_workspace(
             decryption_key=decryption_key,
             devices_form_internal_id=devices_form_internal_id,
             filter_on_date=filter_on_date,
+            executor=(
+                stack.enter_context(decryption_executor_factory(decryption_key, workers))
+                if workers > 1
+                else None
+            ),
+            checkpoint=stack.enter_context(ExtractCheckpoint.open(checkpoint))
+            if checkpoint
+            else None,
+            cache=stack.enter_context(RealmExportCache.open(cache, db)) if cache else None,
         )
         yield from wksp.extract_workspace(output=output)
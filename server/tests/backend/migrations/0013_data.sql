@@ -0,0 +1,10 @@
+-- Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+
+
+INSERT INTO notification_payload(
+    _id, payload, created_on
+) VALUES (
+    13000,
+    E'\\x1234567890abcdef',
+    '2021-07-29 10:13:41.699846+00'
+);
@@ -32,6 +32,11 @@ from parsec.backend.raid5_blockstore import (
     split_block_in_chunks,
 )
 from parsec.backend.realm import RealmGrantedRole
+from parsec.backend.reed_solomon_blockstore import (
+    decode_block,
+    encode_block,
+    generate_parity_matrix,
+)
 from tests.backend.common import block_create, block_read
 from tests.common import customize_fixtures
 
@@ -353,6 +358,89 @@ async def test_raid5_block_read_multiple_failure(
     assert f"block_id={block.hex}" in log
 
 
+@pytest.mark.trio
+@customize_fixtures(blockstore_mode="RS")
+async def test_rs_block_create_and_read(alice_ws, realm):
+    await test_block_create_and_read(alice_ws, realm)
+
+
+@pytest.mark.trio
+@customize_fixtures(blockstore_mode="RS")
+async def test_rs_block_create_single_failure(caplog, alice_ws, backend, realm):
+    async def mock_create(organization_id, id, block):
+        await trio.sleep(0)
+        raise BlockStoreError()
+
+    backend.blockstore.blockstores[4].create = mock_create
+
+    rep = await block_create(alice_ws, BLOCK_ID, realm, BLOCK_DATA, check_rep=False)
+    assert isinstance(rep, BlockCreateRepTimeout)
+
+    log = caplog.assert_occurred_once("[warning  ] Block create error: A node have failed")
+    assert f"organization_id=CoolOrg" in log
+    assert f"block_id={BLOCK_ID.hex}" in log
+
+
+@pytest.mark.trio
+@customize_fixtures(blockstore_mode="RS")
+@pytest.mark.parametrize("failing_blockstores", [(0,), (0, 1), (2, 3), (1, 4)])
+async def test_rs_block_read_failures(alice_ws, backend, block, failing_blockstores):
+    async def mock_read(organization_id, id):
+        await trio.sleep(0)
+        raise BlockStoreError()
+
+    for failing_blockstore in failing_blockstores:
+        backend.blockstore.blockstores[failing_blockstore].read = mock_read
+
+    rep = await block_read(alice_ws, block)
+    assert rep == BlockReadRepOk(BLOCK_DATA)
+
+
+@pytest.mark.trio
+@customize_fixtures(blockstore_mode="RS")
+async def test_rs_block_read_too_many_failures(caplog, alice_ws, backend, block):
+    async def mock_read(organization_id, id):
+        await trio.sleep(0)
+        raise BlockStoreError()
+
+    for failing_blockstore in (0, 2, 4):
+        backend.blockstore.blockstores[failing_blockstore].read = mock_read
+
+    rep = await block_read(alice_ws, block)
+    assert isinstance(rep, BlockReadRepTimeout)
+
+    log = caplog.assert_occurred_once("[warning  ] Block read error: More than 2 nodes have failed")
+    assert f"organization_id=CoolOrg" in log
+    assert f"block_id={block.hex}" in log
+
+
+@pytest.mark.trio
+@customize_fixtures(blockstore_mode="RS")
+async def test_rs_block_read_hedged_on_slow_node(alice, backend, block):
+    never_returns = trio.Event()
+    read_calls = []
+
+    def _spy_read(index):
+        vanilla_read = backend.blockstore.blockstores[index].read
+
+        async def _read(organization_id, id):
+            read_calls.append(index)
+            if index == 1:
+                await never_returns.wait()
+            return await vanilla_read(organization_id, id)
+
+        return _read
+
+    for index in range(5):
+        backend.blockstore.blockstores[index].read = _spy_read(index)
+
+    with trio.fail_after(1):
+        assert await backend.blockstore.read(alice.organization_id, block) == BLOCK_DATA
+    # Only the data shards are fetched, then a single parity shard once the hedge
+    # delay has elapsed
+    assert read_calls == [0, 1, 2, 3]
+
+
 @pytest.mark.parametrize(
     "bad_msg",
     [
@@ -478,3 +566,22 @@ def test_split_block(block, nb_blockstores):
         partial_chunks[missing] = None
         rebuilt = rebuild_block_from_chunks(partial_chunks, checksum_chunk)
         assert rebuilt == block
+
+
+@given(
+    block=st.binary(max_size=2**8),
+    data_shards=st.integers(min_value=1, max_value=8),
+    parity_shards=st.integers(min_value=1, max_value=4),
+    seed=st.randoms(),
+)
+def test_reed_solomon_encode_decode(block, data_shards, parity_shards, seed):
+    parity_matrix = generate_parity_matrix(data_shards, parity_shards)
+    shards = encode_block(block, parity_matrix)
+    assert len(shards) == data_shards + parity_shards
+    shard_size = len(shards[0])
+    for shard in shards[1:]:
+        assert len(shard) == shard_size
+
+    # Any `data_shards` shards are enough to rebuild the block
+    available = seed.sample(range(len(shards)), data_shards)
+    assert decode_block({i: shards[i] for i in available}, parity_matrix) == block
@@ -0,0 +1,87 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+from __future__ import annotations
+
+import pytest
+
+from parsec._parsec import BlockID, DateTime, RealmRole, VlobID
+from parsec.backend.realm import RealmGrantedRole
+from tests.common import customize_fixtures
+
+
+@pytest.mark.trio
+@customize_fixtures(backend_force_mocked=True)
+async def test_memory_indexes(backend_factory, alice, bob, realm_factory):
+    async with backend_factory() as backend:
+        realm_id = await realm_factory(backend, alice, now=DateTime(2000, 1, 2))
+        other_realm_id = await realm_factory(backend, alice, now=DateTime(2000, 1, 2))
+        # Bob already has his user manifest realm
+        bob_realms = await backend.realm.get_realms_for_user(bob.organization_id, bob.user_id)
+        assert realm_id not in bob_realms
+
+        for i, role in enumerate((RealmRole.READER, None, RealmRole.CONTRIBUTOR), 3):
+            await backend.realm.update_roles(
+                alice.organization_id,
+                RealmGrantedRole(
+                    certificate=b"<dummy>",
+                    realm_id=realm_id,
+                    user_id=bob.user_id,
+                    role=role,
+                    granted_by=alice.device_id,
+                    granted_on=DateTime(2000, 1, i),
+                ),
+            )
+            expected = {**bob_realms, realm_id: role} if role else bob_realms
+            assert (
+                await backend.realm.get_realms_for_user(bob.organization_id, bob.user_id)
+                == expected
+            )
+        assert await backend.realm.get_current_roles(alice.organization_id, realm_id) == {
+            alice.user_id: RealmRole.OWNER,
+            bob.user_id: RealmRole.CONTRIBUTOR,
+        }
+
+        vlob_ids = [VlobID.new() for _ in range(3)]
+        for vlob_id in vlob_ids:
+            await backend.vlob.create(
+                organization_id=alice.organization_id,
+                author=alice.device_id,
+                realm_id=realm_id,
+                encryption_revision=1,
+                vlob_id=vlob_id,
+                timestamp=DateTime(2000, 1, 10),
+                blob=b"v1",
+            )
+        await backend.vlob.update(
+            organization_id=alice.organization_id,
+            author=alice.device_id,
+            encryption_revision=1,
+            vlob_id=vlob_ids[0],
+            version=2,
+            timestamp=DateTime(2000, 1, 11),
+            blob=b"v2..",
+        )
+        await backend.block.create(
+            organization_id=alice.organization_id,
+            author=alice.device_id,
+            block_id=BlockID.new(),
+            realm_id=other_realm_id,
+            block=b"<block>",
+        )
+
+        for checkpoint, expected in (
+            (0, {vlob_ids[0]: 2, vlob_ids[1]: 1, vlob_ids[2]: 1}),
+            (1, {vlob_ids[0]: 2, vlob_ids[1]: 1, vlob_ids[2]: 1}),
+            (3, {vlob_ids[0]: 2}),
+            (4, {}),
+            (42, {}),
+        ):
+            assert await backend.vlob.poll_changes(
+                alice.organization_id, alice.device_id, realm_id, checkpoint
+            ) == (4, expected)
+
+        stats = await backend.realm.get_stats(alice.organization_id, alice.device_id, realm_id)
+        assert (stats.vlobs_size, stats.blocks_size) == (10, 0)
+        stats = await backend.realm.get_stats(
+            alice.organization_id, alice.device_id, other_realm_id
+        )
+        assert (stats.vlobs_size, stats.blocks_size) == (0, 7)
@@ -0,0 +1,63 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+from __future__ import annotations
+
+import pytest
+import trio
+from triopg import UniqueViolationError
+
+from parsec._parsec import DateTime, VlobID
+from parsec.backend.postgresql import vlob as pg_vlob
+
+
+def _count_unique_violations(monkeypatch) -> dict:
+    counter = {"retries": 0}
+    vanilla_query_create = pg_vlob.query_create
+
+    async def _query_create(*args, **kwargs):
+        try:
+            return await vanilla_query_create(*args, **kwargs)
+        except UniqueViolationError:
+            counter["retries"] += 1
+            raise
+
+    monkeypatch.setattr(pg_vlob, "query_create", _query_create)
+    return counter
+
+
+async def _concurrent_creates(backend, author, realm_id, writers, vlobs_per_writer):
+    async def _writer():
+        for _ in range(vlobs_per_writer):
+            await backend.vlob.create(
+                organization_id=author.organization_id,
+                author=author.device_id,
+                realm_id=realm_id,
+                encryption_revision=1,
+                vlob_id=VlobID.new(),
+                timestamp=DateTime.now(),
+                blob=b"<dummy>",
+            )
+
+    async with trio.open_nursery() as nursery:
+        for _ in range(writers):
+            nursery.start_soon(_writer)
+
+
+@pytest.mark.trio
+@pytest.mark.postgresql
+async def test_concurrent_vlob_creates_get_contiguous_checkpoints(
+    monkeypatch, backend_factory, alice, realm_factory
+):
+    counter = _count_unique_violations(monkeypatch)
+    async with backend_factory(config={"db_max_connections": 10}) as backend:
+        realm_id = await realm_factory(backend, alice)
+        await _concurrent_creates(backend, alice, realm_id, writers=10, vlobs_per_writer=5)
+
+        checkpoint, changes = await backend.vlob.poll_changes(
+            organization_id=alice.organization_id,
+            author=alice.device_id,
+            realm_id=realm_id,
+            checkpoint=0,
+        )
+        assert checkpoint == 50
+        assert len(changes) == 50
+        assert counter["retries"] == 0
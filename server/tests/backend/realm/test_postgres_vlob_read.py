@@ -0,0 +1,113 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+from __future__ import annotations
+
+import pytest
+
+from parsec._parsec import DateTime, VlobID, authenticated_cmds
+from parsec.api.protocol import ApiV2V3_VlobReadRepOk
+from parsec.backend.postgresql.vlob_queries.read import query_read
+from parsec.backend.vlob import (
+    VlobAccessError,
+    VlobEncryptionRevisionError,
+    VlobInMaintenanceError,
+    VlobNotFoundError,
+    VlobVersionError,
+)
+from tests.backend.common import apiv2v3_vlob_read, vlob_read
+
+
+@pytest.mark.trio
+@pytest.mark.postgresql
+async def test_query_read(backend, alice, realm, vlobs):
+    certificates = await backend.user.get_certificates(
+        alice.organization_id, offset=0, redacted=False
+    )
+    async with backend.vlob.dbh.pool.acquire() as conn:
+
+        async def _read(vlob_id=vlobs[0], **kwargs):
+            return await query_read(
+                conn, alice.organization_id, alice.device_id, 1, vlob_id, **kwargs
+            )
+
+        (
+            version,
+            blob,
+            author,
+            created_on,
+            author_last_role_granted_on,
+            certificate_index,
+        ) = await _read()
+        assert (version, blob, author, created_on) == (
+            2,
+            b"r:A b:1 v:2",
+            alice.device_id,
+            DateTime(2000, 1, 3),
+        )
+        assert author_last_role_granted_on == DateTime(2000, 1, 2)
+        # No certificate has been added since the vlob's creation
+        assert certificate_index == len(certificates)
+
+        assert (await _read(version=1))[:2] == (1, b"r:A b:1 v:1")
+        assert (await _read(timestamp=DateTime(2000, 1, 2, 12)))[:2] == (1, b"r:A b:1 v:1")
+        assert (await _read(timestamp=DateTime(2000, 1, 3)))[:2] == (2, b"r:A b:1 v:2")
+        assert (await _read(vlob_id=vlobs[1]))[:2] == (1, b"r:A b:2 v:1")
+
+        with pytest.raises(VlobVersionError):
+            await _read(version=3)
+        with pytest.raises(VlobVersionError):
+            await _read(timestamp=DateTime(2000, 1, 2))
+        with pytest.raises(VlobNotFoundError):
+            await _read(vlob_id=VlobID.new())
+        with pytest.raises(VlobEncryptionRevisionError):
+            await query_read(conn, alice.organization_id, alice.device_id, 2, vlobs[0])
+
+
+@pytest.mark.trio
+@pytest.mark.postgresql
+async def test_query_read_access(backend, alice, bob, realm, vlobs):
+    async with backend.vlob.dbh.pool.acquire() as conn:
+        with pytest.raises(VlobAccessError):
+            await query_read(conn, bob.organization_id, bob.device_id, 1, vlobs[0])
+
+    await backend.realm.start_reencryption_maintenance(
+        alice.organization_id,
+        alice.device_id,
+        realm,
+        2,
+        {alice.user_id: b"whatever"},
+        DateTime(2000, 1, 5),
+    )
+    async with backend.vlob.dbh.pool.acquire() as conn:
+        # Previous encryption revision is still readable during reencryption
+        assert (await query_read(conn, alice.organization_id, alice.device_id, 1, vlobs[0]))[0] == 2
+        with pytest.raises(VlobInMaintenanceError):
+            await query_read(conn, alice.organization_id, alice.device_id, 2, vlobs[0])
+
+
+@pytest.mark.trio
+@pytest.mark.postgresql
+async def test_vlob_read(backend, alice, alice_ws, realm, vlobs):
+    certificates = await backend.user.get_certificates(
+        alice.organization_id, offset=0, redacted=False
+    )
+
+    rep = await vlob_read(alice_ws, vlobs[0])
+    assert rep == authenticated_cmds.latest.vlob_read.RepOk(
+        version=2,
+        blob=b"r:A b:1 v:2",
+        author=alice.device_id,
+        timestamp=DateTime(2000, 1, 3),
+        certificate_index=len(certificates),
+    )
+
+    rep = await apiv2v3_vlob_read(alice_ws, vlobs[0], version=1)
+    assert rep == ApiV2V3_VlobReadRepOk(
+        version=1,
+        blob=b"r:A b:1 v:1",
+        author=alice.device_id,
+        timestamp=DateTime(2000, 1, 2, 1),
+        author_last_role_granted_on=DateTime(2000, 1, 2),
+    )
+
+    rep = await vlob_read(alice_ws, VlobID.new())
+    assert isinstance(rep, authenticated_cmds.latest.vlob_read.RepNotFound)
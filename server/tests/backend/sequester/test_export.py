@@ -2,8 +2,10 @@
 from __future__ import annotations
 
 import sqlite3
+from pathlib import PurePath
 
 import pytest
+import trio
 
 from parsec._parsec import DateTime, HashDigest, SecretKey, SequesterPrivateKeyDer, VlobID
 from parsec.api.data import (
@@ -24,14 +26,20 @@ from parsec.api.protocol import (
     SequesterServiceID,
     UserProfile,
 )
+from parsec.backend.block import BlockStoreError
 from parsec.backend.postgresql.sequester_export import (
     OUTPUT_DB_INIT_QUERY,
+    ExportManifest,
     RealmExporter,
     RealmExporterInputError,
     RealmExporterOutputDbError,
 )
 from parsec.backend.realm import RealmGrantedRole
-from parsec.sequester_export_reader import extract_workspace
+from parsec.sequester_export_reader import (
+    InvalidRealmExportDatabaseError,
+    RealmExportProgress,
+    extract_workspace,
+)
 from tests.common import OrganizationFullData, customize_fixtures, sequester_service_factory
 
 
@@ -422,6 +430,337 @@ async def test_sequester_export_full_run(
             pass
 
 
+class ConcurrencySpyBlockStore:
+    def __init__(self, blockstore):
+        self.blockstore = blockstore
+        self.concurrent_reads = 0
+        self.max_concurrent_reads = 0
+        self.fail_on = None
+
+    async def read(self, organization_id, block_id):
+        self.concurrent_reads += 1
+        self.max_concurrent_reads = max(self.max_concurrent_reads, self.concurrent_reads)
+        try:
+            # Give a chance to the other fetchers to start
+            await trio.sleep(0.01)
+            if block_id == self.fail_on:
+                raise BlockStoreError("Block not available")
+            return await self.blockstore.read(organization_id, block_id)
+        finally:
+            self.concurrent_reads -= 1
+
+
+@customize_fixtures(coolorg_is_sequestered_organization=True)
+@pytest.mark.postgresql
+@pytest.mark.trio
+async def test_sequester_export_blocks_concurrently(
+    tmp_path, coolorg: OrganizationFullData, backend, alice
+):
+    output_db_path = tmp_path / "export.sqlite"
+    s1 = sequester_service_factory(authority=coolorg.sequester_authority, label="Sequester 1")
+    await backend.sequester.create_service(
+        organization_id=coolorg.organization_id, service=s1.backend_service
+    )
+    realm1 = VlobID.new()
+    await backend.realm.create(
+        organization_id=coolorg.organization_id,
+        self_granted_role=RealmGrantedRole(
+            certificate=b"role_cert1",
+            realm_id=realm1,
+            user_id=alice.user_id,
+            role=RealmRole.OWNER,
+            granted_by=alice.device_id,
+            granted_on=DateTime.now(),
+        ),
+    )
+    blocks = {}
+    for i in range(20):
+        block_id = BlockID.new()
+        blocks[block_id] = f"block{i:02}".encode()
+        await backend.block.create(
+            organization_id=coolorg.organization_id,
+            author=alice.device_id,
+            block_id=block_id,
+            realm_id=realm1,
+            block=blocks[block_id],
+        )
+
+    blockstore = ConcurrencySpyBlockStore(backend.blockstore)
+    async with RealmExporter.run(
+        organization_id=coolorg.organization_id,
+        realm_id=realm1,
+        service_id=s1.service_id,
+        output_db_path=output_db_path,
+        input_dbh=backend.sequester.dbh,
+        input_blockstore=blockstore,
+    ) as exporter:
+        _, block_batch_offset_marker = await exporter.compute_blocks_export_status()
+        block_batch_offset_marker = await exporter.export_blocks(
+            batch_size=10, batch_offset_marker=block_batch_offset_marker, max_concurrency=4
+        )
+        assert blockstore.max_concurrent_reads == 4
+        assert exporter.blocks_stats.items == 10
+        assert exporter.blocks_stats.size == 10 * len(b"block00")
+
+        # An error in the middle of a batch doesn't leave a partially exported batch...
+        blockstore.fail_on = list(blocks)[15]
+        with pytest.raises(BlockStoreError):
+            await exporter.export_blocks(
+                batch_size=10, batch_offset_marker=block_batch_offset_marker, max_concurrency=4
+            )
+        assert await exporter.compute_blocks_export_status() == (20, block_batch_offset_marker)
+
+    # ...so the export can be resumed later on
+    blockstore.fail_on = None
+    async with RealmExporter.run(
+        organization_id=coolorg.organization_id,
+        realm_id=realm1,
+        service_id=s1.service_id,
+        output_db_path=output_db_path,
+        input_dbh=backend.sequester.dbh,
+        input_blockstore=blockstore,
+    ) as exporter:
+        _, block_batch_offset_marker = await exporter.compute_blocks_export_status()
+        while True:
+            new_block_batch_offset_marker = await exporter.export_blocks(
+                batch_size=10, batch_offset_marker=block_batch_offset_marker
+            )
+            if new_block_batch_offset_marker <= block_batch_offset_marker:
+                break
+            block_batch_offset_marker = new_block_batch_offset_marker
+
+    con = sqlite3.connect(f"file:{output_db_path}?mode=ro", uri=True)
+    rows = con.execute("SELECT block_id, data from block").fetchall()
+    assert sorted(rows) == sorted((block_id.bytes, data) for block_id, data in blocks.items())
+    # The export is a regular single-file database once the exporter is closed
+    assert con.execute("PRAGMA journal_mode").fetchone() == ("delete",)
+    con.close()
+
+
+@customize_fixtures(coolorg_is_sequestered_organization=True)
+@pytest.mark.postgresql
+@pytest.mark.trio
+async def test_sequester_export_batch_max_size(
+    tmp_path, coolorg: OrganizationFullData, backend, alice
+):
+    output_db_path = tmp_path / "export.sqlite"
+    s1 = sequester_service_factory(authority=coolorg.sequester_authority, label="Sequester 1")
+    await backend.sequester.create_service(
+        organization_id=coolorg.organization_id, service=s1.backend_service
+    )
+    realm1 = VlobID.new()
+    await backend.realm.create(
+        organization_id=coolorg.organization_id,
+        self_granted_role=RealmGrantedRole(
+            certificate=b"role_cert1",
+            realm_id=realm1,
+            user_id=alice.user_id,
+            role=RealmRole.OWNER,
+            granted_by=alice.device_id,
+            granted_on=DateTime.now(),
+        ),
+    )
+    for i in range(5):
+        await backend.vlob.create(
+            organization_id=coolorg.organization_id,
+            author=alice.device_id,
+            realm_id=realm1,
+            encryption_revision=1,
+            vlob_id=VlobID.new(),
+            timestamp=DateTime.now(),
+            blob=b"<dummy>",
+            sequester_blob={s1.service_id: f"s1:vlob{i}v1".encode()},
+        )
+        await backend.block.create(
+            organization_id=coolorg.organization_id,
+            author=alice.device_id,
+            block_id=BlockID.new(),
+            realm_id=realm1,
+            block=f"block{i}".encode(),
+        )
+
+    async with RealmExporter.run(
+        organization_id=coolorg.organization_id,
+        realm_id=realm1,
+        service_id=s1.service_id,
+        output_db_path=output_db_path,
+        input_dbh=backend.sequester.dbh,
+        input_blockstore=backend.blockstore,
+    ) as exporter:
+        # Each sequester blob is 10 bytes long, the batch stops once 25 bytes have been exported
+        vlob_markers = [await exporter.export_vlobs(batch_max_size=25)]
+        while True:
+            marker = await exporter.export_vlobs(
+                batch_offset_marker=vlob_markers[-1], batch_max_size=25
+            )
+            if marker <= vlob_markers[-1]:
+                break
+            vlob_markers.append(marker)
+        assert vlob_markers == [3, 5]
+        # Keyset pagination never re-exports the boundary row
+        assert exporter.vlobs_stats.items == 5
+        assert exporter.vlobs_stats.size == 50
+
+        # Each block is 6 bytes long
+        _, first_marker = await exporter.compute_blocks_export_status()
+        block_markers = [first_marker]
+        while True:
+            marker = await exporter.export_blocks(
+                batch_offset_marker=block_markers[-1], batch_max_size=10
+            )
+            if marker <= block_markers[-1]:
+                break
+            block_markers.append(marker)
+        assert len(block_markers) == 4
+        assert exporter.blocks_stats.items == 5
+        assert exporter.blocks_stats.size == 30
+        assert await exporter.compute_vlobs_export_status() == (5, 5)
+
+    con = sqlite3.connect(f"file:{output_db_path}?mode=ro", uri=True)
+    assert con.execute("SELECT count(*) FROM vlob_atom").fetchone() == (5,)
+    assert con.execute("SELECT count(*) FROM block").fetchone() == (5,)
+    con.close()
+
+
+@customize_fixtures(coolorg_is_sequestered_organization=True)
+@pytest.mark.postgresql
+@pytest.mark.trio
+async def test_sequester_export_since_previous_export(
+    tmp_path, coolorg: OrganizationFullData, backend, alice, bob, adam
+):
+    base_db_path = tmp_path / "export.sqlite"
+    delta_db_path = tmp_path / "export-delta.sqlite"
+    s1 = sequester_service_factory(authority=coolorg.sequester_authority, label="Sequester 1")
+    await backend.sequester.create_service(
+        organization_id=coolorg.organization_id, service=s1.backend_service
+    )
+    realm1 = VlobID.new()
+    await backend.realm.create(
+        organization_id=coolorg.organization_id,
+        self_granted_role=RealmGrantedRole(
+            certificate=b"role_cert1",
+            realm_id=realm1,
+            user_id=alice.user_id,
+            role=RealmRole.OWNER,
+            granted_by=alice.device_id,
+            granted_on=DateTime.now(),
+        ),
+    )
+
+    async def _populate(i: int) -> None:
+        await backend.vlob.create(
+            organization_id=coolorg.organization_id,
+            author=alice.device_id,
+            realm_id=realm1,
+            encryption_revision=1,
+            vlob_id=VlobID.new(),
+            timestamp=DateTime.now(),
+            blob=b"<dummy>",
+            sequester_blob={s1.service_id: f"s1:vlob{i}v1".encode()},
+        )
+        await backend.block.create(
+            organization_id=coolorg.organization_id,
+            author=alice.device_id,
+            block_id=BlockID.new(),
+            realm_id=realm1,
+            block=f"block{i}".encode(),
+        )
+
+    async def _export(output_db_path, since=None) -> None:
+        async with RealmExporter.run(
+            organization_id=coolorg.organization_id,
+            realm_id=realm1,
+            service_id=s1.service_id,
+            output_db_path=output_db_path,
+            input_dbh=backend.sequester.dbh,
+            input_blockstore=backend.blockstore,
+            since=since,
+        ) as exporter:
+            _, vlob_marker = await exporter.compute_vlobs_export_status()
+            await exporter.export_vlobs(batch_offset_marker=vlob_marker)
+            _, block_marker = await exporter.compute_blocks_export_status()
+            await exporter.export_blocks(batch_offset_marker=block_marker)
+
+    for i in range(2):
+        await _populate(i)
+    await backend.user.revoke_user(
+        organization_id=coolorg.organization_id,
+        user_id=adam.user_id,
+        revoked_user_certificate=b"revoked_adam",
+        revoked_user_certifier=alice.device_id,
+        revoked_on=DateTime(2000, 1, 2),
+    )
+    await _export(base_db_path)
+    base = ExportManifest.load(base_db_path)
+    assert base.vlob_atom == 2
+
+    for i in range(2, 5):
+        await _populate(i)
+    await backend.realm.update_roles(
+        organization_id=coolorg.organization_id,
+        new_role=RealmGrantedRole(
+            certificate=b"role_cert2",
+            realm_id=realm1,
+            user_id=bob.user_id,
+            role=RealmRole.READER,
+            granted_by=alice.device_id,
+            granted_on=DateTime.now(),
+        ),
+    )
+    await backend.user.revoke_user(
+        organization_id=coolorg.organization_id,
+        user_id=bob.user_id,
+        revoked_user_certificate=b"revoked_bob",
+        revoked_user_certifier=alice.device_id,
+    )
+
+    # Only the data added since the base export are exported...
+    async with RealmExporter.run(
+        organization_id=coolorg.organization_id,
+        realm_id=realm1,
+        service_id=s1.service_id,
+        output_db_path=delta_db_path,
+        input_dbh=backend.sequester.dbh,
+        input_blockstore=backend.blockstore,
+        since=base,
+    ) as exporter:
+        assert await exporter.compute_vlobs_export_status() == (3, 2)
+        assert await exporter.compute_blocks_export_status() == (3, base.block)
+        # Data added once the export is started are left to the next export...
+        await _populate(5)
+        assert await exporter.compute_vlobs_export_status() == (3, 2)
+        assert await exporter.compute_blocks_export_status() == (3, base.block)
+    # ...even when it is resumed
+    await _export(delta_db_path, since=base)
+
+    con = sqlite3.connect(f"file:{delta_db_path}?mode=ro", uri=True)
+    assert con.execute("SELECT _id, blob FROM vlob_atom ORDER BY _id").fetchall() == [
+        (3, b"s1:vlob2v1"),
+        (4, b"s1:vlob3v1"),
+        (5, b"s1:vlob4v1"),
+    ]
+    assert sorted(data for (data,) in con.execute("SELECT data FROM block")) == [
+        b"block2",
+        b"block3",
+        b"block4",
+    ]
+    assert con.execute("SELECT role_certificate FROM realm_role").fetchall() == [(b"role_cert2",)]
+    # ...along with the users revoked since then (but not the ones revoked before)
+    assert con.execute("SELECT revoked_user_certificate FROM user_").fetchall() == [
+        (b"revoked_bob",)
+    ]
+    assert con.execute("SELECT count(*) FROM device").fetchone() == (0,)
+    con.close()
+
+    # The next differential export is based on the stacked exports
+    delta = ExportManifest.load(delta_db_path)
+    assert (delta.vlob_atom, delta.user_, delta.device) == (5, base.user_, base.device)
+
+    # A differential export cannot be resumed from another base
+    with pytest.raises(RealmExporterOutputDbError):
+        await _export(delta_db_path, since=delta)
+
+
 @pytest.mark.trio
 async def test_export_reader_full_run(tmp_path, coolorg: OrganizationFullData, alice, bob, adam):
     output_db_path = tmp_path / "export.sqlite"
@@ -821,6 +1160,34 @@ async def test_export_reader_full_run(tmp_path, coolorg: OrganizationFullData, a
     assert (dump_path / "folder2/file2").read_bytes() == b"a" * 10 + b"b" * 10
     assert {x.name for x in (dump_path / "folder2/folder3").iterdir()} == set()
 
+    # Extract with a pool of decryption workers and a checkpoint
+    dump_path_resumed = tmp_path / "extract_dump_resumed"
+    checkpoint = tmp_path / "extract_dump_resumed.checkpoint"
+
+    def _extract_with_checkpoint():
+        events = list(
+            extract_workspace(
+                output=dump_path_resumed,
+                export_db=output_db_path,
+                decryption_key=service_decryption_key,
+                filter_on_date=DateTime.now(),
+                workers=2,
+                checkpoint=checkpoint,
+            )
+        )
+        assert all(
+            event_type == RealmExportProgress.EXTRACT_IN_PROGRESS for _, event_type, _ in events
+        )
+        assert (dump_path_resumed / "folder2/file2").read_bytes() == b"a" * 10 + b"b" * 10
+        return {fs_path for fs_path, _, msg in events if msg == "File already extracted"}
+
+    assert _extract_with_checkpoint() == set()
+    # Files already extracted are skipped when running again...
+    assert _extract_with_checkpoint() == {PurePath("/file1"), PurePath("/folder2/file2")}
+    # ...unless they have been modified since then
+    (dump_path_resumed / "folder2/file2").write_bytes(b"")
+    assert _extract_with_checkpoint() == {PurePath("/file1")}
+
     # Extract dump at 2000-03-14, where folder2 was empty
     dump_path_ts = tmp_path / "extract_dump_ts"
     list(
@@ -831,8 +1198,101 @@ async def test_export_reader_full_run(tmp_path, coolorg: OrganizationFullData, a
             filter_on_date=DateTime(2000, 3, 14),
         )
     )
+    # Same thing with a cache, that is reused when extracting at another date
+    cache_path = tmp_path / "export.sqlite.cache"
+    for filter_on_date, output in (
+        (DateTime.now(), tmp_path / "extract_dump_cache"),
+        (DateTime(2000, 3, 14), dump_path_ts),
+    ):
+        events = list(
+            extract_workspace(
+                output=output,
+                export_db=output_db_path,
+                decryption_key=service_decryption_key,
+                filter_on_date=filter_on_date,
+                cache=cache_path,
+            )
+        )
+        assert all(
+            event_type == RealmExportProgress.EXTRACT_IN_PROGRESS for _, event_type, _ in events
+        )
+        # Only the vlobs index is kept, readable by the owner only
+        assert cache_path.stat().st_mode & 0o777 == 0o600
+        con = sqlite3.connect(cache_path)
+        assert {
+            name for (name,) in con.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        } == {"info", "vlob_version"}
+        assert con.execute("SELECT count(*) FROM vlob_version").fetchone() == (len(vlob_atoms),)
+        con.close()
+    assert (tmp_path / "extract_dump_cache/folder2/file2").read_bytes() == b"a" * 10 + b"b" * 10
     # Check the result
     assert {x.name for x in dump_path_ts.iterdir()} == {"file1", "folder1", "folder2"}
     assert (dump_path_ts / "file1").read_bytes() == b""
     assert {x.name for x in (dump_path_ts / "folder1").iterdir()} == set()
     assert {x.name for x in (dump_path_ts / "folder2").iterdir()} == set()
+
+    # Same thing with the export split into a base and a differential export
+    base_db_path = tmp_path / "export-base.sqlite"
+    delta_db_path = tmp_path / "export-delta.sqlite"
+    con = sqlite3.connect(base_db_path)
+    con.executescript(OUTPUT_DB_INIT_QUERY)
+    con.execute(f"ATTACH DATABASE '{output_db_path}' AS full")
+    for table in ("info", "user_", "device", "realm_role", "vlob_atom"):
+        con.execute(f"INSERT INTO {table} SELECT * FROM full.{table}")
+    con.execute("INSERT INTO export_range VALUES (0, 0, 0, 0, 0, 0, 5, 0, 3, 3, 4, 0)")
+    con.execute("DELETE FROM vlob_atom WHERE _id > 5")
+    con.execute("UPDATE user_ SET revoked_user_certificate = NULL")
+    con.commit()
+    con.close()
+    con = sqlite3.connect(delta_db_path)
+    con.executescript(OUTPUT_DB_INIT_QUERY)
+    con.execute(f"ATTACH DATABASE '{output_db_path}' AS full")
+    con.execute("INSERT INTO info SELECT * FROM full.info")
+    con.execute(
+        "INSERT INTO export_range VALUES (5, 0, 3, 3, 4, 0, (SELECT max(_id) FROM full.vlob_atom), (SELECT max(_id) FROM full.block), 3, 3, 4, 0)"
+    )
+    con.execute("INSERT INTO vlob_atom SELECT * FROM full.vlob_atom WHERE _id > 5")
+    con.execute("INSERT INTO block SELECT * FROM full.block")
+    con.execute("INSERT INTO user_ SELECT * FROM full.user_ WHERE _id = 3")
+    con.commit()
+    con.close()
+
+    dump_path_stacked = tmp_path / "extract_dump_stacked"
+    events = list(
+        extract_workspace(
+            output=dump_path_stacked,
+            export_db=base_db_path,
+            deltas=[delta_db_path],
+            decryption_key=service_decryption_key,
+            filter_on_date=DateTime.now(),
+            cache=tmp_path / "export-base.sqlite.cache",
+        )
+    )
+    assert all(event_type == RealmExportProgress.EXTRACT_IN_PROGRESS for _, event_type, _ in events)
+    assert {x.name for x in (dump_path_stacked / "folder2").iterdir()} == {"file2", "folder3"}
+    assert (dump_path_stacked / "folder2/file2").read_bytes() == b"a" * 10 + b"b" * 10
+    # Without the differential export, only the base export is extracted (the cache
+    # indexed while the differential export was stacked is discarded)
+    dump_path_base = tmp_path / "extract_dump_base"
+    list(
+        extract_workspace(
+            output=dump_path_base,
+            export_db=base_db_path,
+            decryption_key=service_decryption_key,
+            filter_on_date=DateTime.now(),
+            cache=tmp_path / "export-base.sqlite.cache",
+        )
+    )
+    assert {x.name for x in (dump_path_base / "folder2").iterdir()} == set()
+
+    # Differential exports must be stacked in order
+    with pytest.raises(InvalidRealmExportDatabaseError):
+        list(
+            extract_workspace(
+                output=tmp_path / "extract_dump_invalid",
+                export_db=base_db_path,
+                deltas=[delta_db_path, delta_db_path],
+                decryption_key=service_decryption_key,
+                filter_on_date=DateTime.now(),
+            )
+        )
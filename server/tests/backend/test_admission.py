@@ -0,0 +1,179 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+from __future__ import annotations
+
+import pytest
+import trio
+
+from parsec._parsec import OrganizationID
+from parsec.backend.admission import AdmissionController, AdmissionRejected
+from parsec.backend.asgi import app_factory
+from parsec.serde import packb
+from tests.common import AuthenticatedRpcApiClient
+
+PING_RAW_REQ = packb({"cmd": "ping", "ping": "foo"})
+
+
+class ClientContext:
+    def __init__(self, organization_id: str):
+        self.organization_id = OrganizationID(organization_id)
+
+
+def _admission_controller(**kwargs) -> AdmissionController:
+    return AdmissionController(
+        **{
+            "max_concurrent_commands": 3,
+            "reserved_capacity": 1,
+            "priority_commands": frozenset({"vlob_read"}),
+            "command_limits": {"organization_stats": 1},
+            "queue_timeout": 10,
+            **kwargs,
+        }
+    )
+
+
+@pytest.mark.trio
+async def test_admission_budgets():
+    admission = _admission_controller()
+    done = trio.Event()
+    started = []
+
+    async def _cmd(client_ctx, req):
+        started.append(req)
+        await done.wait()
+
+    vlob_update = admission.wrap_api("vlob_update", _cmd)
+    vlob_read = admission.wrap_api("vlob_read", _cmd)
+    organization_stats = admission.wrap_api("organization_stats", _cmd)
+    events_listen = admission.wrap_api("events_listen", _cmd)
+    message_get = admission.wrap_api("message_get", _cmd)
+
+    async with trio.open_nursery() as nursery:
+
+        async def _start(cmd_func, req):
+            nursery.start_soon(cmd_func, ClientContext("Org"), req)
+            await trio.testing.wait_all_tasks_blocked()
+
+        await _start(organization_stats, "stats1")
+        await _start(organization_stats, "stats2")
+        # Limited to one at a time
+        assert started == ["stats1"]
+
+        await _start(vlob_update, "update1")
+        await _start(vlob_update, "update2")
+        # The last slot is reserved to the priority commands
+        assert started == ["stats1", "update1"]
+        assert admission.waiting == 2
+
+        await _start(vlob_read, "read")
+        # Long polling commands are not subject to admission control
+        await _start(events_listen, "listen")
+        assert started == ["stats1", "update1", "read", "listen"]
+        assert admission.running == 3
+        # Unlike regular commands
+        await _start(message_get, "message")
+        assert started == ["stats1", "update1", "read", "listen"]
+        assert admission.waiting == 3
+
+        done.set()
+
+    assert sorted(started) == [
+        "listen",
+        "message",
+        "read",
+        "stats1",
+        "stats2",
+        "update1",
+        "update2",
+    ]
+    assert admission.running == 0
+    assert admission.waiting == 0
+
+
+@pytest.mark.trio
+async def test_admission_fair_between_organizations():
+    admission = _admission_controller(max_concurrent_commands=2, reserved_capacity=0)
+    release = {}
+    started = []
+
+    async def _cmd(client_ctx, req):
+        started.append(req)
+        release[req] = trio.Event()
+        await release[req].wait()
+
+    vlob_update = admission.wrap_api("vlob_update", _cmd)
+
+    async with trio.open_nursery() as nursery:
+        for i in range(4):
+            nursery.start_soon(vlob_update, ClientContext("Noisy"), f"noisy{i}")
+            await trio.testing.wait_all_tasks_blocked()
+        nursery.start_soon(vlob_update, ClientContext("Quiet"), "quiet")
+        await trio.testing.wait_all_tasks_blocked()
+        assert started == ["noisy0", "noisy1"]
+
+        # The quiet organization has been queued last, but has no running command
+        release["noisy0"].set()
+        await trio.testing.wait_all_tasks_blocked()
+        assert started == ["noisy0", "noisy1", "quiet"]
+
+        for req in ("noisy1", "quiet", "noisy2", "noisy3"):
+            release[req].set()
+            await trio.testing.wait_all_tasks_blocked()
+
+    assert started == ["noisy0", "noisy1", "quiet", "noisy2", "noisy3"]
+
+
+@pytest.mark.trio
+async def test_admission_queue_timeout(autojump_clock):
+    admission = _admission_controller(max_concurrent_commands=1, reserved_capacity=0)
+    done = trio.Event()
+
+    async def _cmd(client_ctx, req):
+        await done.wait()
+
+    vlob_update = admission.wrap_api("vlob_update", _cmd)
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(vlob_update, ClientContext("Org"), "running")
+        await trio.testing.wait_all_tasks_blocked()
+
+        with pytest.raises(AdmissionRejected) as exc:
+            await vlob_update(ClientContext("Org"), "queued")
+        assert exc.value.retry_after > 0
+        assert admission.waiting == 0
+
+        # A queued command whose client is gone leaves the queue
+        with trio.move_on_after(1):
+            await vlob_update(ClientContext("Org"), "cancelled")
+        assert admission.waiting == 0
+
+        done.set()
+
+    assert admission.running == 0
+
+
+@pytest.mark.trio
+async def test_rpc_server_overloaded(backend_factory, alice):
+    async with backend_factory(
+        config={"admission_max_concurrent_commands": 1, "admission_queue_timeout": 0}
+    ) as backend:
+        client = AuthenticatedRpcApiClient(app_factory(backend).test_client(), alice)
+        rep = await client.send(PING_RAW_REQ, check_rep=False)
+        assert rep.status_code == 200
+
+        # Fill up the only slot
+        done = trio.Event()
+
+        async def _cmd(client_ctx, req):
+            await done.wait()
+
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(
+                backend.admission.wrap_api("vlob_update", _cmd), ClientContext("Org"), None
+            )
+            await trio.testing.wait_all_tasks_blocked()
+
+            rep = await client.send(PING_RAW_REQ, check_rep=False)
+            assert rep.status_code == 503
+            assert rep.headers["Retry-After"] == "1"
+
+            done.set()
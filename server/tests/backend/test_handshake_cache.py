@@ -0,0 +1,184 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+from __future__ import annotations
+
+import pytest
+
+from parsec._parsec import (
+    BackendEventOrganizationExpired,
+    BackendEventUserUpdatedOrRevoked,
+    DateTime,
+    DeviceID,
+    OrganizationID,
+    UserProfile,
+)
+from parsec.backend import BackendApp
+from parsec.backend.handshake_cache import HandshakeCache
+from parsec.backend.organization import OrganizationNotFoundError
+from parsec.backend.user import UserNotFoundError
+from tests.backend.common import authenticated_ping
+from tests.common import AuthenticatedRpcApiClient, LocalDevice
+from tests.common.binder import OrganizationFullData
+
+
+class CallsCounter:
+    def __init__(self, fn):
+        self.fn = fn
+        self.calls = 0
+
+    async def __call__(self, *args, **kwargs):
+        self.calls += 1
+        return await self.fn(*args, **kwargs)
+
+
+@pytest.fixture
+def counted_backend(backend: BackendApp, monkeypatch) -> BackendApp:
+    monkeypatch.setattr(backend.organization, "get", CallsCounter(backend.organization.get))
+    monkeypatch.setattr(
+        backend.user, "get_user_with_device", CallsCounter(backend.user.get_user_with_device)
+    )
+    return backend
+
+
+@pytest.mark.trio
+async def test_authenticated_handshake_uses_cache(
+    counted_backend: BackendApp, alice_rpc: AuthenticatedRpcApiClient
+):
+    for i in range(3):
+        await authenticated_ping(alice_rpc, f"ping{i}")
+
+    assert counted_backend.organization.get.calls == 1
+    assert counted_backend.user.get_user_with_device.calls == 1
+    stats = counted_backend.handshake_cache.stats()
+    assert stats["hits"] == 4
+    assert stats["misses"] == 2
+
+
+@pytest.mark.trio
+async def test_user_updated_or_revoked_invalidates_cache(
+    counted_backend: BackendApp, alice: LocalDevice, alice2: LocalDevice, bob: LocalDevice
+):
+    cache = counted_backend.handshake_cache
+    await cache.get_user_with_device(alice.organization_id, alice.device_id)
+    await cache.get_user_with_device(alice.organization_id, alice2.device_id)
+    await cache.get_user_with_device(bob.organization_id, bob.device_id)
+    assert counted_backend.user.get_user_with_device.calls == 3
+
+    # Invalidation doesn't wait for the event
+    await counted_backend.user.update_user(
+        organization_id=alice.organization_id,
+        user_id=alice.user_id,
+        new_profile=UserProfile.STANDARD,
+        user_update_certificate=b"<dummy>",
+        user_update_certifier=bob.device_id,
+        updated_on=DateTime.now(),
+    )
+
+    # All Alice's devices have been invalidated, but not Bob's
+    user, _ = await cache.get_user_with_device(alice.organization_id, alice.device_id)
+    assert user.profile == UserProfile.STANDARD
+    await cache.get_user_with_device(alice.organization_id, alice2.device_id)
+    await cache.get_user_with_device(bob.organization_id, bob.device_id)
+    assert counted_backend.user.get_user_with_device.calls == 5
+
+    await counted_backend.user.revoke_user(
+        organization_id=alice.organization_id,
+        user_id=alice.user_id,
+        revoked_user_certificate=b"<dummy>",
+        revoked_user_certifier=bob.device_id,
+    )
+
+    user, _ = await cache.get_user_with_device(alice.organization_id, alice.device_id)
+    assert user.revoked_on is not None
+
+
+@pytest.mark.trio
+async def test_organization_expired_invalidates_cache(
+    counted_backend: BackendApp, coolorg: OrganizationFullData
+):
+    cache = counted_backend.handshake_cache
+    organization = await cache.get_organization(coolorg.organization_id)
+    assert not organization.is_expired
+    await cache.get_organization(coolorg.organization_id)
+    assert counted_backend.organization.get.calls == 1
+
+    await counted_backend.organization.update(id=coolorg.organization_id, is_expired=True)
+
+    organization = await cache.get_organization(coolorg.organization_id)
+    assert organization.is_expired
+    assert counted_backend.organization.get.calls == 2
+
+    # Expired organization is not cached given there is no event when it gets un-expired
+    await counted_backend.organization.update(id=coolorg.organization_id, is_expired=False)
+    organization = await cache.get_organization(coolorg.organization_id)
+    assert not organization.is_expired
+    assert counted_backend.organization.get.calls == 3
+
+
+@pytest.mark.trio
+async def test_events_invalidate_cache(
+    counted_backend: BackendApp, alice: LocalDevice, bob: LocalDevice
+):
+    # Changes done by the other server processes are only known through the events
+    cache = counted_backend.handshake_cache
+    await cache.get_organization(alice.organization_id)
+    await cache.get_user_with_device(alice.organization_id, alice.device_id)
+    await cache.get_user_with_device(bob.organization_id, bob.device_id)
+
+    counted_backend.event_bus.send(
+        BackendEventUserUpdatedOrRevoked,
+        event_id="1",
+        payload=BackendEventUserUpdatedOrRevoked(
+            organization_id=alice.organization_id, user_id=alice.user_id, profile=None
+        ),
+    )
+    await cache.get_user_with_device(alice.organization_id, alice.device_id)
+    await cache.get_user_with_device(bob.organization_id, bob.device_id)
+    assert counted_backend.user.get_user_with_device.calls == 3
+
+    counted_backend.event_bus.send(
+        BackendEventOrganizationExpired,
+        event_id="2",
+        payload=BackendEventOrganizationExpired(organization_id=alice.organization_id),
+    )
+    await cache.get_organization(alice.organization_id)
+    assert counted_backend.organization.get.calls == 2
+
+
+@pytest.mark.trio
+async def test_not_found_is_not_cached(backend: BackendApp, alice: LocalDevice):
+    cache = backend.handshake_cache
+    with pytest.raises(OrganizationNotFoundError):
+        await cache.get_organization(OrganizationID("Dummy"))
+    with pytest.raises(UserNotFoundError):
+        await cache.get_user_with_device(alice.organization_id, DeviceID("dummy@dummy"))
+    assert cache.stats() == {"organizations": 0, "devices": 0, "hits": 0, "misses": 2}
+
+
+@pytest.mark.trio
+async def test_ttl_and_max_size(
+    backend: BackendApp, alice: LocalDevice, alice2: LocalDevice, bob: LocalDevice, monkeypatch
+):
+    now = 0.0
+    monkeypatch.setattr("parsec.backend.handshake_cache.monotonic", lambda: now)
+    cache = HandshakeCache(organization=backend.organization, user=backend.user, ttl=10, max_size=2)
+
+    for device in (alice, alice2):
+        await cache.get_user_with_device(device.organization_id, device.device_id)
+    assert cache.stats()["devices"] == 2
+
+    # Least recently used entry (i.e. alice) is evicted
+    await cache.get_user_with_device(alice2.organization_id, alice2.device_id)
+    await cache.get_user_with_device(bob.organization_id, bob.device_id)
+    assert cache.stats() == {"organizations": 0, "devices": 2, "hits": 1, "misses": 3}
+    await cache.get_user_with_device(alice2.organization_id, alice2.device_id)
+    assert cache.stats()["hits"] == 2
+
+    now = 10.0
+    await cache.get_user_with_device(alice2.organization_id, alice2.device_id)
+    assert cache.stats()["misses"] == 4
+
+    # Cache can be disabled
+    cache = HandshakeCache(organization=backend.organization, user=backend.user, ttl=0, max_size=2)
+    await cache.get_user_with_device(alice.organization_id, alice.device_id)
+    await cache.get_user_with_device(alice.organization_id, alice.device_id)
+    assert cache.stats() == {"organizations": 0, "devices": 0, "hits": 0, "misses": 2}
@@ -1,6 +1,7 @@
 # Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
 from __future__ import annotations
 
+from functools import partial
 from urllib.request import HTTPError, Request, urlopen
 
 import pytest
@@ -10,6 +11,7 @@ from parsec import __version__ as parsec_version
 from parsec._parsec import BackendInvitationAddr, InvitationType
 from parsec.api.protocol import InvitationToken, OrganizationID
 from parsec.backend.asgi import MAX_CONTENT_LENGTH, serve_backend_with_asgi
+from parsec.backend.cli.run import _create_workers_socket
 from tests.common import customize_fixtures
 
 
@@ -94,6 +96,38 @@ async def test_server_header_in_debug(backend_factory, mode):
             nursery.cancel_scope.cancel()
 
 
+@pytest.mark.trio
+async def test_serve_on_shared_socket(backend_factory):
+    # Workers mode: the backend serves an already listening socket
+    sock = _create_workers_socket("127.0.0.1", 0)
+    _, port = sock.getsockname()
+    shutdown = trio.Event()
+
+    async with backend_factory(populated=False) as backend:
+        for _ in range(2):
+            # The socket can be served again (e.g. after a database reconnection)
+            with pytest.raises(KeyboardInterrupt):
+                async with trio.open_nursery() as nursery:
+                    await nursery.start(
+                        partial(
+                            serve_backend_with_asgi,
+                            backend,
+                            "127.0.0.1",
+                            0,
+                            sock=sock,
+                            shutdown_trigger=shutdown.wait,
+                        )
+                    )
+                    rep = await trio.to_thread.run_sync(urlopen, f"http://127.0.0.1:{port}/")
+                    assert rep.status == 200
+
+                    # Graceful shutdown
+                    shutdown.set()
+            shutdown = trio.Event()
+
+    sock.close()
+
+
 @pytest.mark.trio
 async def test_get_404(backend_asgi_app):
     client = backend_asgi_app.test_client()
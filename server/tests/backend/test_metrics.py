@@ -0,0 +1,122 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+from __future__ import annotations
+
+import pytest
+
+from parsec._parsec import BlockID
+from parsec.backend.metrics import (
+    BLOCKSTORE_DURATION,
+    COMMAND_DURATION,
+    COMMAND_REPLIES,
+    Counter,
+    Histogram,
+    Registry,
+)
+from tests.backend.common import authenticated_ping
+
+
+def test_render_metrics():
+    registry = Registry()
+    counter = Counter("test_render_counter_total", "A counter", ("label",), registry=registry)
+    counter.inc('a "quoted" value')
+    counter.inc('a "quoted" value', value=2)
+    histogram = Histogram(
+        "test_render_histogram_seconds", "A histogram", buckets=(0.1, 1.0), registry=registry
+    )
+    histogram.observe(value=0.05)
+    histogram.observe(value=0.5)
+    histogram.observe(value=5)
+
+    assert registry.render() == (
+        "# HELP test_render_counter_total A counter\n"
+        "# TYPE test_render_counter_total counter\n"
+        'test_render_counter_total{label="a \\"quoted\\" value"} 3\n'
+        "# HELP test_render_histogram_seconds A histogram\n"
+        "# TYPE test_render_histogram_seconds histogram\n"
+        'test_render_histogram_seconds_bucket{le="0.1"} 1\n'
+        'test_render_histogram_seconds_bucket{le="1"} 2\n'
+        'test_render_histogram_seconds_bucket{le="+Inf"} 3\n'
+        "test_render_histogram_seconds_sum 5.55\n"
+        "test_render_histogram_seconds_count 3\n"
+    )
+
+
+def test_render_workers_metrics(tmp_path):
+    # Each worker process has its own registry
+    counters = []
+    registries = []
+    for worker in ("0", "1"):
+        registry = Registry()
+        registry.set_worker(worker, tmp_path)
+        counters.append(Counter("test_counter_total", "A counter", ("label",), registry=registry))
+        registries.append(registry)
+    counters[0].inc("foo")
+    counters[1].inc("foo", value=2)
+    counters[1].inc("bar")
+
+    # The samples shared by the other workers are merged with the worker's own ones
+    registries[1].share_samples(registries[1].render_samples())
+    assert registries[0].render(registries[0].load_shared_samples()) == (
+        "# HELP test_counter_total A counter\n"
+        "# TYPE test_counter_total counter\n"
+        'test_counter_total{worker="0",label="foo"} 1\n'
+        'test_counter_total{worker="1",label="bar"} 1\n'
+        'test_counter_total{worker="1",label="foo"} 2\n'
+    )
+    # A worker never loads its own shared samples, which would be outdated
+    registries[0].share_samples(registries[0].render_samples())
+    counters[0].inc("foo")
+    assert registries[0].render(registries[0].load_shared_samples()) == (
+        "# HELP test_counter_total A counter\n"
+        "# TYPE test_counter_total counter\n"
+        'test_counter_total{worker="0",label="foo"} 2\n'
+        'test_counter_total{worker="1",label="bar"} 1\n'
+        'test_counter_total{worker="1",label="foo"} 2\n'
+    )
+
+
+@pytest.mark.trio
+async def test_metrics_unauthorized(backend_asgi_app):
+    client = backend_asgi_app.test_client()  # This client has no token
+    rep = await client.get("/metrics")
+    assert rep.status == "403 FORBIDDEN"
+
+
+@pytest.mark.trio
+async def test_metrics(backend_asgi_app, alice, alice_rpc, realm):
+    backend = backend_asgi_app.backend
+    pings_count = COMMAND_DURATION.get_count("ping")
+    replies_count = COMMAND_REPLIES.get("ping", "RepOk")
+    await authenticated_ping(alice_rpc, "foo")
+    assert COMMAND_DURATION.get_count("ping") == pings_count + 1
+    assert COMMAND_REPLIES.get("ping", "RepOk") == replies_count + 1
+
+    blockstore_name = backend.config.blockstore_config.type
+    creates_count = BLOCKSTORE_DURATION.get_count(blockstore_name, "create")
+    await backend.block.create(
+        organization_id=alice.organization_id,
+        author=alice.device_id,
+        block_id=BlockID.new(),
+        realm_id=realm,
+        block=b"foo",
+    )
+    assert BLOCKSTORE_DURATION.get_count(blockstore_name, "create") == creates_count + 1
+
+    client = backend_asgi_app.test_client()
+    rep = await client.get(
+        "/metrics",
+        headers={"Authorization": f"Bearer {backend.config.administration_token}"},
+    )
+    assert rep.status == "200 OK"
+    assert rep.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = await rep.get_data(as_text=True)
+    assert 'parsec_command_duration_seconds_count{cmd="ping"}' in body
+    assert (
+        f'parsec_blockstore_operation_duration_seconds_count{{blockstore="{blockstore_name}"'
+        in body
+    )
+    assert "parsec_trio_tasks_living " in body
+    assert 'parsec_handshake_cache{kind="hits"}' in body
+    if backend.config.db_type == "POSTGRESQL":
+        assert 'parsec_db_pool_connections{state="max"}' in body
+        assert "parsec_db_pool_acquire_duration_seconds_count " in body
@@ -0,0 +1,88 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+from __future__ import annotations
+
+import pytest
+import trio
+
+from parsec._parsec import BlockID
+from parsec.backend.block import BlockStoreError
+from parsec.backend.postgresql.block import PACKED_BLOCK_MAX_SIZE, PGBlockStoreComponent
+
+
+async def _count_segments(dbh) -> int:
+    async with dbh.pool.acquire() as conn:
+        return await conn.fetchval("SELECT COUNT(*) FROM block_segment")
+
+
+@pytest.mark.trio
+@pytest.mark.postgresql
+async def test_packed_blocks(backend, alice):
+    dbh = backend.sequester.dbh
+    blockstore = PGBlockStoreComponent(dbh, packed=True)
+    organization_id = alice.organization_id
+
+    # Blocks created concurrently are written together in a few segments
+    blocks = {BlockID.new(): f"block{i}".encode() for i in range(20)}
+    async with trio.open_nursery() as nursery:
+        for block_id, block in blocks.items():
+            nursery.start_soon(blockstore.create, organization_id, block_id, block)
+    assert 1 <= await _count_segments(dbh) < len(blocks)
+    for block_id, block in blocks.items():
+        assert await blockstore.read(organization_id, block_id) == block
+
+    # A block created alone is stored in its own row
+    lone_block_id = BlockID.new()
+    segments_count = await _count_segments(dbh)
+    await blockstore.create(organization_id, lone_block_id, b"lone block")
+    assert await _count_segments(dbh) == segments_count
+    assert await blockstore.read(organization_id, lone_block_id) == b"lone block"
+
+    # Create is idempotent
+    block_id = next(iter(blocks))
+    await blockstore.create(organization_id, block_id, blocks[block_id])
+    assert await blockstore.read(organization_id, block_id) == blocks[block_id]
+
+    # Big blocks are not packed
+    big_block_id = BlockID.new()
+    big_block = b"x" * (PACKED_BLOCK_MAX_SIZE + 1)
+    segments_count = await _count_segments(dbh)
+    await blockstore.create(organization_id, big_block_id, big_block)
+    assert await _count_segments(dbh) == segments_count
+    assert await blockstore.read(organization_id, big_block_id) == big_block
+
+    with pytest.raises(BlockStoreError):
+        await blockstore.read(organization_id, BlockID.new())
+
+
+@pytest.mark.trio
+@pytest.mark.postgresql
+async def test_compact_segments(backend, alice):
+    dbh = backend.sequester.dbh
+    blockstore = PGBlockStoreComponent(dbh, packed=True)
+    organization_id = alice.organization_id
+
+    # Blocks created a few at a time end up in small segments
+    blocks = {BlockID.new(): f"block{i}".encode() for i in range(20)}
+    block_ids = list(blocks)
+    for i in range(0, len(block_ids), 4):
+        async with trio.open_nursery() as nursery:
+            for block_id in block_ids[i : i + 4]:
+                nursery.start_soon(blockstore.create, organization_id, block_id, blocks[block_id])
+    segments_count = await _count_segments(dbh)
+    assert segments_count >= 5
+
+    # Remove some blocks, their segments have less live data
+    removed = block_ids[:6]
+    async with dbh.pool.acquire() as conn:
+        await conn.execute("DELETE FROM block_data WHERE block_id = ANY($1::UUID[])", removed)
+    for block_id in removed:
+        del blocks[block_id]
+
+    # Small segments are merged together, dead ones are removed
+    assert await blockstore.compact_segments() == (segments_count, 1)
+    assert await _count_segments(dbh) == 1
+    for block_id, block in blocks.items():
+        assert await blockstore.read(organization_id, block_id) == block
+
+    # Nothing more to do
+    assert await blockstore.compact_segments() == (0, 0)
@@ -0,0 +1,79 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+from __future__ import annotations
+
+import pytest
+
+from parsec._parsec import DateTime, DeviceID, OrganizationID, UserID, VlobID
+from parsec.backend.postgresql.internal_ids import InternalIdCache
+
+
+@pytest.mark.trio
+@pytest.mark.postgresql
+async def test_internal_id_cache(backend, alice, realm):
+    cache = InternalIdCache()
+    async with backend.vlob.dbh.pool.acquire() as conn:
+        organization_internal_id = await cache.organization(conn, alice.organization_id)
+        assert organization_internal_id == await conn.fetchval(
+            "SELECT _id FROM organization WHERE organization_id = $1", alice.organization_id.str
+        )
+        realm_internal_id = await cache.realm(conn, alice.organization_id, realm)
+        assert realm_internal_id == await conn.fetchval(
+            "SELECT _id FROM realm WHERE realm_id = $1", realm
+        )
+        user_internal_id = await cache.user(conn, alice.organization_id, alice.user_id)
+        assert user_internal_id == await conn.fetchval(
+            "SELECT _id FROM user_ WHERE organization = $1 AND user_id = $2",
+            organization_internal_id,
+            alice.user_id.str,
+        )
+        device_internal_id = await cache.device(conn, alice.organization_id, alice.device_id)
+        assert device_internal_id == await conn.fetchval(
+            "SELECT _id FROM device WHERE organization = $1 AND device_id = $2",
+            organization_internal_id,
+            alice.device_id.str,
+        )
+        # Organization is resolved once and then reused for the other kinds of IDs
+        assert cache.stats() == {"size": 4, "hits": 3, "misses": 4}
+
+        assert await cache.realm(conn, alice.organization_id, realm) == realm_internal_id
+        assert cache.stats() == {"size": 4, "hits": 4, "misses": 4}
+
+        # Missing rows are not cached
+        assert await cache.organization(conn, OrganizationID("Dummy")) is None
+        assert await cache.realm(conn, alice.organization_id, VlobID.new()) is None
+        assert await cache.user(conn, alice.organization_id, UserID("dummy")) is None
+        assert await cache.device(conn, alice.organization_id, DeviceID("dummy@dummy")) is None
+        assert cache.stats()["size"] == 4
+
+
+@pytest.mark.trio
+@pytest.mark.postgresql
+async def test_internal_id_cache_max_size(backend, alice, bob):
+    cache = InternalIdCache(max_size=2)
+    async with backend.vlob.dbh.pool.acquire() as conn:
+        await cache.user(conn, alice.organization_id, alice.user_id)
+        await cache.user(conn, bob.organization_id, bob.user_id)
+        # Least recently used entry (i.e. Alice's user) has been evicted
+        assert cache.stats() == {"size": 2, "hits": 1, "misses": 3}
+        await cache.user(conn, alice.organization_id, alice.user_id)
+        assert cache.stats() == {"size": 2, "hits": 2, "misses": 4}
+
+
+@pytest.mark.trio
+@pytest.mark.postgresql
+async def test_vlob_write_populates_internal_id_cache(backend, alice, realm):
+    internal_ids = backend.vlob.dbh.internal_ids
+    internal_ids.clear()
+    for i in range(3):
+        await backend.vlob.create(
+            organization_id=alice.organization_id,
+            author=alice.device_id,
+            realm_id=realm,
+            encryption_revision=1,
+            vlob_id=VlobID.new(),
+            timestamp=DateTime(2000, 1, 3, i),
+            blob=b"<dummy>",
+        )
+    # Organization, realm, user & device are only resolved by the first vlob create
+    assert internal_ids.stats()["size"] == 4
+    assert internal_ids.stats()["misses"] == 4
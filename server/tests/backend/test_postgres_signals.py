@@ -0,0 +1,188 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+from __future__ import annotations
+
+from base64 import b64encode
+from uuid import uuid4
+
+import pytest
+
+from parsec._parsec import BackendEventMessageReceived, BackendEventPinged
+from parsec.backend.postgresql import signals
+from parsec.backend.postgresql.signals import (
+    NOTIFICATION_PAYLOAD_MAX_SIZE,
+    batch_signals,
+    dump_notification_frame,
+    dump_notification_payload,
+    load_notification_frame,
+    load_notification_payload,
+    parse_notification_reference,
+    send_signal,
+)
+from tests.common import real_clock_timeout
+
+
+def _pinged(device, ping: str) -> BackendEventPinged:
+    return BackendEventPinged(
+        organization_id=device.organization_id, author=device.device_id, ping=ping
+    )
+
+
+@pytest.mark.parametrize("kind", ("single", "small_batch", "compressed_batch"))
+def test_notification_frame_roundtrip(alice, kind):
+    if kind == "single":
+        events = [_pinged(alice, "foo")]
+    elif kind == "small_batch":
+        events = [_pinged(alice, "foo"), _pinged(alice, "bar")]
+    else:
+        events = [_pinged(alice, f"ping {i}") for i in range(100)]
+
+    batch_id = uuid4()
+    frame = dump_notification_frame(batch_id, events)
+    assert (frame[0] & signals.FRAME_FLAG_ZLIB) == (kind == "compressed_batch")
+
+    payload = dump_notification_payload(frame)
+    assert parse_notification_reference(payload) is None
+    loaded = load_notification_payload(payload)
+    assert loaded == [(f"{batch_id.hex}.{i}", event) for i, event in enumerate(events)]
+    # Event IDs are unique across notifications
+    assert len({event_id for event_id, _ in loaded}) == len(events)
+
+    assert load_notification_frame(frame) == loaded
+
+
+def test_legacy_notification_payload(alice):
+    event = _pinged(alice, "foo")
+    event_id = uuid4().hex
+    payload = f"{event_id}:{b64encode(event.dump()).decode('ascii')}"
+    assert parse_notification_reference(payload) is None
+    assert load_notification_payload(payload) == [(event_id, event)]
+
+
+@pytest.mark.parametrize(
+    "payload", ("", "dummy", "i", "i" + "0" * 10, "rdummy", dump_notification_payload(b"\x00"))
+)
+def test_invalid_notification_payload(payload):
+    with pytest.raises(ValueError):
+        if parse_notification_reference(payload) is None:
+            load_notification_payload(payload)
+
+
+class SpiedConnection:
+    def __init__(self):
+        self.notifications = []
+
+    async def execute(self, sql, *args):
+        assert "pg_notify" in sql
+        self.notifications.append(args[1])
+
+    async def fetchval(self, sql, *args):
+        assert "notification_payload" in sql
+        self.notifications.append(args[0])
+        return 42
+
+
+@pytest.mark.trio
+async def test_batch_signals(alice):
+    conn = SpiedConnection()
+
+    # Outside a batch, each signal is sent right away
+    await send_signal(conn, _pinged(alice, "1"))
+    assert len(conn.notifications) == 1
+    conn.notifications.clear()
+
+    async with batch_signals(conn):
+        await send_signal(conn, _pinged(alice, "2"))
+        # Nested batch (i.e. savepoint) that gets rolled back
+        with pytest.raises(RuntimeError):
+            async with batch_signals(conn):
+                await send_signal(conn, _pinged(alice, "dropped"))
+                raise RuntimeError
+        async with batch_signals(conn):
+            await send_signal(conn, _pinged(alice, "3"))
+        assert not conn.notifications
+
+    (payload,) = conn.notifications
+    assert [event.ping for _, event in load_notification_payload(payload)] == ["2", "3"]
+    conn.notifications.clear()
+
+    # Rolled back transaction sends nothing
+    with pytest.raises(RuntimeError):
+        async with batch_signals(conn):
+            await send_signal(conn, _pinged(alice, "4"))
+            raise RuntimeError
+    assert not conn.notifications
+
+    # Too big for NOTIFY, use the side table
+    big_event = BackendEventMessageReceived(
+        organization_id=alice.organization_id,
+        author=alice.device_id,
+        recipient=alice.user_id,
+        index=1,
+        # Random data is not compressible
+        message=uuid4().bytes * (NOTIFICATION_PAYLOAD_MAX_SIZE // 16),
+    )
+    await send_signal(conn, big_event)
+    frame, payload = conn.notifications
+    assert parse_notification_reference(payload) == 42
+    assert load_notification_frame(frame)[0][1] == big_event
+
+
+@pytest.mark.trio
+@pytest.mark.postgresql
+async def test_big_event_cross_backend(backend_factory, alice):
+    async with backend_factory() as backend_1, backend_factory(populated=False) as backend_2:
+        message = b"".join(uuid4().bytes for _ in range(NOTIFICATION_PAYLOAD_MAX_SIZE // 16))
+        with backend_2.event_bus.listen() as spy:
+            await backend_1.ping.ping(alice.organization_id, alice.device_id, "before")
+            await backend_1.message.send(
+                organization_id=alice.organization_id,
+                sender=alice.device_id,
+                recipient=alice.user_id,
+                timestamp=alice.timestamp(),
+                body=message,
+            )
+            await backend_1.ping.ping(alice.organization_id, alice.device_id, "after")
+
+            async with real_clock_timeout():
+                await spy.wait_multiple(
+                    [BackendEventPinged, BackendEventMessageReceived, BackendEventPinged]
+                )
+        # Events are received in order even if the big one had to be fetched from the database
+        received = [
+            e.kwargs["payload"]
+            for e in spy.events
+            if e.event in (BackendEventPinged, BackendEventMessageReceived)
+        ]
+        assert [type(p) for p in received] == [
+            BackendEventPinged,
+            BackendEventMessageReceived,
+            BackendEventPinged,
+        ]
+        assert received[1].message == message
+
+
+@pytest.mark.trio
+@pytest.mark.postgresql
+async def test_big_event_fetch_error(backend_factory, alice, monkeypatch):
+    async def _fetch_notification_frame(conn, row_id):
+        raise OSError("Connection reset")
+
+    monkeypatch.setattr(
+        "parsec.backend.postgresql.handler.fetch_notification_frame", _fetch_notification_frame
+    )
+    async with backend_factory() as backend_1, backend_factory(populated=False) as backend_2:
+        message = b"".join(uuid4().bytes for _ in range(NOTIFICATION_PAYLOAD_MAX_SIZE // 16))
+        with backend_2.event_bus.listen() as spy:
+            await backend_1.message.send(
+                organization_id=alice.organization_id,
+                sender=alice.device_id,
+                recipient=alice.user_id,
+                timestamp=alice.timestamp(),
+                body=message,
+            )
+            await backend_1.ping.ping(alice.organization_id, alice.device_id, "after")
+
+            # The big event is lost, but the following ones are still dispatched
+            async with real_clock_timeout():
+                await spy.wait(BackendEventPinged)
+        assert not [e for e in spy.events if e.event is BackendEventMessageReceived]
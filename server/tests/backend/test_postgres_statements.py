@@ -0,0 +1,59 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+from __future__ import annotations
+
+import pytest
+
+from parsec._parsec import BlockID
+from parsec.backend.postgresql.block import _q_insert_block
+from parsec.backend.postgresql.statements import LATENCY_BUCKETS, QueryStats, get_queries_stats
+from parsec.backend.postgresql.utils import Q
+
+
+def _q_factory(table: str) -> Q:
+    return Q(f"SELECT _id FROM {table} WHERE _id = $id")
+
+
+def test_query_stats():
+    stats = QueryStats()
+    stats.record(0.0001)
+    stats.record(LATENCY_BUCKETS[0])
+    stats.record(0.003)
+    stats.record(3600)
+    assert stats.count == 4
+    assert stats.buckets[0] == 2
+    assert stats.buckets[2] == 1
+    assert stats.buckets[-1] == 1
+    assert sum(stats.buckets) == stats.count
+
+
+def test_registered_query_name():
+    assert _q_insert_block.registered.name == "parsec.backend.postgresql.block._q_insert_block"
+    # Generated queries are named after their factory and their SQL
+    q1 = _q_factory("realm")
+    q2 = _q_factory("block")
+    assert q1.registered.name.startswith(f"{__name__}._q_factory:")
+    assert q1.registered.name != q2.registered.name
+    # Same SQL share the same registration
+    assert _q_factory("realm").registered is q1.registered
+
+
+@pytest.mark.trio
+@pytest.mark.postgresql
+async def test_registered_queries_are_prepared(backend, alice, realm):
+    async with backend.block.dbh.pool.acquire() as conn:
+        prepared = await conn.fetchval(
+            "SELECT count(*) FROM pg_prepared_statements WHERE statement = $1",
+            _q_insert_block.registered.sql,
+        )
+        assert prepared == 1
+
+    count_before = _q_insert_block.registered.stats.count
+    await backend.block.create(
+        organization_id=alice.organization_id,
+        author=alice.device_id,
+        block_id=BlockID.new(),
+        realm_id=realm,
+        block=b"<dummy>",
+    )
+    assert _q_insert_block.registered.stats.count == count_before + 1
+    assert get_queries_stats()[_q_insert_block.registered.name] is _q_insert_block.registered.stats
@@ -0,0 +1,99 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+from __future__ import annotations
+
+import pytest
+
+from parsec._parsec import BlockID, DateTime
+from parsec.backend.postgresql.utils import Q, q_organization_internal_id
+
+# Previous implementation of the organization stats, summing up all the vlob
+# atoms, blocks and realms of the organization
+_q_get_stats_full_scan = Q(
+    f"""
+SELECT
+    (
+        SELECT COUNT(DISTINCT(realm._id))
+        FROM realm
+        LEFT JOIN realm_user_role
+        ON realm_user_role.realm = realm._id
+        WHERE realm.organization = { q_organization_internal_id("$organization_id") }
+        AND realm_user_role.certified_on <= $at
+    ) realms,
+    (
+        SELECT COALESCE(SUM(size), 0)
+        FROM vlob_atom
+        WHERE
+            organization = { q_organization_internal_id("$organization_id") }
+            AND created_on <= $at
+    ) metadata_size,
+    (
+        SELECT COALESCE(SUM(size), 0)
+        FROM block
+        WHERE
+            organization = { q_organization_internal_id("$organization_id") }
+            AND created_on <= $at
+    ) data_size
+"""
+)
+
+
+@pytest.mark.trio
+@pytest.mark.postgresql
+async def test_usage_counters_match_full_scan(backend, alice, realm, vlobs, realm_factory):
+    await realm_factory(backend, alice, now=DateTime(2000, 1, 3, 12))
+    await backend.block.create(
+        organization_id=alice.organization_id,
+        author=alice.device_id,
+        block_id=BlockID.new(),
+        realm_id=realm,
+        block=b"<block>",
+        created_on=DateTime(2000, 1, 3, 1),
+    )
+    # Reencryption duplicates the vlob atoms, which are counted in the organization
+    # metadata size (but not in the realm's)
+    await backend.realm.start_reencryption_maintenance(
+        alice.organization_id,
+        alice.device_id,
+        realm,
+        2,
+        {alice.user_id: b"whatever"},
+        DateTime(2000, 1, 5),
+    )
+    batch = await backend.vlob.maintenance_get_reencryption_batch(
+        alice.organization_id, alice.device_id, realm, 2, 100
+    )
+    await backend.vlob.maintenance_save_reencryption_batch(
+        alice.organization_id,
+        alice.device_id,
+        realm,
+        2,
+        [(vlob_id, version, blob + b"<reencrypted>") for vlob_id, version, blob in batch],
+    )
+    await backend.realm.finish_reencryption_maintenance(
+        alice.organization_id, alice.device_id, realm, 2
+    )
+
+    for at in (
+        DateTime(2000, 1, 1),
+        DateTime(2000, 1, 2),
+        DateTime(2000, 1, 2, 1),
+        DateTime(2000, 1, 2, 0, 59),
+        DateTime(2000, 1, 3),
+        DateTime(2000, 1, 3, 12),
+        DateTime(2000, 1, 4),
+        DateTime(2000, 1, 5),
+        DateTime.now(),
+    ):
+        stats = await backend.organization.stats(alice.organization_id, at=at)
+        async with backend.organization.dbh.pool.acquire() as conn:
+            expected = await conn.fetchrow(
+                *_q_get_stats_full_scan(organization_id=alice.organization_id.str, at=at)
+            )
+        assert (stats.realms, stats.metadata_size, stats.data_size) == tuple(expected), at
+
+    server_stats = await backend.organization.server_stats()
+    assert server_stats[alice.organization_id] == stats
+
+    realm_stats = await backend.realm.get_stats(alice.organization_id, alice.device_id, realm)
+    assert realm_stats.vlobs_size == sum(len(blob) for _, _, blob in batch)
+    assert realm_stats.blocks_size == len(b"<block>")
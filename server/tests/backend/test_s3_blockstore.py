@@ -1,10 +1,12 @@
 # Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
 from __future__ import annotations
 
+import time
 from unittest import mock
 from unittest.mock import Mock
 
 import pytest
+import trio
 from botocore.exceptions import ClientError as S3ClientError
 from botocore.exceptions import EndpointConnectionError as S3EndpointConnectionError
 
@@ -32,9 +34,10 @@ async def test_s3_read(caplog):
 
         # Ok
         response_mock = Mock()
-        response_mock.read.return_value = "content"
+        response_mock.iter_chunks.return_value = [b"con", b"tent"]
         client_mock().get_object.return_value = {"Body": response_mock}
-        assert await blockstore.read(org_id, block_id) == "content"
+        assert await blockstore.read(org_id, block_id) == b"content"
+        response_mock.close.assert_called_once_with()
         client_mock().get_object.assert_called_once_with(
             Bucket="parsec", Key="org42/0694a211-7635-4e82-95e2-8a543e5887f9"
         )
@@ -111,3 +114,85 @@ async def test_s3_create(caplog):
         with pytest.raises(BlockStoreError):
             await blockstore.create(org_id, block_id, "content")
         _assert_log()
+
+
+@pytest.mark.trio
+async def test_s3_concurrency_limit():
+    org_id = OrganizationID("org42")
+    block_id = BlockID.from_hex("0694a21176354e8295e28a543e5887f9")
+    max_concurrency = 0
+    concurrency = 0
+
+    def _get_object(**kwargs):
+        nonlocal max_concurrency, concurrency
+        concurrency += 1
+        max_concurrency = max(max_concurrency, concurrency)
+        time.sleep(0.01)
+        concurrency -= 1
+        body = Mock()
+        body.iter_chunks.return_value = [b"content"]
+        return {"Body": body}
+
+    with mock.patch("boto3.client") as client_mock:
+        client_mock.return_value = Mock()
+        client_mock().get_object.side_effect = _get_object
+        blockstore = S3BlockStoreComponent("europe", "parsec", "john", "secret", max_connections=2)
+        assert client_mock.call_args.kwargs["config"].max_pool_connections == 2
+
+        async with trio.open_nursery() as nursery:
+            for _ in range(6):
+                nursery.start_soon(blockstore.read, org_id, block_id)
+
+        assert max_concurrency == 2
+        stats = blockstore.stats()
+        assert stats["in_flight"] == 0
+        assert stats["queued"] == 0
+        assert stats["requests"] == 6
+        assert stats["max_queue_wait_time"] > 0
+
+
+@pytest.mark.trio
+async def test_s3_read_doesnt_block_event_loop():
+    # Block reads must not stall the event loop (hence the other RPC requests), the
+    # S3 stand-in being a blocking client with a fixed latency
+    org_id = OrganizationID("org42")
+    block_id = BlockID.from_hex("0694a21176354e8295e28a543e5887f9")
+    s3_latency = 0.05
+    block = b"x" * 512 * 1024
+
+    def _get_object(**kwargs):
+        time.sleep(s3_latency)
+        body = Mock()
+        body.iter_chunks.return_value = [
+            block[i : i + 64 * 1024] for i in range(0, len(block), 64 * 1024)
+        ]
+        return {"Body": body}
+
+    with mock.patch("boto3.client") as client_mock:
+        client_mock.return_value = Mock()
+        client_mock().get_object.side_effect = _get_object
+        blockstore = S3BlockStoreComponent("europe", "parsec", "john", "secret")
+
+        latencies = []
+
+        async def _rpc_stand_in():
+            # Stands for a cheap RPC request that only needs the event loop to be available
+            while True:
+                start = time.monotonic()
+                await trio.sleep(0.001)
+                latencies.append(time.monotonic() - start - 0.001)
+
+        async def _block_reads():
+            async with trio.open_nursery() as nursery:
+                for _ in range(20):
+                    nursery.start_soon(blockstore.read, org_id, block_id)
+
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(_rpc_stand_in)
+            await _block_reads()
+            nursery.cancel_scope.cancel()
+
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99)]
+    # A single blocking S3 read would stall the event loop for `s3_latency`
+    assert p99 < s3_latency
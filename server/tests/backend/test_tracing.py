@@ -0,0 +1,94 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+from __future__ import annotations
+
+import json
+
+import pytest
+import trio
+
+from parsec._parsec import BlockID
+from parsec.backend.tracing import open_tracing, span, start_trace
+from tests.backend.common import authenticated_ping
+
+
+def _load_traces(path):
+    traces = []
+    for line in path.read_text().splitlines():
+        (resource_spans,) = json.loads(line)["resourceSpans"]
+        (scope_spans,) = resource_spans["scopeSpans"]
+        traces.append({span["name"]: span for span in scope_spans["spans"]})
+    return traces
+
+
+@pytest.mark.trio
+async def test_tracing_disabled(tmp_path):
+    export_path = tmp_path / "traces.json"
+    async with open_tracing(sample_rate=0.0, export_path=export_path):
+        with start_trace("root") as root_span:
+            assert root_span is None
+            with span("child") as child_span:
+                assert child_span is None
+    assert not export_path.exists()
+
+
+@pytest.mark.trio
+async def test_span_tree(tmp_path):
+    export_path = tmp_path / "traces.json"
+    async with open_tracing(sample_rate=1.0, export_path=export_path):
+        with start_trace("root", foo="bar"):
+            with span("child", count=1):
+                pass
+
+            # Spans are propagated to the tasks started within the trace
+            async def _task():
+                with span("task_child"):
+                    await trio.sleep(0)
+
+            async with trio.open_nursery() as nursery:
+                nursery.start_soon(_task)
+
+            with pytest.raises(KeyError):
+                with span("failed_child"):
+                    raise KeyError()
+
+        # Not sampled
+        with span("orphan"):
+            pass
+
+    (trace,) = _load_traces(export_path)
+    assert trace.keys() == {"root", "child", "task_child", "failed_child"}
+    root = trace["root"]
+    assert "parentSpanId" not in root
+    assert root["attributes"] == [{"key": "foo", "value": {"stringValue": "bar"}}]
+    for name in ("child", "task_child", "failed_child"):
+        assert trace[name]["traceId"] == root["traceId"]
+        assert trace[name]["parentSpanId"] == root["spanId"]
+    assert trace["child"]["attributes"] == [{"key": "count", "value": {"intValue": "1"}}]
+    assert trace["failed_child"]["status"] == {"code": 2, "message": "KeyError"}
+    assert int(root["startTimeUnixNano"]) <= int(root["endTimeUnixNano"])
+
+
+@pytest.mark.trio
+async def test_trace_requests(tmp_path, backend, alice, alice_rpc, realm):
+    export_path = tmp_path / "traces.json"
+    async with open_tracing(sample_rate=1.0, export_path=export_path):
+        await authenticated_ping(alice_rpc, "foo")
+        with start_trace("block_create"):
+            await backend.block.create(
+                organization_id=alice.organization_id,
+                author=alice.device_id,
+                block_id=BlockID.new(),
+                realm_id=realm,
+                block=b"foo",
+            )
+
+    ping_trace, block_trace = _load_traces(export_path)
+    assert ping_trace["api.ping"]["parentSpanId"] == ping_trace["rpc.authenticated"]["spanId"]
+    assert {"key": "organization_id", "value": {"stringValue": alice.organization_id.str}} in (
+        ping_trace["api.ping"]["attributes"]
+    )
+    # With RAID, the sub-blockstores also have their `blockstore.create` span
+    assert block_trace["blockstore.create"]["traceId"] == block_trace["block_create"]["traceId"]
+    if backend.config.db_type == "POSTGRESQL":
+        assert "db.pool.acquire" in block_trace
+        assert "db.query" in block_trace
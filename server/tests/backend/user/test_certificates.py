@@ -0,0 +1,72 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
+from __future__ import annotations
+
+import pytest
+
+from parsec._parsec import DateTime, RealmRole, VlobID
+from parsec.backend.realm import RealmGrantedRole
+
+
+@pytest.mark.trio
+async def test_get_certificates_from_offset(backend, alice, bob):
+    certificates = await backend.user.get_certificates(
+        alice.organization_id, offset=0, redacted=False
+    )
+    redacted_certificates = await backend.user.get_certificates(
+        alice.organization_id, offset=0, redacted=True
+    )
+    assert len(redacted_certificates) == len(certificates)
+
+    # User certificate is followed by the certificate of its first device
+    user, device = await backend.user.get_user_with_device(alice.organization_id, alice.device_id)
+    index = certificates.index(user.user_certificate)
+    assert certificates[index + 1] == device.device_certificate
+    assert redacted_certificates[index] == user.redacted_user_certificate
+    assert redacted_certificates[index + 1] == device.redacted_device_certificate
+
+    # New certificates are appended to the log
+    realm_id = VlobID.new()
+    await backend.realm.create(
+        alice.organization_id,
+        RealmGrantedRole(
+            certificate=b"<realm create>",
+            realm_id=realm_id,
+            user_id=alice.user_id,
+            role=RealmRole.OWNER,
+            granted_by=alice.device_id,
+            granted_on=DateTime(2000, 1, 2),
+        ),
+    )
+    await backend.realm.update_roles(
+        alice.organization_id,
+        RealmGrantedRole(
+            certificate=b"<realm share>",
+            realm_id=realm_id,
+            user_id=bob.user_id,
+            role=RealmRole.READER,
+            granted_by=alice.device_id,
+            granted_on=DateTime(2000, 1, 3),
+        ),
+    )
+    await backend.user.revoke_user(
+        alice.organization_id,
+        bob.user_id,
+        revoked_user_certificate=b"<revoke>",
+        revoked_user_certifier=alice.device_id,
+        revoked_on=DateTime(2000, 1, 4),
+    )
+
+    offset = len(certificates)
+    for redacted in (False, True):
+        assert await backend.user.get_certificates(
+            alice.organization_id, offset=offset, redacted=redacted
+        ) == [b"<realm create>", b"<realm share>", b"<revoke>"]
+        assert await backend.user.get_certificates(
+            alice.organization_id, offset=offset + 2, redacted=redacted
+        ) == [b"<revoke>"]
+        assert (
+            await backend.user.get_certificates(
+                alice.organization_id, offset=offset + 3, redacted=redacted
+            )
+            == []
+        )
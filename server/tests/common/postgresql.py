@@ -69,6 +69,7 @@ async def asyncio_reset_postgresql_testbed():
         """
 TRUNCATE TABLE
     organization,
+    certificate,
 
     user_,
     device,
@@ -82,9 +83,13 @@ TRUNCATE TABLE
     vlob_encryption_revision,
     vlob_atom,
     realm_vlob_update,
+    realm_usage,
 
     block,
-    block_data
+    block_data,
+    block_segment,
+
+    notification_payload
 RESTART IDENTITY CASCADE
 """,
     )
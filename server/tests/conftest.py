@@ -17,6 +17,7 @@ from parsec.backend.config import (
     RAID0BlockStoreConfig,
     RAID1BlockStoreConfig,
     RAID5BlockStoreConfig,
+    ReedSolomonBlockStoreConfig,
 )
 from parsec.monitoring import TaskMonitoringInstrument
 
@@ -358,6 +359,10 @@ def blockstore(backend_store, fixtures_customization):
             blockstores=[config, MockedBlockStoreConfig(), MockedBlockStoreConfig()],
             partial_create_ok=True,
         )
+    elif raid == "RS":
+        config = ReedSolomonBlockStoreConfig(
+            blockstores=[config, *(MockedBlockStoreConfig() for _ in range(4))], parity_shards=2
+        )
     else:
         assert raid == "NO_RAID"
 
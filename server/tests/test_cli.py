@@ -3,8 +3,12 @@ from __future__ import annotations
 
 import os
 import re
+import signal
+import socket
 from functools import partial
 from pathlib import Path
+from typing import Set
+from urllib.request import urlopen
 
 import click
 import trio
@@ -27,6 +31,7 @@ from click.testing import Result as CliResult
 
 from parsec import __version__ as parsec_version
 from parsec._parsec import (
+    ApiVersion,
     BackendAddr,
     BackendOrganizationAddr,
     DateTime,
@@ -79,6 +84,34 @@ def test_version(args: list[str]):
     assert f"parsec, version {parsec_version}\n" in result.output
 
 
+@pytest.mark.parametrize(
+    "db, blockstore",
+    (
+        ("MOCKED", ["MOCKED"]),
+        ("postgresql://localhost/parsec", ["MOCKED"]),
+        ("postgresql://localhost/parsec", ["raid1:0:POSTGRESQL", "raid1:1:MOCKED"]),
+    ),
+    ids=("mocked_db", "mocked_blockstore", "mocked_raid_node"),
+)
+def test_run_workers_requires_persistent_storage(db, blockstore):
+    runner = CliRunner()
+    result = runner.invoke(
+        cli,
+        [
+            "backend",
+            "run",
+            "--workers=2",
+            f"--db={db}",
+            *(f"--blockstore={config}" for config in blockstore),
+            "--administration-token=s3cr3t",
+            "--backend-addr=parsec://localhost:6777",
+            "--email-host=MOCKED",
+        ],
+    )
+    assert result.exit_code == 1
+    assert "--workers cannot be used with MOCKED database or blockstore" in result.output
+
+
 def test_datetime_parsing():
     parser = ParsecDateTimeClickType()
     dt = DateTime(2000, 1, 1, 12, 30, 59)
@@ -254,6 +287,81 @@ def test_migrate_backend(postgresql_url, unused_tcp_port):
         assert "100003_migration3.sql (already applied)" in result.output
 
 
+def _children_pids(pid: int) -> Set[int]:
+    children = set()
+    for stat in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            # Fields after the process name (which is between parentheses and
+            # may contain spaces), the parent PID being the second one
+            fields = stat.read_text().rsplit(")", 1)[1].split()
+        except OSError:  # Process has exited in the meantime
+            continue
+        if int(fields[1]) == pid:
+            children.add(int(stat.parent.name))
+    return children
+
+
+@pytest.mark.slow
+@pytest.mark.postgresql
+@pytest.mark.skipif(sys.platform != "linux", reason="Workers are retrieved from /proc")
+def test_run_workers(postgresql_url, unused_tcp_port):
+    def _wait_for_workers(p, excluded: Set[int] = frozenset()) -> Set[int]:
+        for _ in range(SUBPROCESS_TIMEOUT * 10):  # 100ms sleep steps
+            workers = _children_pids(p.pid)
+            if len(workers) == 2 and not workers & excluded:
+                return workers
+            sleep(0.1)
+        else:
+            raise AssertionError("Too slow")
+
+    with _running(
+        (
+            f"backend run --workers=2 --db={postgresql_url} --blockstore=POSTGRESQL"
+            f" --administration-token=s3cr3t"
+            f" --port={unused_tcp_port}"
+            f" --backend-addr=parsec://127.0.0.1:{unused_tcp_port}"
+            f" --email-host=MOCKED"
+            f" --spontaneous-organization-bootstrap"
+        ),
+        wait_for="Starting Parsec Backend",
+    ) as p:
+        workers = _wait_for_workers(p)
+        rep = urlopen(f"http://127.0.0.1:{unused_tcp_port}/", timeout=SUBPROCESS_TIMEOUT)
+        assert rep.status == 200
+
+        # A crashed worker is restarted (after `WORKER_MIN_UPTIME` given it has just started)
+        crashed = workers.pop()
+        os.kill(crashed, signal.SIGKILL)
+        restarted = _wait_for_workers(p, excluded={crashed})
+        assert workers < restarted
+        rep = urlopen(f"http://127.0.0.1:{unused_tcp_port}/", timeout=SUBPROCESS_TIMEOUT)
+        assert rep.status == 200
+
+        # Graceful shutdown lets the running requests finish: the request is kept
+        # running by sending only the beginning of its body before the SIGTERM
+        with socket.create_connection(
+            ("127.0.0.1", unused_tcp_port), timeout=SUBPROCESS_TIMEOUT
+        ) as conn:
+            conn.sendall(
+                b"POST /anonymous/NewOrg HTTP/1.1\r\n"
+                b"Host: 127.0.0.1\r\n"
+                b"Content-Type: application/msgpack\r\n"
+                + f"Api-Version: {ApiVersion.API_LATEST_VERSION}\r\n".encode()
+                + b"Content-Length: 2\r\n"
+                b"\r\n"
+                b"\x81"
+            )
+            sleep(0.5)
+            p.send_signal(signal.SIGTERM)
+            sleep(0.5)
+            conn.sendall(b"\x80")
+            rep = conn.recv(4096)
+        # The request is processed (and rejected given the body is not a valid command)
+        assert rep.startswith(b"HTTP/1.1 415 ")
+        assert p.wait(timeout=SUBPROCESS_TIMEOUT) == 0
+        assert not _children_pids(p.pid)
+
+
 @pytest.fixture(params=(False, True), ids=("no_ssl", "ssl"))
 def ssl_conf(request):
     @attr.s
@@ -9,6 +9,7 @@ from parsec.backend.config import (
     MockedBlockStoreConfig,
     PostgreSQLBlockStoreConfig,
     RAID0BlockStoreConfig,
+    ReedSolomonBlockStoreConfig,
     S3BlockStoreConfig,
     SWIFTBlockStoreConfig,
 )
@@ -22,6 +23,8 @@ def test_parse_mocked():
 def test_parse_postgresql():
     config = _parse_blockstore_params(["POSTGRESQL"])
     assert config == PostgreSQLBlockStoreConfig()
+    config = _parse_blockstore_params(["postgresql:packed"])
+    assert config == PostgreSQLBlockStoreConfig(packed=True)
 
 
 def test_parse_s3():
@@ -46,6 +49,22 @@ def test_parse_s3_with_default_endpoint():
     )
 
 
+def test_parse_s3_with_max_connections():
+    config = _parse_blockstore_params(["s3::region1:bucketA:key123:S3cr3t:42"])
+    assert config == S3BlockStoreConfig(
+        s3_endpoint_url=None,
+        s3_region="region1",
+        s3_bucket="bucketA",
+        s3_key="key123",
+        s3_secret="S3cr3t",
+        s3_max_connections=42,
+    )
+
+    for bad_max_connections in ("0", "dummy"):
+        with pytest.raises(BadParameter):
+            _parse_blockstore_params([f"s3::region1:bucketA:key123:S3cr3t:{bad_max_connections}"])
+
+
 def test_parse_s3_with_custom_url_scheme():
     config = _parse_blockstore_params(
         ["s3:http\\://s3.example.com:region1:bucketA:key123:\\:S3cr3t\\\\"]
@@ -114,12 +133,19 @@ def test_parse_simple_raid():
     )
 
 
+def test_parse_reed_solomon():
+    config = _parse_blockstore_params([f"rs2:{i}:MOCKED" for i in range(5)])
+    assert config == ReedSolomonBlockStoreConfig(
+        blockstores=[MockedBlockStoreConfig()] * 5, parity_shards=2
+    )
+
+
 @pytest.mark.parametrize(
     "param",
     [
         "foo",  # Unknown type
         "s3:",  # Too few parts
-        "s3:s3.example.com:region1:bucketA:key123:S3cr3t:dummy",  # Too much parts
+        "s3:s3.example.com:region1:bucketA:key123:S3cr3t:10:dummy",  # Too much parts
     ],
 )
 def test_bad_single_param(param):
@@ -132,7 +158,7 @@ def test_bad_single_param(param):
     [
         "foo",  # Unknown type
         "s3:",  # Too few parts
-        "s3:s3.example.com:region1:bucketA:key123:S3cr3t:dummy",  # Too much parts
+        "s3:s3.example.com:region1:bucketA:key123:S3cr3t:10:dummy",  # Too much parts
     ],
 )
 def test_invalid_mix_raid_params(param):
@@ -149,6 +175,9 @@ def test_invalid_mix_raid_params(param):
         ["raid0:1:MOCKED", "raid0:2:MOCKED"],  # Hole in the nodes
         ["raid0:0:MOCKED", "raid0:2:MOCKED"],  # Hole in the nodes
         ["raid0:0:MOCKED", "raid0:0:MOCKED"],  # Same node multiple times
+        ["rs2:0:MOCKED", "rs2:1:MOCKED"],  # No data node
+        ["rs0:0:MOCKED", "rs0:1:MOCKED"],  # No parity node
+        ["rs1:0:MOCKED", "rs2:1:MOCKED", "rs2:2:MOCKED"],  # Mixin parity nodes count
     ],
 )
 def test_bad_raid_params(params):
@@ -1,6 +1,8 @@
 # Parsec Cloud (https://parsec.cloud) Copyright (c) BUSL-1.1 2016-present Scille SAS
 from __future__ import annotations
 
+import time
+
 import pytest
 import trio
 
@@ -123,3 +125,140 @@ def test_connection_context(event_bus):
     events_received.clear()
     event_bus_ctx.send("foo")
     assert events_received == [("global", "foo")]
+
+
+def test_keyed_dispatch(event_bus):
+    events_received = []
+
+    def _listen(name):
+        def _cb(event, **kwargs):
+            events_received.append((name, event, kwargs))
+
+        return _cb
+
+    with pytest.raises(AssertionError):
+        # A dispatch key must be configured before connecting with a key
+        event_bus.connect("foo", _listen("ko"), "a")
+
+    event_bus.set_dispatch_key("foo", lambda event, target: target)
+    listen_global = _listen("global")
+    listen_a = _listen("a")
+    listen_b = _listen("b")
+    event_bus.connect("foo", listen_global)
+    event_bus.connect("foo", listen_a, "a")
+
+    with event_bus.connection_context() as event_bus_ctx:
+        event_bus_ctx.connect("foo", listen_b, "b")
+        assert event_bus.stats() == {"foo": 3}
+
+        event_bus.send("foo", target="a")
+        assert events_received == [
+            ("global", "foo", {"target": "a"}),
+            ("a", "foo", {"target": "a"}),
+        ]
+
+        events_received.clear()
+        event_bus.send("foo", target="b")
+        assert events_received == [
+            ("global", "foo", {"target": "b"}),
+            ("b", "foo", {"target": "b"}),
+        ]
+
+        events_received.clear()
+        event_bus.send("foo", target="c")
+        assert events_received == [("global", "foo", {"target": "c"})]
+
+    assert event_bus.stats() == {"foo": 2}
+    events_received.clear()
+    event_bus.send("foo", target="b")
+    assert events_received == [("global", "foo", {"target": "b"})]
+
+    event_bus.disconnect("foo", listen_a, "a")
+    assert event_bus.stats() == {"foo": 1}
+
+
+def test_connect_same_callback_multiple_times(event_bus):
+    events_received = []
+
+    def _listen(event):
+        events_received.append(event)
+
+    with event_bus.connection_context() as event_bus_ctx:
+        event_bus_ctx.connect("foo", _listen)
+        event_bus_ctx.connect("foo", _listen)
+        assert event_bus.stats() == {"foo": 2}
+
+        # Callback is called once per connection
+        event_bus.send("foo")
+        assert events_received == ["foo", "foo"]
+
+        event_bus_ctx.disconnect("foo", _listen)
+        assert event_bus.stats() == {"foo": 1}
+        events_received.clear()
+        event_bus.send("foo")
+        assert events_received == ["foo"]
+
+        event_bus_ctx.connect("foo", _listen)
+
+    assert event_bus.stats() == {}
+
+    with pytest.raises(ValueError):
+        event_bus.disconnect("foo", _listen)
+
+
+def test_connect_disconnect_during_dispatch(event_bus):
+    events_received = []
+
+    def _listen_late(event):
+        events_received.append(("late", event))
+
+    def _listen(event):
+        events_received.append(("listen", event))
+        # Only concerns the next events
+        event_bus.disconnect("foo", _listen)
+        event_bus.connect("foo", _listen_late)
+
+    def _listen_other(event):
+        events_received.append(("other", event))
+
+    event_bus.connect("foo", _listen)
+    event_bus.connect("foo", _listen_other)
+    event_bus.send("foo")
+    assert events_received == [("listen", "foo"), ("other", "foo")]
+
+    events_received.clear()
+    event_bus.send("foo")
+    assert events_received == [("other", "foo"), ("late", "foo")]
+    assert event_bus.stats() == {"foo": 2}
+
+
+def test_disconnect_many_clients(event_bus):
+    # Simulate a mass reconnection of clients (e.g. after the PostgreSQL notification
+    # connection got lost), each client connecting the events it listens on
+    clients_count = 20_000
+    event_bus.set_dispatch_key("realm_updated", lambda event, realm: realm)
+
+    def _listen_factory():
+        def _listen(event, **kwargs):
+            pass
+
+        return _listen
+
+    contexts = []
+    for i in range(clients_count):
+        # Each client has its own callback
+        _listen = _listen_factory()
+        event_bus_ctx = event_bus.connection_context()
+        event_bus_ctx.connect("pinged", _listen)
+        event_bus_ctx.connect("realm_updated", _listen, f"realm-{i % 100}")
+        contexts.append(event_bus_ctx)
+    assert event_bus.stats() == {"pinged": clients_count, "realm_updated": clients_count}
+
+    start = time.monotonic()
+    # Disconnection occurs in arbitrary order
+    for event_bus_ctx in reversed(contexts):
+        event_bus_ctx.clear()
+    disconnect_time = time.monotonic() - start
+    assert event_bus.stats() == {}
+    # Quadratic teardown used to take tens of seconds here
+    assert disconnect_time < 5